@@ -1,5 +1,9 @@
 """Ứng dụng cấu hình và thiết lập môi trường."""
 
+import os
+import tempfile
+from typing import Any, Dict
+
 from pydantic_settings import BaseSettings
 
 
@@ -9,12 +13,128 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "my-secret-key"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Số token đã xác thực giữ trong cache LRU (mỗi mục hết hạn cùng token)
+    TOKEN_CACHE_SIZE: int = 10000
+    # Nơi lưu tài khoản: "clickhouse" (bảng auth_users) hoặc "memory";
+    # số vòng PBKDF2 khi băm mật khẩu và tài khoản quản trị tạo sẵn; tài khoản
+    # chỉ được tạo khi AUTH_ADMIN_PASSWORD được đặt rõ (không có mật khẩu mặc định)
+    AUTH_BACKEND: str = "clickhouse"
+    PASSWORD_HASH_ITERATIONS: int = 200000
+    AUTH_ADMIN_USERNAME: str = "admin"
+    AUTH_ADMIN_PASSWORD: str = ""
     # Mặc định trỏ tới máy cục bộ để tránh lỗi không resolve được DNS
     CLICKHOUSE_HOST: str = "localhost"
     CLICKHOUSE_PORT: int = 8123
     CLICKHOUSE_USER: str = "admin"
     CLICKHOUSE_PASSWORD: str = "password"
     CLICKHOUSE_DATABASE: str = "default"
+    # Pool kết nối ClickHouse: số phiên HTTP, số truy vấn đồng thời tối đa
+    # và thời gian chờ (giây) khi lấy kết nối từ pool
+    CLICKHOUSE_POOL_SIZE: int = 8
+    CLICKHOUSE_MAX_INFLIGHT: int = 32
+    CLICKHOUSE_POOL_TIMEOUT: float = 10.0
+    # Gộp các truy vấn đọc giống hệt nhau (SQL + tham số) đang chạy đồng thời
+    CLICKHOUSE_SINGLE_FLIGHT: bool = True
+    # Cache schema bảng cho router CRUD động: thời gian sống (giây) và số bảng tối đa
+    SCHEMA_CACHE_TTL: float = 300.0
+    SCHEMA_CACHE_SIZE: int = 256
+    # Phân trang keyset cho GET /crud/{table}
+    CRUD_DEFAULT_PAGE_SIZE: int = 100
+    CRUD_MAX_PAGE_SIZE: int = 10000
+    # Tổng hợp xấp xỉ (approx=true): bảng thực thể được init_db tạo kèm
+    # SAMPLE BY intHash64(<khóa>) (vd "fact_orders", chỉ áp dụng cho bảng mới) và
+    # tỷ lệ mẫu mặc định khi đọc bảng có SAMPLE BY
+    SAMPLED_TABLES: str = ""
+    # Số khóa liên tiếp mỗi khoảng ở đầu sorting key của bảng lấy mẫu
+    # (intDiv(<khóa>, N)); nên chứa nhiều granule để SAMPLE bỏ qua được dữ liệu
+    SAMPLE_KEY_BUCKET: int = 1048576
+    APPROX_SAMPLE_RATIO: float = 0.1
+    # Gộp các lần đọc một dòng theo khóa thành một truy vấn WHERE key IN (...):
+    # thời gian chờ gom lô (0 = vòng event loop kế tiếp), số khóa tối đa mỗi truy vấn
+    # và số ID tối đa của các endpoint đọc nhiều dòng (?ids=1,2,3)
+    BATCH_LOADER_DELAY: float = 0.0
+    BATCH_LOADER_MAX_KEYS: int = 1000
+    MULTI_GET_MAX_IDS: int = 1000
+    # Bản sao trong bộ nhớ của bảng chiều (vd "dim_users,dim_products", rỗng = tắt):
+    # chu kỳ làm mới (giây) theo watermark _version và khoảng đọc lùi (giây) để không
+    # bỏ sót dòng có _version nhỏ hơn watermark nhưng ghi xong muộn hơn
+    DIMENSION_STORE_TABLES: str = ""
+    DIMENSION_STORE_REFRESH_INTERVAL: float = 5.0
+    DIMENSION_STORE_LOOKBACK: float = 30.0
+    # Dictionary ClickHouse (<bảng>_dict) cho các bảng chiều, dùng để lấy tên người
+    # dùng/sản phẩm bằng dictGet khi đọc đơn hàng; nạp lại sau MIN-MAX giây nếu
+    # bảng có _version mới
+    DICTIONARY_TABLES: str = "dim_users,dim_products"
+    DICTIONARY_LIFETIME_MIN: int = 60
+    DICTIONARY_LIFETIME_MAX: int = 300
+    # Bộ đệm gom các lệnh chèn một dòng: flush khi đủ số dòng, đủ byte hoặc quá
+    # MAX_DELAY giây; MAX_PENDING giới hạn số dòng chờ ghi trước khi chặn request
+    INSERT_BUFFER_MAX_ROWS: int = 10000
+    INSERT_BUFFER_MAX_BYTES: int = 8 * 1024 * 1024
+    INSERT_BUFFER_MAX_DELAY: float = 0.2
+    INSERT_BUFFER_MAX_PENDING: int = 100000
+    INSERT_BUFFER_ENQUEUE_TIMEOUT: float = 5.0
+    # Số dòng mỗi lô khi nạp dữ liệu qua POST /crud/{table}/bulk
+    BULK_INSERT_BATCH_SIZE: int = 100000
+    # Chiến lược cập nhật/xóa ghi đè theo bảng, dạng "bảng:chiến lược,..." với
+    # chiến lược là versioned, lightweight hoặc mutation (mặc định tự nhận diện);
+    # các mutation trong BATCH_DELAY giây được gom thành một lệnh tối đa MAX_KEYS khóa
+    MUTATION_STRATEGIES: str = ""
+    MUTATION_BATCH_DELAY: float = 0.5
+    MUTATION_BATCH_MAX_KEYS: int = 1000
+    # Cache kết quả đọc: danh sách endpoint bật cache (vd "users.read_user,crud.query_rows",
+    # "*" cho tất cả), TTL (giây) cho dữ liệu ghi từ bên ngoài dịch vụ, giới hạn byte
+    # của tầng bộ nhớ và của một mục; DISK_DIR khác rỗng bật thêm tầng đĩa cục bộ
+    RESULT_CACHE_ENDPOINTS: str = ""
+    RESULT_CACHE_TTL: float = 30.0
+    RESULT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESULT_CACHE_MAX_ENTRY_BYTES: int = 1024 * 1024
+    RESULT_CACHE_DISK_DIR: str = ""
+    RESULT_CACHE_DISK_MAX_BYTES: int = 1024 * 1024 * 1024
+    # Hồ sơ giới hạn truy vấn (JSON: tên -> setting ClickHouse). Hồ sơ "default"
+    # áp cho mọi request, sau đó lần lượt ghi đè bằng hồ sơ của endpoint
+    # ("sql.execute_sql:adhoc,...") và của người dùng trong token ("alice:readonly,...")
+    QUERY_PROFILES: Dict[str, Dict[str, Any]] = {
+        "default": {
+            "max_execution_time": 300,
+            "max_memory_usage": 8 * 1024**3,
+        },
+        "adhoc": {
+            "max_execution_time": 60,
+            "max_memory_usage": 2 * 1024**3,
+            "max_result_rows": 1000000,
+            "result_overflow_mode": "throw",
+        },
+        # readonly=2: chỉ cho phép đọc nhưng vẫn được đổi setting của truy vấn
+        "readonly": {"readonly": 2},
+    }
+    QUERY_PROFILE_ENDPOINTS: str = "sql.execute_sql:adhoc"
+    QUERY_PROFILE_USERS: str = ""
+    # Job truy vấn nền (POST /sql/jobs): số job chạy đồng thời, số job chờ tối đa,
+    # thư mục chứa kết quả và thời gian giữ kết quả (giây) sau khi job kết thúc
+    JOBS_MAX_CONCURRENCY: int = 2
+    JOBS_MAX_QUEUED: int = 100
+    JOBS_SPILL_DIR: str = os.path.join(tempfile.gettempdir(), "fastapi_clickhouse_jobs")
+    JOBS_RESULT_TTL: float = 3600.0
+    # Số series tối đa của mỗi họ số đo trên /metrics (vd số dạng truy vấn khác nhau);
+    # vượt quá thì dồn vào nhãn "__other__"
+    METRICS_MAX_SERIES: int = 1000
+    # Rollup tổng hợp sẵn (JSON: tên -> khai báo), ví dụ
+    # {"orders_by_user_day": {"table": "fact_orders",
+    #   "dimensions": ["user_id", "product_id", "day=toDate(order_date)"],
+    #   "measures": ["sum:total", "count:order_id"], "append_only": true}};
+    # bảng có phiên bản chỉ dùng được rollup khi khai báo append_only
+    ROLLUPS: Dict[str, Dict[str, Any]] = {}
+    # Khoảng (giây) từ lúc tạo view tới mốc _version chia dòng giữa view và phần nạp
+    # dữ liệu cũ; cần lớn hơn thời gian một request ghi từ lúc sinh _version tới lúc ghi xong
+    ROLLUP_WATERMARK_DELAY: float = 2.0
+    # Request chậm hơn THRESHOLD giây được log kèm phân rã giai đoạn (0 để tắt);
+    # số liệu system.query_log được đọc sau QUERY_LOG_DELAY giây (chờ ClickHouse ghi log)
+    SLOW_REQUEST_THRESHOLD: float = 1.0
+    SLOW_REQUEST_QUERY_LOG_DELAY: float = 8.0
+    # Endpoint lấy mẫu stack (GET /debug/profile), tắt mặc định; thời gian lấy mẫu tối đa (giây)
+    PROFILER_ENABLED: bool = False
+    PROFILER_MAX_SECONDS: float = 60.0
 
 
 settings = Settings()
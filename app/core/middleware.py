@@ -0,0 +1,173 @@
+"""Middleware ASGI dùng chung cho ứng dụng."""
+
+import asyncio
+import time
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services import metrics, tracing
+
+
+class CancelOnDisconnectMiddleware:
+    """Hủy xử lý request khi client ngắt kết nối trước khi nhận phản hồi.
+
+    Sau khi body được đọc xong (ngay từ đầu với request không có body),
+    middleware theo dõi ``http.disconnect``; nếu client rời đi khi phản hồi
+    chưa gửi xong, task xử lý request bị hủy. Việc hủy lan tới
+    ``ClickHouseClient`` (``aquery``/``acommand``/stream) và truy vấn tương
+    ứng bị ``KILL QUERY`` thay vì tiếp tục chạy vô ích.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+        response_done = False
+        headers = dict(scope.get("headers") or [])
+        # Request không có body: message body rỗng được trả cho ứng dụng khi cần,
+        # còn kênh ``receive`` gốc dành cho việc theo dõi ngắt kết nối
+        empty_body = (
+            headers.get(b"content-length", b"0") == b"0"
+            and b"transfer-encoding" not in headers
+        )
+        if empty_body:
+            body_read.set()
+
+        async def wrapped_receive():
+            nonlocal empty_body
+            if empty_body:
+                empty_body = False
+                return {"type": "http.request", "body": b"", "more_body": False}
+            if body_read.is_set():
+                # Body đã đọc hết: chỉ còn chờ client ngắt kết nối
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        async def wrapped_send(message):
+            nonlocal response_done
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_done = True
+            await send(message)
+
+        handler = asyncio.ensure_future(self.app(scope, wrapped_receive, wrapped_send))
+
+        async def watch():
+            await body_read.wait()
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+            if not response_done and not handler.done():
+                logger.info("Client ngắt kết nối, hủy request {}", scope.get("path"))
+                handler.cancel()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not disconnected.is_set():
+                raise
+        finally:
+            watcher.cancel()
+
+
+class MetricsMiddleware:
+    """Ghi thời gian xử lý, mã trạng thái và số request đang xử lý cho ``/metrics``.
+
+    Nhãn route là mẫu đường dẫn của route khớp (``/users/{user_id}``) chứ không
+    phải đường dẫn thực để số series không tăng theo dữ liệu. Request bị hủy
+    do client ngắt kết nối được ghi với mã ``499``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 499
+        started = time.perf_counter()
+
+        async def wrapped_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, wrapped_send)
+        except Exception as exc:
+            status = 500
+            metrics.record_error("http", exc)
+            raise
+        finally:
+            metrics.HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            metrics.HTTP_LATENCY.observe(time.perf_counter() - started, method, path)
+            metrics.HTTP_RESPONSES.inc(method, path, str(status))
+
+
+class TracingMiddleware:
+    """Gán ID cho request, theo dõi các giai đoạn và log request chậm.
+
+    ID lấy từ header ``X-Request-ID`` của client (nếu hợp lệ) hoặc sinh mới, được
+    trả lại trong header ``X-Request-ID`` của phản hồi và dùng làm tiền tố
+    ``query_id`` (kèm phần ngẫu nhiên do server sinh) cho các truy vấn
+    ClickHouse của request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        header = headers.get(tracing.REQUEST_ID_HEADER.encode(), b"").decode("latin-1")
+        request_id = tracing.request_id_from(header)
+        status = 499
+
+        async def wrapped_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (tracing.REQUEST_ID_HEADER.encode(), request_id.encode())
+                ]
+            await send(message)
+
+        token = tracing.start_trace(request_id)
+        trace = tracing.current_trace()
+        try:
+            await self.app(scope, receive, wrapped_send)
+        except Exception:
+            status = 500
+            raise
+        finally:
+            tracing.end_trace(token)
+            total = time.perf_counter() - trace.started
+            threshold = settings.SLOW_REQUEST_THRESHOLD
+            if threshold > 0 and total >= threshold:
+                ch = getattr(getattr(scope.get("app"), "state", None), "clickhouse", None)
+                tracing.schedule_slow_log(
+                    ch, trace, scope.get("method", ""), scope.get("path", ""), status, total
+                )
@@ -1,5 +1,9 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -8,6 +12,66 @@ from app.core.config import settings
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+
+class TokenCache:
+    """Cache LRU các token đã xác thực, khóa là hash SHA-256 của token.
+
+    Mỗi mục chỉ còn hiệu lực tới thời điểm ``exp`` của token nên token hết hạn
+    không bao giờ được chấp nhận từ cache. Token không hợp lệ không được lưu.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, token: str, payload: Dict[str, Any]) -> None:
+        expires = payload.get("exp")
+        if not isinstance(expires, (int, float)):
+            return
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (float(expires), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Tạo JWT access token."""
     expire = datetime.utcnow() + (
@@ -18,6 +82,20 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     logger.debug("Tạo token cho {}", data.get("sub"))
     return token
 
+
+def decode_token(token: str) -> Dict[str, Any]:
+    """Giải mã và xác thực JWT, dùng kết quả trong ``token_cache`` nếu có.
+
+    Raises:
+        JWTError: Nếu token sai chữ ký, sai định dạng hoặc đã hết hạn.
+    """
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        token_cache.set(token, payload)
+    return payload
+
+
 def get_current_user(token: str = Depends(oauth2_scheme)):
     """Lấy tên người dùng hiện tại từ token JWT."""
     credentials_exception = HTTPException(
@@ -26,7 +104,7 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
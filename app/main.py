@@ -1,21 +1,37 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from loguru import logger
 from pathlib import Path
-from app.routers import auth, users, products, orders, dynamic, crud
+from app.core.middleware import (
+    CancelOnDisconnectMiddleware,
+    MetricsMiddleware,
+    TracingMiddleware,
+)
+from app.routers import auth, users, products, orders, dynamic, crud, debug
+from app.services import metrics
 from app.services.clickhouse_client import ClickHouseClient
+from app.services.credentials import build_credential_store
+from app.services.guardrails import apply_query_profile
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Quản lý vòng đời ứng dụng và kết nối ClickHouse."""
     app.state.clickhouse = ClickHouseClient()
     app.state.clickhouse.init_db()
+    app.state.credentials = build_credential_store(app.state.clickhouse)
+    await app.state.credentials.init()
+    await app.state.clickhouse.dimensions.start()
     logger.info("Ứng dụng khởi động")
     try:
         yield
     finally:
+        await app.state.clickhouse.dimensions.stop()
+        await app.state.clickhouse.insert_buffer.flush_all()
+        await app.state.clickhouse.mutations.flush_all()
+        await app.state.clickhouse.jobs.shutdown()
+        app.state.clickhouse.close()
         logger.info("Ứng dụng dừng")
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -23,13 +39,21 @@ BASE_DIR = Path(__file__).resolve().parent
 app = FastAPI(title="FastAPI ClickHouse API", lifespan=lifespan)
 
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
+app.add_middleware(CancelOnDisconnectMiddleware)
+app.add_middleware(TracingMiddleware)
+# Thêm sau cùng nên bọc ngoài cùng: đo cả request bị hủy khi client ngắt kết nối
+app.add_middleware(MetricsMiddleware)
+
+# Mọi router truy vấn ClickHouse chạy với hồ sơ giới hạn theo endpoint/người dùng
+query_limits = [Depends(apply_query_profile)]
 
 app.include_router(auth.router)
-app.include_router(users.router)
-app.include_router(products.router)
-app.include_router(orders.router)
-app.include_router(dynamic.router)
-app.include_router(crud.router)
+app.include_router(users.router, dependencies=query_limits)
+app.include_router(products.router, dependencies=query_limits)
+app.include_router(orders.router, dependencies=query_limits)
+app.include_router(dynamic.router, dependencies=query_limits)
+app.include_router(crud.router, dependencies=query_limits)
+app.include_router(debug.router)
 
 
 @app.get("/frontend")
@@ -45,6 +69,17 @@ async def frontend() -> FileResponse:
         logger.exception("Không thể phục vụ trang frontend: {}", exc)
         raise HTTPException(status_code=500, detail="Frontend not available")
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request) -> PlainTextResponse:
+    """Số đo vận hành theo định dạng text của Prometheus."""
+    try:
+        metrics.track_pool(request.app.state.clickhouse)
+        metrics.track_dimensions(request.app.state.clickhouse.dimensions)
+        return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+    except Exception as exc:
+        logger.exception("Không thể xuất số đo: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
 @app.get("/")
 async def root():
     """API kiểm tra trạng thái.
@@ -2,9 +2,16 @@
 
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional, Union
+from typing import Annotated, Optional, Union
+from fastapi import Path
 from pydantic import BaseModel
 
+from app.services.batch_loader import UINT64_MAX
+
+# ID (UInt64) trong đường dẫn của /users, /products, /orders: giá trị âm hoặc
+# vượt UInt64 bị từ chối (422) trước khi vào lô đọc/ghi chung với request khác
+EntityId = Annotated[int, Path(ge=0, le=UINT64_MAX)]
+
 class User(BaseModel):
     """Thông tin người dùng."""
 
@@ -30,3 +37,21 @@ class Order(BaseModel):
     total: float
     order_date: Optional[datetime] = None
 
+
+
+class EnrichedOrder(Order):
+    """Đơn hàng kèm thông tin người dùng và sản phẩm (``None`` nếu không tìm thấy)."""
+
+    user_name: Optional[str] = None
+    user_email: Optional[str] = None
+    product_name: Optional[str] = None
+
+
+class OrderSummary(BaseModel):
+    """Tổng hợp đơn hàng theo một người dùng hoặc một sản phẩm."""
+
+    id: int
+    name: Optional[str] = None
+    orders: int
+    quantity: int
+    total: float
@@ -1,18 +1,31 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, Request, status, Depends
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from loguru import logger
 
-from app.core.security import create_access_token
+from app.core.security import create_access_token, token_cache
+from app.services.credentials import (
+    CredentialStore,
+    RegistrationConflictError,
+    UserExistsError,
+    hash_password,
+    hash_password_async,
+    verify_password_async,
+)
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-fake_users_db = {
-    "admin": {
-        "username": "admin",
-        "password": "password",
-    }
-}
+# Chuỗi băm giả để đăng nhập với tên không tồn tại tốn thời gian như tên có thật
+_DUMMY_HASH = hash_password("dummy-password")
+
+
+def get_credentials(request: Request) -> CredentialStore:
+    """Lấy nơi lưu tài khoản đã khởi tạo cùng ứng dụng."""
+    store = getattr(request.app.state, "credentials", None)
+    if store is None:
+        logger.error("Chưa khởi tạo nơi lưu tài khoản")
+        raise HTTPException(status_code=500, detail="Credential store is not configured")
+    return store
 
 
 class RegisterForm(BaseModel):
@@ -23,18 +36,19 @@ class RegisterForm(BaseModel):
 
 
 @router.post("/register")
-async def register(user: RegisterForm):
+async def register(user: RegisterForm, store: CredentialStore = Depends(get_credentials)):
     """Đăng ký tài khoản mới và trả về token truy cập."""
     try:
-        if user.username in fake_users_db:
+        if await store.get(user.username) is not None:
             raise HTTPException(status_code=400, detail="Username already registered")
-        fake_users_db[user.username] = {
-            "username": user.username,
-            "password": user.password,
-        }
+        await store.create(user.username, await hash_password_async(user.password))
         access_token = create_access_token(data={"sub": user.username})
         logger.info("Người dùng {} đã đăng ký", user.username)
         return {"access_token": access_token, "token_type": "bearer"}
+    except RegistrationConflictError:
+        raise HTTPException(status_code=409, detail="Username already registered")
+    except UserExistsError:
+        raise HTTPException(status_code=400, detail="Username already registered")
     except HTTPException:
         raise
     except Exception as exc:
@@ -43,21 +57,31 @@ async def register(user: RegisterForm):
 
 
 @router.post("/login")
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    store: CredentialStore = Depends(get_credentials),
+):
     """Đăng nhập và trả về token truy cập."""
     try:
-        user = fake_users_db.get(form_data.username)
-        if not user or user["password"] != form_data.password:
+        password_hash = await store.get(form_data.username)
+        valid = await verify_password_async(form_data.password, password_hash or _DUMMY_HASH)
+        if password_hash is None or not valid:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        access_token = create_access_token(data={"sub": user["username"]})
-        logger.info("Người dùng {} đăng nhập", user["username"])
+        access_token = create_access_token(data={"sub": form_data.username})
+        logger.info("Người dùng {} đăng nhập", form_data.username)
         return {"access_token": access_token, "token_type": "bearer"}
     except HTTPException:
         raise
     except Exception as exc:
         logger.exception("Lỗi đăng nhập: {}", exc)
         raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+@router.get("/token-cache")
+async def token_cache_stats():
+    """Số token đã xác thực trong cache và tỷ lệ hit."""
+    return token_cache.stats()
@@ -1,7 +1,45 @@
-from fastapi import APIRouter, Depends, Request, HTTPException
-from typing import Any, Dict, List
+from fastapi import APIRouter, Depends, Query, Request, HTTPException
+from typing import Any, Dict, List, Optional
 from loguru import logger
+from app.core.config import settings
+from app.services.batch_loader import Lookup, cast_key, parse_ids
+from app.services.bulk_insert import BulkFormatError, ingest_body
 from app.services.clickhouse_client import ClickHouseClient
+from app.services.insert_buffer import AckMode, BufferFullError, InvalidRowError, coerce_value
+from app.services.pagination import (
+    InvalidCursorError,
+    decode_cursor,
+    encode_cursor,
+    keyset_condition,
+    parse_sorting_key,
+)
+from app.services.query_dsl import (
+    QueryDSLError,
+    parse_aggregates,
+    parse_fields,
+    parse_filter,
+    parse_having,
+    parse_order_by,
+    split_list,
+)
+from app.services.result_cache import cached_query
+from app.services.sampling import (
+    CONFIDENCE,
+    SAMPLED_ROWS_ALIAS,
+    approx_expr,
+    parse_ratio,
+    relative_error,
+    sample_clause,
+)
+from app.services.streaming import (
+    COLUMNAR_SETTINGS,
+    negotiate_format,
+    start_stream,
+    stream_format_response,
+    stream_rows_response,
+    wants_ndjson,
+)
+from app.services.versioning import DELETED_COLUMN, VERSION_COLUMN, is_versioned, next_version
 
 
 def get_ch(request: Request) -> ClickHouseClient:
@@ -24,13 +62,27 @@ def get_ch(request: Request) -> ClickHouseClient:
 
 router = APIRouter(prefix="/crud", tags=["crud"])
 
+# Tham số của GET /crud/{table} không phải điều kiện lọc
+RESERVED_PARAMS = {
+    "aggregate",
+    "group_by",
+    "stream",
+    "limit",
+    "after",
+    "fields",
+    "order_by",
+    "having",
+    "approx",
+    "sample",
+}
 
-def _schema_dict(
+
+async def _schema_dict(
     ch: ClickHouseClient, table: str
 ) -> tuple[list[tuple[str, str]], dict[str, str]]:
     """Lấy thông tin cột và xây dựng từ điển schema."""
     try:
-        columns = ch.get_table_schema(table)
+        columns = await ch.aget_table_schema(table)
         schema = {name: dtype for name, dtype in columns}
         return columns, schema
     except HTTPException:
@@ -56,99 +108,375 @@ def _cast_value(value: str, ch_type: str) -> Any:
         return value
 
 
+def _key_value(item_id: str, schema: Dict[str, str], id_column: str) -> Any:
+    """Khóa chính đã kiểm tra của request, lỗi 400 nếu không hợp lệ."""
+    try:
+        return cast_key(item_id, schema[id_column])
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid id: {item_id}")
+
+
+def _page_size(limit: Optional[str]) -> int:
+    """Kiểm tra tham số ``limit`` và trả về kích thước trang."""
+    if limit is None:
+        return settings.CRUD_DEFAULT_PAGE_SIZE
+    try:
+        size = int(limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid limit")
+    if size <= 0 or size > settings.CRUD_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be between 1 and {settings.CRUD_MAX_PAGE_SIZE}",
+        )
+    return size
+
+
 @router.post("/{table}")
-async def create_row(table: str, data: Dict[str, Any], ch: ClickHouseClient = Depends(get_ch)):
-    """Chèn bản ghi mới vào bảng bất kỳ."""
+async def create_row(
+    table: str,
+    data: Dict[str, Any],
+    ack: AckMode = "flush",
+    ch: ClickHouseClient = Depends(get_ch),
+):
+    """Chèn bản ghi mới vào bảng bất kỳ.
+
+    Bản ghi được ghi qua bộ đệm chèn; ``ack=async`` trả về ngay khi bản ghi đã
+    vào hàng đợi thay vì chờ ghi xong.
+    """
     try:
-        columns, schema = _schema_dict(ch, table)
-        unknown = set(data) - set(schema)
-        if unknown:
-            raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
-        cols = list(data.keys())
-        cols_str = ", ".join(cols)
-        placeholders = ", ".join([f"{{{c}:{schema[c]}}}" for c in cols])
-        sql = f"INSERT INTO {table} ({cols_str}) VALUES ({placeholders})"
-        ch.command(sql, parameters=data)
+        _, schema = await _schema_dict(ch, table)
+        row = dict(data)
+        if is_versioned(schema):
+            row.setdefault(VERSION_COLUMN, next_version())
+        # Bộ đệm kiểm tra và ép kiểu dòng theo schema trước khi đưa vào lô
+        await ch.insert_buffer.insert(table, row, ack=ack)
         logger.info("Chèn dữ liệu vào bảng {}", table)
-        return {"status": "ok"}
+        return {"status": "ok" if ack == "flush" else "accepted"}
     except HTTPException:
         raise
+    except InvalidRowError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except BufferFullError as exc:
+        logger.warning("Hàng đợi chèn đầy: {}", exc)
+        raise HTTPException(status_code=503, detail="Insert queue is full")
     except Exception as exc:
         logger.exception("Lỗi chèn dữ liệu bảng {}: {}", table, exc)
         raise HTTPException(status_code=500, detail="Lỗi máy chủ")
 
 
+@router.post("/{table}/bulk")
+async def bulk_insert(
+    table: str,
+    request: Request,
+    batch_size: Optional[int] = None,
+    ch: ClickHouseClient = Depends(get_ch),
+):
+    """Nạp nhiều bản ghi từ body NDJSON, CSV, Arrow IPC hoặc Parquet.
+
+    Định dạng được xác định qua header ``Content-Type``. Body được đọc dần và
+    chèn theo lô ``batch_size`` dòng nên không giữ toàn bộ dữ liệu trong bộ nhớ.
+    Dữ liệu lỗi trả về 400 kèm ``rows_committed``: số dòng của các lô đã ghi
+    trước lô lỗi.
+    """
+    try:
+        _, schema = await _schema_dict(ch, table)
+        media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        size = batch_size or settings.BULK_INSERT_BATCH_SIZE
+        if size <= 0:
+            raise HTTPException(status_code=400, detail="Invalid batch_size")
+        stats = await ingest_body(ch, table, media_type, request.stream(), schema, size)
+        return {"status": "ok", **stats}
+    except HTTPException:
+        raise
+    except BulkFormatError as exc:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": str(exc), "rows_committed": exc.rows_committed},
+        )
+    except Exception as exc:
+        logger.exception("Lỗi nạp dữ liệu hàng loạt bảng {}: {}", table, exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
 @router.get("/{table}")
 async def query_rows(table: str, request: Request, ch: ClickHouseClient = Depends(get_ch)):
-    """Truy vấn các bản ghi với bộ lọc linh hoạt."""
+    """Truy vấn các bản ghi với bộ lọc linh hoạt.
+
+    Cú pháp tham số (``fields``, ``col__gte``/``__lt``/``__in``..., nhiều
+    ``aggregate``, ``having``, ``order_by``) xem ``app.services.query_dsl``.
+
+    Truyền ``stream=true`` hoặc header ``Accept: application/x-ndjson`` để nhận
+    kết quả dạng stream theo từng block thay vì nạp toàn bộ vào bộ nhớ.
+
+    Header ``Accept`` là ``application/vnd.apache.arrow.stream``,
+    ``application/x-parquet`` hoặc ``text/csv`` sẽ nhận dữ liệu dạng cột do
+    ClickHouse mã hóa trực tiếp.
+
+    Truyền ``limit`` (và ``after`` cho các trang tiếp theo) để phân trang theo
+    sorting key của bảng; kết quả có dạng ``{"rows": [...], "next": cursor}``.
+    Khi có ``aggregate`` hoặc ``order_by``, ``limit`` chỉ giới hạn số dòng trả về.
+
+    Truy vấn ``aggregate`` khớp một rollup (xem ``ROLLUPS``) được đọc từ bảng
+    tổng hợp sẵn thay vì bảng gốc.
+
+    ``approx=true`` dùng hàm tổng hợp xấp xỉ và đọc mẫu ``sample`` (mặc định
+    ``APPROX_SAMPLE_RATIO``) của bảng có ``SAMPLE BY``; kết quả có dạng
+    ``{"rows": [...], "sample": k, "sample_factor": 1/k, "confidence": 0.95}``,
+    mỗi dòng kèm ``relative_error`` (xem ``app.services.sampling``), ``None`` khi
+    truy vấn không đọc mẫu.
+    """
     try:
-        columns, schema = _schema_dict(ch, table)
-        filters: Dict[str, Any] = {}
-        aggregate = request.query_params.get("aggregate")
-        group_by = request.query_params.get("group_by")
-        for key, value in request.query_params.items():
-            if key in {"aggregate", "group_by"}:
-                continue
-            if key not in schema:
-                raise HTTPException(status_code=400, detail=f"Invalid filter column: {key}")
-            filters[key] = _cast_value(value, schema[key])
-
-        sql = "SELECT "
-        agg_alias = None
-        group_cols: List[str] = []
-        if aggregate:
-            parts = aggregate.split(":")
-            if len(parts) != 2:
-                raise HTTPException(status_code=400, detail="Invalid aggregate format")
-            func, col = parts[0].upper(), parts[1]
-            if col not in schema:
-                raise HTTPException(status_code=400, detail="Invalid aggregate column")
-            agg_alias = f"{func.lower()}_{col}"
-            sql += f"{func}({col}) AS {agg_alias}"
-            if group_by:
-                group_cols = [c.strip() for c in group_by.split(",") if c.strip()]
-                invalid = [c for c in group_cols if c not in schema]
-                if invalid:
-                    raise HTTPException(status_code=400, detail=f"Invalid group_by column: {', '.join(invalid)}")
-                sql += ", " + ", ".join(group_cols)
-            sql += f" FROM {table}"
-        else:
-            sql += f"* FROM {table}"
+        columns, schema = await _schema_dict(ch, table)
+        qp = request.query_params
+        ndjson = wants_ndjson(request.headers.get("accept"))
+        columnar = negotiate_format(request.headers.get("accept"))
+        stream = (
+            ndjson
+            or columnar is not None
+            or qp.get("stream", "").lower() in {"1", "true"}
+        )
+        limit = qp.get("limit")
+        after = qp.get("after")
+        try:
+            filters = [
+                parse_filter(key, value, schema, _cast_value)
+                for key, value in qp.multi_items()
+                if key not in RESERVED_PARAMS
+            ]
+            aggregates = parse_aggregates(qp.getlist("aggregate"), schema)
+            group_cols = split_list(qp.get("group_by")) if aggregates else []
+            # Bí danh chiều biểu thức của rollup (``day=toDate(order_date)``)
+            # dùng được như cột trong group_by
+            unknown = [c for c in group_cols if c not in schema]
+            derived = ch.rollups.expressions(table) if unknown else {}
+            group_exprs = {c: derived[c] for c in unknown if c in derived}
+            invalid = [c for c in unknown if c not in derived]
+            if invalid:
+                raise QueryDSLError(f"Invalid group_by column: {', '.join(invalid)}")
+            if aggregates:
+                if "fields" in qp:
+                    raise QueryDSLError("fields cannot be combined with aggregate")
+                out_cols = [a.alias for a in aggregates] + group_cols
+            else:
+                out_cols = parse_fields(qp["fields"], schema) if "fields" in qp else [
+                    c for c, _ in columns
+                ]
+            order_by = parse_order_by(
+                qp.get("order_by", ""), out_cols if aggregates else list(schema)
+            )
+            having, having_params = (
+                parse_having(qp["having"], aggregates, schema, _cast_value)
+                if "having" in qp
+                else ([], {})
+            )
+            if having and not aggregates:
+                raise QueryDSLError("having requires aggregate")
+            approx = qp.get("approx", "").lower() in {"1", "true"}
+            if approx and not aggregates:
+                raise QueryDSLError("approx requires aggregate")
+            if approx and stream:
+                raise QueryDSLError("approx cannot be combined with streaming")
+            if "sample" in qp and not approx:
+                raise QueryDSLError("sample requires approx=true")
+            ratio = parse_ratio(qp.get("sample"), settings.APPROX_SAMPLE_RATIO) if approx else 1.0
+        except QueryDSLError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+
+        conditions = [f.condition(schema[f.column]) for f in filters]
+        params: Dict[str, Any] = {f.param: f.value for f in filters}
+        params.update(having_params)
+        filter_cols = {f.column for f in filters}
+        # Phân trang theo cursor chỉ khi đọc dòng gốc theo sorting key
+        paginate = (limit is not None or after is not None) and not aggregates and not order_by
+        if after is not None and not paginate:
+            raise HTTPException(
+                status_code=400, detail="after cannot be combined with aggregate or order_by"
+            )
+        page_size = _page_size(limit) if limit is not None or paginate else None
+        page_keys: Optional[List[str]] = None
+        if paginate:
+            page_keys = parse_sorting_key(await ch.aget_sorting_key(table), schema)
+            if after:
+                if page_keys is None:
+                    raise HTTPException(status_code=400, detail="Table has no sorting key for cursor pagination")
+                try:
+                    after_values = decode_cursor(after, len(page_keys))
+                except InvalidCursorError:
+                    raise HTTPException(status_code=400, detail="Invalid cursor")
+                condition, after_params = keyset_condition(page_keys, schema, after_values)
+                conditions.append(condition)
+                params.update(after_params)
 
-        if filters:
-            conditions = " AND ".join([f"{k}={{{k}:{schema[k]}}}" for k in filters])
-            sql += f" WHERE {conditions}"
-        if aggregate and group_cols:
+        # Cột sorting key cần cho cursor nhưng không nằm trong ``fields`` được
+        # đọc thêm rồi bỏ khỏi kết quả JSON
+        select_cols = list(out_cols)
+        if page_keys and not stream:
+            select_cols += [k for k in page_keys if k not in select_cols]
+
+        routed = (
+            ch.rollups.route(
+                table,
+                [(a.func, a.column) for a in aggregates],
+                group_cols,
+                sorted(filter_cols),
+                group_exprs,
+            )
+            if aggregates
+            else None
+        )
+        sampling_key = ""
+        # Trên bảng gốc, bí danh chiều biểu thức được tính lại từ biểu thức
+        group_select = [
+            f"{group_exprs[c]} AS {c}" if c in group_exprs else c for c in group_cols
+        ]
+        if routed:
+            # Đọc trạng thái tổng hợp sẵn thay vì tổng hợp lại từ dòng gốc
+            source, select = routed
+            select = select + group_cols
+        else:
+            source = table
+            if approx and ratio < 1:
+                sampling_key = await ch.aget_sampling_key(table)
+            if approx:
+                select = [f"{approx_expr(a, sampling_key)} AS {a.alias}" for a in aggregates]
+                select += group_select
+                if sampling_key:
+                    # Số dòng mẫu của mỗi nhóm để ước lượng sai số
+                    select.append(f"count() AS {SAMPLED_ROWS_ALIAS}")
+            elif aggregates:
+                select = [f"{a.expr} AS {a.alias}" for a in aggregates] + group_select
+            elif "fields" in qp or len(select_cols) != len(columns):
+                select = select_cols
+            else:
+                select = ["*"]
+            if is_versioned(schema):
+                # Bảng ReplacingMergeTree: chỉ đọc phiên bản mới nhất chưa bị xóa
+                source += " FINAL"
+                if DELETED_COLUMN not in filter_cols:
+                    conditions.append(f"{DELETED_COLUMN} = 0")
+            if sampling_key:
+                source += f" {sample_clause(ratio)}"
+        # Bảng không có SAMPLE BY (hoặc rollup) được đọc toàn bộ
+        sample = ratio if sampling_key else 1.0
+        sql = f"SELECT {', '.join(select)} FROM {source}"
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        if group_cols:
             sql += f" GROUP BY {', '.join(group_cols)}"
+        if having:
+            sql += f" HAVING {' AND '.join(having)}"
+        if paginate and page_keys:
+            order_by = page_keys
+        if order_by:
+            sql += f" ORDER BY {', '.join(order_by)}"
+        if page_size is not None:
+            # Phân trang lấy thêm một dòng để biết còn trang tiếp theo hay không
+            sql += f" LIMIT {page_size + 1 if paginate and not stream else page_size}"
 
-        result = ch.query(sql, parameters=filters)
-        if aggregate:
-            col_names = [agg_alias] + group_cols
-            return [
-                {col_names[idx]: row[idx] for idx in range(len(col_names))}
-                for row in result.result_rows
+        if columnar:
+            media_type, fmt = columnar
+            chunks = await start_stream(
+                ch.stream_raw(sql, parameters=params, fmt=fmt, settings=COLUMNAR_SETTINGS)
+            )
+            return stream_format_response(chunks, media_type)
+        if stream:
+            blocks = await start_stream(ch.stream_row_blocks(sql, parameters=params))
+            return stream_rows_response(blocks, out_cols, ndjson)
+
+        def build(result):
+            rows = [
+                {col: row[idx] for idx, col in enumerate(out_cols)}
+                for row in result.result_rows[:page_size]
             ]
+            if approx:
+                # Không đọc mẫu (bảng không có SAMPLE BY hoặc sample=1): không có sai
+                # số mẫu để ước lượng, còn sai số của hàm xấp xỉ thì không tính được
+                for row, raw in zip(rows, result.result_rows):
+                    row["relative_error"] = (
+                        relative_error(raw[len(out_cols)], sample) if sampling_key else None
+                    )
+                return {
+                    "rows": rows,
+                    "sample": sample,
+                    "sample_factor": 1 / sample,
+                    "confidence": CONFIDENCE,
+                }
+            if not paginate:
+                return rows
+            next_cursor = None
+            if page_keys and len(result.result_rows) > page_size:
+                last = result.result_rows[page_size - 1]
+                next_cursor = encode_cursor([last[select_cols.index(k)] for k in page_keys])
+            return {"rows": rows, "next": next_cursor}
+
+        # Truy vấn rollup chỉ nhắc tới bảng rollup, nhưng bảng này đổi theo mỗi
+        # lần ghi vào bảng nguồn (qua materialized view)
+        return await cached_query(
+            ch, request, "crud.query_rows", sql, params, build, tables=(table,)
+        )
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("Lỗi truy vấn bảng {}: {}", table, exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+def _lookup(table: str, columns: List[tuple], schema: Dict[str, str], id_column: str) -> Lookup:
+    """Cách đọc dòng theo ``id_column`` qua ``BatchLoader``."""
+    if id_column not in schema:
+        raise HTTPException(status_code=400, detail="Invalid id column")
+    return Lookup(
+        table,
+        id_column,
+        schema[id_column],
+        tuple(name for name, _ in columns),
+        versioned=is_versioned(schema),
+    )
+
+
+@router.get("/{table}/batch")
+async def read_rows_batch(
+    table: str,
+    ids: str = Query(..., description="Danh sách khóa cách nhau bởi dấu phẩy"),
+    id_column: str = "id",
+    ch: ClickHouseClient = Depends(get_ch),
+):
+    """Đọc nhiều bản ghi theo khóa chính trong một truy vấn (``?ids=1,2,3``).
+
+    Kết quả theo thứ tự khóa yêu cầu, bỏ qua khóa không tồn tại.
+    """
+    try:
+        columns, schema = await _schema_dict(ch, table)
+        lookup = _lookup(table, columns, schema, id_column)
+        try:
+            keys = parse_ids(ids, lambda item: cast_key(item, schema[id_column]))
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        rows = await ch.loader.load_many(lookup, keys)
         return [
-            {col: row[idx] for idx, (col, _) in enumerate(columns)}
-            for row in result.result_rows
+            {col: row[idx] for idx, col in enumerate(lookup.columns)}
+            for key in keys
+            for row in rows.get(key, [])[:1]
         ]
     except HTTPException:
         raise
     except Exception as exc:
-        logger.exception("Lỗi truy vấn bảng {}: {}", table, exc)
+        logger.exception("Lỗi đọc nhiều dòng bảng {}: {}", table, exc)
         raise HTTPException(status_code=500, detail="Lỗi máy chủ")
 
 
 @router.get("/{table}/{item_id}")
 async def read_row(table: str, item_id: str, id_column: str = "id", ch: ClickHouseClient = Depends(get_ch)):
-    """Đọc một bản ghi theo khóa chính."""
+    """Đọc một bản ghi theo khóa chính.
+
+    Các request đọc cùng bảng đồng thời được gộp thành một truy vấn ``IN``.
+    """
     try:
-        columns, schema = _schema_dict(ch, table)
-        if id_column not in schema:
-            raise HTTPException(status_code=400, detail="Invalid id column")
-        id_value = _cast_value(item_id, schema[id_column])
-        sql = f"SELECT * FROM {table} WHERE {id_column}={{{id_column}:{schema[id_column]}}}"
-        result = ch.query(sql, parameters={id_column: id_value})
+        columns, schema = await _schema_dict(ch, table)
+        lookup = _lookup(table, columns, schema, id_column)
+        id_value = _key_value(item_id, schema, id_column)
+        result = await ch.loader.load(lookup, id_value)
         rows = result.result_rows
         if not rows:
             raise HTTPException(status_code=404, detail="Row not found")
@@ -163,18 +491,28 @@ async def read_row(table: str, item_id: str, id_column: str = "id", ch: ClickHou
 
 @router.put("/{table}/{item_id}")
 async def update_row(table: str, item_id: str, data: Dict[str, Any], id_column: str = "id", ch: ClickHouseClient = Depends(get_ch)):
-    """Cập nhật bản ghi theo khóa chính."""
+    """Cập nhật bản ghi theo khóa chính.
+
+    Cách ghi phụ thuộc chiến lược của bảng (xem ``GET /sql/mutations``): bảng
+    phiên bản chèn dòng mới, các bảng khác dùng mutation được gom nhóm.
+    """
     try:
-        _, schema = _schema_dict(ch, table)
+        _, schema = await _schema_dict(ch, table)
         if id_column not in schema:
             raise HTTPException(status_code=400, detail="Invalid id column")
         unknown = set(data) - set(schema)
         if unknown:
             raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
-        set_clause = ", ".join([f"{c}={{{c}:{schema[c]}}}" for c in data.keys()])
-        sql = f"ALTER TABLE {table} UPDATE {set_clause} WHERE {id_column}={{{id_column}:{schema[id_column]}}}"
-        params = {**data, id_column: _cast_value(item_id, schema[id_column])}
-        ch.command(sql, parameters=params)
+        if id_column in data:
+            raise HTTPException(status_code=400, detail="Cannot update id column")
+        try:
+            values = {c: coerce_value(v, schema[c]) for c, v in data.items()}
+        except (TypeError, ValueError) as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid value: {exc}")
+        key_value = _key_value(item_id, schema, id_column)
+        written = await ch.mutations.update(table, id_column, key_value, values, schema)
+        if written == 0:
+            raise HTTPException(status_code=404, detail="Row not found")
         logger.info("Cập nhật dữ liệu bảng {}", table)
         return {"status": "ok"}
     except HTTPException:
@@ -186,13 +524,18 @@ async def update_row(table: str, item_id: str, data: Dict[str, Any], id_column:
 
 @router.delete("/{table}/{item_id}")
 async def delete_row(table: str, item_id: str, id_column: str = "id", ch: ClickHouseClient = Depends(get_ch)):
-    """Xóa bản ghi theo khóa chính."""
+    """Xóa bản ghi theo khóa chính.
+
+    Bảng phiên bản nhận bản ghi đánh dấu xóa, bảng ``MergeTree`` dùng
+    ``DELETE FROM`` nhẹ; các lệnh xóa gần nhau được gom thành một.
+    """
     try:
-        _, schema = _schema_dict(ch, table)
+        _, schema = await _schema_dict(ch, table)
         if id_column not in schema:
             raise HTTPException(status_code=400, detail="Invalid id column")
-        sql = f"ALTER TABLE {table} DELETE WHERE {id_column}={{{id_column}:{schema[id_column]}}}"
-        ch.command(sql, parameters={id_column: _cast_value(item_id, schema[id_column])})
+        key_value = _key_value(item_id, schema, id_column)
+        if await ch.mutations.delete(table, id_column, key_value, schema) == 0:
+            raise HTTPException(status_code=404, detail="Row not found")
         logger.info("Xóa dữ liệu bảng {}", table)
         return {"status": "ok"}
     except HTTPException:
@@ -0,0 +1,32 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from loguru import logger
+from app.core.config import settings
+from app.services.profiler import ProfilerBusyError, folded, sample
+
+router = APIRouter(prefix="/debug", tags=["debug"])
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10.0, gt=0),
+    interval: float = Query(0.005, ge=0.001, le=1.0),
+):
+    """Lấy mẫu stack của tiến trình trong ``seconds`` giây.
+
+    Trả về folded stacks (``flamegraph.pl``, speedscope). Chỉ bật khi
+    ``PROFILER_ENABLED=true``; mỗi lúc chỉ chạy một phiên lấy mẫu.
+    """
+    if not settings.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    seconds = min(seconds, settings.PROFILER_MAX_SECONDS)
+    try:
+        logger.info("Lấy mẫu stack trong {} giây", seconds)
+        stacks = await asyncio.to_thread(sample, seconds, interval)
+        return PlainTextResponse(folded(stacks))
+    except ProfilerBusyError:
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    except Exception as exc:
+        logger.exception("Lỗi lấy mẫu stack: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
@@ -1,8 +1,29 @@
+import asyncio
 from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from typing import Any, Dict, Optional
 from loguru import logger
+from app.core.config import settings
 from app.services.clickhouse_client import ClickHouseClient
+from app.services.dictionaries import DictionaryNotFoundError
+from app.services.query_jobs import (
+    InvalidJobQueryError,
+    JobNotFoundError,
+    JobNotReadyError,
+    JobQueueFullError,
+    Priority,
+)
+from app.services.result_cache import cached_query
+from app.services.rollups import RollupNotFoundError
+from app.services.streaming import (
+    COLUMNAR_SETTINGS,
+    negotiate_format,
+    start_stream,
+    stream_format_response,
+    stream_rows_response,
+    wants_ndjson,
+)
 
 
 def get_ch(request: Request) -> ClickHouseClient:
@@ -32,17 +53,274 @@ class SQLRequest(BaseModel):
     sql: str
     params: Optional[Dict[str, Any]] = None
     is_select: bool = False
+    stream: bool = False
 
 
 @router.post("/")
-async def execute_sql(req: SQLRequest, ch: ClickHouseClient = Depends(get_ch)):
-    """Thực thi câu lệnh SQL tùy ý trên ClickHouse."""
+async def execute_sql(
+    req: SQLRequest, request: Request, ch: ClickHouseClient = Depends(get_ch)
+):
+    """Thực thi câu lệnh SQL tùy ý trên ClickHouse.
+
+    Với ``stream=true`` kết quả ``SELECT`` được gửi dần theo từng block (NDJSON
+    nếu header ``Accept`` yêu cầu ``application/x-ndjson``). Header ``Accept``
+    Arrow/Parquet/CSV trả về dữ liệu dạng cột do ClickHouse mã hóa trực tiếp.
+    """
     try:
+        columnar = negotiate_format(request.headers.get("accept"))
+        if req.is_select and columnar:
+            media_type, fmt = columnar
+            chunks = await start_stream(
+                ch.stream_raw(
+                    req.sql, parameters=req.params or {}, fmt=fmt, settings=COLUMNAR_SETTINGS
+                )
+            )
+            return stream_format_response(chunks, media_type)
+        if req.is_select and req.stream:
+            blocks = await start_stream(
+                ch.stream_row_blocks(req.sql, parameters=req.params or {})
+            )
+            ndjson = wants_ndjson(request.headers.get("accept"))
+            return stream_rows_response(
+                blocks, None, ndjson, prefix=b'{"rows":[', suffix=b"]}"
+            )
         if req.is_select:
-            result = ch.query(req.sql, parameters=req.params or {})
-            return {"rows": result.result_rows}
-        ch.command(req.sql, parameters=req.params or {})
+            return await cached_query(
+                ch,
+                request,
+                "sql.execute_sql",
+                req.sql,
+                req.params or {},
+                lambda result: {"rows": result.result_rows},
+            )
+        await ch.acommand(req.sql, parameters=req.params or {})
+        if ch.invalidate_for_sql(req.sql):
+            logger.info("Câu lệnh DDL, đã làm mới cache schema")
         return {"status": "ok"}
+    except HTTPException:
+        raise
     except Exception as exc:
         logger.exception("Lỗi thực thi SQL: {}", exc)
         raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+class JobRequest(BaseModel):
+    """Dữ liệu yêu cầu tạo job truy vấn nền."""
+
+    sql: str
+    params: Optional[Dict[str, Any]] = None
+    priority: Priority = "normal"
+
+
+@router.post("/jobs", status_code=202)
+async def submit_job(req: JobRequest, ch: ClickHouseClient = Depends(get_ch)):
+    """Đưa câu ``SELECT`` dài vào hàng đợi job nền và trả về ``job_id`` ngay."""
+    try:
+        job = await ch.jobs.submit(req.sql, req.params, req.priority)
+        return {"job_id": job.id, "status": job.status}
+    except InvalidJobQueryError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except JobQueueFullError as exc:
+        logger.warning("Hàng đợi job đầy: {}", exc)
+        raise HTTPException(status_code=429, detail="Job queue is full")
+    except Exception as exc:
+        logger.exception("Lỗi tạo job: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+@router.get("/jobs")
+async def list_jobs(ch: ClickHouseClient = Depends(get_ch)):
+    """Danh sách job còn được lưu cùng thống kê của bộ lập lịch."""
+    return {"jobs": ch.jobs.summaries(), "stats": ch.jobs.stats()}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, ch: ClickHouseClient = Depends(get_ch)):
+    """Trạng thái job; job đang chạy có thêm tiến độ đọc từ ``system.processes``."""
+    try:
+        return await ch.jobs.status(job_id)
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, ch: ClickHouseClient = Depends(get_ch)):
+    """Hủy job đang chờ hoặc đang chạy (``KILL QUERY``)."""
+    try:
+        return ch.jobs.cancel(job_id).summary()
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(
+    job_id: str,
+    request: Request,
+    offset: int = 0,
+    limit: int = 1000,
+    ch: ClickHouseClient = Depends(get_ch),
+):
+    """Kết quả của job đã xong.
+
+    Mặc định trả về một trang JSON (``offset``/``limit``); header ``Accept``
+    Arrow hoặc Parquet trả về nguyên file kết quả.
+    """
+    try:
+        columnar = negotiate_format(request.headers.get("accept"))
+        if columnar and columnar[1] in {"ArrowStream", "Parquet"}:
+            media_type, fmt = columnar
+            path = await asyncio.to_thread(
+                ch.jobs.result_path, job_id, "parquet" if fmt == "Parquet" else "arrow"
+            )
+            return FileResponse(path, media_type=media_type)
+        if offset < 0 or not 0 < limit <= settings.CRUD_MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail="Invalid offset or limit")
+        return await asyncio.to_thread(ch.jobs.page, job_id, offset, limit)
+    except HTTPException:
+        raise
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    except JobNotReadyError as exc:
+        raise HTTPException(status_code=409, detail=f"Job is {exc}")
+    except Exception as exc:
+        logger.exception("Lỗi đọc kết quả job {}: {}", job_id, exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+@router.get("/schema-cache")
+async def schema_cache_stats(ch: ClickHouseClient = Depends(get_ch)):
+    """Thống kê hit/miss của cache schema bảng."""
+    return ch.schema_cache.stats()
+
+
+@router.delete("/schema-cache")
+async def invalidate_schema_cache(
+    table: Optional[str] = None, ch: ClickHouseClient = Depends(get_ch)
+):
+    """Xóa cache schema của một bảng hoặc toàn bộ cache."""
+    ch.invalidate_metadata(table)
+    logger.info("Xóa cache schema {}", table or "toàn bộ")
+    return {"status": "ok"}
+
+
+@router.get("/result-cache")
+async def result_cache_stats(ch: ClickHouseClient = Depends(get_ch)):
+    """Tỷ lệ hit, số mục và dung lượng của cache kết quả."""
+    return ch.result_cache.stats()
+
+
+@router.delete("/result-cache")
+async def clear_result_cache(
+    table: Optional[str] = None, ch: ClickHouseClient = Depends(get_ch)
+):
+    """Làm mới cache kết quả của một bảng hoặc xóa toàn bộ cache."""
+    if table:
+        ch.result_cache.invalidate_table(table)
+    else:
+        await ch.result_cache.clear()
+    logger.info("Xóa cache kết quả {}", table or "toàn bộ")
+    return {"status": "ok"}
+
+
+@router.get("/single-flight")
+async def single_flight_stats(ch: ClickHouseClient = Depends(get_ch)):
+    """Số truy vấn đọc thực chạy và số lời gọi được gộp vào truy vấn đang chạy."""
+    return ch.flights.stats()
+
+
+@router.get("/batch-loader")
+async def batch_loader_stats(ch: ClickHouseClient = Depends(get_ch)):
+    """Số lời gọi đọc theo khóa, số truy vấn ``IN`` thực chạy và tỷ lệ gộp."""
+    return ch.loader.stats()
+
+
+@router.get("/dimension-store")
+async def dimension_store_stats(ch: ClickHouseClient = Depends(get_ch)):
+    """Số dòng, bộ nhớ và độ trễ làm mới của các bảng chiều trong bộ nhớ."""
+    return ch.dimensions.stats()
+
+
+@router.get("/insert-buffer")
+async def insert_buffer_stats(ch: ClickHouseClient = Depends(get_ch)):
+    """Thống kê kích thước và độ trễ flush của bộ đệm chèn."""
+    return ch.insert_buffer.stats()
+
+
+@router.get("/mutations")
+async def mutation_stats(ch: ClickHouseClient = Depends(get_ch)):
+    """Thống kê chiến lược cập nhật/xóa và các mutation còn tồn trong ``system.mutations``."""
+    try:
+        backlog = await ch.mutations.backlog()
+    except Exception as exc:
+        logger.exception("Lỗi đọc system.mutations: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+    return {"stats": ch.mutations.stats(), "backlog": backlog}
+
+
+@router.get("/mutations/{table}")
+async def get_mutation_strategy(table: str, ch: ClickHouseClient = Depends(get_ch)):
+    """Chiến lược cập nhật/xóa đang áp dụng cho một bảng."""
+    try:
+        return {"table": table, "strategy": await ch.mutations.strategy(table)}
+    except Exception as exc:
+        logger.exception("Lỗi xác định chiến lược bảng {}: {}", table, exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+@router.put("/mutations/{table}")
+async def set_mutation_strategy(
+    table: str, strategy: Optional[str] = None, ch: ClickHouseClient = Depends(get_ch)
+):
+    """Ghi đè chiến lược của bảng; bỏ trống ``strategy`` để tự nhận diện lại."""
+    try:
+        ch.mutations.set_strategy(table, strategy)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    logger.info("Chiến lược cập nhật bảng {}: {}", table, strategy or "tự nhận diện")
+    return {"status": "ok"}
+
+
+@router.get("/dictionaries")
+async def dictionary_stats(ch: ClickHouseClient = Depends(get_ch)):
+    """Trạng thái, số phần tử, bộ nhớ và lần nạp gần nhất của các dictionary."""
+    try:
+        return await ch.dictionaries.stats()
+    except Exception as exc:
+        logger.exception("Lỗi đọc trạng thái dictionary: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+@router.post("/dictionaries/{table}/reload")
+async def reload_dictionary(table: str, ch: ClickHouseClient = Depends(get_ch)):
+    """Nạp lại ngay dictionary của một bảng chiều."""
+    try:
+        await ch.run(ch.dictionaries.reload, table)
+        return {"status": "ok"}
+    except DictionaryNotFoundError:
+        raise HTTPException(status_code=404, detail="Dictionary not found")
+    except Exception as exc:
+        logger.exception("Lỗi nạp lại dictionary {}: {}", table, exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+@router.get("/rollups")
+async def rollup_stats(ch: ClickHouseClient = Depends(get_ch)):
+    """Các rollup, số dòng bảng nguồn so với bảng rollup và số truy vấn đã chuyển hướng."""
+    try:
+        return await ch.rollups.stats()
+    except Exception as exc:
+        logger.exception("Lỗi đọc thống kê rollup: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+@router.post("/rollups/{name}/rebuild")
+async def rebuild_rollup(name: str, ch: ClickHouseClient = Depends(get_ch)):
+    """Tính lại toàn bộ rollup từ bảng nguồn."""
+    try:
+        await ch.run(ch.rollups.rebuild, name)
+        return {"status": "ok"}
+    except RollupNotFoundError:
+        raise HTTPException(status_code=404, detail="Rollup not found")
+    except Exception as exc:
+        logger.exception("Lỗi nạp lại rollup {}: {}", name, exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
@@ -1,7 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from functools import partial
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from loguru import logger
-from app.models.warehouse import Order
+from app.core.config import settings
+from app.models.warehouse import EnrichedOrder, EntityId, Order, OrderSummary
+from app.services.batch_loader import Lookup, parse_ids
 from app.services.clickhouse_client import ClickHouseClient
+from app.services.dictionaries import DictionaryNotFoundError
+from app.services.insert_buffer import AckMode, BufferFullError, InvalidRowError
+from app.services.result_cache import cached_query
+from app.services.versioning import next_version
 
 
 def get_ch(request: Request) -> ClickHouseClient:
@@ -24,58 +33,258 @@ def get_ch(request: Request) -> ClickHouseClient:
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
+ORDER_LOOKUP = Lookup(
+    "fact_orders",
+    "order_id",
+    "UInt64",
+    ("order_id", "user_id", "product_id", "quantity", "total", "order_date"),
+    versioned=True,
+)
+
+
+ORDER_COLUMNS = "order_id, user_id, product_id, quantity, total, order_date"
+# Bảng nguồn của các dictionary: câu SQL chỉ nhắc tới fact_orders nên cache kết
+# quả phải theo dõi thêm các bảng này (dictionary tự nạp lại sau LIFETIME giây)
+ENRICHED_TABLES = ("dim_users", "dim_products")
+
+
+def _enriched_sql(ch: ClickHouseClient, where: str) -> str:
+    """``SELECT`` đơn hàng kèm tên người dùng/sản phẩm lấy qua dictionary."""
+    user_name = ch.dictionaries.get_expr("dim_users", "name", "user_id")
+    user_email = ch.dictionaries.get_expr("dim_users", "email", "user_id")
+    product_name = ch.dictionaries.get_expr("dim_products", "name", "product_id")
+    return (
+        f"SELECT {ORDER_COLUMNS}, {user_name} AS user_name, {user_email} AS user_email, "
+        f"{product_name} AS product_name FROM fact_orders FINAL "
+        f"WHERE {where} AND _deleted = 0"
+    )
+
+
+def _enriched(r) -> EnrichedOrder:
+    return EnrichedOrder(
+        order_id=r[0],
+        user_id=r[1],
+        product_id=r[2],
+        quantity=r[3],
+        total=r[4],
+        order_date=r[5],
+        user_name=r[6],
+        user_email=r[7],
+        product_name=r[8],
+    )
+
+
+def _order(r) -> Order:
+    return Order(
+        order_id=r[0],
+        user_id=r[1],
+        product_id=r[2],
+        quantity=r[3],
+        total=r[4],
+        order_date=r[5],
+    )
+
 
 @router.post("/")
-async def create_order(order: Order, ch: ClickHouseClient = Depends(get_ch)):
-    """Tạo mới một đơn hàng."""
-    try:
-        check_sql = "SELECT count() FROM fact_orders WHERE order_id={order_id:UInt64}"
-        exists = ch.query(check_sql, parameters={"order_id": order.order_id}).result_rows[0][0]
-        if exists:
-            raise HTTPException(status_code=400, detail="Order with this id already exists")
+async def create_order(
+    order: Order, ack: AckMode = "flush", ch: ClickHouseClient = Depends(get_ch)
+):
+    """Tạo mới một đơn hàng.
 
-        sql = (
-            "INSERT INTO fact_orders (order_id, user_id, product_id, quantity, total) "
-            "VALUES ({order_id:UInt64}, {user_id:UInt64}, {product_id:UInt64}, {quantity:UInt32}, {total:Float64})"
-        )
+    Dòng mới được ghi qua bộ đệm chèn với ``_version`` mới nên tạo lại cùng ID
+    sẽ ghi đè bản cũ thay vì tạo bản trùng; ``ack=async`` trả về ngay khi dòng
+    đã vào hàng đợi thay vì chờ ghi xong.
+    """
+    try:
         params = {
             "order_id": order.order_id,
             "user_id": order.user_id,
             "product_id": order.product_id,
             "quantity": order.quantity,
             "total": order.total,
+            "_version": next_version(),
         }
-        ch.command(sql, parameters=params)
+        await ch.insert_buffer.insert("fact_orders", params, ack=ack)
         logger.info("Tạo đơn hàng {}", order.order_id)
-        return {"status": "ok"}
+        return {"status": "ok" if ack == "flush" else "accepted"}
     except HTTPException:
         raise
+    except InvalidRowError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except BufferFullError as exc:
+        logger.warning("Hàng đợi chèn đầy: {}", exc)
+        raise HTTPException(status_code=503, detail="Insert queue is full")
     except Exception as exc:
         logger.exception("Lỗi tạo đơn hàng: {}", exc)
         raise HTTPException(status_code=500, detail="Lỗi máy chủ")
 
 
+@router.get("", response_model=List[Order])
+async def read_orders(
+    ids: str = Query(..., description="Danh sách ID cách nhau bởi dấu phẩy"),
+    ch: ClickHouseClient = Depends(get_ch),
+):
+    """Lấy nhiều đơn hàng trong một request (``?ids=1,2,3``).
+
+    Kết quả theo thứ tự ID yêu cầu, bỏ qua ID không tồn tại.
+    """
+    try:
+        try:
+            keys = parse_ids(ids)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        rows = await ch.loader.load_many(ORDER_LOOKUP, keys)
+        return [
+            _order(r)
+            for key in keys
+            for r in rows.get(key, [])[:1]
+        ]
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("Lỗi đọc nhiều đơn hàng: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+@router.get("/enriched", response_model=List[EnrichedOrder])
+async def read_enriched_orders(
+    request: Request,
+    user_id: Optional[int] = None,
+    product_id: Optional[int] = None,
+    after: Optional[int] = Query(None, description="Chỉ lấy đơn hàng có order_id lớn hơn"),
+    limit: int = Query(settings.CRUD_DEFAULT_PAGE_SIZE, ge=1, le=settings.CRUD_MAX_PAGE_SIZE),
+    ch: ClickHouseClient = Depends(get_ch),
+):
+    """Danh sách đơn hàng kèm tên người dùng và sản phẩm trong một truy vấn.
+
+    Sắp xếp theo ``order_id``; trang tiếp theo dùng ``after`` bằng ``order_id``
+    cuối cùng của trang trước.
+    """
+    try:
+        conditions = ["1"]
+        params = {"limit": limit}
+        for column, value in (("user_id", user_id), ("product_id", product_id)):
+            if value is not None:
+                conditions.append(f"{column} = {{{column}:UInt64}}")
+                params[column] = value
+        if after is not None:
+            conditions.append("order_id > {after:UInt64}")
+            params["after"] = after
+        sql = (
+            _enriched_sql(ch, " AND ".join(conditions))
+            + " ORDER BY order_id LIMIT {limit:UInt32}"
+        )
+        return await cached_query(
+            ch,
+            request,
+            "orders.read_enriched_orders",
+            sql,
+            params,
+            lambda result: [_enriched(r) for r in result.result_rows],
+            tables=ENRICHED_TABLES,
+        )
+    except DictionaryNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=f"Dictionary for {exc} is not configured")
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("Lỗi đọc đơn hàng kèm thông tin: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+@router.get("/summary", response_model=List[OrderSummary])
+async def summarize_orders(
+    request: Request,
+    by: Literal["user", "product"] = "user",
+    limit: int = Query(settings.CRUD_DEFAULT_PAGE_SIZE, ge=1, le=settings.CRUD_MAX_PAGE_SIZE),
+    ch: ClickHouseClient = Depends(get_ch),
+):
+    """Số đơn, số lượng và doanh thu theo người dùng hoặc sản phẩm, kèm tên.
+
+    Tổng hợp theo khóa trước rồi mới tra tên, nên mỗi nhóm chỉ gọi ``dictGet``
+    một lần; kết quả sắp xếp theo doanh thu giảm dần.
+    """
+    try:
+        table, key = ("dim_users", "user_id") if by == "user" else ("dim_products", "product_id")
+        name = ch.dictionaries.get_expr(table, "name", key)
+        sql = (
+            f"SELECT {key}, {name} AS name, count() AS orders, sum(quantity) AS quantity, "
+            f"sum(total) AS total FROM fact_orders FINAL WHERE _deleted = 0 "
+            f"GROUP BY {key} ORDER BY total DESC LIMIT {{limit:UInt32}}"
+        )
+
+        def build(result):
+            return [
+                OrderSummary(id=r[0], name=r[1], orders=r[2], quantity=r[3], total=r[4])
+                for r in result.result_rows
+            ]
+
+        return await cached_query(
+            ch, request, "orders.summarize_orders", sql, {"limit": limit}, build, tables=(table,)
+        )
+    except DictionaryNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=f"Dictionary for {exc} is not configured")
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("Lỗi tổng hợp đơn hàng: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
+@router.get("/{order_id}/enriched", response_model=EnrichedOrder)
+async def read_enriched_order(
+    order_id: EntityId, request: Request, ch: ClickHouseClient = Depends(get_ch)
+):
+    """Đơn hàng kèm tên người dùng và sản phẩm, thay cho ba lần gọi riêng."""
+    try:
+        sql = _enriched_sql(ch, "order_id = {order_id:UInt64}")
+
+        def build(result):
+            rows = result.result_rows
+            if not rows:
+                raise HTTPException(status_code=404, detail="Order not found")
+            return _enriched(rows[0])
+
+        return await cached_query(
+            ch,
+            request,
+            "orders.read_enriched_order",
+            sql,
+            {"order_id": order_id},
+            build,
+            tables=ENRICHED_TABLES,
+        )
+    except DictionaryNotFoundError as exc:
+        raise HTTPException(status_code=503, detail=f"Dictionary for {exc} is not configured")
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("Lỗi đọc đơn hàng kèm thông tin: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
 @router.get("/{order_id}", response_model=Order)
-async def read_order(order_id: int, ch: ClickHouseClient = Depends(get_ch)):
+async def read_order(
+    order_id: EntityId, request: Request, ch: ClickHouseClient = Depends(get_ch)
+):
     """Lấy thông tin đơn hàng theo ID."""
     try:
         sql = (
             "SELECT order_id, user_id, product_id, quantity, total, order_date "
-            "FROM fact_orders WHERE order_id = {order_id:UInt64}"
+            "FROM fact_orders FINAL WHERE order_id = {order_id:UInt64} AND _deleted = 0"
         )
         params = {"order_id": order_id}
-        result = ch.query(sql, parameters=params)
-        rows = result.result_rows
-        if not rows:
-            raise HTTPException(status_code=404, detail="Order not found")
-        r = rows[0]
-        return Order(
-            order_id=r[0],
-            user_id=r[1],
-            product_id=r[2],
-            quantity=r[3],
-            total=r[4],
-            order_date=r[5],
+
+        def build(result):
+            rows = result.result_rows
+            if not rows:
+                raise HTTPException(status_code=404, detail="Order not found")
+            return _order(rows[0])
+
+        # Các request đọc đơn hàng đồng thời được gộp thành một truy vấn IN
+        fetch = partial(ch.loader.load, ORDER_LOOKUP, order_id)
+        return await cached_query(
+            ch, request, "orders.read_order", sql, params, build, fetch=fetch
         )
     except HTTPException:
         raise
@@ -85,26 +294,18 @@ async def read_order(order_id: int, ch: ClickHouseClient = Depends(get_ch)):
 
 
 @router.put("/{order_id}")
-async def update_order(order_id: int, order: Order, ch: ClickHouseClient = Depends(get_ch)):
+async def update_order(order_id: EntityId, order: Order, ch: ClickHouseClient = Depends(get_ch)):
     """Cập nhật thông tin đơn hàng."""
     try:
-        check_sql = "SELECT count() FROM fact_orders WHERE order_id={order_id:UInt64}"
-        exists = ch.query(check_sql, parameters={"order_id": order_id}).result_rows[0][0]
-        if not exists:
-            raise HTTPException(status_code=404, detail="Order not found")
-
-        sql = (
-            "ALTER TABLE fact_orders UPDATE user_id={user_id:UInt64}, product_id={product_id:UInt64}, "
-            "quantity={quantity:UInt32}, total={total:Float64} WHERE order_id={order_id:UInt64}"
-        )
-        params = {
+        # order_date không nằm trong danh sách cập nhật nên giữ nguyên giá trị cũ
+        values = {
             "user_id": order.user_id,
             "product_id": order.product_id,
             "quantity": order.quantity,
             "total": order.total,
-            "order_id": order_id,
         }
-        ch.command(sql, parameters=params)
+        if await ch.mutations.update("fact_orders", "order_id", order_id, values) == 0:
+            raise HTTPException(status_code=404, detail="Order not found")
         logger.info("Cập nhật đơn hàng {}", order_id)
         return {"status": "ok"}
     except HTTPException:
@@ -115,17 +316,11 @@ async def update_order(order_id: int, order: Order, ch: ClickHouseClient = Depen
 
 
 @router.delete("/{order_id}")
-async def delete_order(order_id: int, ch: ClickHouseClient = Depends(get_ch)):
+async def delete_order(order_id: EntityId, ch: ClickHouseClient = Depends(get_ch)):
     """Xóa đơn hàng theo ID."""
     try:
-        check_sql = "SELECT count() FROM fact_orders WHERE order_id={order_id:UInt64}"
-        exists = ch.query(check_sql, parameters={"order_id": order_id}).result_rows[0][0]
-        if not exists:
+        if await ch.mutations.delete("fact_orders", "order_id", order_id) == 0:
             raise HTTPException(status_code=404, detail="Order not found")
-
-        sql = "ALTER TABLE fact_orders DELETE WHERE order_id={order_id:UInt64}"
-        params = {"order_id": order_id}
-        ch.command(sql, parameters=params)
         logger.info("Xóa đơn hàng {}", order_id)
         return {"status": "ok"}
     except HTTPException:
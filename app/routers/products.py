@@ -1,7 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from functools import partial
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from loguru import logger
-from app.models.warehouse import Product
+from app.models.warehouse import EntityId, Product
+from app.services.batch_loader import Lookup, parse_ids
 from app.services.clickhouse_client import ClickHouseClient
+from app.services.insert_buffer import AckMode, BufferFullError, InvalidRowError
+from app.services.result_cache import cached_query
+from app.services.versioning import next_version
 
 
 def get_ch(request: Request) -> ClickHouseClient:
@@ -24,40 +31,100 @@ def get_ch(request: Request) -> ClickHouseClient:
 
 router = APIRouter(prefix="/products", tags=["products"])
 
+PRODUCT_LOOKUP = Lookup("dim_products", "id", "UInt64", ("id", "name"), versioned=True)
+
 
 @router.post("/")
-async def create_product(product: Product, ch: ClickHouseClient = Depends(get_ch)):
-    """Tạo mới một sản phẩm."""
+async def create_product(
+    product: Product, ack: AckMode = "flush", ch: ClickHouseClient = Depends(get_ch)
+):
+    """Tạo mới một sản phẩm.
+
+    Dòng mới được ghi qua bộ đệm chèn với ``_version`` mới nên tạo lại cùng ID
+    sẽ ghi đè bản cũ thay vì tạo bản trùng; ``ack=async`` trả về ngay khi dòng
+    đã vào hàng đợi thay vì chờ ghi xong.
+    """
     try:
-        check_sql = "SELECT count() FROM dim_products WHERE id={id:UInt64}"
-        exists = ch.query(check_sql, parameters={"id": product.id}).result_rows[0][0]
-        if exists:
-            raise HTTPException(status_code=400, detail="Product with this id already exists")
-
-        sql = "INSERT INTO dim_products (id, name) VALUES ({id:UInt64}, {name:String})"
-        params = {"id": product.id, "name": product.name}
-        ch.command(sql, parameters=params)
+        params = {"id": product.id, "name": product.name, "_version": next_version()}
+        await ch.insert_buffer.insert("dim_products", params, ack=ack)
         logger.info("Tạo sản phẩm {}", product.id)
-        return {"status": "ok"}
+        return {"status": "ok" if ack == "flush" else "accepted"}
     except HTTPException:
         raise
+    except InvalidRowError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except BufferFullError as exc:
+        logger.warning("Hàng đợi chèn đầy: {}", exc)
+        raise HTTPException(status_code=503, detail="Insert queue is full")
     except Exception as exc:
         logger.exception("Lỗi tạo sản phẩm: {}", exc)
         raise HTTPException(status_code=500, detail="Lỗi máy chủ")
 
 
+@router.get("", response_model=List[Product])
+async def read_products(
+    ids: str = Query(..., description="Danh sách ID cách nhau bởi dấu phẩy"),
+    ch: ClickHouseClient = Depends(get_ch),
+):
+    """Lấy nhiều sản phẩm trong một request (``?ids=1,2,3``).
+
+    Kết quả theo thứ tự ID yêu cầu, bỏ qua ID không tồn tại.
+    """
+    try:
+        try:
+            keys = parse_ids(ids)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        dim = ch.dimensions.table("dim_products")
+        if dim is not None:
+            rows = dim.get_many(keys)
+        else:
+            rows = await ch.loader.load_many(PRODUCT_LOOKUP, keys)
+        return [
+            Product(id=r[0], name=r[1])
+            for key in keys
+            for r in rows.get(key, [])[:1]
+        ]
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("Lỗi đọc nhiều sản phẩm: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
 @router.get("/{product_id}", response_model=Product)
-async def read_product(product_id: int, ch: ClickHouseClient = Depends(get_ch)):
-    """Lấy thông tin sản phẩm theo ID."""
+async def read_product(
+    product_id: EntityId, request: Request, ch: ClickHouseClient = Depends(get_ch)
+):
+    """Lấy thông tin sản phẩm theo ID.
+
+    Đọc từ bản sao trong bộ nhớ khi bảng được bật trong ``DIMENSION_STORE_TABLES``.
+    """
     try:
-        sql = "SELECT id, name FROM dim_products WHERE id = {product_id:UInt64}"
+        dim = ch.dimensions.table("dim_products")
+        if dim is not None:
+            row = dim.get(product_id)
+            if row is None:
+                raise HTTPException(status_code=404, detail="Product not found")
+            return Product(id=row[0], name=row[1])
+        sql = (
+            "SELECT id, name FROM dim_products FINAL "
+            "WHERE id = {product_id:UInt64} AND _deleted = 0"
+        )
         params = {"product_id": product_id}
-        result = ch.query(sql, parameters=params)
-        rows = result.result_rows
-        if not rows:
-            raise HTTPException(status_code=404, detail="Product not found")
-        r = rows[0]
-        return Product(id=r[0], name=r[1])
+
+        def build(result):
+            rows = result.result_rows
+            if not rows:
+                raise HTTPException(status_code=404, detail="Product not found")
+            r = rows[0]
+            return Product(id=r[0], name=r[1])
+
+        # Các request đọc sản phẩm đồng thời được gộp thành một truy vấn IN
+        fetch = partial(ch.loader.load, PRODUCT_LOOKUP, product_id)
+        return await cached_query(
+            ch, request, "products.read_product", sql, params, build, fetch=fetch
+        )
     except HTTPException:
         raise
     except Exception as exc:
@@ -66,17 +133,12 @@ async def read_product(product_id: int, ch: ClickHouseClient = Depends(get_ch)):
 
 
 @router.put("/{product_id}")
-async def update_product(product_id: int, product: Product, ch: ClickHouseClient = Depends(get_ch)):
+async def update_product(product_id: EntityId, product: Product, ch: ClickHouseClient = Depends(get_ch)):
     """Cập nhật thông tin sản phẩm."""
     try:
-        check_sql = "SELECT count() FROM dim_products WHERE id={product_id:UInt64}"
-        exists = ch.query(check_sql, parameters={"product_id": product_id}).result_rows[0][0]
-        if not exists:
+        values = {"name": product.name}
+        if await ch.mutations.update("dim_products", "id", product_id, values) == 0:
             raise HTTPException(status_code=404, detail="Product not found")
-
-        sql = "ALTER TABLE dim_products UPDATE name={name:String} WHERE id={product_id:UInt64}"
-        params = {"name": product.name, "product_id": product_id}
-        ch.command(sql, parameters=params)
         logger.info("Cập nhật sản phẩm {}", product_id)
         return {"status": "ok"}
     except HTTPException:
@@ -87,17 +149,11 @@ async def update_product(product_id: int, product: Product, ch: ClickHouseClient
 
 
 @router.delete("/{product_id}")
-async def delete_product(product_id: int, ch: ClickHouseClient = Depends(get_ch)):
+async def delete_product(product_id: EntityId, ch: ClickHouseClient = Depends(get_ch)):
     """Xóa sản phẩm theo ID."""
     try:
-        check_sql = "SELECT count() FROM dim_products WHERE id={product_id:UInt64}"
-        exists = ch.query(check_sql, parameters={"product_id": product_id}).result_rows[0][0]
-        if not exists:
+        if await ch.mutations.delete("dim_products", "id", product_id) == 0:
             raise HTTPException(status_code=404, detail="Product not found")
-
-        sql = "ALTER TABLE dim_products DELETE WHERE id={product_id:UInt64}"
-        params = {"product_id": product_id}
-        ch.command(sql, parameters=params)
         logger.info("Xóa sản phẩm {}", product_id)
         return {"status": "ok"}
     except HTTPException:
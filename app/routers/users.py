@@ -1,7 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from functools import partial
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from loguru import logger
-from app.models.warehouse import User
+from app.models.warehouse import EntityId, User
+from app.services.batch_loader import Lookup, parse_ids
 from app.services.clickhouse_client import ClickHouseClient
+from app.services.insert_buffer import AckMode, BufferFullError, InvalidRowError
+from app.services.result_cache import cached_query
+from app.services.versioning import next_version
 
 
 def get_ch(request: Request) -> ClickHouseClient:
@@ -24,40 +31,105 @@ def get_ch(request: Request) -> ClickHouseClient:
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+USER_LOOKUP = Lookup("dim_users", "id", "UInt64", ("id", "name", "email"), versioned=True)
+
 
 @router.post("/")
-async def create_user(user: User, ch: ClickHouseClient = Depends(get_ch)):
-    """Tạo mới một người dùng."""
+async def create_user(
+    user: User, ack: AckMode = "flush", ch: ClickHouseClient = Depends(get_ch)
+):
+    """Tạo mới một người dùng.
+
+    Dòng mới được ghi qua bộ đệm chèn với ``_version`` mới nên tạo lại cùng ID
+    sẽ ghi đè bản cũ thay vì tạo bản trùng; ``ack=async`` trả về ngay khi dòng
+    đã vào hàng đợi thay vì chờ ghi xong.
+    """
     try:
-        check_sql = "SELECT count() FROM dim_users WHERE id={id:UInt64}"
-        exists = ch.query(check_sql, parameters={"id": user.id}).result_rows[0][0]
-        if exists:
-            raise HTTPException(status_code=400, detail="User with this id already exists")
-
-        sql = "INSERT INTO dim_users (id, name, email) VALUES ({id:UInt64}, {name:String}, {email:String})"
-        params = {"id": user.id, "name": user.name, "email": user.email}
-        ch.command(sql, parameters=params)
+        params = {
+            "id": user.id,
+            "name": user.name,
+            "email": user.email,
+            "_version": next_version(),
+        }
+        await ch.insert_buffer.insert("dim_users", params, ack=ack)
         logger.info("Tạo người dùng {}", user.id)
-        return {"status": "ok"}
+        return {"status": "ok" if ack == "flush" else "accepted"}
     except HTTPException:
         raise
+    except InvalidRowError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except BufferFullError as exc:
+        logger.warning("Hàng đợi chèn đầy: {}", exc)
+        raise HTTPException(status_code=503, detail="Insert queue is full")
     except Exception as exc:
         logger.exception("Lỗi tạo người dùng: {}", exc)
         raise HTTPException(status_code=500, detail="Lỗi máy chủ")
 
 
+@router.get("", response_model=List[User])
+async def read_users(
+    ids: str = Query(..., description="Danh sách ID cách nhau bởi dấu phẩy"),
+    ch: ClickHouseClient = Depends(get_ch),
+):
+    """Lấy nhiều người dùng trong một request (``?ids=1,2,3``).
+
+    Kết quả theo thứ tự ID yêu cầu, bỏ qua ID không tồn tại.
+    """
+    try:
+        try:
+            keys = parse_ids(ids)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        dim = ch.dimensions.table("dim_users")
+        if dim is not None:
+            rows = dim.get_many(keys)
+        else:
+            rows = await ch.loader.load_many(USER_LOOKUP, keys)
+        return [
+            User(id=r[0], name=r[1], email=r[2])
+            for key in keys
+            for r in rows.get(key, [])[:1]
+        ]
+    except HTTPException:
+        raise
+    except Exception as exc:
+        logger.exception("Lỗi đọc nhiều người dùng: {}", exc)
+        raise HTTPException(status_code=500, detail="Lỗi máy chủ")
+
+
 @router.get("/{user_id}", response_model=User)
-async def read_user(user_id: int, ch: ClickHouseClient = Depends(get_ch)):
-    """Lấy thông tin một người dùng theo ID."""
+async def read_user(
+    user_id: EntityId, request: Request, ch: ClickHouseClient = Depends(get_ch)
+):
+    """Lấy thông tin một người dùng theo ID.
+
+    Đọc từ bản sao trong bộ nhớ khi bảng được bật trong ``DIMENSION_STORE_TABLES``.
+    """
     try:
-        sql = "SELECT id, name, email FROM dim_users WHERE id = {user_id:UInt64}"
+        dim = ch.dimensions.table("dim_users")
+        if dim is not None:
+            row = dim.get(user_id)
+            if row is None:
+                raise HTTPException(status_code=404, detail="User not found")
+            return User(id=row[0], name=row[1], email=row[2])
+        sql = (
+            "SELECT id, name, email FROM dim_users FINAL "
+            "WHERE id = {user_id:UInt64} AND _deleted = 0"
+        )
         params = {"user_id": user_id}
-        result = ch.query(sql, parameters=params)
-        rows = result.result_rows
-        if not rows:
-            raise HTTPException(status_code=404, detail="User not found")
-        r = rows[0]
-        return User(id=r[0], name=r[1], email=r[2])
+
+        def build(result):
+            rows = result.result_rows
+            if not rows:
+                raise HTTPException(status_code=404, detail="User not found")
+            r = rows[0]
+            return User(id=r[0], name=r[1], email=r[2])
+
+        # Các request đọc người dùng đồng thời được gộp thành một truy vấn IN
+        fetch = partial(ch.loader.load, USER_LOOKUP, user_id)
+        return await cached_query(
+            ch, request, "users.read_user", sql, params, build, fetch=fetch
+        )
     except HTTPException:
         raise
     except Exception as exc:
@@ -66,17 +138,12 @@ async def read_user(user_id: int, ch: ClickHouseClient = Depends(get_ch)):
 
 
 @router.put("/{user_id}")
-async def update_user(user_id: int, user: User, ch: ClickHouseClient = Depends(get_ch)):
+async def update_user(user_id: EntityId, user: User, ch: ClickHouseClient = Depends(get_ch)):
     """Cập nhật thông tin người dùng."""
     try:
-        check_sql = "SELECT count() FROM dim_users WHERE id={user_id:UInt64}"
-        exists = ch.query(check_sql, parameters={"user_id": user_id}).result_rows[0][0]
-        if not exists:
+        values = {"name": user.name, "email": user.email}
+        if await ch.mutations.update("dim_users", "id", user_id, values) == 0:
             raise HTTPException(status_code=404, detail="User not found")
-
-        sql = "ALTER TABLE dim_users UPDATE name={name:String}, email={email:String} WHERE id={user_id:UInt64}"
-        params = {"name": user.name, "email": user.email, "user_id": user_id}
-        ch.command(sql, parameters=params)
         logger.info("Cập nhật người dùng {}", user_id)
         return {"status": "ok"}
     except HTTPException:
@@ -87,17 +154,11 @@ async def update_user(user_id: int, user: User, ch: ClickHouseClient = Depends(g
 
 
 @router.delete("/{user_id}")
-async def delete_user(user_id: int, ch: ClickHouseClient = Depends(get_ch)):
+async def delete_user(user_id: EntityId, ch: ClickHouseClient = Depends(get_ch)):
     """Xóa người dùng theo ID."""
     try:
-        check_sql = "SELECT count() FROM dim_users WHERE id={user_id:UInt64}"
-        exists = ch.query(check_sql, parameters={"user_id": user_id}).result_rows[0][0]
-        if not exists:
+        if await ch.mutations.delete("dim_users", "id", user_id) == 0:
             raise HTTPException(status_code=404, detail="User not found")
-
-        sql = "ALTER TABLE dim_users DELETE WHERE id={user_id:UInt64}"
-        params = {"user_id": user_id}
-        ch.command(sql, parameters=params)
         logger.info("Xóa người dùng {}", user_id)
         return {"status": "ok"}
     except HTTPException:
@@ -0,0 +1,224 @@
+"""Gộp các truy vấn đọc theo khóa đang chờ cùng lúc thành một ``WHERE key IN (...)``.
+
+Theo kiểu DataLoader: mỗi ``load`` chỉ ghi khóa cần đọc vào lô của bảng rồi
+chờ; lô được gửi đi ở vòng lặp kế tiếp của event loop (hoặc sau
+``BATCH_LOADER_DELAY`` giây) bằng một truy vấn duy nhất, sau đó mỗi người gọi
+nhận đúng các dòng của khóa mình. Khi frontend gửi hàng trăm request đọc một
+dòng cùng lúc, số truy vấn ClickHouse giảm xuống còn vài truy vấn.
+"""
+
+import asyncio
+import re
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.guardrails import profile_name
+from app.services.insert_buffer import coerce_value
+from app.services.versioning import DELETED_COLUMN
+
+if TYPE_CHECKING:
+    from app.services.clickhouse_client import ClickHouseClient
+
+
+UINT64_MAX = 2**64 - 1
+_INT_TYPE_RE = re.compile(r"(U?)Int(\d+)")
+
+
+class TooManyKeysError(ValueError):
+    """Yêu cầu đọc nhiều khóa hơn giới hạn cho phép."""
+
+
+def cast_key(value: Any, ch_type: str = "UInt64") -> Any:
+    """Ép khóa sang kiểu của cột, báo ``ValueError`` nếu không hợp lệ.
+
+    Khóa được gộp chung một truy vấn ``IN`` (hoặc một mutation) với khóa của
+    request khác; một khóa ClickHouse không đọc được (sai kiểu, âm hoặc vượt
+    phạm vi của kiểu số nguyên) sẽ làm lỗi cả lô nên bị từ chối ở đây.
+    """
+    key = coerce_value(value, ch_type)
+    if key is None:
+        raise ValueError(f"Invalid id: {value}")
+    match = _INT_TYPE_RE.fullmatch(ch_type)
+    if match:
+        bits = int(match.group(2))
+        low, high = (0, 2**bits - 1) if match.group(1) else (-(2 ** (bits - 1)), 2 ** (bits - 1) - 1)
+        if not low <= key <= high:
+            raise ValueError(f"Invalid id: {value}")
+    return key
+
+
+@dataclass(frozen=True)
+class Lookup:
+    """Cách đọc dòng theo khóa của một bảng: cột khóa, kiểu khóa và cột cần lấy."""
+
+    table: str
+    key_column: str
+    key_type: str
+    columns: Tuple[str, ...]
+    versioned: bool = False
+
+    def sql(self) -> str:
+        sql = f"SELECT {', '.join(self.columns)} FROM {self.table}"
+        condition = f"{self.key_column} IN {{__keys:Array({self.key_type})}}"
+        if self.versioned:
+            sql += " FINAL"
+            condition += f" AND {DELETED_COLUMN} = 0"
+        return f"{sql} WHERE {condition}"
+
+
+class LoadedRows:
+    """Các dòng của một khóa, có thuộc tính ``result_rows`` như ``QueryResult``."""
+
+    def __init__(self, result_rows: List[Sequence[Any]]):
+        self.result_rows = result_rows
+
+
+class _Batch:
+    def __init__(self):
+        self.waiters: Dict[Any, List["asyncio.Future[List[Sequence[Any]]]"]] = {}
+
+
+def _match_key(value: Any) -> Any:
+    """Khóa để so khớp giá trị trả về với khóa yêu cầu.
+
+    Số và chuỗi so khớp trực tiếp; kiểu khác (``UUID``, ``datetime``...) được
+    đọc từ ClickHouse dưới dạng đối tượng Python còn khóa yêu cầu là chuỗi,
+    nên so khớp theo dạng chuỗi.
+    """
+    return value if isinstance(value, (int, float, str)) else str(value)
+
+
+def parse_ids(
+    raw: str,
+    cast: Callable[[str], Any] = cast_key,
+    max_ids: Optional[int] = None,
+) -> List[Any]:
+    """Tách danh sách ``1,2,3`` (bỏ phần tử rỗng và trùng, giữ thứ tự).
+
+    Raises:
+        TooManyKeysError: Nếu vượt ``MULTI_GET_MAX_IDS``.
+        ValueError: Nếu có ID không ép được sang kiểu của khóa.
+    """
+    max_ids = max_ids or settings.MULTI_GET_MAX_IDS
+    items = [item.strip() for item in raw.split(",") if item.strip()]
+    if not items:
+        raise ValueError("ids must not be empty")
+    ids = []
+    for item in items:
+        try:
+            ids.append(cast(item))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid id: {item}")
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > max_ids:
+        raise TooManyKeysError(f"At most {max_ids} ids per request")
+    return ids
+
+
+class BatchLoader:
+    """Gom lời gọi ``load`` theo bảng trong cùng một vòng event loop.
+
+    Lô chỉ gộp các lời gọi cùng ``Lookup`` và cùng hồ sơ giới hạn truy vấn;
+    truy vấn của lô chạy trong context của lời gọi đầu tiên. Mỗi truy vấn đọc
+    tối đa ``max_keys`` khóa, lô lớn hơn được chia nhỏ.
+    """
+
+    def __init__(
+        self,
+        ch: "ClickHouseClient",
+        delay: Optional[float] = None,
+        max_keys: Optional[int] = None,
+    ):
+        self._ch = ch
+        self.delay = delay if delay is not None else settings.BATCH_LOADER_DELAY
+        self.max_keys = max_keys or settings.BATCH_LOADER_MAX_KEYS
+        self._batches: Dict[Tuple[Lookup, str], _Batch] = {}
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        self._metrics: Dict[str, int] = {"loads": 0, "keys": 0, "queries": 0, "errors": 0}
+
+    async def load(self, lookup: Lookup, key: Any) -> LoadedRows:
+        """Các dòng có ``key_column == key`` (rỗng nếu không có)."""
+        rows = await self.load_many(lookup, [key])
+        return LoadedRows(rows.get(key, []))
+
+    async def load_many(
+        self, lookup: Lookup, keys: Iterable[Any]
+    ) -> Dict[Any, List[Sequence[Any]]]:
+        """Dòng theo từng khóa; khóa không có dòng nào không xuất hiện trong kết quả."""
+        loop = asyncio.get_running_loop()
+        group = (lookup, profile_name())
+        batch = self._batches.get(group)
+        if batch is None:
+            batch = self._batches[group] = _Batch()
+            if self.delay > 0:
+                loop.call_later(self.delay, self._dispatch, group)
+            else:
+                loop.call_soon(self._dispatch, group)
+        futures = {}
+        for key in keys:
+            future = loop.create_future()
+            batch.waiters.setdefault(key, []).append(future)
+            futures[key] = future
+            self._metrics["loads"] += 1
+        results = await asyncio.gather(*futures.values())
+        return {key: rows for key, rows in zip(futures, results) if rows}
+
+    def _dispatch(self, group: Tuple[Lookup, str]) -> None:
+        batch = self._batches.pop(group, None)
+        if batch is None:
+            return
+        # Bỏ khóa mà mọi người chờ đã hủy trước khi lô được gửi
+        keys = [
+            key for key, futures in batch.waiters.items()
+            if not all(future.cancelled() for future in futures)
+        ]
+        for start in range(0, len(keys), self.max_keys):
+            chunk = keys[start:start + self.max_keys]
+            task = asyncio.ensure_future(self._fetch(group[0], batch, chunk))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            waiters = [future for key in chunk for future in batch.waiters[key]]
+
+            def cancel_if_abandoned(_, task=task, waiters=waiters):
+                # Mọi request chờ lô đã hủy (client ngắt kết nối): hủy truy vấn
+                # để ``KILL QUERY`` như khi truy vấn chạy trong chính request
+                if all(future.cancelled() for future in waiters):
+                    task.cancel()
+
+            for future in waiters:
+                future.add_done_callback(cancel_if_abandoned)
+
+    async def _fetch(self, lookup: Lookup, batch: _Batch, keys: List[Any]) -> None:
+        self._metrics["queries"] += 1
+        self._metrics["keys"] += len(keys)
+        try:
+            result = await self._ch.aquery(lookup.sql(), parameters={"__keys": keys})
+        except Exception as exc:
+            self._metrics["errors"] += 1
+            logger.warning("Lỗi đọc lô {} khóa từ {}: {}", len(keys), lookup.table, exc)
+            for key in keys:
+                for future in batch.waiters[key]:
+                    if not future.done():
+                        future.set_exception(exc)
+            return
+        index = lookup.columns.index(lookup.key_column)
+        found: Dict[Any, List[Sequence[Any]]] = {}
+        for row in result.result_rows:
+            found.setdefault(_match_key(row[index]), []).append(row)
+        for key in keys:
+            rows = found.get(_match_key(key), [])
+            for future in batch.waiters[key]:
+                if not future.done():
+                    future.set_result(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        """Số lời gọi, số truy vấn thực chạy và tỷ lệ gộp."""
+        loads, queries = self._metrics["loads"], self._metrics["queries"]
+        return {
+            **self._metrics,
+            "pending_batches": len(self._batches),
+            "loads_per_query": round(loads / queries, 2) if queries else 0.0,
+        }
@@ -0,0 +1,341 @@
+"""Nạp dữ liệu hàng loạt (NDJSON, CSV, Arrow IPC, Parquet) vào ClickHouse theo lô.
+
+Mỗi lô được kiểm tra toàn bộ trước khi chèn, nên lỗi dữ liệu không làm hỏng
+một lệnh ``insert`` giữa chừng. Các lô trước đó đã được ghi: lỗi mang theo số
+dòng đã ghi (``rows_committed``) để client nạp tiếp từ dòng kế tiếp.
+"""
+
+import asyncio
+import io
+import json
+import queue
+import tempfile
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from loguru import logger
+
+from app.services.insert_buffer import coerce_value
+
+NDJSON = "application/x-ndjson"
+CSV = "text/csv"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+PARQUET_TYPES = {"application/x-parquet", "application/vnd.apache.parquet"}
+SUPPORTED_TYPES = {NDJSON, CSV, ARROW_STREAM, *PARQUET_TYPES}
+
+_STRING_TYPES = (
+    "String", "FixedString", "UUID", "Enum", "LowCardinality(String", "Nullable(String"
+)
+
+
+class BulkFormatError(ValueError):
+    """Dữ liệu tải lên không đúng định dạng hoặc không khớp schema bảng."""
+
+    def __init__(self, message: str, rows_committed: int = 0):
+        super().__init__(message)
+        self.rows_committed = rows_committed
+
+
+# Kiểu Arrow dùng để kiểm tra cột của kiểu số ClickHouse
+_NUMERIC_TYPES = (("UInt", pa.uint64()), ("Int", pa.int64()), ("Float", pa.float64()))
+
+
+def _base_type(ch_type: str) -> str:
+    for wrapper in ("LowCardinality(", "Nullable("):
+        if ch_type.startswith(wrapper):
+            ch_type = ch_type[len(wrapper):-1]
+    return ch_type
+
+
+def _nullable(ch_type: str) -> bool:
+    return ch_type.startswith("Nullable(") or ch_type.startswith("LowCardinality(Nullable(")
+
+
+def check_chunk(table: pa.Table, schema: Dict[str, str]) -> None:
+    """Kiểm tra cột số của một lô Arrow ép được sang kiểu ClickHouse trước khi chèn."""
+    for name in table.column_names:
+        base = _base_type(schema[name])
+        for prefix, arrow_type in _NUMERIC_TYPES:
+            if base.startswith(prefix):
+                try:
+                    pc.cast(table.column(name), arrow_type)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as exc:
+                    raise BulkFormatError(f"Invalid value in column {name}: {exc}")
+                break
+
+
+def rebatch(batches: Iterable[pa.RecordBatch], batch_size: int) -> Iterator[pa.Table]:
+    """Gom hoặc cắt các ``RecordBatch`` thành bảng Arrow khoảng ``batch_size`` dòng."""
+    pending: List[pa.RecordBatch] = []
+    pending_rows = 0
+    for batch in batches:
+        offset = 0
+        while offset < batch.num_rows:
+            take = min(batch_size - pending_rows, batch.num_rows - offset)
+            pending.append(batch.slice(offset, take))
+            pending_rows += take
+            offset += take
+            if pending_rows >= batch_size:
+                yield pa.Table.from_batches(pending)
+                pending, pending_rows = [], 0
+    if pending_rows:
+        yield pa.Table.from_batches(pending)
+
+
+def insert_arrow_batches(
+    ch_client,
+    dest_table: str,
+    batches: Iterable[pa.RecordBatch],
+    batch_size: int = 100000,
+    on_batch: Optional[Callable[[int, int, float], None]] = None,
+    validate: Optional[Callable[[pa.Table], None]] = None,
+) -> int:
+    """Chèn các batch Arrow vào ``dest_table`` theo từng lô ``batch_size`` dòng.
+
+    ``ch_client`` chỉ cần có phương thức ``insert_arrow``. ``on_batch`` (nếu có)
+    được gọi với ``(số thứ tự lô, số dòng, thời gian chèn)`` sau mỗi lô;
+    ``validate`` (nếu có) được gọi với mỗi lô trước khi chèn.
+    """
+    total_rows = 0
+    for index, table in enumerate(rebatch(batches, batch_size), start=1):
+        if validate is not None:
+            validate(table)
+        start = time.time()
+        ch_client.insert_arrow(dest_table, table)
+        total_rows += table.num_rows
+        if on_batch is not None:
+            on_batch(index, table.num_rows, time.time() - start)
+    return total_rows
+
+
+class _BodyPipe(io.RawIOBase):
+    """File-like đọc chặn, được event loop đẩy dữ liệu vào qua hàng đợi có giới hạn."""
+
+    def __init__(self, max_chunks: int = 8):
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(max_chunks)
+        self._buffer = b""
+        self._eof = False
+        self.reader_done = False
+        self.aborted = False
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer and not self._eof:
+            if self.aborted:
+                raise BulkFormatError("Upload aborted")
+            try:
+                chunk = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer = chunk
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        self.bytes_read += size
+        return size
+
+    def feed(self, chunk: Optional[bytes]) -> bool:
+        """Đẩy một đoạn dữ liệu (``None`` = hết dữ liệu). Trả về ``False`` nếu bên đọc đã dừng."""
+        while not self.reader_done:
+            try:
+                self._queue.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+def _check_columns(names: List[str], schema: Dict[str, str]) -> None:
+    unknown = [name for name in names if name not in schema]
+    if unknown:
+        raise BulkFormatError(f"Unknown columns: {', '.join(unknown)}")
+
+
+def _arrow_batches(source, schema: Dict[str, str]) -> Iterator[pa.RecordBatch]:
+    try:
+        reader = pa.ipc.open_stream(source)
+    except pa.ArrowInvalid as exc:
+        raise BulkFormatError(f"Invalid Arrow stream: {exc}")
+    _check_columns(reader.schema.names, schema)
+    yield from reader
+
+
+def _csv_batches(source, schema: Dict[str, str]) -> Iterator[pa.RecordBatch]:
+    # Cột String của ClickHouse luôn đọc dạng chuỗi, tránh pyarrow tự suy ra số
+    column_types = {
+        name: pa.string() for name, ch_type in schema.items() if ch_type.startswith(_STRING_TYPES)
+    }
+    try:
+        reader = pacsv.open_csv(
+            source, convert_options=pacsv.ConvertOptions(column_types=column_types)
+        )
+    except pa.ArrowInvalid as exc:
+        raise BulkFormatError(f"Invalid CSV: {exc}")
+    _check_columns(reader.schema.names, schema)
+    yield from reader
+
+
+def _parquet_batches(source, schema: Dict[str, str], batch_size: int) -> Iterator[pa.RecordBatch]:
+    # Parquet cần đọc footer ở cuối file nên dữ liệu được ghi tạm ra đĩa
+    with tempfile.TemporaryFile() as spool:
+        while True:
+            chunk = source.read(1 << 20)
+            if not chunk:
+                break
+            spool.write(chunk)
+        spool.seek(0)
+        try:
+            pq_file = pq.ParquetFile(spool)
+        except pa.ArrowInvalid as exc:
+            raise BulkFormatError(f"Invalid Parquet file: {exc}")
+        _check_columns(pq_file.schema_arrow.names, schema)
+        yield from pq_file.iter_batches(batch_size=batch_size)
+
+
+def _insert_ndjson(
+    ch,
+    table: str,
+    source,
+    schema: Dict[str, str],
+    batch_size: int,
+    on_batch: Callable[[int, int, float], None],
+) -> int:
+    """Chèn NDJSON bằng ``insert`` dạng cột, mỗi lô ``batch_size`` dòng.
+
+    Khóa thiếu trên một dòng chỉ hợp lệ khi cột là ``Nullable``.
+    """
+    columns: Optional[List[str]] = None
+    data: List[List[Any]] = []
+    total = batches = 0
+    for line_no, line in enumerate(io.TextIOWrapper(source, encoding="utf-8"), start=1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise BulkFormatError(f"Invalid JSON on line {line_no}: {exc}")
+        if not isinstance(obj, dict):
+            raise BulkFormatError(f"Line {line_no} is not a JSON object")
+        if columns is None:
+            columns = list(obj)
+            _check_columns(columns, schema)
+            data = [[] for _ in columns]
+        extra = set(obj) - set(columns)
+        if extra:
+            raise BulkFormatError(f"Unexpected columns on line {line_no}: {', '.join(extra)}")
+        try:
+            values = [coerce_value(obj.get(col), schema[col]) for col in columns]
+        except (TypeError, ValueError) as exc:
+            raise BulkFormatError(f"Invalid value on line {line_no}: {exc}")
+        for col, value in zip(columns, values):
+            if value is None and not _nullable(schema[col]):
+                raise BulkFormatError(f"Missing value for column {col} on line {line_no}")
+        for idx, value in enumerate(values):
+            data[idx].append(value)
+        if len(data[0]) >= batch_size:
+            batches += 1
+            total += _insert_columns(ch, table, data, columns, batches, on_batch)
+            data = [[] for _ in columns]
+    if columns and data[0]:
+        total += _insert_columns(ch, table, data, columns, batches + 1, on_batch)
+    return total
+
+
+def _insert_columns(
+    ch,
+    table: str,
+    data: List[List[Any]],
+    columns: List[str],
+    index: int,
+    on_batch: Callable[[int, int, float], None],
+) -> int:
+    start = time.time()
+    ch.insert(table, data, column_names=columns, column_oriented=True)
+    on_batch(index, len(data[0]), time.time() - start)
+    return len(data[0])
+
+
+def _ingest(
+    ch, table: str, media_type: str, source: _BodyPipe, schema: Dict[str, str], batch_size: int
+) -> int:
+    committed = 0
+
+    def on_batch(index: int, rows: int, elapsed: float) -> None:
+        nonlocal committed
+        committed += rows
+
+    try:
+        reader = io.BufferedReader(source, buffer_size=1 << 16)
+        if media_type == NDJSON:
+            return _insert_ndjson(ch, table, reader, schema, batch_size, on_batch)
+        if media_type == CSV:
+            batches = _csv_batches(reader, schema)
+        elif media_type == ARROW_STREAM:
+            batches = _arrow_batches(reader, schema)
+        else:
+            batches = _parquet_batches(reader, schema, batch_size)
+        return insert_arrow_batches(
+            ch, table, batches, batch_size, on_batch, lambda chunk: check_chunk(chunk, schema)
+        )
+    except BulkFormatError as exc:
+        exc.rows_committed = committed
+        raise
+    except (pa.ArrowInvalid, UnicodeDecodeError) as exc:
+        # Lỗi phân tích ở giữa stream (dòng CSV hỏng, byte không phải UTF-8...)
+        raise BulkFormatError(f"Invalid data: {exc}", rows_committed=committed)
+    finally:
+        source.reader_done = True
+
+
+async def ingest_body(
+    ch,
+    table: str,
+    media_type: str,
+    body: AsyncIterator[bytes],
+    schema: Dict[str, str],
+    batch_size: int,
+) -> Dict[str, Any]:
+    """Đọc dần body request và chèn vào ``table`` theo lô.
+
+    Việc phân tích dữ liệu và chèn chạy trong thread riêng; event loop chỉ đẩy
+    các đoạn byte qua một hàng đợi có giới hạn nên bộ nhớ không phụ thuộc kích
+    thước file tải lên.
+    """
+    if media_type not in SUPPORTED_TYPES:
+        raise BulkFormatError(f"Unsupported content type: {media_type}")
+    pipe = _BodyPipe()
+    start = time.perf_counter()
+    worker = asyncio.ensure_future(
+        asyncio.to_thread(_ingest, ch, table, media_type, pipe, schema, batch_size)
+    )
+    try:
+        async for chunk in body:
+            if worker.done() or not await asyncio.to_thread(pipe.feed, chunk):
+                break
+        if not worker.done():
+            await asyncio.to_thread(pipe.feed, None)
+        rows = await worker
+    finally:
+        # Client ngắt kết nối giữa chừng: báo cho thread đọc dừng lại
+        pipe.aborted = not worker.done()
+    elapsed = time.perf_counter() - start
+    logger.info(
+        "Nạp {} dòng ({} byte) vào bảng {} trong {:.2f}s", rows, pipe.bytes_read, table, elapsed
+    )
+    return {
+        "rows": rows,
+        "bytes": pipe.bytes_read,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 1) if elapsed else None,
+        "bytes_per_second": round(pipe.bytes_read / elapsed, 1) if elapsed else None,
+    }
@@ -1,18 +1,317 @@
 """Client tiện ích để kết nối và thao tác với ClickHouse."""
 
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
 from clickhouse_connect import get_client
+from clickhouse_connect.driver.httputil import get_pool_manager
+from clickhouse_connect.driver.query import bind_query
 from app.core.config import settings
+from app.services.guardrails import limit_error, profile_name, profile_settings, unrestricted
+from app.services import metrics, tracing
+from app.services.batch_loader import BatchLoader
+from app.services.dictionaries import DictionaryManager
+from app.services.dimension_store import DimensionStore
+from app.services.insert_buffer import InsertBuffer
+from app.services.mutations import MutationManager
+from app.services.query_jobs import JobScheduler
+from app.services.result_cache import ResultCache, cache_key, read_tables
+from app.services.rollups import RollupManager
+from app.services.sampling import sample_key, sampled_order_by
+from app.services.schema_cache import SchemaCache, ddl_table, is_ddl
+from app.services.single_flight import SingleFlight
+from app.services.versioning import VERSION_COLUMN, VERSION_COLUMNS_DDL, VERSIONED_ENGINE
 import backoff
 from loguru import logger
-from typing import Optional, Dict, List, Tuple, Any
+from typing import Optional, Dict, List, Tuple, Any, AsyncIterator, Callable, Sequence
+
+
+RAW_CHUNK_SIZE = 1 << 20
+
+# Bảng thực thể: định nghĩa cột, khóa sắp xếp và danh sách cột dữ liệu
+ENTITY_TABLES: Dict[str, Dict[str, Any]] = {
+    "dim_users": {
+        "ddl": "id UInt64,\nname String,\nemail String",
+        "order_by": "id",
+        "columns": ["id", "name", "email"],
+    },
+    "dim_products": {
+        "ddl": "id UInt64,\nname String",
+        "order_by": "id",
+        "columns": ["id", "name"],
+    },
+    "fact_orders": {
+        "ddl": (
+            "order_id UInt64,\nuser_id UInt64,\nproduct_id UInt64,\n"
+            "quantity UInt32,\ntotal Float64,\norder_date DateTime DEFAULT now()"
+        ),
+        "order_by": "order_id",
+        "columns": ["order_id", "user_id", "product_id", "quantity", "total", "order_date"],
+    },
+}
+
+
+def sampled_tables() -> List[str]:
+    """Bảng thực thể cấu hình tạo kèm ``SAMPLE BY`` (``SAMPLED_TABLES``)."""
+    return [t.strip() for t in settings.SAMPLED_TABLES.split(",") if t.strip()]
+
+
+def _entity_ddl(entity: str, name: str) -> str:
+    """Câu lệnh tạo bảng phiên bản ``name`` theo định nghĩa của ``entity``.
+
+    Bảng trong ``SAMPLED_TABLES`` lấy ``intHash64(<khóa>)`` làm khóa lấy mẫu,
+    đặt sau tiền tố ``intDiv(<khóa>, SAMPLE_KEY_BUCKET)`` trong sorting key để
+    ``SAMPLE`` thực sự bỏ qua granule (xem ``sampled_order_by``). Mọi thành
+    phần chỉ phụ thuộc khóa nên không đổi cách ``ReplacingMergeTree`` gộp
+    phiên bản.
+    """
+    spec = ENTITY_TABLES[entity]
+    order_by = spec["order_by"]
+    sample_by = ""
+    if entity in sampled_tables():
+        sample_by = f"\nSAMPLE BY {sample_key(order_by)}"
+        order_by = sampled_order_by(order_by, settings.SAMPLE_KEY_BUCKET)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {name} (\n{spec['ddl']},\n{VERSION_COLUMNS_DDL}\n) "
+        f"ENGINE = {VERSIONED_ENGINE}\nORDER BY {order_by}{sample_by}"
+    )
+
+
+class PoolTimeoutError(Exception):
+    """Hết thời gian chờ lấy kết nối ClickHouse từ pool."""
+
+
+class _RawStream:
+    """Đọc dần phần thân response HTTP của ClickHouse theo từng đoạn byte."""
+
+    def __init__(self, response, chunk_size: int):
+        self._response = response
+        self._chunks = response.stream(chunk_size, decode_content=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._response.close()
+
+    def __next__(self) -> bytes:
+        return next(self._chunks)
+
+
+def _query_settings(query_id: Optional[str] = None) -> Dict[str, Any]:
+    """Setting của hồ sơ giới hạn hiện tại, kèm ``query_id`` nếu có."""
+    query_settings = profile_settings()
+    if query_id is not None:
+        query_settings["query_id"] = query_id
+    return query_settings
+
+
+def _open_row_blocks(sql: str, parameters: Optional[Dict], client, query_id: str):
+    """Mở stream block dòng bằng ``query_row_block_stream``."""
+    return client.query_row_block_stream(
+        sql, parameters=parameters or {}, settings=_query_settings(query_id)
+    )
+
+
+def _open_raw(
+    sql: str,
+    parameters: Optional[Dict],
+    fmt: str,
+    settings: Dict[str, Any],
+    client,
+    query_id: str,
+) -> _RawStream:
+    """Mở stream byte thô theo định dạng ``fmt``.
+
+    ``clickhouse_connect`` 0.6 chưa có API stream byte thô nên hàm này dựng
+    request giống ``raw_query`` nhưng đọc response ở chế độ stream và không
+    chờ ClickHouse chạy xong truy vấn (``wait_end_of_query``).
+    """
+    final_query, bind_params = bind_query(sql, parameters, client.server_tz)
+    # Bỏ qua các setting mà phiên bản ClickHouse hiện tại không hỗ trợ
+    known = {k: v for k, v in settings.items() if k in client.server_settings}
+    params = client._validate_settings({**known, **_query_settings(query_id)})
+    if client.database:
+        params["database"] = client.database
+    params.update(bind_params)
+    response = client._raw_request(
+        f"{final_query}\n FORMAT {fmt}", params, stream=True, server_wait=False
+    )
+    return _RawStream(response, RAW_CHUNK_SIZE)
 
 
 class ClickHouseClient:
-    """Bao bọc client ClickHouse và cung cấp các phương thức tiện ích."""
+    """Bao bọc client ClickHouse và cung cấp các phương thức tiện ích.
+
+    Mỗi client của ``clickhouse_connect`` giữ một phiên HTTP riêng và không
+    cho phép chạy hai truy vấn đồng thời, vì vậy lớp này quản lý một pool
+    gồm ``pool_size`` client. Các phương thức ``a*`` (``aquery``,
+    ``acommand``...) chạy lời gọi chặn trong thread pool riêng để không
+    làm nghẽn event loop, đồng thời giới hạn số truy vấn đang chờ bằng
+    ``max_inflight``.
+    """
+
+    def __init__(
+        self,
+        pool_size: Optional[int] = None,
+        max_inflight: Optional[int] = None,
+        acquire_timeout: Optional[float] = None,
+        client_factory: Optional[Callable[[], Any]] = None,
+        single_flight: Optional[bool] = None,
+    ):
+        """Khởi tạo pool kết nối tới ClickHouse.
+
+        Kết nối đầu tiên được tạo ngay để phát hiện lỗi cấu hình sớm, các
+        kết nối còn lại được tạo dần khi cần.
+        """
+        self.pool_size = max(1, pool_size or settings.CLICKHOUSE_POOL_SIZE)
+        self.max_inflight = max(1, max_inflight or settings.CLICKHOUSE_MAX_INFLIGHT)
+        self.acquire_timeout = (
+            acquire_timeout
+            if acquire_timeout is not None
+            else settings.CLICKHOUSE_POOL_TIMEOUT
+        )
+        self._factory = client_factory or self._connect
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._inflight = asyncio.Semaphore(self.max_inflight)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.pool_size, thread_name_prefix="clickhouse"
+        )
+        self.schema_cache = SchemaCache(
+            ttl=settings.SCHEMA_CACHE_TTL, max_size=settings.SCHEMA_CACHE_SIZE
+        )
+        self.sorting_key_cache = SchemaCache(
+            ttl=settings.SCHEMA_CACHE_TTL, max_size=settings.SCHEMA_CACHE_SIZE
+        )
+        self.engine_cache = SchemaCache(
+            ttl=settings.SCHEMA_CACHE_TTL, max_size=settings.SCHEMA_CACHE_SIZE
+        )
+        self.sampling_key_cache = SchemaCache(
+            ttl=settings.SCHEMA_CACHE_TTL, max_size=settings.SCHEMA_CACHE_SIZE
+        )
+        self.insert_buffer = InsertBuffer(self)
+        self.mutations = MutationManager(self)
+        self.result_cache = ResultCache()
+        self.single_flight = (
+            single_flight if single_flight is not None else settings.CLICKHOUSE_SINGLE_FLIGHT
+        )
+        self.flights = SingleFlight()
+        self.jobs = JobScheduler(self)
+        self.rollups = RollupManager(self)
+        self.loader = BatchLoader(self)
+        self.dimensions = DimensionStore(self, ENTITY_TABLES)
+        self.dictionaries = DictionaryManager(self, ENTITY_TABLES)
+        self._reserve_slot()
+        self._release(self._new_client())
+
+    def _reserve_slot(self) -> bool:
+        """Giữ chỗ cho một client mới nếu pool chưa đầy.
+
+        Kiểm tra và tăng ``_created`` trong cùng một lần giữ khóa để các thread
+        mượn đồng thời không cùng vượt ``pool_size``.
+        """
+        with self._lock:
+            if self._created >= self.pool_size:
+                return False
+            self._created += 1
+            return True
+
+    def _new_client(self):
+        """Tạo client cho chỗ đã giữ bằng ``_reserve_slot``; trả lại chỗ nếu lỗi."""
+        try:
+            return self._factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _acquire(self):
+        """Mượn một client rảnh, tạo mới nếu pool chưa đầy."""
+        try:
+            client = self._idle.get_nowait()
+        except queue.Empty:
+            if self._reserve_slot():
+                client = self._new_client()
+            else:
+                try:
+                    client = self._idle.get(timeout=self.acquire_timeout)
+                except queue.Empty:
+                    raise PoolTimeoutError(
+                        f"Không lấy được kết nối ClickHouse sau {self.acquire_timeout}s"
+                    )
+        with self._lock:
+            self._in_use += 1
+        return client
 
-    def __init__(self):
-        """Khởi tạo kết nối tới ClickHouse."""
-        self.client = self._connect()
+    def _release(self, client) -> None:
+        """Trả client về pool."""
+        with self._lock:
+            self._in_use = max(0, self._in_use - 1)
+        self._idle.put(client)
+
+    @contextmanager
+    def session(self):
+        """Context manager mượn một client ``clickhouse_connect`` từ pool."""
+        client = self._acquire()
+        try:
+            yield client
+        finally:
+            self._release(client)
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Trạng thái hiện tại của pool kết nối."""
+        with self._lock:
+            return {
+                "size": self.pool_size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "max_inflight": self.max_inflight,
+            }
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Chạy hàm chặn ``func`` trong thread pool của ClickHouse.
+
+        ``func`` chạy trong bản sao context hiện tại (hồ sơ giới hạn của
+        request vẫn có hiệu lực). Số lời gọi đồng thời bị giới hạn bởi ``max_inflight``; nếu không chờ
+        được slot trong ``acquire_timeout`` giây sẽ ném ``PoolTimeoutError``.
+        """
+        try:
+            await asyncio.wait_for(self._inflight.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(
+                f"Quá {self.max_inflight} truy vấn ClickHouse đang chờ xử lý"
+            )
+        try:
+            loop = asyncio.get_running_loop()
+            # Chép context để thread thấy hồ sơ giới hạn của request hiện tại
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(
+                self._executor, partial(context.run, func, *args, **kwargs)
+            )
+        finally:
+            self._inflight.release()
+
+    def close(self) -> None:
+        """Đóng thread pool và toàn bộ kết nối trong pool."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        while True:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                client.close()
+            except Exception as exc:
+                logger.warning("Không thể đóng kết nối ClickHouse: {}", exc)
 
     @backoff.on_exception(backoff.expo, Exception, max_time=20, jitter=None)
     def _connect(self):
@@ -25,6 +324,7 @@ class ClickHouseClient:
                 username=settings.CLICKHOUSE_USER,
                 password=settings.CLICKHOUSE_PASSWORD,
                 database=settings.CLICKHOUSE_DATABASE,
+                pool_mgr=get_pool_manager(maxsize=1),
             )
         except Exception as exc:
             logger.warning(
@@ -40,52 +340,443 @@ class ClickHouseClient:
                     username=settings.CLICKHOUSE_USER,
                     password=settings.CLICKHOUSE_PASSWORD,
                     database=settings.CLICKHOUSE_DATABASE,
+                    pool_mgr=get_pool_manager(maxsize=1),
                 )
             raise
 
-    def command(self, sql: str, parameters: Optional[Dict] = None):
+    def command(
+        self, sql: str, parameters: Optional[Dict] = None, query_id: Optional[str] = None
+    ):
         """Thực thi câu lệnh không phải ``SELECT``.
 
         Tham số có thể truyền vào để thay thế động trong truy vấn, giúp API
         hoạt động với các câu lệnh tùy ý mà không cần định dạng chuỗi.
         """
+        started = time.perf_counter()
+        result = None
+        query_id = tracing.traced_query_id(query_id)
         try:
-            return self.client.command(sql, parameters=parameters or {})
+            query_settings = _query_settings(query_id)
+            with self.session() as client:
+                if query_settings:
+                    result = client.command(
+                        sql, parameters=parameters or {}, settings=query_settings
+                    )
+                else:
+                    result = client.command(sql, parameters=parameters or {})
+                return result
         except Exception as exc:
+            metrics.record_error("clickhouse", exc)
+            self._raise_limit_error(exc)
             logger.exception("Lỗi khi thực thi command: {}", exc)
             raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.record_query("command", sql, elapsed, result)
+            tracing.record_query(query_id, sql, elapsed)
+            self.result_cache.invalidate_for_sql(sql)
+
+    def query(
+        self, sql: str, parameters: Optional[Dict] = None, query_id: Optional[str] = None
+    ):
+        """Thực thi câu lệnh ``SELECT`` và trả về kết quả thô từ ClickHouse.
 
-    def query(self, sql: str, parameters: Optional[Dict] = None):
-        """Thực thi câu lệnh ``SELECT`` và trả về kết quả thô từ ClickHouse."""
+        Thời gian, số dòng/byte đọc và trả về được ghi vào ``/metrics`` theo
+        dạng chuẩn hóa của câu SQL (``metrics.query_shape``).
+        """
+        started = time.perf_counter()
+        result = None
+        query_id = tracing.traced_query_id(query_id)
         try:
-            return self.client.query(sql, parameters=parameters or {})
+            query_settings = _query_settings(query_id)
+            with self.session() as client:
+                if query_settings:
+                    result = client.query(
+                        sql, parameters=parameters or {}, settings=query_settings
+                    )
+                else:
+                    result = client.query(sql, parameters=parameters or {})
+                return result
         except Exception as exc:
+            metrics.record_error("clickhouse", exc)
+            self._raise_limit_error(exc)
             logger.exception("Lỗi khi thực thi query: {}", exc)
             raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.record_query("query", sql, elapsed, result)
+            tracing.record_query(query_id, sql, elapsed)
+
+    def insert(
+        self,
+        table: str,
+        data: Sequence[Sequence[Any]],
+        column_names: Optional[List[str]] = None,
+        column_oriented: bool = False,
+    ):
+        """Chèn nhiều dòng (hoặc nhiều cột) bằng một lệnh ``INSERT`` native."""
+        try:
+            query_settings = _query_settings()
+            with self.session() as client:
+                if query_settings:
+                    summary = client.insert(
+                        table,
+                        data,
+                        column_names=column_names or "*",
+                        column_oriented=column_oriented,
+                        settings=query_settings,
+                    )
+                else:
+                    summary = client.insert(
+                        table,
+                        data,
+                        column_names=column_names or "*",
+                        column_oriented=column_oriented,
+                    )
+            self.dimensions.apply_insert(table, data, column_names, column_oriented)
+            return summary
+        except Exception as exc:
+            self._raise_limit_error(exc)
+            logger.exception("Lỗi khi chèn dữ liệu vào bảng {}: {}", table, exc)
+            raise
+        finally:
+            self.result_cache.invalidate_table(table)
+
+    def insert_arrow(self, table: str, arrow_table):
+        """Chèn một bảng ``pyarrow.Table`` bằng định dạng Arrow."""
+        try:
+            query_settings = _query_settings()
+            with self.session() as client:
+                if query_settings:
+                    return client.insert_arrow(table, arrow_table, settings=query_settings)
+                return client.insert_arrow(table, arrow_table)
+        except Exception as exc:
+            self._raise_limit_error(exc)
+            logger.exception("Lỗi khi chèn Arrow vào bảng {}: {}", table, exc)
+            raise
+        finally:
+            self.result_cache.invalidate_table(table)
+
+    @staticmethod
+    def _raise_limit_error(exc: Exception) -> None:
+        """Ném ``QueryLimitError`` (4xx) nếu ``exc`` là lỗi vượt giới hạn của hồ sơ."""
+        error = limit_error(exc)
+        if error is not None:
+            logger.warning("Truy vấn vượt giới hạn: {}", exc)
+            raise error from exc
 
     def get_table_schema(self, table: str) -> List[Tuple[str, str]]:
-        """Lấy danh sách cột và kiểu dữ liệu của một bảng."""
+        """Lấy danh sách cột và kiểu dữ liệu của một bảng.
+
+        Kết quả được lưu trong ``schema_cache`` để tránh gọi ``DESCRIBE TABLE``
+        cho mỗi request.
+        """
+        cached = self.schema_cache.get(table)
+        if cached is not None:
+            return cached
+        return self._describe_table(table)
+
+    def _describe_table(self, table: str) -> List[Tuple[str, str]]:
+        """Chạy ``DESCRIBE TABLE`` và lưu kết quả vào cache."""
         try:
             result = self.query(f"DESCRIBE TABLE {table}")
-            return [(row[0], row[1]) for row in result.result_rows]
+            columns = [(row[0], row[1]) for row in result.result_rows]
+            self.schema_cache.set(table, columns)
+            return columns
         except Exception as exc:
             logger.exception("Không thể lấy schema cho bảng {}: {}", table, exc)
             raise
 
+    def _table_property(self, table: str, column: str, cache: SchemaCache) -> str:
+        """Đọc một cột của ``system.tables`` cho bảng ``table`` (có cache)."""
+        cached = cache.get(table)
+        if cached is not None:
+            return cached
+        try:
+            result = self.query(
+                f"SELECT {column} FROM system.tables "
+                "WHERE database = currentDatabase() AND name = {table:String}",
+                parameters={"table": table},
+            )
+            value = result.result_rows[0][0] if result.result_rows else ""
+            cache.set(table, value)
+            return value
+        except Exception as exc:
+            logger.exception("Không thể lấy {} cho bảng {}: {}", column, table, exc)
+            raise
+
+    def get_sorting_key(self, table: str) -> str:
+        """Lấy biểu thức sorting key (``ORDER BY``) của bảng từ ``system.tables``."""
+        return self._table_property(table, "sorting_key", self.sorting_key_cache)
+
+    def get_table_engine(self, table: str) -> str:
+        """Lấy tên engine của bảng (``MergeTree``, ``ReplacingMergeTree``...)."""
+        return self._table_property(table, "engine", self.engine_cache)
+
+    def get_sampling_key(self, table: str) -> str:
+        """Lấy biểu thức ``SAMPLE BY`` của bảng (rỗng nếu bảng không lấy mẫu được)."""
+        return self._table_property(table, "sampling_key", self.sampling_key_cache)
+
+    def invalidate_metadata(self, table: Optional[str] = None) -> None:
+        """Xóa cache schema, sorting key, engine và sampling key của một bảng hoặc toàn bộ."""
+        self.schema_cache.invalidate(table)
+        self.sorting_key_cache.invalidate(table)
+        self.engine_cache.invalidate(table)
+        self.sampling_key_cache.invalidate(table)
+
+    def invalidate_for_sql(self, sql: str) -> bool:
+        """Làm mới cache metadata nếu ``sql`` là DDL. Trả về ``True`` nếu đã làm mới."""
+        if not is_ddl(sql):
+            return False
+        self.invalidate_metadata(ddl_table(sql))
+        return True
+
+    async def acommand(self, sql: str, parameters: Optional[Dict] = None):
+        """Phiên bản bất đồng bộ của ``command``.
+
+        Nếu coroutine bị hủy (ví dụ client HTTP ngắt kết nối), câu lệnh bị
+        ``KILL QUERY`` phía ClickHouse.
+        """
+        return await self._run_killable(self.command, sql, parameters)
+
+    async def _run_killable(self, func: Callable, sql: str, parameters: Optional[Dict]):
+        """Chạy ``func(sql, parameters, query_id)`` và dừng truy vấn khi bị hủy."""
+        query_id = tracing.new_query_id()
+        try:
+            return await self.run(func, sql, parameters, query_id)
+        except asyncio.CancelledError:
+            self._kill_in_background(query_id)
+            raise
+
+    async def aquery(self, sql: str, parameters: Optional[Dict] = None):
+        """Phiên bản bất đồng bộ của ``query``.
+
+        Khi bật ``single_flight``, các lời gọi cùng SQL (đã chuẩn hóa) và tham
+        số đang chạy đồng thời chỉ tạo một truy vấn ClickHouse và cùng nhận
+        một ``QueryResult`` (người gọi không được sửa kết quả này). Khóa gộp
+        gồm phiên bản các bảng trong cache kết quả nên lời gọi tới sau một
+        lệnh ghi không dùng lại truy vấn đã bắt đầu trước lệnh ghi đó; lời gọi
+        dưới các hồ sơ giới hạn khác nhau cũng không được gộp. Nếu mọi người
+        chờ đều hủy, truy vấn bị ``KILL QUERY``.
+        """
+        if not self.single_flight:
+            return await self._run_killable(self.query, sql, parameters)
+        key = (
+            cache_key(sql, parameters),
+            self.result_cache.snapshot(read_tables(sql)),
+            profile_name(),
+        )
+        return await self.flights.do(
+            key, partial(self._run_killable, self.query, sql, parameters)
+        )
+
+    def _kill_in_background(self, query_id: str) -> None:
+        """Gửi ``KILL QUERY`` từ một thread riêng, không chặn event loop."""
+        threading.Thread(target=self.kill_query, args=(query_id,), daemon=True).start()
+
+    async def ainsert(
+        self,
+        table: str,
+        data: Sequence[Sequence[Any]],
+        column_names: Optional[List[str]] = None,
+        column_oriented: bool = False,
+    ):
+        """Phiên bản bất đồng bộ của ``insert``."""
+        return await self.run(self.insert, table, data, column_names, column_oriented)
+
+    async def aget_table_schema(self, table: str) -> List[Tuple[str, str]]:
+        """Phiên bản bất đồng bộ của ``get_table_schema``.
+
+        Nếu schema đã có trong cache thì trả về ngay, không cần qua thread pool.
+        """
+        cached = self.schema_cache.get(table)
+        if cached is not None:
+            return cached
+        return await self.run(self._describe_table, table)
+
+    async def aget_sorting_key(self, table: str) -> str:
+        """Phiên bản bất đồng bộ của ``get_sorting_key``."""
+        cached = self.sorting_key_cache.get(table)
+        if cached is not None:
+            return cached
+        return await self.run(self.get_sorting_key, table)
+
+    async def aget_table_engine(self, table: str) -> str:
+        """Phiên bản bất đồng bộ của ``get_table_engine``."""
+        cached = self.engine_cache.get(table)
+        if cached is not None:
+            return cached
+        return await self.run(self.get_table_engine, table)
+
+    async def aget_sampling_key(self, table: str) -> str:
+        """Phiên bản bất đồng bộ của ``get_sampling_key``."""
+        cached = self.sampling_key_cache.get(table)
+        if cached is not None:
+            return cached
+        return await self.run(self.get_sampling_key, table)
+
+    def kill_query(self, query_id: str) -> None:
+        """Yêu cầu ClickHouse dừng truy vấn đang chạy theo ``query_id``."""
+        try:
+            with unrestricted():
+                self.command(
+                    "KILL QUERY WHERE query_id = {query_id:String} ASYNC",
+                    parameters={"query_id": query_id},
+                )
+            logger.info("Đã gửi KILL QUERY cho {}", query_id)
+        except Exception as exc:
+            logger.warning("Không thể dừng truy vấn {}: {}", query_id, exc)
+
+    async def stream_row_blocks(
+        self, sql: str, parameters: Optional[Dict] = None
+    ) -> AsyncIterator[Sequence[Sequence[Any]]]:
+        """Truy vấn dạng stream, trả về từng block dòng ngay khi ClickHouse gửi tới.
+
+        Client trong pool được giữ suốt thời gian stream. Nếu consumer dừng
+        sớm (ví dụ client HTTP ngắt kết nối), truy vấn phía ClickHouse bị
+        ``KILL QUERY`` rồi stream mới được đóng.
+        """
+        async for block in self._stream(partial(_open_row_blocks, sql, parameters)):
+            yield block
+
+    async def stream_raw(
+        self,
+        sql: str,
+        parameters: Optional[Dict] = None,
+        fmt: str = "ArrowStream",
+        settings: Optional[Dict[str, Any]] = None,
+        query_id: Optional[str] = None,
+    ) -> AsyncIterator[bytes]:
+        """Stream nguyên byte kết quả theo định dạng ``fmt`` của ClickHouse.
+
+        Dữ liệu (ArrowStream, Parquet, CSV...) được ClickHouse mã hóa và chuyển
+        thẳng cho client, không tạo object Python cho từng dòng.
+        """
+        opener = partial(_open_raw, sql, parameters, fmt, settings or {})
+        async for chunk in self._stream(opener, query_id):
+            yield chunk
+
+    async def _stream(
+        self, opener: Callable[[Any, str], Any], query_id: Optional[str] = None
+    ) -> AsyncIterator[Any]:
+        """Khung chung cho các truy vấn stream.
+
+        ``opener(client, query_id)`` trả về một context stream có ``__next__``
+        và ``__exit__``; hàm này đảm nhiệm giới hạn in-flight, đọc trong
+        thread pool và dọn dẹp khi consumer dừng sớm. Nếu không truyền
+        ``query_id``, ID được sinh theo request hiện tại (``tracing``).
+        """
+        try:
+            await asyncio.wait_for(self._inflight.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(
+                f"Quá {self.max_inflight} truy vấn ClickHouse đang chờ xử lý"
+            )
+        query_id = query_id or tracing.new_query_id()
+        client = stream = pending = None
+        finished = False
+        started = time.perf_counter()
+        try:
+            context = contextvars.copy_context()
+            opening = self._executor.submit(context.run, self._open_stream, opener, query_id)
+            try:
+                client, stream = await asyncio.wrap_future(opening)
+            except asyncio.CancelledError:
+                opening.add_done_callback(partial(self._abandon_stream, query_id))
+                raise
+            while True:
+                pending = self._executor.submit(next, stream, None)
+                item = await asyncio.wrap_future(pending)
+                pending = None
+                if item is None:
+                    finished = True
+                    break
+                yield item
+        except Exception as exc:
+            metrics.record_error("clickhouse", exc)
+            self._raise_limit_error(exc)
+            logger.exception("Lỗi khi stream truy vấn: {}", exc)
+            raise
+        finally:
+            self._inflight.release()
+            # Gồm cả thời gian consumer xử lý từng block
+            tracing.add_phase("clickhouse.stream", time.perf_counter() - started)
+            if client is not None:
+                if finished:
+                    self._finish_stream(client, stream, None, None)
+                else:
+                    threading.Thread(
+                        target=self._finish_stream,
+                        args=(client, stream, pending, query_id),
+                        daemon=True,
+                    ).start()
+
+    def _open_stream(self, opener: Callable[[Any, str], Any], query_id: str):
+        """Mượn client và mở stream truy vấn, trả về ``(client, stream)``."""
+        client = self._acquire()
+        try:
+            stream = opener(client, query_id)
+            stream.__enter__()
+            return client, stream
+        except Exception:
+            self._release(client)
+            raise
+
+    def _abandon_stream(self, query_id: str, future) -> None:
+        """Dọn dẹp stream được mở xong sau khi consumer đã hủy."""
+        if not future.cancelled() and future.exception() is None:
+            client, stream = future.result()
+            self._finish_stream(client, stream, None, query_id)
+
+    def _finish_stream(self, client, stream, pending, query_id: Optional[str]) -> None:
+        """Dừng truy vấn (nếu cần), đóng stream và trả client về pool."""
+        try:
+            if query_id is not None:
+                self.kill_query(query_id)
+            if pending is not None:
+                try:
+                    pending.result(timeout=self.acquire_timeout)
+                except Exception:
+                    pass
+            if stream is not None:
+                stream.__exit__(None, None, None)
+        except Exception as exc:
+            logger.warning("Không thể đóng stream ClickHouse: {}", exc)
+        finally:
+            self._release(client)
+
     def init_db(self):
-        """Khởi tạo các bảng cần thiết nếu chưa tồn tại."""
+        """Khởi tạo các bảng cần thiết nếu chưa tồn tại.
+
+        Các bảng thực thể dùng ``ReplacingMergeTree`` có cột phiên bản; bảng cũ
+        tạo bằng ``MergeTree`` chỉ được báo lỗi ở đây (mọi worker đều chạy
+        ``init_db``), việc chuyển đổi chạy một lần bằng
+        ``scripts/migrate_versioned.py``; bảng trong ``SAMPLED_TABLES`` được tạo
+        kèm ``SAMPLE BY``. Sau đó tạo dictionary của các bảng chiều và các rollup
+        đã cấu hình.
+        """
         try:
             logger.info("Khởi tạo cơ sở dữ liệu ClickHouse")
-            self.command(
-                """
-                CREATE TABLE IF NOT EXISTS dim_users (
-                    id UInt64,
-                    name String,
-                    email String
-                ) ENGINE = MergeTree()
-                ORDER BY id
-                """
-            )
+            for table in ENTITY_TABLES:
+                self.command(_entity_ddl(table, table))
+                engine = self.get_table_engine(table)
+                if engine and engine != "ReplacingMergeTree":
+                    logger.error(
+                        "Bảng {} vẫn dùng {}, chạy scripts/migrate_versioned.py để chuyển "
+                        "sang ReplacingMergeTree",
+                        table,
+                        engine,
+                    )
+            for table in sampled_tables():
+                if table not in ENTITY_TABLES:
+                    logger.warning("SAMPLED_TABLES: bỏ qua bảng không phải bảng thực thể {}", table)
+                elif not self.get_sampling_key(table):
+                    # CREATE TABLE IF NOT EXISTS không đổi bảng đã có; khóa lấy mẫu
+                    # phải nằm trong primary key nên không thêm được bằng ALTER
+                    logger.warning(
+                        "Bảng {} đã tồn tại không có SAMPLE BY, approx=true sẽ đọc toàn bộ bảng",
+                        table,
+                    )
             # Seed sample users so example queries return data
             result = self.query("SELECT count() FROM dim_users")
             if result.first_item == 0:
@@ -99,29 +790,59 @@ class ClickHouseClient:
                         (5, 'User 5', 'user5@example.com')
                     """
                 )
-            self.command(
-                """
-                CREATE TABLE IF NOT EXISTS dim_products (
-                    id UInt64,
-                    name String
-                ) ENGINE = MergeTree()
-                ORDER BY id
-                """
-            )
-            self.command(
-                """
-                CREATE TABLE IF NOT EXISTS fact_orders (
-                    order_id UInt64,
-                    user_id UInt64,
-                    product_id UInt64,
-                    quantity UInt32,
-                    total Float64,
-                    order_date DateTime DEFAULT now()
-                ) ENGINE = MergeTree()
-                ORDER BY order_id
-                """
-            )
+            self.dictionaries.create_all()
+            self.rollups.create_all()
             logger.info("Khởi tạo cơ sở dữ liệu hoàn tất")
         except Exception as exc:
             logger.exception("Lỗi khởi tạo cơ sở dữ liệu: {}", exc)
             raise
+
+    def migrate_to_versioned(self, table: str) -> bool:
+        """Chuyển bảng thực thể cũ (``MergeTree``) sang ``ReplacingMergeTree``.
+
+        Dữ liệu được chép sang bảng mới rồi hoán đổi bằng ``EXCHANGE TABLES``;
+        bảng cũ được giữ lại với tên ``<table>__legacy_<thời điểm>`` để có thể
+        khôi phục. Bảng ``<table>__migration_lock`` đóng vai trò khóa: ``CREATE
+        TABLE`` không có ``IF NOT EXISTS`` chỉ thành công ở một tiến trình, tiến
+        trình khác bỏ qua. Trả về ``True`` nếu đã chuyển đổi.
+        """
+        self.invalidate_metadata(table)
+        engine = self.get_table_engine(table)
+        if not engine or engine == "ReplacingMergeTree":
+            return False
+        lock = f"{table}__migration_lock"
+        try:
+            self.command(f"CREATE TABLE {lock} (started DateTime DEFAULT now()) ENGINE = Memory")
+        except Exception:
+            if int(self.command(f"EXISTS TABLE {lock}")):
+                logger.warning("Bảng {} đang được chuyển đổi ở nơi khác ({})", table, lock)
+                return False
+            raise
+        try:
+            # Tiến trình khác có thể đã chuyển xong trước khi lấy được khóa
+            self.invalidate_metadata(table)
+            if self.get_table_engine(table) == "ReplacingMergeTree":
+                return False
+            suffix = time.strftime("%Y%m%d%H%M%S")
+            staging = f"{table}__versioned_{suffix}"
+            legacy = f"{table}__legacy_{suffix}"
+            for name in (staging, legacy):
+                if int(self.command(f"EXISTS TABLE {name}")):
+                    raise RuntimeError(f"Table {name} already exists")
+            columns = ", ".join(ENTITY_TABLES[table]["columns"])
+            logger.warning("Chuyển bảng {} sang ReplacingMergeTree", table)
+            self.command(_entity_ddl(table, staging))
+            self.command(
+                f"INSERT INTO {staging} ({columns}, {VERSION_COLUMN}) "
+                f"SELECT {columns}, 1 FROM {table}"
+            )
+            self.command(f"EXCHANGE TABLES {table} AND {staging}")
+            self.command(f"RENAME TABLE {staging} TO {legacy}")
+            self.invalidate_metadata(table)
+            logger.info("Đã chuyển bảng {}, bảng cũ lưu tại {}", table, legacy)
+            return True
+        except Exception as exc:
+            logger.exception("Lỗi chuyển đổi bảng {}: {}", table, exc)
+            raise
+        finally:
+            self.command(f"DROP TABLE IF EXISTS {lock}")
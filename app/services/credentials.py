@@ -0,0 +1,175 @@
+"""Lưu thông tin đăng nhập người dùng và băm mật khẩu.
+
+Mật khẩu được băm bằng PBKDF2-HMAC-SHA256 với salt ngẫu nhiên cho từng người
+dùng; việc băm tốn CPU có chủ đích nên luôn chạy trong thread pool
+(``hash_password_async``/``verify_password_async``) để không chặn event loop.
+
+``ClickHouseCredentialStore`` lưu tài khoản trong bảng ``auth_users``
+(``ReplacingMergeTree`` theo ``username``) nên tài khoản được giữ qua các lần
+khởi động lại và dùng chung giữa các worker. Lần đăng ký đầu tiên của một tên
+luôn thắng (xem ``registration_rank``). ``MemoryCredentialStore`` chỉ
+dùng cho thử nghiệm hoặc một tiến trình đơn lẻ. Chọn backend bằng
+``AUTH_BACKEND``.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Dict, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from app.services.clickhouse_client import ClickHouseClient
+
+HASH_ALGORITHM = "pbkdf2_sha256"
+SALT_BYTES = 16
+
+# ReplacingMergeTree giữ dòng có ``rank`` lớn nhất, ``rank`` giảm dần theo thời
+# điểm đăng ký nên dòng đăng ký sớm nhất được giữ
+AUTH_USERS_DDL = (
+    "CREATE TABLE IF NOT EXISTS {table} (\n"
+    "username String,\npassword_hash String,\nrank UInt64,\n"
+    "created_at DateTime DEFAULT now()\n"
+    ") ENGINE = ReplacingMergeTree(rank)\nORDER BY username"
+)
+_MAX_RANK = 2**64 - 1
+
+
+class UserExistsError(Exception):
+    """Tên đăng nhập đã được đăng ký."""
+
+
+class RegistrationConflictError(UserExistsError):
+    """Một lần đăng ký khác cùng tên diễn ra đồng thời và đã thắng."""
+
+
+def registration_rank() -> int:
+    """Thứ hạng của lần đăng ký hiện tại: đăng ký càng sớm thứ hạng càng cao."""
+    return _MAX_RANK - time.time_ns()
+
+
+def hash_password(password: str, iterations: Optional[int] = None) -> str:
+    """Băm mật khẩu, kết quả dạng ``pbkdf2_sha256$<vòng lặp>$<salt>$<hash>``."""
+    iterations = iterations or settings.PASSWORD_HASH_ITERATIONS
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{HASH_ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    """So khớp mật khẩu với chuỗi băm (so sánh thời gian hằng)."""
+    try:
+        algorithm, iterations, salt, expected = encoded.split("$")
+        if algorithm != HASH_ALGORITHM:
+            return False
+        digest = hashlib.pbkdf2_hmac(
+            "sha256", password.encode(), bytes.fromhex(salt), int(iterations)
+        )
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.to_thread(hash_password, password)
+
+
+async def verify_password_async(password: str, encoded: str) -> bool:
+    return await asyncio.to_thread(verify_password, password, encoded)
+
+
+class CredentialStore(ABC):
+    """Giao diện chung của nơi lưu tài khoản."""
+
+    async def init(self) -> None:
+        """Tạo bảng/tài khoản quản trị nếu cần.
+
+        Tài khoản quản trị chỉ được tạo khi ``AUTH_ADMIN_PASSWORD`` được đặt rõ,
+        tránh lưu vĩnh viễn một tài khoản có mật khẩu mặc định.
+        """
+        if not (settings.AUTH_ADMIN_USERNAME and settings.AUTH_ADMIN_PASSWORD):
+            return
+        if await self.get(settings.AUTH_ADMIN_USERNAME) is None:
+            await self.create(
+                settings.AUTH_ADMIN_USERNAME,
+                await hash_password_async(settings.AUTH_ADMIN_PASSWORD),
+            )
+            logger.info("Tạo tài khoản quản trị {}", settings.AUTH_ADMIN_USERNAME)
+
+    @abstractmethod
+    async def get(self, username: str) -> Optional[str]:
+        """Chuỗi băm mật khẩu của ``username`` hoặc ``None``."""
+
+    @abstractmethod
+    async def create(self, username: str, password_hash: str) -> None:
+        """Thêm tài khoản mới, ném ``UserExistsError`` nếu đã tồn tại."""
+
+
+class MemoryCredentialStore(CredentialStore):
+    """Tài khoản trong bộ nhớ tiến trình (mất khi khởi động lại)."""
+
+    def __init__(self):
+        self._users: Dict[str, str] = {}
+
+    async def get(self, username: str) -> Optional[str]:
+        return self._users.get(username)
+
+    async def create(self, username: str, password_hash: str) -> None:
+        if username in self._users:
+            raise UserExistsError(username)
+        self._users[username] = password_hash
+
+
+class ClickHouseCredentialStore(CredentialStore):
+    """Tài khoản trong bảng ClickHouse ``auth_users``.
+
+    ClickHouse không có ràng buộc duy nhất: hai worker đăng ký cùng tên cùng
+    lúc có thể cùng vượt qua bước kiểm tra và cùng chèn. Khi đọc, dòng có
+    ``rank`` lớn nhất (đăng ký sớm nhất) thắng, giống dòng ``ReplacingMergeTree``
+    giữ lại khi gộp, nên bản ghi sau không thể ghi đè mật khẩu đã có; bên thua
+    nhận ``RegistrationConflictError`` khi đọc lại.
+    """
+
+    def __init__(self, ch: "ClickHouseClient", table: str = "auth_users"):
+        self._ch = ch
+        self.table = table
+
+    async def init(self) -> None:
+        await self._ch.acommand(AUTH_USERS_DDL.format(table=self.table))
+        await super().init()
+
+    async def get(self, username: str) -> Optional[str]:
+        result = await self._ch.aquery(
+            f"SELECT argMax(password_hash, (rank, password_hash)) FROM {self.table} "
+            "WHERE username = {username:String} GROUP BY username",
+            parameters={"username": username},
+        )
+        return result.result_rows[0][0] if result.result_rows else None
+
+    async def create(self, username: str, password_hash: str) -> None:
+        if await self.get(username) is not None:
+            raise UserExistsError(username)
+        await self._ch.ainsert(
+            self.table,
+            [[username, password_hash, registration_rank()]],
+            column_names=["username", "password_hash", "rank"],
+        )
+        # Một lần đăng ký đồng thời khác có thể đã chèn trước
+        if await self.get(username) != password_hash:
+            logger.warning("Đăng ký trùng tên {} đồng thời, giữ tài khoản đầu tiên", username)
+            raise RegistrationConflictError(username)
+
+
+def build_credential_store(ch: "ClickHouseClient") -> CredentialStore:
+    """Tạo backend lưu tài khoản theo ``AUTH_BACKEND`` (``clickhouse``/``memory``)."""
+    if settings.AUTH_BACKEND == "memory":
+        return MemoryCredentialStore()
+    if settings.AUTH_BACKEND != "clickhouse":
+        raise ValueError(f"Unknown AUTH_BACKEND: {settings.AUTH_BACKEND}")
+    return ClickHouseCredentialStore(ch)
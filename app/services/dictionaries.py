@@ -0,0 +1,150 @@
+"""Dictionary ClickHouse cho các bảng chiều, dùng với ``dictGet`` khi đọc đơn hàng.
+
+Mỗi bảng chiều trong ``DICTIONARY_TABLES`` có một dictionary ``<bảng>_dict``
+nạp trạng thái mới nhất của bảng (``FINAL``, bỏ dòng đã xóa) vào bộ nhớ của
+server. Truy vấn đơn hàng lấy tên người dùng/sản phẩm bằng ``dictGetOrNull``
+ngay trong câu ``SELECT`` nên chỉ cần một round-trip thay vì gọi thêm
+``/users/{id}`` và ``/products/{id}`` cho mỗi đơn hàng.
+
+Dictionary tự nạp lại sau ``DICTIONARY_LIFETIME_MIN``-``DICTIONARY_LIFETIME_MAX``
+giây, nhưng chỉ đọc lại bảng khi ``max(_version)`` đổi (``INVALIDATE_QUERY``).
+"""
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.versioning import DELETED_COLUMN, VERSION_COLUMN
+
+if TYPE_CHECKING:
+    from app.services.clickhouse_client import ClickHouseClient
+
+
+class DictionaryNotFoundError(Exception):
+    """Không có dictionary với tên yêu cầu."""
+
+
+def dictionary_name(table: str) -> str:
+    return f"{table}_dict"
+
+
+def _quote(value: str) -> str:
+    """Chuỗi hằng trong DDL của ClickHouse."""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def dictionary_ddl(
+    table: str,
+    key: str,
+    attributes: Sequence[Sequence[str]],
+    lifetime_min: int,
+    lifetime_max: int,
+) -> str:
+    """Câu ``CREATE OR REPLACE DICTIONARY`` đọc bảng phiên bản ``table``."""
+    columns = ", ".join([key] + [name for name, _ in attributes])
+    query = f"SELECT {columns} FROM {table} FINAL WHERE {DELETED_COLUMN} = 0"
+    invalidate = f"SELECT max({VERSION_COLUMN}) FROM {table}"
+    structure = ",\n".join(
+        [f"{key} UInt64"] + [f"{name} {ch_type}" for name, ch_type in attributes]
+    )
+    source = (
+        f"QUERY {_quote(query)} INVALIDATE_QUERY {_quote(invalidate)} "
+        f"USER {_quote(settings.CLICKHOUSE_USER)} "
+        f"PASSWORD {_quote(settings.CLICKHOUSE_PASSWORD)} "
+        f"DB {_quote(settings.CLICKHOUSE_DATABASE)}"
+    )
+    return (
+        f"CREATE OR REPLACE DICTIONARY {dictionary_name(table)} (\n{structure}\n)\n"
+        f"PRIMARY KEY {key}\n"
+        f"SOURCE(CLICKHOUSE({source}))\n"
+        f"LAYOUT(HASHED())\n"
+        f"LIFETIME(MIN {lifetime_min} MAX {lifetime_max})"
+    )
+
+
+def _attributes(spec: Dict[str, Any]) -> List[List[str]]:
+    """Cột (tên, kiểu) của bảng chiều, trừ khóa, đọc từ DDL trong ``ENTITY_TABLES``."""
+    attributes = []
+    for line in spec["ddl"].split(",\n"):
+        name, ch_type = line.split(None, 1)
+        if name != spec["order_by"]:
+            attributes.append([name, ch_type])
+    return attributes
+
+
+class DictionaryManager:
+    """Tạo, nạp lại và báo trạng thái dictionary của các bảng chiều."""
+
+    def __init__(
+        self,
+        ch: "ClickHouseClient",
+        entities: Dict[str, Dict[str, Any]],
+        tables: Optional[str] = None,
+        lifetime_min: Optional[int] = None,
+        lifetime_max: Optional[int] = None,
+    ):
+        self._ch = ch
+        names = tables if tables is not None else settings.DICTIONARY_TABLES
+        self.lifetime_min = (
+            lifetime_min if lifetime_min is not None else settings.DICTIONARY_LIFETIME_MIN
+        )
+        self.lifetime_max = (
+            lifetime_max if lifetime_max is not None else settings.DICTIONARY_LIFETIME_MAX
+        )
+        self.specs: Dict[str, Dict[str, Any]] = {}
+        for name in (item.strip() for item in names.split(",")):
+            if not name:
+                continue
+            if name not in entities:
+                raise ValueError(f"Unknown dictionary table: {name}")
+            self.specs[name] = entities[name]
+
+    def get_expr(self, table: str, attribute: str, key_expr: str) -> str:
+        """Biểu thức ``dictGetOrNull`` lấy ``attribute`` của khóa ``key_expr``."""
+        if table not in self.specs:
+            raise DictionaryNotFoundError(table)
+        return f"dictGetOrNull('{dictionary_name(table)}', '{attribute}', {key_expr})"
+
+    def create_all(self) -> None:
+        """Tạo (hoặc cập nhật định nghĩa) dictionary của mọi bảng được cấu hình."""
+        for table, spec in self.specs.items():
+            self._ch.command(
+                dictionary_ddl(
+                    table,
+                    spec["order_by"],
+                    _attributes(spec),
+                    self.lifetime_min,
+                    self.lifetime_max,
+                )
+            )
+            logger.info("Dictionary {} sẵn sàng cho bảng {}", dictionary_name(table), table)
+
+    def reload(self, table: str) -> None:
+        """Nạp lại ngay dictionary của ``table`` (không chờ hết ``LIFETIME``)."""
+        if table not in self.specs:
+            raise DictionaryNotFoundError(table)
+        self._ch.command(f"SYSTEM RELOAD DICTIONARY {dictionary_name(table)}")
+        logger.info("Đã nạp lại dictionary {}", dictionary_name(table))
+
+    async def stats(self) -> List[Dict[str, Any]]:
+        """Trạng thái, số phần tử, bộ nhớ và lần nạp gần nhất của từng dictionary."""
+        if not self.specs:
+            return []
+        result = await self._ch.aquery(
+            "SELECT name, status, element_count, bytes_allocated, "
+            "last_successful_update_time, loading_duration, last_exception "
+            "FROM system.dictionaries "
+            "WHERE database = currentDatabase() AND name IN {names:Array(String)}",
+            parameters={"names": [dictionary_name(t) for t in self.specs]},
+        )
+        names = [
+            "name",
+            "status",
+            "element_count",
+            "bytes_allocated",
+            "last_successful_update_time",
+            "loading_duration",
+            "last_exception",
+        ]
+        return [dict(zip(names, row)) for row in result.result_rows]
@@ -0,0 +1,361 @@
+"""Bản sao trong bộ nhớ của các bảng chiều nhỏ, đọc nhiều (``dim_users``...).
+
+Mỗi bảng được nạp khi khởi động thành các mảng theo cột (``array`` cho cột
+số, ``list`` cho cột chuỗi) cùng một index khóa → vị trí dòng, nên đọc một
+dòng hay nhiều dòng theo khóa không cần truy vấn ClickHouse. Sau đó bản sao
+được làm mới tăng dần trong nền: mỗi chu kỳ chỉ đọc các dòng có ``_version``
+lớn hơn watermark (trừ đi một khoảng đọc lùi để không bỏ sót dòng có phiên
+bản nhỏ nhưng ghi xong muộn), và một dòng chỉ ghi đè bản trong bộ nhớ khi có
+phiên bản không nhỏ hơn.
+
+Ghi từ chính dịch vụ (chèn, cập nhật/xóa phiên bản) được áp vào bản sao ngay
+khi ClickHouse xác nhận. Ghi từ nơi khác xuất hiện sau tối đa một chu kỳ làm
+mới; ``ALTER TABLE ... UPDATE`` không đổi ``_version`` nên chỉ thấy được sau
+khi nạp lại toàn bộ (``reload``).
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from array import array
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services import metrics
+from app.services.guardrails import unrestricted
+from app.services.versioning import DELETED_COLUMN, VERSION_COLUMN, next_version
+
+if TYPE_CHECKING:
+    from app.services.clickhouse_client import ClickHouseClient
+
+# Kiểu ClickHouse lưu được trong ``array`` (mã kiểu của module ``array``)
+_ARRAY_CODES = (("UInt", "Q"), ("Int", "q"), ("Float", "d"))
+
+
+def _new_column(ch_type: str):
+    for prefix, code in _ARRAY_CODES:
+        if ch_type.startswith(prefix):
+            return array(code)
+    return []
+
+
+def _column_bytes(column) -> int:
+    if isinstance(column, array):
+        return sys.getsizeof(column)
+    return sys.getsizeof(column) + sum(sys.getsizeof(value) for value in column)
+
+
+class DimensionTable:
+    """Một bảng chiều lưu theo cột, có index khóa → vị trí dòng.
+
+    Dòng bị xóa vẫn giữ vị trí (đánh dấu trong ``_deleted``) để dòng cũ hơn
+    đọc lại trong khoảng lùi không làm nó xuất hiện lại. Mọi thao tác đọc/ghi
+    giữ một khóa ngắn vì ghi có thể tới từ thread của pool ClickHouse.
+    """
+
+    def __init__(self, name: str, key: str, columns: Sequence[str], types: Dict[str, str]):
+        self.name = name
+        self.key = key
+        self.columns = tuple(columns)
+        self._key_pos = self.columns.index(key)
+        self._types = types
+        self._lock = threading.Lock()
+        self.watermark = 0
+        self.refreshed_at: Optional[float] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._data = [_new_column(self._types.get(col, "")) for col in self.columns]
+        self._versions = array("Q")
+        self._deleted = bytearray()
+        self._index: Dict[Any, int] = {}
+
+    def replace(self, rows: Sequence[Sequence[Any]]) -> None:
+        """Thay toàn bộ dữ liệu bằng ``rows`` (các cột, ``_version``, ``_deleted``)."""
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._upsert(row)
+
+    def apply(self, rows: Sequence[Sequence[Any]]) -> int:
+        """Áp các dòng mới; trả về số dòng đã ghi đè hoặc thêm vào bản sao."""
+        with self._lock:
+            return sum(self._upsert(row) for row in rows)
+
+    def _upsert(self, row: Sequence[Any]) -> bool:
+        n = len(self.columns)
+        version, deleted = row[n], row[n + 1]
+        pos = self._index.get(row[self._key_pos])
+        if pos is None:
+            pos = len(self._versions)
+            appended = []
+            try:
+                for column, value in zip(self._data, row):
+                    column.append(value)
+                    appended.append(column)
+            except Exception:
+                # Giá trị sai kiểu cho mảng: bỏ phần đã thêm để các cột vẫn cùng độ dài
+                for column in appended:
+                    column.pop()
+                raise
+            self._versions.append(version)
+            self._deleted.append(1 if deleted else 0)
+            self._index[row[self._key_pos]] = pos
+            return True
+        if version < self._versions[pos]:
+            return False
+        self._write(pos, dict(zip(range(len(self.columns)), row)))
+        self._versions[pos] = version
+        self._deleted[pos] = 1 if deleted else 0
+        return True
+
+    def _write(self, pos: int, values: Dict[int, Any]) -> None:
+        """Ghi đè các cột (theo chỉ số) của một dòng, khôi phục nếu có giá trị sai kiểu."""
+        old = {i: self._data[i][pos] for i in values}
+        try:
+            for i, value in values.items():
+                self._data[i][pos] = value
+        except Exception:
+            for i, value in old.items():
+                self._data[i][pos] = value
+            raise
+
+    def update(self, key: Any, values: Dict[str, Any], version: int, deleted: bool = False) -> bool:
+        """Đổi một số cột của dòng đang có; bỏ qua nếu chưa có dòng hoặc phiên bản cũ hơn."""
+        with self._lock:
+            pos = self._index.get(key)
+            if pos is None or self._deleted[pos] or version < self._versions[pos]:
+                return False
+            self._write(
+                pos,
+                {self.columns.index(col): v for col, v in values.items() if col in self.columns},
+            )
+            self._versions[pos] = version
+            self._deleted[pos] = 1 if deleted else 0
+            return True
+
+    def get(self, key: Any) -> Optional[Tuple[Any, ...]]:
+        """Dòng (theo thứ tự ``columns``) có khóa ``key``, ``None`` nếu không có."""
+        with self._lock:
+            pos = self._index.get(key)
+            if pos is None or self._deleted[pos]:
+                return None
+            return tuple(column[pos] for column in self._data)
+
+    def get_many(self, keys: Sequence[Any]) -> Dict[Any, List[Tuple[Any, ...]]]:
+        """Dòng theo từng khóa, cùng dạng với ``BatchLoader.load_many``."""
+        found: Dict[Any, List[Tuple[Any, ...]]] = {}
+        with self._lock:
+            for key in keys:
+                pos = self._index.get(key)
+                if pos is not None and not self._deleted[pos]:
+                    found[key] = [tuple(column[pos] for column in self._data)]
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = len(self._versions)
+            deleted = sum(self._deleted)
+            memory = (
+                sum(_column_bytes(column) for column in self._data)
+                + sys.getsizeof(self._versions)
+                + sys.getsizeof(self._deleted)
+                + sys.getsizeof(self._index)
+                + sum(sys.getsizeof(key) for key in self._index)
+            )
+        return {
+            "rows": rows - deleted,
+            "deleted": deleted,
+            "memory_bytes": memory,
+            "watermark": self.watermark,
+            "refresh_lag_seconds": self.refresh_lag(),
+        }
+
+    def refresh_lag(self) -> float:
+        """Số giây từ lần làm mới thành công gần nhất."""
+        if self.refreshed_at is None:
+            return 0.0
+        return max(0.0, time.time() - self.refreshed_at)
+
+
+class DimensionStore:
+    """Giữ các ``DimensionTable`` của ``DIMENSION_STORE_TABLES`` và làm mới chúng.
+
+    Bảng chỉ phục vụ đọc (``table``) sau khi nạp lần đầu thành công; trước đó
+    hoặc khi tắt, router đọc từ ClickHouse như bình thường.
+    """
+
+    def __init__(
+        self,
+        ch: "ClickHouseClient",
+        entities: Dict[str, Dict[str, Any]],
+        tables: Optional[str] = None,
+        interval: Optional[float] = None,
+        lookback: Optional[float] = None,
+    ):
+        self._ch = ch
+        names = tables if tables is not None else settings.DIMENSION_STORE_TABLES
+        self.interval = (
+            interval if interval is not None else settings.DIMENSION_STORE_REFRESH_INTERVAL
+        )
+        self.lookback = lookback if lookback is not None else settings.DIMENSION_STORE_LOOKBACK
+        self.specs: Dict[str, Dict[str, Any]] = {}
+        for name in (item.strip() for item in names.split(",")):
+            if not name:
+                continue
+            if name not in entities:
+                raise ValueError(f"Unknown dimension table: {name}")
+            self.specs[name] = entities[name]
+        self._tables: Dict[str, DimensionTable] = {}
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._metrics: Dict[str, int] = {
+            "refreshes": 0,
+            "rows_applied": 0,
+            "local_writes": 0,
+            "errors": 0,
+        }
+
+    def table(self, name: str) -> Optional[DimensionTable]:
+        """Bản sao đã nạp của bảng ``name`` hoặc ``None``."""
+        return self._tables.get(name)
+
+    def _select(self, name: str) -> str:
+        columns = ", ".join(self.specs[name]["columns"])
+        return f"SELECT {columns}, {VERSION_COLUMN}, {DELETED_COLUMN} FROM {name}"
+
+    async def reload(self, name: str) -> None:
+        """Nạp lại toàn bộ bảng (trạng thái mới nhất của mỗi khóa)."""
+        spec = self.specs[name]
+        types = dict(await self._ch.aget_table_schema(name))
+        table = DimensionTable(name, spec["order_by"], spec["columns"], types)
+        with unrestricted():
+            result = await self._ch.aquery(f"{self._select(name)} FINAL")
+        table.replace(result.result_rows)
+        n = len(table.columns)
+        table.watermark = max((row[n] for row in result.result_rows), default=0)
+        table.refreshed_at = time.time()
+        self._tables[name] = table
+        logger.info("Nạp bảng chiều {} vào bộ nhớ: {} dòng", name, len(result.result_rows))
+
+    async def refresh(self, name: str) -> int:
+        """Áp các dòng có ``_version`` mới hơn watermark (trừ khoảng đọc lùi)."""
+        table = self._tables.get(name)
+        if table is None:
+            await self.reload(name)
+            return 0
+        since = max(0, table.watermark - int(self.lookback * 1e9))
+        with unrestricted():
+            result = await self._ch.aquery(
+                f"{self._select(name)} WHERE {VERSION_COLUMN} > {{since:UInt64}} "
+                f"ORDER BY {VERSION_COLUMN}",
+                parameters={"since": since},
+            )
+        rows = result.result_rows
+        applied = table.apply(rows)
+        n = len(table.columns)
+        table.watermark = max(table.watermark, max((row[n] for row in rows), default=0))
+        table.refreshed_at = time.time()
+        self._metrics["refreshes"] += 1
+        self._metrics["rows_applied"] += applied
+        return applied
+
+    async def start(self) -> None:
+        """Nạp các bảng và chạy vòng làm mới nền (không làm gì nếu đã tắt)."""
+        if not self.specs or self._task is not None:
+            return
+        for name in self.specs:
+            try:
+                await self.reload(name)
+            except Exception as exc:
+                # Bảng chưa nạp được vẫn đọc từ ClickHouse, vòng làm mới sẽ thử lại
+                self._metrics["errors"] += 1
+                metrics.record_error("dimension_store", exc)
+                logger.exception("Lỗi nạp bảng chiều {}: {}", name, exc)
+        self._task = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            for name in self.specs:
+                try:
+                    await self.refresh(name)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    self._metrics["errors"] += 1
+                    metrics.record_error("dimension_store", exc)
+                    logger.warning("Lỗi làm mới bảng chiều {}: {}", name, exc)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def apply_insert(
+        self,
+        name: str,
+        data: Sequence[Sequence[Any]],
+        column_names: Optional[Sequence[str]],
+        column_oriented: bool = False,
+    ) -> None:
+        """Áp các dòng vừa chèn thành công vào bản sao của bảng ``name``.
+
+        Dòng không có ``_version`` nhận phiên bản mới (ClickHouse cũng gán giá
+        trị mặc định theo thời gian hiện tại); chèn thiếu cột dữ liệu thì bỏ
+        qua, vòng làm mới sẽ đọc lại.
+        """
+        table = self._tables.get(name)
+        if table is None or not column_names or not data:
+            return
+        names = list(column_names)
+        if not set(table.columns) <= set(names):
+            return
+        rows = list(zip(*data)) if column_oriented else data
+        positions = [names.index(col) for col in table.columns]
+        version_pos = names.index(VERSION_COLUMN) if VERSION_COLUMN in names else None
+        deleted_pos = names.index(DELETED_COLUMN) if DELETED_COLUMN in names else None
+        try:
+            table.apply(
+                [
+                    (
+                        *(row[i] for i in positions),
+                        row[version_pos] if version_pos is not None else next_version(),
+                        row[deleted_pos] if deleted_pos is not None else 0,
+                    )
+                    for row in rows
+                ]
+            )
+            self._metrics["local_writes"] += len(rows)
+        except Exception as exc:
+            logger.warning("Không áp được dòng chèn vào bảng chiều {}: {}", name, exc)
+
+    def apply_update(
+        self,
+        name: str,
+        key: str,
+        key_value: Any,
+        values: Dict[str, Any],
+        version: int,
+        deleted: bool = False,
+    ) -> None:
+        """Áp một lệnh cập nhật/xóa theo khóa đã ghi thành công."""
+        table = self._tables.get(name)
+        if table is None or key != table.key:
+            return
+        try:
+            if table.update(key_value, values, version, deleted):
+                self._metrics["local_writes"] += 1
+        except Exception as exc:
+            logger.warning("Không áp được cập nhật vào bảng chiều {}: {}", name, exc)
+
+    def stats(self) -> Dict[str, Any]:
+        """Số dòng, bộ nhớ và độ trễ làm mới của từng bảng."""
+        return {
+            **self._metrics,
+            "interval": self.interval,
+            "tables": {name: table.stats() for name, table in self._tables.items()},
+        }
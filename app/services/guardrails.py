@@ -0,0 +1,177 @@
+"""Hồ sơ giới hạn truy vấn ClickHouse theo endpoint và theo người dùng.
+
+Mỗi hồ sơ là một tập setting ClickHouse (``max_execution_time``,
+``max_result_rows``, ``max_memory_usage``, ``result_overflow_mode``,
+``readonly``...). Dependency ``apply_query_profile`` chọn hồ sơ cho request
+và lưu vào ``ContextVar``; ``ClickHouseClient`` đọc biến này ở mọi lời gọi
+(``query``, ``command``, ``insert``, stream) nên không cần truyền tay qua
+từng router.
+"""
+
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from jose import JWTError
+from loguru import logger
+
+from app.core.config import settings
+from app.core.security import decode_token
+
+
+class QueryProfile:
+    """Tập setting ClickHouse đã gộp từ một hoặc nhiều hồ sơ."""
+
+    def __init__(self, names: Tuple[str, ...], query_settings: Dict[str, Any]):
+        self.names = names
+        self.settings = query_settings
+
+    @property
+    def name(self) -> str:
+        return "+".join(self.names)
+
+
+_current: ContextVar[Optional[QueryProfile]] = ContextVar("query_profile", default=None)
+
+# Mã lỗi ClickHouse khi vượt giới hạn -> (status HTTP, thông báo)
+LIMIT_ERRORS: Dict[int, Tuple[int, str]] = {
+    158: (413, "Query returns too many rows"),
+    159: (408, "Query exceeded max_execution_time"),
+    164: (403, "Query is not allowed in readonly mode"),
+    241: (413, "Query exceeded max_memory_usage"),
+    307: (413, "Query reads too many bytes"),
+    396: (413, "Query result exceeds max_result_rows/max_result_bytes"),
+}
+_CODE_RE = re.compile(r"Code: (\d+)")
+
+
+class QueryLimitError(HTTPException):
+    """Truy vấn bị ClickHouse dừng vì vượt giới hạn của hồ sơ.
+
+    Kế thừa ``HTTPException`` để đi thẳng qua nhánh ``except HTTPException``
+    của các router và trả về mã 4xx tương ứng.
+    """
+
+    def __init__(self, code: int, status_code: int, detail: str):
+        super().__init__(status_code=status_code, detail=detail)
+        self.code = code
+
+
+def parse_mapping(spec: str) -> Dict[str, str]:
+    """Đọc cấu hình dạng ``tên:hồ sơ,tên:hồ sơ``."""
+    result: Dict[str, str] = {}
+    for item in spec.split(","):
+        name, _, profile = item.partition(":")
+        if name.strip() and profile.strip():
+            result[name.strip()] = profile.strip()
+    return result
+
+
+def limit_error(exc: BaseException) -> Optional[QueryLimitError]:
+    """Chuyển lỗi ClickHouse vượt giới hạn thành ``QueryLimitError`` (nếu đúng loại)."""
+    if isinstance(exc, QueryLimitError):
+        return exc
+    match = _CODE_RE.search(str(exc))
+    if not match or int(match.group(1)) not in LIMIT_ERRORS:
+        return None
+    code = int(match.group(1))
+    status_code, detail = LIMIT_ERRORS[code]
+    profile = _current.get()
+    if profile is not None:
+        detail += f" (profile {profile.name})"
+    return QueryLimitError(code, status_code, detail)
+
+
+def profile_settings() -> Dict[str, Any]:
+    """Setting ClickHouse của hồ sơ đang áp dụng trong ngữ cảnh hiện tại."""
+    profile = _current.get()
+    return dict(profile.settings) if profile is not None else {}
+
+
+def profile_name() -> str:
+    """Tên hồ sơ đang áp dụng, rỗng nếu không có."""
+    profile = _current.get()
+    return profile.name if profile is not None else ""
+
+
+def resolve_profile(
+    endpoint: str,
+    user: Optional[str] = None,
+    profiles: Optional[Dict[str, Dict[str, Any]]] = None,
+    endpoint_profiles: Optional[str] = None,
+    user_profiles: Optional[str] = None,
+) -> QueryProfile:
+    """Gộp hồ sơ ``default``, hồ sơ của endpoint rồi của người dùng (sau ghi đè trước)."""
+    profiles = profiles if profiles is not None else settings.QUERY_PROFILES
+    by_endpoint = parse_mapping(
+        endpoint_profiles if endpoint_profiles is not None else settings.QUERY_PROFILE_ENDPOINTS
+    )
+    by_user = parse_mapping(
+        user_profiles if user_profiles is not None else settings.QUERY_PROFILE_USERS
+    )
+    names: List[str] = ["default"]
+    for name in (by_endpoint.get(endpoint), by_user.get(user) if user else None):
+        if name and name not in names:
+            names.append(name)
+    merged: Dict[str, Any] = {}
+    for name in names:
+        if name not in profiles and name != "default":
+            logger.warning("Không có hồ sơ giới hạn {}", name)
+        merged.update(profiles.get(name, {}))
+    return QueryProfile(tuple(names), merged)
+
+
+def set_profile(profile: Optional[QueryProfile]):
+    """Đặt hồ sơ cho ngữ cảnh hiện tại, trả về token để khôi phục."""
+    return _current.set(profile)
+
+
+@contextmanager
+def unrestricted() -> Iterator[None]:
+    """Bỏ hồ sơ của request trong khối lệnh (dùng cho tác vụ nền gom nhiều request)."""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def fixed_settings(name: str, query_settings: Dict[str, Any]) -> Iterator[None]:
+    """Chỉ dùng ``query_settings`` trong khối lệnh thay cho hồ sơ của request."""
+    token = _current.set(QueryProfile((name,), dict(query_settings)))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def endpoint_name(request: Request) -> str:
+    """Tên endpoint dạng ``<tag>.<tên hàm>``, ví dụ ``users.read_user``."""
+    route = request.scope.get("route")
+    endpoint = request.scope.get("endpoint")
+    tags = getattr(route, "tags", None) or []
+    func = getattr(endpoint, "__name__", "")
+    return f"{tags[0]}.{func}" if tags else func
+
+
+def request_user(request: Request) -> Optional[str]:
+    """Tên người dùng trong bearer token nếu có và hợp lệ."""
+    auth = request.headers.get("authorization", "")
+    scheme, _, token = auth.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = decode_token(token)
+    except JWTError:
+        return None
+    return payload.get("sub")
+
+
+async def apply_query_profile(request: Request) -> QueryProfile:
+    """Dependency chọn hồ sơ giới hạn cho request theo endpoint và người dùng."""
+    profile = resolve_profile(endpoint_name(request), request_user(request))
+    set_profile(profile)
+    return profile
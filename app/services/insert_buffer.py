@@ -0,0 +1,251 @@
+"""Bộ đệm gom nhiều lệnh chèn một dòng thành một lần ``insert`` dạng cột."""
+
+import asyncio
+import time
+from datetime import date, datetime
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.guardrails import unrestricted
+
+if TYPE_CHECKING:
+    from app.services.clickhouse_client import ClickHouseClient
+
+# ``flush``: chờ tới khi dữ liệu được ghi vào ClickHouse;
+# ``async``: trả về ngay sau khi dữ liệu vào hàng đợi
+AckMode = Literal["flush", "async"]
+
+
+class BufferFullError(Exception):
+    """Hàng đợi chèn đã đầy và không còn chỗ trong thời gian chờ cho phép."""
+
+
+class InvalidRowError(ValueError):
+    """Dòng không khớp schema của bảng, bị từ chối trước khi vào bộ đệm."""
+
+
+def coerce_value(value: Any, ch_type: str) -> Any:
+    """Chuyển giá trị JSON sang kiểu Python phù hợp để chèn dạng native."""
+    if value is None:
+        return None
+    base = ch_type
+    for wrapper in ("Nullable(", "LowCardinality("):
+        if base.startswith(wrapper):
+            base = base[len(wrapper):-1]
+    if base.startswith("UInt") or base.startswith("Int"):
+        return int(value)
+    if base.startswith("Float") or base.startswith("Decimal"):
+        return float(value)
+    if base.startswith("DateTime"):
+        return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    if base.startswith("Date"):
+        return value if isinstance(value, date) else date.fromisoformat(str(value))
+    if base.startswith("String"):
+        return value if isinstance(value, str) else str(value)
+    return value
+
+
+def prepare_row(row: Dict[str, Any], schema: Sequence[Tuple[str, str]]) -> Dict[str, Any]:
+    """Ép kiểu các giá trị của ``row`` theo ``schema``, cột theo thứ tự của bảng.
+
+    Dòng có cột lạ, giá trị sai kiểu hoặc ``None`` ở cột không ``Nullable`` bị
+    từ chối ngay thay vì làm hỏng cả lô khi flush.
+    """
+    types = dict(schema)
+    unknown = set(row) - set(types)
+    if unknown:
+        raise InvalidRowError(f"Unknown columns: {', '.join(sorted(unknown))}")
+    prepared: Dict[str, Any] = {}
+    for col, ch_type in schema:
+        if col not in row:
+            continue
+        try:
+            value = coerce_value(row[col], ch_type)
+        except (TypeError, ValueError) as exc:
+            raise InvalidRowError(f"Invalid value for {col}: {exc}")
+        if value is None and not ch_type.startswith("Nullable("):
+            raise InvalidRowError(f"Column {col} is not nullable")
+        prepared[col] = value
+    return prepared
+
+
+class _TableBuffer:
+    """Các dòng đang chờ ghi của một bảng với một tập cột cố định."""
+
+    def __init__(self, table: str, columns: Tuple[str, ...]):
+        self.table = table
+        self.columns = columns
+        self.rows: List[Tuple[Any, ...]] = []
+        self.waiters: List[Optional[asyncio.Future]] = []
+        self.bytes = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.lock = asyncio.Lock()
+
+
+class InsertBuffer:
+    """Gom các dòng chèn theo bảng và ghi khi đủ số dòng, đủ dung lượng hoặc quá hạn.
+
+    Mỗi lần flush gọi một ``insert`` dạng cột duy nhất, giúp ClickHouse chỉ tạo
+    một part cho cả lô thay vì một part cho mỗi request.
+    """
+
+    def __init__(
+        self,
+        ch: "ClickHouseClient",
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_delay: Optional[float] = None,
+        max_pending: Optional[int] = None,
+        enqueue_timeout: Optional[float] = None,
+    ):
+        self._ch = ch
+        self.max_rows = max_rows or settings.INSERT_BUFFER_MAX_ROWS
+        self.max_bytes = max_bytes or settings.INSERT_BUFFER_MAX_BYTES
+        self.max_delay = max_delay if max_delay is not None else settings.INSERT_BUFFER_MAX_DELAY
+        self.max_pending = max_pending or settings.INSERT_BUFFER_MAX_PENDING
+        self.enqueue_timeout = (
+            enqueue_timeout
+            if enqueue_timeout is not None
+            else settings.INSERT_BUFFER_ENQUEUE_TIMEOUT
+        )
+        self._buffers: Dict[Tuple[str, Tuple[str, ...]], _TableBuffer] = {}
+        self._capacity = asyncio.Semaphore(self.max_pending)
+        self._pending = 0
+        self._tasks: set = set()
+        self._metrics: Dict[str, Any] = {
+            "flushes": 0,
+            "rows_flushed": 0,
+            "errors": 0,
+            "max_flush_rows": 0,
+            "total_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+            "reasons": {"rows": 0, "bytes": 0, "delay": 0, "shutdown": 0},
+        }
+
+    async def insert(self, table: str, row: Dict[str, Any], ack: AckMode = "flush") -> None:
+        """Đưa một dòng vào bộ đệm của bảng.
+
+        Dòng được kiểm tra và ép kiểu theo schema trước (lỗi là
+        ``InvalidRowError``); các dòng cùng tập cột dùng chung một bộ đệm bất kể
+        thứ tự khóa trong ``row``. Với ``ack="flush"`` hàm chờ tới khi lô chứa dòng này được ghi xong
+        (lỗi ghi được ném lại cho caller). Với ``ack="async"`` hàm trả về ngay;
+        khi hàng đợi đầy hàm chờ tối đa ``enqueue_timeout`` giây rồi ném
+        ``BufferFullError``.
+        """
+        row = prepare_row(row, await self._ch.aget_table_schema(table))
+        try:
+            await asyncio.wait_for(self._capacity.acquire(), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            raise BufferFullError(f"Hàng đợi chèn đầy ({self.max_pending} dòng)")
+        self._pending += 1
+        columns = tuple(row)
+        key = (table, columns)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = _TableBuffer(table, columns)
+        waiter = asyncio.get_running_loop().create_future() if ack == "flush" else None
+        buf.rows.append(tuple(row.values()))
+        buf.waiters.append(waiter)
+        buf.bytes += sum(len(str(v)) for v in row.values())
+
+        if len(buf.rows) >= self.max_rows:
+            self._spawn(self._flush(key, "rows"))
+        elif buf.bytes >= self.max_bytes:
+            self._spawn(self._flush(key, "bytes"))
+        elif buf.timer is None:
+            buf.timer = asyncio.get_running_loop().call_later(
+                self.max_delay, lambda: self._spawn(self._flush(key, "delay"))
+            )
+        if waiter is not None:
+            await waiter
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, key: Tuple[str, Tuple[str, ...]], reason: str) -> None:
+        """Ghi toàn bộ dòng đang chờ của một bộ đệm bằng một lệnh ``insert``."""
+        buf = self._buffers.get(key)
+        if buf is None:
+            return
+        async with buf.lock:
+            if buf.timer is not None:
+                buf.timer.cancel()
+                buf.timer = None
+            rows, waiters = buf.rows, buf.waiters
+            if not rows:
+                self._prune(key, buf)
+                return
+            buf.rows, buf.waiters, buf.bytes = [], [], 0
+            start = time.perf_counter()
+            try:
+                data = [list(col) for col in zip(*rows)]
+                # Lô gồm dòng của nhiều request, không áp hồ sơ giới hạn của request nào
+                with unrestricted():
+                    await self._ch.ainsert(
+                        buf.table, data, column_names=list(buf.columns), column_oriented=True
+                    )
+            except Exception as exc:
+                self._metrics["errors"] += 1
+                logger.exception("Lỗi ghi lô {} dòng vào bảng {}: {}", len(rows), buf.table, exc)
+                for waiter in waiters:
+                    if waiter is not None and not waiter.done():
+                        waiter.set_exception(exc)
+            else:
+                for waiter in waiters:
+                    if waiter is not None and not waiter.done():
+                        waiter.set_result(None)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._record(len(rows), elapsed, reason)
+                self._pending -= len(rows)
+                for _ in rows:
+                    self._capacity.release()
+            logger.debug(
+                "Flush {} dòng vào bảng {} trong {:.3f}s ({})",
+                len(rows),
+                buf.table,
+                elapsed,
+                reason,
+            )
+            self._prune(key, buf)
+
+    def _prune(self, key: Tuple[str, Tuple[str, ...]], buf: _TableBuffer) -> None:
+        """Bỏ bộ đệm không còn dòng chờ để số bộ đệm không tăng theo số tập cột đã gặp."""
+        if not buf.rows and buf.timer is None and self._buffers.get(key) is buf:
+            del self._buffers[key]
+
+    def _record(self, rows: int, elapsed: float, reason: str) -> None:
+        metrics = self._metrics
+        metrics["flushes"] += 1
+        metrics["rows_flushed"] += rows
+        metrics["max_flush_rows"] = max(metrics["max_flush_rows"], rows)
+        metrics["total_flush_seconds"] += elapsed
+        metrics["max_flush_seconds"] = max(metrics["max_flush_seconds"], elapsed)
+        metrics["reasons"][reason] += 1
+
+    async def flush_all(self) -> None:
+        """Ghi ngay mọi bộ đệm, dùng khi ứng dụng dừng."""
+        await asyncio.gather(
+            *(self._flush(key, "shutdown") for key in list(self._buffers)),
+            return_exceptions=True,
+        )
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê kích thước và độ trễ của các lần flush."""
+        metrics = self._metrics
+        flushes = metrics["flushes"]
+        return {
+            **metrics,
+            "reasons": dict(metrics["reasons"]),
+            "avg_flush_rows": metrics["rows_flushed"] / flushes if flushes else 0.0,
+            "avg_flush_seconds": metrics["total_flush_seconds"] / flushes if flushes else 0.0,
+            "pending_rows": self._pending,
+            "max_pending": self.max_pending,
+            "buffers": len(self._buffers),
+        }
@@ -0,0 +1,386 @@
+"""Số đo vận hành dạng Prometheus cho ``GET /metrics``.
+
+Không dùng thư viện ngoài: mỗi series (một bộ giá trị nhãn) giữ mảng số đếm
+được cấp phát sẵn cho từng thread, đường ghi chỉ cộng vào mảng của thread
+hiện tại nên không cần khóa và không mất lượt cộng. Khóa chỉ dùng khi tạo
+series mới hoặc khi một thread ghi lần đầu vào series; lúc scrape các mảng
+được cộng dồn lại (giá trị có thể lệch một lượt ghi đang diễn ra, chấp nhận
+được với số đo).
+"""
+
+import re
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SERIALIZATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+# Giá trị nhãn thay thế khi một họ số đo vượt quá số series cho phép
+OVERFLOW_LABEL = "__other__"
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SHAPE_MAX_LENGTH = 200
+
+
+@lru_cache(maxsize=4096)
+def query_shape(sql: str) -> str:
+    """Dạng chuẩn hóa của câu SQL: bỏ hằng chuỗi/số và gộp danh sách ``IN``.
+
+    ``SELECT * FROM t WHERE id IN (1, 2, 3)`` và ``... IN (4, 5)`` có cùng
+    dạng ``SELECT * FROM t WHERE id IN (?)``. Tham số ``{name:Type}`` được
+    giữ nguyên vì đã là placeholder.
+    """
+    shape = " ".join(sql.split()).rstrip(";").strip()
+    shape = _STRING_RE.sub("?", shape)
+    shape = _NUMBER_RE.sub("?", shape)
+    shape = _LIST_RE.sub("(?)", shape)
+    if len(shape) > _SHAPE_MAX_LENGTH:
+        shape = shape[:_SHAPE_MAX_LENGTH] + "..."
+    return shape
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Series:
+    """Một series: mảng ``size`` số đếm riêng cho mỗi thread ghi vào nó."""
+
+    __slots__ = ("_size", "_local", "_shards", "_lock", "function")
+
+    def __init__(self, size: int, lock: threading.Lock):
+        self._size = size
+        self._local = threading.local()
+        self._shards: List[List[float]] = []
+        self._lock = lock
+        self.function: Optional[Callable[[], float]] = None
+
+    def shard(self) -> List[float]:
+        """Mảng số đếm của thread hiện tại (tạo khi thread ghi lần đầu)."""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = [0.0] * self._size
+            with self._lock:
+                self._shards.append(values)
+            self._local.values = values
+            return values
+
+    def totals(self) -> List[float]:
+        with self._lock:
+            shards = list(self._shards)
+        totals = [0.0] * self._size
+        for values in shards:
+            for i, value in enumerate(values):
+                totals[i] += value
+        return totals
+
+
+class _Family:
+    """Một họ số đo cùng tên, mỗi bộ giá trị nhãn là một series."""
+
+    kind = ""
+    size = 1
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        max_series: Optional[int] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series or settings.METRICS_MAX_SERIES
+        self._series: Dict[Tuple[str, ...], _Series] = {}
+        self._lock = threading.Lock()
+
+    def series(self, *values: str) -> _Series:
+        """Series của bộ nhãn ``values``; quá ``max_series`` thì dồn vào ``__other__``."""
+        series = self._series.get(values)
+        if series is not None:
+            return series
+        with self._lock:
+            if values not in self._series and len(self._series) >= self.max_series:
+                values = (OVERFLOW_LABEL,) * len(self.labelnames)
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = _Series(self.size, self._lock)
+            return series
+
+    def collect(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            items = list(self._series.items())
+        for values, series in items:
+            lines.extend(self._samples(values, series))
+        return lines
+
+    def _samples(self, values: Tuple[str, ...], series: _Series) -> List[str]:
+        value = series.function() if series.function else series.totals()[0]
+        return [f"{self.name}{_labels(self.labelnames, values)} {_format_value(value)}"]
+
+
+class Counter(_Family):
+    """Bộ đếm chỉ tăng."""
+
+    kind = "counter"
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        self.series(*values).shard()[0] += amount
+
+
+class Gauge(_Family):
+    """Giá trị tăng/giảm, hoặc tính bằng hàm tại thời điểm scrape."""
+
+    kind = "gauge"
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        self.series(*values).shard()[0] += amount
+
+    def dec(self, *values: str, amount: float = 1) -> None:
+        self.series(*values).shard()[0] -= amount
+
+    def set_function(self, function: Callable[[], float], *values: str) -> None:
+        self.series(*values).function = function
+
+
+class Histogram(_Family):
+    """Histogram với các ngưỡng cố định.
+
+    Mảng số đếm của mỗi series gồm một ô cho mỗi ngưỡng, một ô ``+Inf`` và một
+    ô tổng giá trị; ghi một giá trị chỉ là ``bisect`` và hai phép cộng.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        max_series: Optional[int] = None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        self.size = len(self.buckets) + 2
+        super().__init__(name, documentation, labelnames, max_series)
+
+    def observe(self, value: float, *values: str) -> None:
+        shard = self.series(*values).shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def _samples(self, values: Tuple[str, ...], series: _Series) -> List[str]:
+        totals = series.totals()
+        lines = []
+        cumulative = 0.0
+        for bound, count in zip(self.buckets + (float("inf"),), totals):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(
+                f"{self.name}_bucket{_labels(self.labelnames, values, le)} "
+                f"{_format_value(cumulative)}"
+            )
+        labels = _labels(self.labelnames, values)
+        lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        lines.append(f"{self.name}_sum{labels} {_format_value(totals[-1])}")
+        return lines
+
+
+class Registry:
+    """Danh sách họ số đo được xuất ra ``/metrics``."""
+
+    def __init__(self):
+        self._families: List[_Family] = []
+
+    def register(self, family: Any) -> Any:
+        self._families.append(family)
+        return family
+
+    def render(self) -> str:
+        """Nội dung định dạng text của Prometheus."""
+        lines: List[str] = []
+        for family in self._families:
+            lines.extend(family.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Thời gian xử lý request HTTP theo route.",
+        ("method", "route"),
+    )
+)
+HTTP_RESPONSES = REGISTRY.register(
+    Counter(
+        "http_responses_total",
+        "Số phản hồi HTTP theo route và mã trạng thái.",
+        ("method", "route", "status"),
+    )
+)
+HTTP_IN_FLIGHT = REGISTRY.register(
+    Gauge("http_requests_in_flight", "Số request HTTP đang xử lý.")
+)
+QUERY_LATENCY = REGISTRY.register(
+    Histogram(
+        "clickhouse_query_duration_seconds",
+        "Thời gian truy vấn ClickHouse theo loại lời gọi và dạng truy vấn.",
+        ("kind", "shape"),
+    )
+)
+ROWS_READ = REGISTRY.register(
+    Counter(
+        "clickhouse_read_rows_total",
+        "Số dòng ClickHouse đã đọc theo dạng truy vấn.",
+        ("kind", "shape"),
+    )
+)
+BYTES_READ = REGISTRY.register(
+    Counter(
+        "clickhouse_read_bytes_total",
+        "Số byte ClickHouse đã đọc theo dạng truy vấn.",
+        ("kind", "shape"),
+    )
+)
+ROWS_RETURNED = REGISTRY.register(
+    Counter(
+        "clickhouse_result_rows_total",
+        "Số dòng kết quả trả về theo dạng truy vấn.",
+        ("kind", "shape"),
+    )
+)
+BYTES_RETURNED = REGISTRY.register(
+    Counter(
+        "clickhouse_result_bytes_total",
+        "Số byte kết quả trả về theo dạng truy vấn.",
+        ("kind", "shape"),
+    )
+)
+SERIALIZATION = REGISTRY.register(
+    Histogram(
+        "response_serialization_seconds",
+        "Thời gian mã hóa kết quả thành JSON/NDJSON.",
+        ("format",),
+        buckets=SERIALIZATION_BUCKETS,
+    )
+)
+ERRORS = REGISTRY.register(
+    Counter(
+        "errors_total",
+        "Số lỗi theo nguồn và kiểu exception.",
+        ("source", "type"),
+    )
+)
+POOL = REGISTRY.register(
+    Gauge(
+        "clickhouse_pool_connections",
+        "Trạng thái pool kết nối ClickHouse.",
+        ("state",),
+    )
+)
+DIMENSION_ROWS = REGISTRY.register(
+    Gauge(
+        "dimension_store_rows",
+        "Số dòng của bảng chiều trong bộ nhớ.",
+        ("table",),
+    )
+)
+DIMENSION_MEMORY = REGISTRY.register(
+    Gauge(
+        "dimension_store_memory_bytes",
+        "Bộ nhớ ước tính của bảng chiều trong bộ nhớ.",
+        ("table",),
+    )
+)
+DIMENSION_LAG = REGISTRY.register(
+    Gauge(
+        "dimension_store_refresh_lag_seconds",
+        "Số giây từ lần làm mới bảng chiều thành công gần nhất.",
+        ("table",),
+    )
+)
+
+
+def _summary_int(summary: Dict[str, Any], key: str) -> int:
+    try:
+        return int(summary.get(key) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def record_query(kind: str, sql: str, elapsed: float, result: Any = None) -> None:
+    """Ghi thời gian và lượng dữ liệu của một lời gọi ``query``/``command``.
+
+    Số dòng/byte lấy từ header ``X-ClickHouse-Summary`` (``result.summary``);
+    nếu không có ``result_rows`` trong summary thì đếm dòng của kết quả.
+    """
+    shape = query_shape(sql)
+    QUERY_LATENCY.observe(elapsed, kind, shape)
+    if result is None:
+        return
+    summary = getattr(result, "summary", None)
+    if not isinstance(summary, dict):
+        summary = {}
+    ROWS_READ.inc(kind, shape, amount=_summary_int(summary, "read_rows"))
+    BYTES_READ.inc(kind, shape, amount=_summary_int(summary, "read_bytes"))
+    rows = _summary_int(summary, "result_rows")
+    if not rows and kind == "query":
+        rows = len(getattr(result, "result_rows", None) or ())
+    ROWS_RETURNED.inc(kind, shape, amount=rows)
+    BYTES_RETURNED.inc(kind, shape, amount=_summary_int(summary, "result_bytes"))
+
+
+def record_error(source: str, exc: BaseException) -> None:
+    ERRORS.inc(source, type(exc).__name__)
+
+
+def track_pool(ch: Any) -> None:
+    """Gắn số đo pool với client ClickHouse hiện tại (đọc khi scrape)."""
+    for state in ("size", "created", "in_use", "max_inflight"):
+        POOL.set_function(lambda state=state: ch.pool_stats()[state], state)
+
+
+def track_dimensions(store: Any) -> None:
+    """Gắn số đo các bảng chiều đã nạp vào bộ nhớ (đọc khi scrape)."""
+    for name in store.specs:
+        table = store.table(name)
+        if table is None:
+            continue
+        DIMENSION_ROWS.set_function(lambda t=table: t.stats()["rows"], name)
+        DIMENSION_MEMORY.set_function(lambda t=table: t.stats()["memory_bytes"], name)
+        DIMENSION_LAG.set_function(table.refresh_lag, name)
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,334 @@
+"""Chọn cách cập nhật/xóa dữ liệu theo bảng thay vì luôn dùng ``ALTER TABLE``.
+
+``ALTER TABLE ... UPDATE/DELETE`` là mutation nặng: ClickHouse ghi lại toàn bộ
+part chứa dòng bị ảnh hưởng. Mỗi bảng được gán một chiến lược:
+
+- ``versioned``: bảng ``ReplacingMergeTree`` có ``_version``/``_deleted``; cập
+  nhật và xóa là một lệnh ``INSERT ... SELECT`` phiên bản mới.
+- ``lightweight``: bảng họ ``MergeTree``; xóa bằng ``DELETE FROM`` (chỉ đánh
+  dấu dòng), cập nhật vẫn là mutation nhưng được gom nhóm.
+- ``mutation``: luôn dùng ``ALTER TABLE``, các lệnh gần nhau được gom thành một.
+
+Các nhóm chờ của một bảng nằm trong một hàng đợi và được gửi lần lượt theo
+thứ tự tới, nên cập nhật rồi xóa cùng một khóa không bị đảo thứ tự. Lệnh gom
+chạy với ``mutations_sync = 1``: request chỉ thành công (và bản sao bảng chiều
+chỉ được cập nhật) khi mutation đã áp xong trên server.
+"""
+
+import asyncio
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.guardrails import fixed_settings
+from app.services.versioning import (
+    DELETED_COLUMN,
+    VERSION_COLUMN,
+    delete_sql,
+    is_versioned,
+    next_version,
+    update_sql,
+    written_rows,
+)
+
+if TYPE_CHECKING:
+    from app.services.clickhouse_client import ClickHouseClient
+
+Strategy = Literal["versioned", "lightweight", "mutation"]
+STRATEGIES = ("versioned", "lightweight", "mutation")
+
+
+def parse_strategies(spec: str) -> Dict[str, str]:
+    """Đọc cấu hình dạng ``bảng:chiến lược,bảng:chiến lược``."""
+    result: Dict[str, str] = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        table, _, strategy = item.partition(":")
+        strategy = strategy.strip()
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown mutation strategy for {table.strip()}: {strategy}")
+        result[table.strip()] = strategy
+    return result
+
+
+def choose_strategy(engine: str, schema: Dict[str, str]) -> Strategy:
+    """Chiến lược mặc định theo engine và các cột của bảng."""
+    if engine.startswith("ReplacingMergeTree") and is_versioned(schema):
+        return "versioned"
+    if engine.endswith("MergeTree"):
+        return "lightweight"
+    return "mutation"
+
+
+def grouped_delete_sql(table: str, key: str, key_type: str, lightweight: bool) -> str:
+    """Câu lệnh xóa mọi khóa trong tham số ``__keys`` bằng một lệnh duy nhất."""
+    condition = f"{key} IN {{__keys:Array({key_type})}}"
+    if lightweight:
+        return f"DELETE FROM {table} WHERE {condition}"
+    return f"ALTER TABLE {table} DELETE WHERE {condition}"
+
+
+def grouped_update_sql(
+    table: str, key: str, key_type: str, columns: Dict[str, str], count: int
+) -> str:
+    """Một mutation ``ALTER TABLE ... UPDATE`` cho ``count`` khóa khác nhau.
+
+    Giá trị của khóa thứ ``i`` truyền qua tham số ``__k{i}`` và ``{cột}__{i}``;
+    mỗi cột được gán bằng ``multiIf`` nên cả nhóm chỉ ghi lại part một lần.
+    """
+    assignments = []
+    for col, ch_type in columns.items():
+        branches = ", ".join(
+            f"{key} = {{__k{i}:{key_type}}}, {{{col}__{i}:{ch_type}}}" for i in range(count)
+        )
+        assignments.append(f"{col} = multiIf({branches}, {col})")
+    return (
+        f"ALTER TABLE {table} UPDATE {', '.join(assignments)} "
+        f"WHERE {key} IN {{__keys:Array({key_type})}}"
+    )
+
+
+# Chờ mutation áp xong thay vì chỉ chờ server nhận lệnh
+_SYNC_SETTINGS = {"mutations_sync": 1}
+
+
+class _PendingGroup:
+    """Các thao tác cùng loại, cùng bảng, cùng tập cột đang chờ gom thành một lệnh."""
+
+    def __init__(self, sql_args: Tuple[Any, ...]):
+        self.sql_args = sql_args
+        self.items: Dict[Any, Dict[str, Any]] = {}
+        self.waiters: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MutationManager:
+    """Thực hiện cập nhật/xóa theo chiến lược của từng bảng.
+
+    Với ``lightweight`` và ``mutation``, các lệnh tới trong ``max_delay`` giây
+    được gom thành một lệnh ``IN (...)``/``multiIf`` (tối đa ``max_keys`` khóa)
+    để số mutation chờ xử lý không tăng theo số request.
+    """
+
+    def __init__(
+        self,
+        ch: "ClickHouseClient",
+        overrides: Optional[Dict[str, str]] = None,
+        max_delay: Optional[float] = None,
+        max_keys: Optional[int] = None,
+    ):
+        self._ch = ch
+        self.overrides = (
+            overrides if overrides is not None else parse_strategies(settings.MUTATION_STRATEGIES)
+        )
+        self.max_delay = max_delay if max_delay is not None else settings.MUTATION_BATCH_DELAY
+        self.max_keys = max_keys or settings.MUTATION_BATCH_MAX_KEYS
+        # Hàng đợi nhóm chờ theo bảng; chỉ nhóm cuối còn nhận thêm thao tác
+        self._queues: Dict[str, List[_PendingGroup]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._tasks: set = set()
+        self._metrics: Dict[str, int] = {
+            "versioned": 0,
+            "lightweight": 0,
+            "mutation": 0,
+            "statements": 0,
+            "grouped": 0,
+            "errors": 0,
+        }
+
+    async def strategy(self, table: str, schema: Optional[Dict[str, str]] = None) -> Strategy:
+        """Chiến lược áp dụng cho ``table`` (cấu hình ghi đè hoặc tự nhận diện)."""
+        if table in self.overrides:
+            return self.overrides[table]  # type: ignore[return-value]
+        if schema is None:
+            schema = dict(await self._ch.aget_table_schema(table))
+        return choose_strategy(await self._ch.aget_table_engine(table), schema)
+
+    def set_strategy(self, table: str, strategy: Optional[str]) -> None:
+        """Ghi đè chiến lược của một bảng; ``None`` để quay lại tự nhận diện."""
+        if strategy is None:
+            self.overrides.pop(table, None)
+            return
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown mutation strategy: {strategy}")
+        self.overrides[table] = strategy
+
+    async def update(
+        self,
+        table: str,
+        key: str,
+        key_value: Any,
+        values: Dict[str, Any],
+        schema: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """Cập nhật các cột ``values`` của dòng có ``key = key_value``.
+
+        Trả về số dòng đã ghi, 0 nghĩa là không tìm thấy dòng. Với các chiến lược
+        mutation, khóa được kiểm tra tồn tại trước khi đưa vào nhóm (mutation
+        không cho biết số dòng bị ảnh hưởng) và giá trị trả về là 1.
+        """
+        if schema is None:
+            schema = dict(await self._ch.aget_table_schema(table))
+        strategy = await self.strategy(table, schema)
+        self._metrics[strategy] += 1
+        if strategy == "versioned":
+            sql = update_sql(
+                table, key, schema[key], _data_columns(schema), {c: schema[c] for c in values}
+            )
+            params = {**values, "__key": key_value, "__version": next_version()}
+            written = written_rows(await self._ch.acommand(sql, parameters=params))
+            if written:
+                self._ch.dimensions.apply_update(
+                    table, key, key_value, values, params["__version"]
+                )
+            return written
+        if not await self._exists(table, key, schema[key], key_value):
+            return 0
+        columns = {c: schema[c] for c in values}
+        args = ("update", table, key, schema[key], tuple(columns.items()))
+        version = next_version()
+        await self._enqueue(args, key_value, values)
+        self._ch.dimensions.apply_update(table, key, key_value, values, version)
+        return 1
+
+    async def delete(
+        self,
+        table: str,
+        key: str,
+        key_value: Any,
+        schema: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """Xóa dòng có ``key = key_value``; giá trị trả về giống ``update``."""
+        if schema is None:
+            schema = dict(await self._ch.aget_table_schema(table))
+        strategy = await self.strategy(table, schema)
+        self._metrics[strategy] += 1
+        if strategy == "versioned":
+            sql = delete_sql(table, key, schema[key], _data_columns(schema))
+            params = {"__key": key_value, "__version": next_version()}
+            written = written_rows(await self._ch.acommand(sql, parameters=params))
+            if written:
+                self._ch.dimensions.apply_update(
+                    table, key, key_value, {}, params["__version"], deleted=True
+                )
+            return written
+        if not await self._exists(table, key, schema[key], key_value):
+            return 0
+        args = ("delete", table, key, schema[key], strategy == "lightweight")
+        version = next_version()
+        await self._enqueue(args, key_value, {})
+        self._ch.dimensions.apply_update(table, key, key_value, {}, version, deleted=True)
+        return 1
+
+    async def _exists(self, table: str, key: str, key_type: str, key_value: Any) -> bool:
+        result = await self._ch.aquery(
+            f"SELECT 1 FROM {table} WHERE {key} = {{__key:{key_type}}} LIMIT 1",
+            parameters={"__key": key_value},
+        )
+        return bool(result.result_rows)
+
+    async def _enqueue(self, args: Tuple[Any, ...], key_value: Any, values: Dict[str, Any]) -> None:
+        table = args[1]
+        queue = self._queues.setdefault(table, [])
+        if queue and queue[-1].sql_args == args:
+            group = queue[-1]
+        else:
+            # Khác loại hoặc tập cột: nhóm mới, gửi sau các nhóm đang chờ của bảng
+            group = _PendingGroup(args)
+            queue.append(group)
+        # Cùng một khóa được cập nhật nhiều lần: giá trị sau cùng được giữ lại
+        group.items[key_value] = values
+        waiter = asyncio.get_running_loop().create_future()
+        group.waiters.append(waiter)
+        if len(group.items) >= self.max_keys:
+            self._spawn(self._flush(table))
+        elif group.timer is None:
+            group.timer = asyncio.get_running_loop().call_later(
+                self.max_delay, lambda: self._spawn(self._flush(table))
+            )
+        await waiter
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, table: str) -> None:
+        """Gửi lần lượt mọi nhóm đang chờ của bảng, theo thứ tự tới."""
+        lock = self._locks.setdefault(table, asyncio.Lock())
+        async with lock:
+            queue = self._queues.get(table)
+            while queue:
+                group = queue.pop(0)
+                if group.timer is not None:
+                    group.timer.cancel()
+                await self._send(group)
+            self._queues.pop(table, None)
+
+    async def _send(self, group: _PendingGroup) -> None:
+        """Gửi một lệnh cho toàn bộ thao tác đang chờ của nhóm."""
+        kind, table, key, key_type, extra = group.sql_args
+        keys = list(group.items)
+        params: Dict[str, Any] = {"__keys": keys}
+        if kind == "delete":
+            sql = grouped_delete_sql(table, key, key_type, lightweight=extra)
+        else:
+            columns = dict(extra)
+            sql = grouped_update_sql(table, key, key_type, columns, len(keys))
+            for i, key_value in enumerate(keys):
+                params[f"__k{i}"] = key_value
+                for col in columns:
+                    params[f"{col}__{i}"] = group.items[key_value][col]
+        try:
+            # Lệnh gom thao tác của nhiều request, không áp hồ sơ giới hạn của request nào
+            with fixed_settings("mutation", _SYNC_SETTINGS):
+                await self._ch.acommand(sql, parameters=params)
+        except Exception as exc:
+            self._metrics["errors"] += 1
+            logger.exception("Lỗi {} {} khóa bảng {}: {}", kind, len(keys), table, exc)
+            for waiter in group.waiters:
+                if not waiter.done():
+                    waiter.set_exception(exc)
+        else:
+            self._metrics["statements"] += 1
+            self._metrics["grouped"] += len(group.waiters)
+            logger.debug("Gửi {} {} khóa bảng {} trong một lệnh", kind, len(keys), table)
+            for waiter in group.waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def flush_all(self) -> None:
+        """Gửi ngay mọi nhóm đang chờ, dùng khi ứng dụng dừng."""
+        await asyncio.gather(
+            *(self._flush(table) for table in list(self._queues)), return_exceptions=True
+        )
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Số thao tác theo chiến lược và số lệnh thực sự gửi tới ClickHouse."""
+        return {
+            **self._metrics,
+            "pending": sum(
+                len(g.waiters) for queue in self._queues.values() for g in queue
+            ),
+            "overrides": dict(self.overrides),
+        }
+
+    async def backlog(self) -> List[Dict[str, Any]]:
+        """Các mutation chưa hoàn tất trong ``system.mutations``, gom theo bảng."""
+        result = await self._ch.aquery(
+            "SELECT table, count() AS pending, sum(parts_to_do) AS parts_to_do, "
+            "min(create_time) AS oldest, anyLast(latest_fail_reason) AS latest_fail_reason "
+            "FROM system.mutations "
+            "WHERE database = currentDatabase() AND is_done = 0 "
+            "GROUP BY table ORDER BY pending DESC"
+        )
+        names = ["table", "pending", "parts_to_do", "oldest", "latest_fail_reason"]
+        return [dict(zip(names, row)) for row in result.result_rows]
+
+
+def _data_columns(schema: Dict[str, str]) -> List[str]:
+    return [c for c in schema if c not in (VERSION_COLUMN, DELETED_COLUMN)]
@@ -0,0 +1,108 @@
+"""Phân trang keyset (cursor) dựa trên sorting key của bảng ClickHouse."""
+
+import base64
+import json
+import re
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+_IDENTIFIER_CHARS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_")
+_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_FUNCTION_RE = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)\s*\(")
+
+
+class InvalidCursorError(ValueError):
+    """Cursor phân trang không hợp lệ."""
+
+
+def _split_key(sorting_key: str) -> List[str]:
+    """Tách sorting key theo dấu phẩy ở ngoài ngoặc."""
+    parts, depth, current = [], 0, ""
+    for char in sorting_key:
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        current += char
+    parts.append(current.strip())
+    return parts
+
+
+def _derived_from(expr: str, keys: List[str]) -> bool:
+    """``expr`` chỉ phụ thuộc các cột ``keys`` của sorting key, vd ``intHash64(id)``."""
+    functions = set(_FUNCTION_RE.findall(expr))
+    names = set(_NAME_RE.findall(expr)) - functions
+    return bool(names) and names <= set(keys)
+
+
+def parse_sorting_key(sorting_key: str, schema: Dict[str, str]) -> Optional[List[str]]:
+    """Tách sorting key thành danh sách cột.
+
+    Chỉ hỗ trợ sorting key gồm các cột thuần (không phải biểu thức); biểu thức
+    chỉ tính từ các cột thuần của sorting key (như khóa ``SAMPLE BY`` hay
+    ``intDiv(id, N)`` đứng trước ``id``) được bỏ qua: các cột thuần đã xác
+    định giá trị của biểu thức nên sắp theo chúng vẫn là một thứ tự toàn phần.
+    Trả về ``None`` nếu bảng không có sorting key dùng được để phân trang.
+    """
+    if not sorting_key:
+        return None
+    keys: List[str] = []
+    expressions: List[str] = []
+    for part in _split_key(sorting_key):
+        key = part.strip("`")
+        if key and not set(key) - _IDENTIFIER_CHARS and key in schema:
+            keys.append(key)
+        else:
+            expressions.append(part)
+    if not keys or not all(_derived_from(expr, keys) for expr in expressions):
+        return None
+    return keys
+
+
+def _cursor_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None).isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Mã hóa giá trị sorting key của dòng cuối thành cursor ``next``."""
+    raw = json.dumps([_cursor_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """Giải mã cursor thành danh sách giá trị sorting key."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception as exc:
+        raise InvalidCursorError("Invalid cursor") from exc
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursorError("Invalid cursor")
+    return values
+
+
+def keyset_condition(
+    keys: List[str], schema: Dict[str, str], values: List[Any]
+) -> Tuple[str, Dict[str, Any]]:
+    """Tạo điều kiện ``WHERE`` lấy các dòng đứng sau ``values`` theo ``keys``.
+
+    Điều kiện được viết dạng ``k1 >= v1 AND (k1 > v1 OR (k1 = v1 AND k2 > v2))``
+    để ClickHouse dùng primary key cắt bớt granule thay vì quét bằng ``OFFSET``.
+    """
+    params = {f"__after_{idx}": value for idx, value in enumerate(values)}
+    refs = [f"{{__after_{idx}:{schema[key]}}}" for idx, key in enumerate(keys)]
+    branches = []
+    for idx, key in enumerate(keys):
+        equal = [f"{keys[j]} = {refs[j]}" for j in range(idx)]
+        branches.append(" AND ".join(equal + [f"{key} > {refs[idx]}"]))
+    if len(branches) == 1:
+        return branches[0], params
+    condition = " OR ".join(f"({b})" for b in branches)
+    return f"{keys[0]} >= {refs[0]} AND ({condition})", params
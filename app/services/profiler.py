@@ -0,0 +1,62 @@
+"""Lấy mẫu stack của toàn bộ thread trong tiến trình (sampling profiler).
+
+Kết quả ở định dạng "folded stacks" (mỗi dòng ``frame;frame;... số_mẫu``),
+dùng trực tiếp được với ``flamegraph.pl``, speedscope hoặc ``inferno``.
+"""
+
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+_running = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """Đang có một phiên lấy mẫu khác chạy."""
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample(seconds: float, interval: float = 0.005) -> Dict[str, int]:
+    """Lấy mẫu stack mỗi ``interval`` giây trong ``seconds`` giây.
+
+    Hàm chặn trong suốt thời gian lấy mẫu, nên gọi từ thread riêng
+    (``asyncio.to_thread``) để event loop vẫn chạy và được lấy mẫu. Trả về
+    số mẫu theo stack đã gộp (gốc đứng trước, tên thread là frame đầu tiên).
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusyError("Profiler đang chạy")
+    try:
+        own = threading.get_ident()
+        stacks: Dict[str, int] = {}
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames: List[str] = []
+                while frame is not None:
+                    frames.append(_frame_name(frame))
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(frames))
+                stacks[key] = stacks.get(key, 0) + 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _running.release()
+
+
+def folded(stacks: Dict[str, int]) -> str:
+    """Định dạng folded stacks, stack nhiều mẫu nhất đứng trước."""
+    lines = [
+        f"{stack} {count}"
+        for stack, count in sorted(stacks.items(), key=lambda item: -item[1])
+    ]
+    return "\n".join(lines) + "\n" if lines else ""
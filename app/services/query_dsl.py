@@ -0,0 +1,178 @@
+"""Cú pháp tham số truy vấn của ``GET /crud/{table}``.
+
+- ``fields=a,b``: chỉ đọc các cột cần thiết thay vì ``SELECT *``.
+- ``col=v`` (bằng), ``col__gt``/``__gte``/``__lt``/``__lte``/``__ne=v`` và
+  ``col__in=v1,v2``: điều kiện trên cột sorting key giúp ClickHouse bỏ qua các
+  granule không khớp.
+- ``aggregate=sum:total,count:order_id`` (hoặc lặp lại ``aggregate``): nhiều phép
+  tổng hợp, bí danh ``<func>_<col>``; ``p50``/``p90``/``p95``/``p99`` là phân vị,
+  ``topk`` là 10 giá trị xuất hiện nhiều nhất.
+- ``having=sum_total__gte:100,...``: lọc kết quả tổng hợp theo bí danh.
+- ``order_by=col,-col2``: sắp xếp (``-`` là giảm dần).
+
+Mọi tên cột được kiểm tra theo schema bảng và mọi giá trị được truyền qua
+tham số truy vấn, không ghép vào câu SQL.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Toán tử lọc dạng ``col__op``
+FILTER_OPERATORS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "ne": "!="}
+HAVING_OPERATORS = {"eq": "=", **FILTER_OPERATORS}
+# Tên trong tham số ``aggregate`` -> tên hàm ClickHouse
+AGGREGATE_FUNCTIONS = {
+    "sum": "SUM",
+    "count": "COUNT",
+    "avg": "AVG",
+    "min": "MIN",
+    "max": "MAX",
+    "uniq": "uniq",
+    "uniqexact": "uniqExact",
+    "median": "median",
+    "any": "any",
+    "anylast": "anyLast",
+    "p50": "quantileExact(0.5)",
+    "p90": "quantileExact(0.9)",
+    "p95": "quantileExact(0.95)",
+    "p99": "quantileExact(0.99)",
+    "topk": "topK(10)",
+}
+_COUNTING = {"count", "uniq", "uniqexact"}
+_FLOATING = {"sum", "avg", "median", "p50", "p90", "p95", "p99"}
+# Kết quả là mảng, không so sánh được trong ``having``
+_ARRAYS = {"topk"}
+
+Cast = Callable[[str, str], Any]
+
+
+class QueryDSLError(ValueError):
+    """Tham số truy vấn không hợp lệ."""
+
+
+def split_list(raw: Optional[str]) -> List[str]:
+    """Tách ``a,b,c`` thành danh sách, bỏ phần tử rỗng."""
+    return [item.strip() for item in (raw or "").split(",") if item.strip()]
+
+
+@dataclass(frozen=True)
+class Filter:
+    """Điều kiện ``WHERE`` trên một cột: ``op`` là ``eq``, ``in`` hoặc toán tử so sánh."""
+
+    column: str
+    op: str
+    value: Any
+
+    @property
+    def param(self) -> str:
+        return self.column if self.op == "eq" else f"{self.column}__{self.op}"
+
+    def condition(self, ch_type: str) -> str:
+        if self.op == "eq":
+            return f"{self.column}={{{self.param}:{ch_type}}}"
+        if self.op == "in":
+            return f"{self.column} IN {{{self.param}:Array({ch_type})}}"
+        return f"{self.column} {FILTER_OPERATORS[self.op]} {{{self.param}:{ch_type}}}"
+
+
+def parse_filter(key: str, raw: str, schema: Dict[str, str], cast: Cast) -> Filter:
+    """Điều kiện của tham số ``key=raw`` (``col`` hoặc ``col__op``)."""
+    if key in schema:
+        return Filter(key, "eq", cast(raw, schema[key]))
+    column, _, op = key.rpartition("__")
+    if column not in schema or (op != "in" and op not in FILTER_OPERATORS):
+        raise QueryDSLError(f"Invalid filter column: {key}")
+    if op == "in":
+        values = split_list(raw)
+        if not values:
+            raise QueryDSLError(f"Empty IN list: {key}")
+        return Filter(column, op, [cast(v, schema[column]) for v in values])
+    return Filter(column, op, cast(raw, schema[column]))
+
+
+def parse_fields(raw: str, schema: Dict[str, str]) -> List[str]:
+    """Các cột của ``fields=``, giữ thứ tự và bỏ trùng."""
+    fields = list(dict.fromkeys(split_list(raw)))
+    if not fields:
+        raise QueryDSLError("fields must not be empty")
+    invalid = [c for c in fields if c not in schema]
+    if invalid:
+        raise QueryDSLError(f"Invalid field: {', '.join(invalid)}")
+    return fields
+
+
+@dataclass(frozen=True)
+class Aggregate:
+    """Một phép tổng hợp ``func(column)``."""
+
+    func: str
+    column: str
+
+    @property
+    def alias(self) -> str:
+        return f"{self.func}_{self.column}"
+
+    @property
+    def expr(self) -> str:
+        return f"{AGGREGATE_FUNCTIONS[self.func]}({self.column})"
+
+    def result_type(self, schema: Dict[str, str]) -> str:
+        """Kiểu dùng để truyền giá trị so sánh trong ``having``."""
+        if self.func in _COUNTING:
+            return "UInt64"
+        if self.func in _FLOATING:
+            return "Float64"
+        return schema[self.column]
+
+
+def parse_aggregates(values: Iterable[str], schema: Dict[str, str]) -> List[Aggregate]:
+    """Các phép tổng hợp từ một hoặc nhiều tham số ``aggregate``."""
+    aggregates: Dict[str, Aggregate] = {}
+    for raw in values:
+        for item in split_list(raw):
+            parts = item.split(":")
+            if len(parts) != 2:
+                raise QueryDSLError("Invalid aggregate format")
+            func, column = parts[0].strip().lower(), parts[1].strip()
+            if func not in AGGREGATE_FUNCTIONS:
+                raise QueryDSLError(f"Unsupported aggregate function: {parts[0]}")
+            if column not in schema:
+                raise QueryDSLError("Invalid aggregate column")
+            aggregate = Aggregate(func, column)
+            aggregates.setdefault(aggregate.alias, aggregate)
+    return list(aggregates.values())
+
+
+def parse_order_by(raw: str, allowed: Sequence[str]) -> List[str]:
+    """Biểu thức ``ORDER BY`` từ ``col,-col2``; chỉ nhận cột trong ``allowed``."""
+    order = []
+    for item in split_list(raw):
+        column = item.lstrip("-")
+        if column not in allowed:
+            raise QueryDSLError(f"Invalid order_by column: {column}")
+        order.append(f"{column} DESC" if item.startswith("-") else column)
+    return order
+
+
+def parse_having(
+    raw: str, aggregates: Sequence[Aggregate], schema: Dict[str, str], cast: Cast
+) -> Tuple[List[str], Dict[str, Any]]:
+    """Điều kiện ``HAVING`` từ ``alias__op:value,...`` và tham số của chúng."""
+    by_alias = {aggregate.alias: aggregate for aggregate in aggregates}
+    conditions: List[str] = []
+    params: Dict[str, Any] = {}
+    for i, item in enumerate(split_list(raw)):
+        target, sep, value = item.partition(":")
+        alias, _, op = target.rpartition("__")
+        if (
+            not sep
+            or alias not in by_alias
+            or by_alias[alias].func in _ARRAYS
+            or op not in HAVING_OPERATORS
+        ):
+            raise QueryDSLError(f"Invalid having condition: {item}")
+        ch_type = by_alias[alias].result_type(schema)
+        name = f"__having_{i}"
+        conditions.append(f"{alias} {HAVING_OPERATORS[op]} {{{name}:{ch_type}}}")
+        params[name] = cast(value, ch_type)
+    return conditions, params
@@ -0,0 +1,352 @@
+"""Chạy truy vấn phân tích dài dưới dạng job nền, kết quả ghi ra thư mục spill.
+
+``POST /sql/jobs`` chỉ đưa truy vấn vào hàng đợi ưu tiên và trả về ``job_id``;
+một số worker giới hạn (``JOBS_MAX_CONCURRENCY``) lấy job theo lớp ưu tiên
+(``high`` > ``normal`` > ``low``, cùng lớp thì theo thứ tự gửi), stream kết quả
+dạng ArrowStream từ ClickHouse thẳng vào file ``<job_id>.arrow``. Client hỏi
+tiến độ (đọc từ ``system.processes``), hủy job (``KILL QUERY``) và lấy kết quả
+theo trang hoặc dưới dạng file Arrow/Parquet. File kết quả bị xóa sau
+``JOBS_RESULT_TTL`` giây.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from loguru import logger
+
+from app.core.config import settings
+from app.services import tracing
+from app.services.streaming import COLUMNAR_SETTINGS
+
+if TYPE_CHECKING:
+    from app.services.clickhouse_client import ClickHouseClient
+
+Priority = Literal["high", "normal", "low"]
+PRIORITIES: Dict[str, int] = {"high": 0, "normal": 1, "low": 2}
+JobStatus = Literal["queued", "running", "done", "failed", "cancelled"]
+FINISHED = ("done", "failed", "cancelled")
+
+
+# Job chỉ chạy truy vấn đọc: kết quả được ghi ra file và không có bước làm mới
+# cache schema/kết quả như ``POST /sql``
+_READ_QUERY_RE = re.compile(r"^[\s(]*(SELECT|WITH)\b", re.IGNORECASE)
+
+
+class InvalidJobQueryError(ValueError):
+    """Câu lệnh gửi lên job không phải truy vấn ``SELECT``/``WITH``."""
+
+
+class JobQueueFullError(Exception):
+    """Hàng đợi job đã đầy."""
+
+
+class JobNotFoundError(Exception):
+    """Không có job với ID yêu cầu (hoặc job đã hết hạn)."""
+
+
+class JobNotReadyError(Exception):
+    """Job chưa chạy xong nên chưa có kết quả."""
+
+
+@dataclass
+class QueryJob:
+    """Trạng thái một job truy vấn."""
+
+    id: str
+    sql: str
+    parameters: Dict[str, Any]
+    priority: str
+    context: contextvars.Context
+    status: str = "queued"
+    query_id: str = ""
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    spilled_bytes: int = 0
+    result_rows: Optional[int] = None
+    error: Optional[str] = None
+    task: Optional["asyncio.Task[None]"] = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "spilled_bytes": self.spilled_bytes,
+            "result_rows": self.result_rows,
+            "error": self.error,
+        }
+
+
+class JobScheduler:
+    """Hàng đợi ưu tiên và worker chạy job truy vấn.
+
+    Job chạy trong context của request đã gửi nó nên hồ sơ giới hạn truy vấn
+    của request vẫn được áp dụng.
+    """
+
+    def __init__(
+        self,
+        ch: "ClickHouseClient",
+        max_concurrency: Optional[int] = None,
+        max_queued: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+        result_ttl: Optional[float] = None,
+    ):
+        self._ch = ch
+        self.max_concurrency = max(1, max_concurrency or settings.JOBS_MAX_CONCURRENCY)
+        self.max_queued = max_queued or settings.JOBS_MAX_QUEUED
+        self.spill_dir = spill_dir or settings.JOBS_SPILL_DIR
+        self.result_ttl = result_ttl if result_ttl is not None else settings.JOBS_RESULT_TTL
+        self._jobs: Dict[str, QueryJob] = {}
+        self._queue: List[Tuple[int, int, str]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._workers: List["asyncio.Task[None]"] = []
+        self._metrics: Dict[str, int] = {
+            "submitted": 0,
+            "done": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "expired": 0,
+        }
+
+    def _path(self, job_id: str, ext: str = "arrow") -> str:
+        return os.path.join(self.spill_dir, f"{job_id}.{ext}")
+
+    def _start_workers(self) -> None:
+        if self._workers:
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._wakeup = asyncio.Condition()
+        self._workers = [
+            asyncio.ensure_future(self._worker()) for _ in range(self.max_concurrency)
+        ]
+
+    async def submit(
+        self, sql: str, parameters: Optional[Dict[str, Any]] = None, priority: str = "normal"
+    ) -> QueryJob:
+        """Đưa truy vấn vào hàng đợi và trả về job mới."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        if not _READ_QUERY_RE.match(sql):
+            raise InvalidJobQueryError("Jobs only run SELECT queries")
+        self.expire()
+        queued = sum(1 for job in self._jobs.values() if job.status == "queued")
+        if queued >= self.max_queued:
+            raise JobQueueFullError(f"Hàng đợi job đầy ({self.max_queued} job)")
+        self._start_workers()
+        job = QueryJob(
+            id=uuid.uuid4().hex,
+            sql=sql.strip().rstrip(";"),
+            parameters=parameters or {},
+            priority=priority,
+            context=contextvars.copy_context(),
+        )
+        self._jobs[job.id] = job
+        heapq.heappush(self._queue, (PRIORITIES[priority], next(self._seq), job.id))
+        self._metrics["submitted"] += 1
+        async with self._wakeup:
+            self._wakeup.notify()
+        logger.info("Nhận job {} ({})", job.id, priority)
+        return job
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._wakeup:
+                await self._wakeup.wait_for(lambda: bool(self._queue))
+                _, _, job_id = heapq.heappop(self._queue)
+            job = self._jobs.get(job_id)
+            if job is None or job.status != "queued":
+                continue
+            # Task mới được tạo trong context của request đã gửi job
+            job.task = job.context.run(asyncio.ensure_future, self._execute(job))
+            # ``wait`` không ném lỗi/hủy của job ra worker
+            await asyncio.wait({job.task})
+
+    async def _execute(self, job: QueryJob) -> None:
+        job.status, job.started = "running", time.time()
+        # Chạy trong context của request gửi job nên query_id gắn với request đó
+        job.query_id = tracing.new_query_id()
+        path = self._path(job.id)
+        try:
+            with open(path, "wb") as f:
+                async for chunk in self._ch.stream_raw(
+                    job.sql,
+                    parameters=job.parameters,
+                    fmt="ArrowStream",
+                    settings=COLUMNAR_SETTINGS,
+                    query_id=job.query_id,
+                ):
+                    await asyncio.to_thread(f.write, chunk)
+                    job.spilled_bytes += len(chunk)
+            job.result_rows = await asyncio.to_thread(_count_rows, path)
+            job.status = "done"
+            logger.info("Job {} xong: {} dòng", job.id, job.result_rows)
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            _remove(path)
+            raise
+        except Exception as exc:
+            job.status, job.error = "failed", str(getattr(exc, "detail", exc))
+            _remove(path)
+            logger.warning("Job {} lỗi: {}", job.id, exc)
+        finally:
+            job.finished = time.time()
+            self._metrics[job.status] += 1
+
+    def get(self, job_id: str) -> QueryJob:
+        self.expire()
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFoundError(job_id)
+        return job
+
+    async def status(self, job_id: str) -> Dict[str, Any]:
+        """Trạng thái job, kèm tiến độ đọc của ClickHouse khi job đang chạy."""
+        job = self.get(job_id)
+        info = job.summary()
+        if job.status == "queued":
+            waiting = [
+                item[2]
+                for item in sorted(self._queue)
+                if self._jobs.get(item[2]) and self._jobs[item[2]].status == "queued"
+            ]
+            info["queue_position"] = waiting.index(job.id)
+        if job.status == "running":
+            info["progress"] = await self._progress(job)
+        if job.status == "done":
+            info["expires"] = job.finished + self.result_ttl
+        return info
+
+    async def _progress(self, job: QueryJob) -> Optional[Dict[str, Any]]:
+        try:
+            result = await self._ch.aquery(
+                "SELECT read_rows, read_bytes, total_rows_approx, elapsed "
+                "FROM system.processes WHERE query_id = {query_id:String}",
+                parameters={"query_id": job.query_id},
+            )
+        except Exception as exc:
+            logger.warning("Không đọc được tiến độ job {}: {}", job.id, exc)
+            return None
+        if not result.result_rows:
+            return None
+        read_rows, read_bytes, total_rows, elapsed = result.result_rows[0]
+        return {
+            "read_rows": read_rows,
+            "read_bytes": read_bytes,
+            "total_rows_approx": total_rows,
+            "elapsed": elapsed,
+            "percent": round(100 * read_rows / total_rows, 1) if total_rows else None,
+        }
+
+    def cancel(self, job_id: str) -> QueryJob:
+        """Hủy job đang chờ hoặc đang chạy; truy vấn đang chạy bị ``KILL QUERY``."""
+        job = self.get(job_id)
+        if job.status == "queued":
+            job.status, job.finished = "cancelled", time.time()
+            self._metrics["cancelled"] += 1
+        elif job.status == "running" and job.task is not None:
+            job.task.cancel()
+        logger.info("Hủy job {}", job_id)
+        return job
+
+    def result_path(self, job_id: str, fmt: str = "arrow") -> str:
+        """Đường dẫn file kết quả dạng ``arrow`` hoặc ``parquet`` (chuyển đổi khi cần)."""
+        job = self.get(job_id)
+        if job.status != "done":
+            raise JobNotReadyError(job.status)
+        path = self._path(job.id)
+        if fmt == "parquet":
+            parquet_path = self._path(job.id, "parquet")
+            if not os.path.exists(parquet_path):
+                pq.write_table(_read_table(path), parquet_path)
+            return parquet_path
+        return path
+
+    def page(self, job_id: str, offset: int, limit: int) -> Dict[str, Any]:
+        """Một trang kết quả dạng danh sách dict."""
+        table = _read_table(self.result_path(job_id))
+        rows = table.slice(offset, limit).to_pylist()
+        next_offset = offset + len(rows)
+        return {
+            "columns": table.column_names,
+            "rows": rows,
+            "offset": offset,
+            "next_offset": next_offset if next_offset < table.num_rows else None,
+            "total_rows": table.num_rows,
+        }
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        self.expire()
+        return [job.summary() for job in self._jobs.values()]
+
+    def expire(self) -> None:
+        """Xóa job đã xong quá ``result_ttl`` giây và file spill mồ côi."""
+        now = time.time()
+        for job in list(self._jobs.values()):
+            if job.status in FINISHED and job.finished and now - job.finished > self.result_ttl:
+                del self._jobs[job.id]
+                _remove(self._path(job.id))
+                _remove(self._path(job.id, "parquet"))
+                self._metrics["expired"] += 1
+        if not os.path.isdir(self.spill_dir):
+            return
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            job_id = name.split(".")[0]
+            try:
+                stale = now - os.path.getmtime(path) > self.result_ttl
+            except OSError:
+                continue
+            if job_id not in self._jobs and stale:
+                _remove(path)
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {**self._metrics, "jobs": counts, "max_concurrency": self.max_concurrency}
+
+    async def shutdown(self) -> None:
+        """Hủy các job đang chạy và dừng worker khi ứng dụng dừng."""
+        for job in self._jobs.values():
+            if job.status == "running" and job.task is not None:
+                job.task.cancel()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+def _read_table(path: str) -> pa.Table:
+    """Đọc file ArrowStream (memory map, không sao chép dữ liệu)."""
+    if os.path.getsize(path) == 0:
+        return pa.table({})
+    # Buffer của bảng giữ tham chiếu tới vùng nhớ map nên không đóng file ở đây
+    return ipc.open_stream(pa.memory_map(path)).read_all()
+
+
+def _count_rows(path: str) -> int:
+    return _read_table(path).num_rows
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,508 @@
+"""Cache kết quả truy vấn đọc, làm mới theo phiên bản bảng khi dịch vụ ghi dữ liệu.
+
+Khóa cache là SQL đã chuẩn hóa cùng tham số và hồ sơ giới hạn đang áp dụng.
+Mỗi mục lưu phiên bản của các bảng mà truy vấn đọc tới tại thời điểm bắt đầu
+truy vấn; mọi lệnh ghi đi qua ``ClickHouseClient`` tăng phiên bản bảng tương
+ứng nên mục cũ tự hết hiệu lực. Ghi từ bên ngoài dịch vụ chỉ được phản ánh sau
+``ttl`` giây.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from loguru import logger
+
+from app.core.config import settings
+from app.services.guardrails import profile_name
+from app.services.metrics import SERIALIZATION
+from app.services.streaming import json_default
+from app.services.tracing import add_phase, span
+
+_READ_TABLE_RE = re.compile(r"\b(?:FROM|JOIN)\s+([`\"\w.]+)", re.IGNORECASE)
+_WRITE_TABLE_RE = re.compile(
+    r"^\s*(?:INSERT\s+INTO\s+(?:TABLE\s+)?|ALTER\s+TABLE\s+|DELETE\s+FROM\s+|"
+    r"UPDATE\s+|OPTIMIZE\s+TABLE\s+|"
+    r"(?:CREATE|DROP|TRUNCATE)\s+(?:OR\s+REPLACE\s+)?(?:TEMPORARY\s+)?(?:TABLE\s+)?"
+    r"(?:IF\s+(?:NOT\s+)?EXISTS\s+)?)([`\"\w.]+)",
+    re.IGNORECASE,
+)
+_TABLE_PAIR_RE = re.compile(
+    r"^\s*(?:EXCHANGE\s+TABLES|RENAME\s+TABLE)\s+([`\"\w.]+)\s+(?:AND|TO)\s+([`\"\w.]+)",
+    re.IGNORECASE,
+)
+# Câu lệnh không thay đổi dữ liệu bảng
+_READ_ONLY_RE = re.compile(
+    r"^\s*(?:SELECT|WITH|SHOW|DESCRIBE|DESC|EXISTS|EXPLAIN|KILL|SET|USE)\b", re.IGNORECASE
+)
+
+
+def _table_name(raw: str) -> str:
+    return raw.replace("`", "").replace('"', "").split(".")[-1]
+
+
+def normalize_sql(sql: str) -> str:
+    """Bỏ khoảng trắng thừa và dấu ``;`` cuối để các câu SQL giống nhau cùng khóa."""
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+def cache_key(sql: str, parameters: Optional[Dict[str, Any]] = None, profile: str = "") -> str:
+    """Khóa cache từ SQL chuẩn hóa, tham số và tên hồ sơ giới hạn.
+
+    Hồ sơ có ``max_result_rows``/``result_overflow_mode=break``... có thể trả
+    về kết quả bị cắt, nên kết quả dưới hồ sơ khác nhau không dùng chung mục.
+    """
+    params = json.dumps(parameters or {}, sort_keys=True, default=str)
+    return hashlib.sha256(f"{normalize_sql(sql)}\0{params}\0{profile}".encode()).hexdigest()
+
+
+def read_tables(sql: str) -> FrozenSet[str]:
+    """Các bảng xuất hiện sau ``FROM``/``JOIN`` trong câu truy vấn đọc."""
+    return frozenset(_table_name(name) for name in _READ_TABLE_RE.findall(sql))
+
+
+def written_tables(sql: str) -> Optional[Set[str]]:
+    """Các bảng bị câu lệnh ghi tác động.
+
+    Trả về tập rỗng với câu lệnh chỉ đọc và ``None`` khi không xác định được
+    bảng (khi đó nên làm mới toàn bộ cache).
+    """
+    if _READ_ONLY_RE.match(sql):
+        return set()
+    pair = _TABLE_PAIR_RE.match(sql)
+    if pair:
+        return {_table_name(pair.group(1)), _table_name(pair.group(2))}
+    match = _WRITE_TABLE_RE.match(sql)
+    if match:
+        return {_table_name(match.group(1))}
+    return None
+
+
+@dataclass
+class CacheEntry:
+    """Kết quả đã mã hóa JSON cùng phiên bản các bảng tại thời điểm truy vấn."""
+
+    body: bytes
+    etag: str
+    expires: float
+    versions: Tuple[Tuple[str, int], ...]
+
+
+class MemoryTier:
+    """Tầng LRU trong bộ nhớ giới hạn theo tổng số byte."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: CacheEntry):
+        """Lưu mục mới; trả về danh sách mục bị đẩy ra để chuyển xuống tầng dưới."""
+        self.delete(key)
+        self._entries[key] = entry
+        self.bytes += len(entry.body)
+        evicted = []
+        while self.bytes > self.max_bytes and self._entries:
+            old_key, old = self._entries.popitem(last=False)
+            self.bytes -= len(old.body)
+            evicted.append((old_key, old))
+        return evicted
+
+    def delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry.body)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@dataclass
+class DiskRecord:
+    """Mục trên đĩa: metadata giữ trong bộ nhớ, thân JSON nằm ở ``path``."""
+
+    path: str
+    etag: str
+    expires: float
+    versions: Tuple[Tuple[str, int], ...]
+    size: int
+    ready: bool = False
+
+    def entry(self, body: bytes) -> CacheEntry:
+        return CacheEntry(body=body, etag=self.etag, expires=self.expires, versions=self.versions)
+
+
+class DiskTier:
+    """Tầng đĩa cục bộ nhận các mục bị đẩy ra khỏi bộ nhớ.
+
+    Thư mục được xóa khi khởi động vì phiên bản bảng chỉ tồn tại trong tiến
+    trình, mục của lần chạy trước không thể kiểm tra được nữa.
+
+    Lớp này chỉ giữ sổ sách (gọi dưới khóa của ``ResultCache``); đọc, ghi và
+    xóa file do ``ResultCache`` làm ngoài khóa, trong thread riêng. Mỗi lần ghi
+    dùng một file mới (ghi vào file tạm rồi ``os.replace``) và mục chỉ được
+    đọc sau khi ghi xong (``ready``), nên không ai đọc phải file đang ghi dở.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._records: "OrderedDict[str, DiskRecord]" = OrderedDict()
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+    def lookup(self, key: str) -> Optional[DiskRecord]:
+        record = self._records.get(key)
+        return record if record is not None and record.ready else None
+
+    def reserve(self, key: str, entry: CacheEntry) -> Tuple[DiskRecord, List[str]]:
+        """Ghi sổ mục mới; trả về mục và các file cần xóa (mục cũ, mục bị đẩy ra)."""
+        removed = [path for path in [self.delete(key)] if path]
+        record = DiskRecord(
+            path=os.path.join(self.directory, f"{key}-{uuid.uuid4().hex[:8]}.bin"),
+            etag=entry.etag,
+            expires=entry.expires,
+            versions=entry.versions,
+            size=len(entry.body),
+        )
+        self._records[key] = record
+        self.bytes += record.size
+        while self.bytes > self.max_bytes and self._records:
+            removed.append(self.delete(next(iter(self._records))))
+        return record, [path for path in removed if path]
+
+    def commit(self, key: str, record: DiskRecord) -> bool:
+        """Đánh dấu mục đã ghi xong; ``False`` nếu mục đã bị thay hoặc xóa trong lúc ghi."""
+        if self._records.get(key) is not record:
+            return False
+        record.ready = True
+        return True
+
+    def discard(self, key: str, record: DiskRecord) -> Optional[str]:
+        """Xóa ``key`` nếu vẫn là ``record`` (ví dụ khi đọc/ghi file lỗi)."""
+        return self.delete(key) if self._records.get(key) is record else None
+
+    def delete(self, key: str) -> Optional[str]:
+        """Bỏ ``key`` khỏi sổ sách; trả về file cần xóa."""
+        record = self._records.pop(key, None)
+        if record is None:
+            return None
+        self.bytes -= record.size
+        return record.path
+
+    def clear(self) -> List[str]:
+        paths = [record.path for record in self._records.values()]
+        self._records.clear()
+        self.bytes = 0
+        return paths
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_file(path: str, body: bytes) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(body)
+    os.replace(tmp, path)
+
+
+def _remove_files(paths: Iterable[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ResultCache:
+    """Cache kết quả đọc hai tầng (bộ nhớ, đĩa tùy chọn) với phiên bản theo bảng."""
+
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        max_entry_bytes: Optional[int] = None,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: Optional[int] = None,
+        endpoints: Optional[str] = None,
+    ):
+        self.ttl = ttl if ttl is not None else settings.RESULT_CACHE_TTL
+        self.max_entry_bytes = max_entry_bytes or settings.RESULT_CACHE_MAX_ENTRY_BYTES
+        self.memory = MemoryTier(max_bytes or settings.RESULT_CACHE_MAX_BYTES)
+        disk_dir = disk_dir if disk_dir is not None else settings.RESULT_CACHE_DISK_DIR
+        self.disk = (
+            DiskTier(disk_dir, disk_max_bytes or settings.RESULT_CACHE_DISK_MAX_BYTES)
+            if disk_dir
+            else None
+        )
+        spec = endpoints if endpoints is not None else settings.RESULT_CACHE_ENDPOINTS
+        self.endpoints = {name.strip() for name in spec.split(",") if name.strip()}
+        self._versions: Dict[str, int] = {}
+        self._global_version = 0
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, int] = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "expired": 0,
+            "stores": 0,
+            "too_large": 0,
+            "not_modified": 0,
+            "invalidations": 0,
+        }
+
+    def enabled_for(self, endpoint: str) -> bool:
+        """Endpoint có bật cache hay không (``*`` bật cho mọi endpoint)."""
+        return endpoint in self.endpoints or "*" in self.endpoints
+
+    def snapshot(self, tables: FrozenSet[str]) -> Tuple[Tuple[str, int], ...]:
+        """Phiên bản hiện tại của các bảng; chụp trước khi chạy truy vấn."""
+        with self._lock:
+            versions = [("*", self._global_version)]
+            versions += [(t, self._versions.get(t, 0)) for t in sorted(tables)]
+            return tuple(versions)
+
+    def _valid(self, entry: CacheEntry) -> bool:
+        current = dict(self.snapshot(frozenset(t for t, _ in entry.versions if t != "*")))
+        return all(current[t] == v for t, v in entry.versions)
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        """Mục còn hiệu lực của ``key`` hoặc ``None``."""
+        record = None
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is None and self.disk is not None:
+                record = self.disk.lookup(key)
+        if record is not None:
+            # Đọc file ngoài khóa và ngoài event loop
+            try:
+                entry = record.entry(await asyncio.to_thread(_read_file, record.path))
+            except OSError as exc:
+                logger.warning("Không đọc được mục cache trên đĩa {}: {}", record.path, exc)
+                with self._lock:
+                    path = self.disk.discard(key, record)
+                await self._remove([path] if path else [])
+                entry = None
+        if entry is None:
+            self._count("misses")
+            return None
+        if entry.expires < time.time():
+            await self._drop(key)
+            self._count("expired")
+            self._count("misses")
+            return None
+        if not self._valid(entry):
+            await self._drop(key)
+            self._count("stale")
+            self._count("misses")
+            return None
+        if record is not None:
+            self._count("disk_hits")
+            await self._store(key, entry)
+        self._count("hits")
+        return entry
+
+    async def set(
+        self, key: str, body: bytes, versions: Tuple[Tuple[str, int], ...]
+    ) -> CacheEntry:
+        """Lưu kết quả đã mã hóa; mục lớn hơn ``max_entry_bytes`` không được lưu."""
+        entry = CacheEntry(
+            body=body,
+            etag=f'"{hashlib.sha1(body).hexdigest()}"',
+            expires=time.time() + self.ttl,
+            versions=versions,
+        )
+        if len(body) > self.max_entry_bytes:
+            self._count("too_large")
+            return entry
+        self._count("stores")
+        await self._store(key, entry)
+        return entry
+
+    async def _store(self, key: str, entry: CacheEntry) -> None:
+        writes: List[Tuple[str, DiskRecord, bytes]] = []
+        removed: List[str] = []
+        with self._lock:
+            evicted = self.memory.set(key, entry)
+            if self.disk is not None:
+                path = self.disk.delete(key)
+                removed += [path] if path else []
+                for old_key, old in evicted:
+                    record, paths = self.disk.reserve(old_key, old)
+                    writes.append((old_key, record, old.body))
+                    removed += paths
+        if writes or removed:
+            await asyncio.to_thread(self._write_disk, writes, removed)
+
+    def _write_disk(self, writes: List[Tuple[str, DiskRecord, bytes]], removed: List[str]) -> None:
+        """Ghi các mục bị đẩy xuống đĩa (chạy trong thread, chỉ giữ khóa khi ghi sổ)."""
+        _remove_files(removed)
+        for key, record, body in writes:
+            try:
+                _write_file(record.path, body)
+            except OSError as exc:
+                logger.warning("Không ghi được mục cache xuống đĩa {}: {}", record.path, exc)
+                with self._lock:
+                    self.disk.discard(key, record)
+                _remove_files([record.path, f"{record.path}.tmp"])
+                continue
+            with self._lock:
+                current = self.disk.commit(key, record)
+            if not current:
+                # Mục đã bị thay hoặc xóa trong lúc ghi
+                _remove_files([record.path])
+
+    async def _remove(self, paths: List[str]) -> None:
+        if paths:
+            await asyncio.to_thread(_remove_files, paths)
+
+    async def _drop(self, key: str) -> None:
+        with self._lock:
+            self.memory.delete(key)
+            path = self.disk.delete(key) if self.disk is not None else None
+        await self._remove([path] if path else [])
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._metrics[name] += 1
+
+    def invalidate_table(self, table: Optional[str] = None) -> None:
+        """Tăng phiên bản một bảng (hoặc mọi bảng) để mục cache liên quan hết hiệu lực."""
+        with self._lock:
+            if table is None:
+                self._global_version += 1
+            else:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            self._metrics["invalidations"] += 1
+        logger.debug("Làm mới cache kết quả cho {}", table or "tất cả bảng")
+
+    def invalidate_for_sql(self, sql: str) -> None:
+        """Làm mới cache theo các bảng mà câu lệnh ghi tác động."""
+        tables = written_tables(sql)
+        if tables is None:
+            self.invalidate_table(None)
+            return
+        for table in tables:
+            self.invalidate_table(table)
+
+    async def clear(self) -> None:
+        """Xóa toàn bộ mục trong cache."""
+        with self._lock:
+            self.memory.clear()
+            paths = self.disk.clear() if self.disk is not None else []
+        await self._remove(paths)
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê hit/miss và dung lượng các tầng cache."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            lookups = metrics["hits"] + metrics["misses"]
+            return {
+                **metrics,
+                "hit_rate": metrics["hits"] / lookups if lookups else 0.0,
+                "entries": len(self.memory),
+                "bytes": self.memory.bytes,
+                "max_bytes": self.memory.max_bytes,
+                "disk_entries": len(self.disk) if self.disk is not None else 0,
+                "disk_bytes": self.disk.bytes if self.disk is not None else 0,
+                "ttl": self.ttl,
+                "endpoints": sorted(self.endpoints),
+            }
+
+
+def _encode(body: Any) -> bytes:
+    started = time.perf_counter()
+    encoded = json.dumps(
+        jsonable_encoder(body), default=json_default, ensure_ascii=False
+    ).encode()
+    elapsed = time.perf_counter() - started
+    SERIALIZATION.observe(elapsed, "json")
+    add_phase("encode", elapsed)
+    return encoded
+
+
+def _response(request: Request, entry: CacheEntry, cache: ResultCache, status: str) -> Response:
+    max_age = max(0, int(entry.expires - time.time()))
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"private, max-age={max_age}",
+        "X-Cache": status,
+    }
+    if entry.etag in request.headers.get("if-none-match", ""):
+        cache._count("not_modified")
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+async def cached_query(
+    ch,
+    request: Request,
+    endpoint: str,
+    sql: str,
+    parameters: Dict[str, Any],
+    build: Callable[[Any], Any],
+    fetch: Optional[Callable[[], Awaitable[Any]]] = None,
+    tables: Iterable[str] = (),
+) -> Any:
+    """Chạy ``sql`` qua cache kết quả nếu ``endpoint`` bật cache.
+
+    ``build`` chuyển ``QueryResult`` thành dữ liệu trả về (có thể ném
+    ``HTTPException``, khi đó không có gì được lưu). Khi cache tắt hàm trả
+    về đúng dữ liệu của ``build``; khi bật trả về ``Response`` JSON kèm
+    ``ETag``/``Cache-Control`` và hỗ trợ ``If-None-Match`` (304). Header
+    ``Cache-Control: no-cache`` bỏ qua mục đang có và truy vấn lại.
+
+    ``fetch`` thay cho ``ch.aquery(sql, parameters)`` khi dữ liệu được đọc theo
+    cách khác (ví dụ qua ``BatchLoader``); ``sql`` vẫn dùng làm khóa cache.
+    ``tables`` là các bảng mà kết quả phụ thuộc nhưng không có trong ``sql``
+    (bảng nguồn của rollup, của dictionary...); ghi vào chúng cũng làm mục
+    cache hết hiệu lực.
+    """
+    cache: ResultCache = ch.result_cache
+    if fetch is None:
+        fetch = partial(ch.aquery, sql, parameters=parameters)
+    if not cache.enabled_for(endpoint):
+        result = await fetch()
+        with span("build"):
+            return build(result)
+    key = cache_key(sql, parameters, profile_name())
+    if "no-cache" not in request.headers.get("cache-control", ""):
+        entry = await cache.get(key)
+        if entry is not None:
+            return _response(request, entry, cache, "HIT")
+    versions = cache.snapshot(read_tables(sql) | frozenset(tables))
+    result = await fetch()
+    with span("build"):
+        body = build(result)
+    entry = await cache.set(key, _encode(body), versions)
+    return _response(request, entry, cache, "MISS")
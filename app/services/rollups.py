@@ -0,0 +1,317 @@
+"""Bảng tổng hợp sẵn (rollup) cho các truy vấn ``aggregate``/``group_by``.
+
+Mỗi rollup khai báo trong ``ROLLUPS`` gồm bảng nguồn, các chiều (cột hoặc biểu
+thức có bí danh, ví dụ ``day=toDate(order_date)``) và các phép tổng hợp
+(``sum:total``, ``count:order_id``...). Khi khởi động, ``create_all`` tạo bảng
+``AggregatingMergeTree`` lưu trạng thái tổng hợp (``sumState``...) cùng một
+materialized view ghi tiếp mọi lô chèn mới vào bảng đó, rồi nạp dữ liệu cũ
+nếu bảng rollup vừa được tạo.
+
+``route`` viết lại truy vấn ``aggregate=func:col,...&group_by=...`` của
+``/crud/{table}`` sang bảng rollup bằng tổ hợp ``-Merge`` khi các phép tổng
+hợp, các cột ``group_by`` và cột lọc đều nằm trong rollup. ``group_by`` có thể
+dùng bí danh của chiều biểu thức (``group_by=day``). Materialized view chỉ
+thấy dòng mới chèn, không thấy việc ghi đè phiên bản cũ của bảng
+``ReplacingMergeTree``, nên với bảng phiên bản, rollup chỉ được dùng khi khai
+báo ``append_only`` (bảng chỉ chèn, không cập nhật/xóa).
+
+Khi tạo hoặc nạp lại rollup của bảng phiên bản, materialized view chỉ nhận
+dòng có ``_version`` lớn hơn một mốc ``W`` hơi ở tương lai, còn phần nạp dữ
+liệu cũ chạy sau khi qua ``W`` và chỉ đọc dòng ``_version <= W``, nên không
+dòng nào được đếm hai lần. Bảng không có ``_version`` không có mốc như vậy:
+phải dừng ghi vào bảng nguồn trong lúc tạo/nạp lại rollup.
+"""
+
+import re
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.versioning import DELETED_COLUMN, VERSION_COLUMN, is_versioned, next_version
+
+if TYPE_CHECKING:
+    from app.services.clickhouse_client import ClickHouseClient
+
+# Phép tổng hợp có trạng thái gộp được (``-State``/``-Merge``)
+ROLLUP_FUNCTIONS = ("sum", "count", "avg", "min", "max", "uniq")
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class RollupNotFoundError(Exception):
+    """Không có rollup với tên yêu cầu."""
+
+
+def _identifier(name: str, what: str) -> str:
+    if not _IDENTIFIER_RE.match(name):
+        raise ValueError(f"Invalid rollup {what}: {name!r}")
+    return name
+
+
+@dataclass
+class Rollup:
+    """Khai báo một rollup: bảng nguồn, chiều và phép tổng hợp."""
+
+    name: str
+    table: str
+    dimensions: Dict[str, str]
+    measures: List[Tuple[str, str]]
+    append_only: bool = False
+    ready: bool = field(default=False, compare=False)
+    routed: int = field(default=0, compare=False)
+
+    @classmethod
+    def parse(cls, name: str, spec: Dict[str, Any]) -> "Rollup":
+        """Đọc khai báo dạng ``{"table", "dimensions", "measures", "append_only"}``."""
+        dimensions: Dict[str, str] = {}
+        for item in spec.get("dimensions", []):
+            alias, _, expr = item.partition("=")
+            alias = _identifier(alias.strip(), "dimension")
+            dimensions[alias] = expr.strip() or alias
+        measures: List[Tuple[str, str]] = []
+        for item in spec.get("measures", []):
+            func, _, col = item.partition(":")
+            func = func.strip().lower()
+            if func not in ROLLUP_FUNCTIONS:
+                raise ValueError(f"Unsupported rollup function: {func}")
+            measures.append((func, _identifier(col.strip(), "column")))
+        if not measures:
+            raise ValueError(f"Rollup {name} has no measures")
+        return cls(
+            name=_identifier(name, "name"),
+            table=_identifier(spec["table"], "table"),
+            dimensions=dimensions,
+            measures=measures,
+            append_only=bool(spec.get("append_only", False)),
+        )
+
+    @property
+    def view(self) -> str:
+        return f"{self.name}_mv"
+
+    @staticmethod
+    def state_column(func: str, col: str) -> str:
+        return f"{func}_{col}_state"
+
+    def select_sql(
+        self, versioned: bool, final: bool = False, condition: Optional[str] = None
+    ) -> str:
+        """``SELECT`` tính trạng thái tổng hợp từ bảng nguồn theo các chiều."""
+        columns = [f"{expr} AS {alias}" for alias, expr in self.dimensions.items()]
+        columns += [
+            f"{func}State({col}) AS {self.state_column(func, col)}"
+            for func, col in self.measures
+        ]
+        sql = f"SELECT {', '.join(columns)} FROM {self.table}"
+        conditions = [condition] if condition else []
+        if versioned:
+            sql += " FINAL" if final else ""
+            conditions.insert(0, f"{DELETED_COLUMN} = 0")
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        if self.dimensions:
+            sql += f" GROUP BY {', '.join(self.dimensions)}"
+        return sql
+
+    def order_by(self) -> str:
+        return f"({', '.join(self.dimensions)})" if self.dimensions else "tuple()"
+
+
+def parse_rollups(specs: Dict[str, Dict[str, Any]]) -> Dict[str, Rollup]:
+    return {name: Rollup.parse(name, spec) for name, spec in specs.items()}
+
+
+class RollupManager:
+    """Tạo, nạp lại và chọn rollup cho truy vấn tổng hợp."""
+
+    def __init__(
+        self,
+        ch: "ClickHouseClient",
+        rollups: Optional[Dict[str, Dict[str, Any]]] = None,
+        watermark_delay: Optional[float] = None,
+    ):
+        self._ch = ch
+        self.rollups = parse_rollups(rollups if rollups is not None else settings.ROLLUPS)
+        self.watermark_delay = (
+            watermark_delay if watermark_delay is not None else settings.ROLLUP_WATERMARK_DELAY
+        )
+
+    def get(self, name: str) -> Rollup:
+        rollup = self.rollups.get(name)
+        if rollup is None:
+            raise RollupNotFoundError(name)
+        return rollup
+
+    def _versioned(self, rollup: Rollup) -> bool:
+        schema = dict(self._ch.get_table_schema(rollup.table))
+        return is_versioned(schema)
+
+    def create_all(self) -> None:
+        """Tạo bảng rollup và materialized view còn thiếu, nạp dữ liệu cho bảng mới."""
+        for rollup in self.rollups.values():
+            versioned = self._versioned(rollup)
+            if versioned and not rollup.append_only:
+                logger.warning(
+                    "Bỏ qua rollup {}: bảng {} có phiên bản nhưng không khai báo append_only",
+                    rollup.name,
+                    rollup.table,
+                )
+                continue
+            existed = bool(int(self._ch.command(f"EXISTS TABLE {rollup.name}")))
+            # Bảng rỗng có đúng kiểu AggregateFunction suy ra từ câu SELECT
+            self._ch.command(
+                f"CREATE TABLE IF NOT EXISTS {rollup.name} "
+                f"ENGINE = AggregatingMergeTree ORDER BY {rollup.order_by()} "
+                f"AS {rollup.select_sql(versioned)} LIMIT 0"
+            )
+            if existed:
+                self._create_view(rollup, versioned, None)
+            else:
+                self._fill(rollup, versioned)
+            rollup.ready = True
+            logger.info("Rollup {} sẵn sàng cho bảng {}", rollup.name, rollup.table)
+
+    def _watermark(self, rollup: Rollup, versioned: bool) -> Optional[int]:
+        """Mốc ``_version`` chia dòng giữa materialized view và phần nạp dữ liệu cũ.
+
+        Mốc ở tương lai ``watermark_delay`` giây: mọi dòng có ``_version`` lớn hơn
+        được ghi sau khi view đã tồn tại.
+        """
+        if not versioned:
+            logger.warning(
+                "Rollup {}: bảng {} không có {}, cần dừng ghi trong lúc nạp rollup "
+                "để tránh đếm trùng",
+                rollup.name,
+                rollup.table,
+                VERSION_COLUMN,
+            )
+            return None
+        return next_version() + int(self.watermark_delay * 1e9)
+
+    def _create_view(self, rollup: Rollup, versioned: bool, watermark: Optional[int]) -> None:
+        condition = f"{VERSION_COLUMN} > {watermark}" if watermark is not None else None
+        self._ch.command(
+            f"CREATE MATERIALIZED VIEW IF NOT EXISTS {rollup.view} TO {rollup.name} "
+            f"AS {rollup.select_sql(versioned, condition=condition)}"
+        )
+
+    def _fill(self, rollup: Rollup, versioned: bool) -> None:
+        """Tạo view rồi nạp dữ liệu cũ, chia dòng theo mốc ``_version``."""
+        watermark = self._watermark(rollup, versioned)
+        self._create_view(rollup, versioned, watermark)
+        condition = None
+        if watermark is not None:
+            # Chờ qua mốc để mọi dòng ``_version <= W`` đã được ghi trước khi nạp
+            time.sleep(max(0.0, (watermark - time.time_ns()) / 1e9))
+            condition = f"{VERSION_COLUMN} <= {watermark}"
+        self._ch.command(
+            f"INSERT INTO {rollup.name} "
+            f"{rollup.select_sql(versioned, final=True, condition=condition)}"
+        )
+
+    def rebuild(self, name: str) -> None:
+        """Xóa và tính lại toàn bộ rollup từ bảng nguồn.
+
+        View được tạo lại cùng mốc mới để không đếm trùng dòng ghi trong lúc nạp.
+        Trong lúc xóa và nạp lại (hoặc nếu nạp lỗi) rollup chỉ chứa một phần dữ
+        liệu nên ``route`` không dùng nó, truy vấn đọc bảng gốc.
+        """
+        rollup = self.get(name)
+        versioned = self._versioned(rollup)
+        rollup.ready = False
+        self._ch.command(f"DROP VIEW IF EXISTS {rollup.view}")
+        self._ch.command(f"TRUNCATE TABLE {rollup.name}")
+        self._fill(rollup, versioned)
+        rollup.ready = True
+        logger.info("Đã nạp lại rollup {}", name)
+
+    def expressions(self, table: str) -> Dict[str, str]:
+        """Chiều dạng biểu thức (bí danh -> biểu thức) của các rollup trên ``table``.
+
+        ``group_by`` được dùng các bí danh này như cột: trên bảng gốc chúng được
+        tính lại bằng biểu thức, trên rollup chúng là cột có sẵn.
+        """
+        result: Dict[str, str] = {}
+        for rollup in self.rollups.values():
+            if rollup.table != table:
+                continue
+            for alias, expr in rollup.dimensions.items():
+                if alias != expr:
+                    result.setdefault(alias, expr)
+        return result
+
+    def route(
+        self,
+        table: str,
+        aggregates: List[Tuple[str, str]],
+        group_cols: List[str],
+        filter_cols: List[str],
+        expressions: Optional[Dict[str, str]] = None,
+    ) -> Optional[Tuple[str, List[str]]]:
+        """Bảng rollup và các biểu thức ``-Merge`` thay cho ``aggregates``.
+
+        Trả về ``None`` nếu phải đọc bảng gốc. Chỉ rollup đã được
+        ``create_all`` tạo (``ready``) và chứa mọi phép tổng hợp, mọi cột
+        ``group_by`` và mọi cột lọc mới được dùng. ``expressions`` cho biểu
+        thức của các cột ``group_by`` là bí danh (xem ``expressions``), các cột
+        còn lại là cột gốc; chiều của rollup phải có đúng biểu thức đó.
+
+        Biểu thức có cùng bí danh với truy vấn gốc (``<func>_<col>``) và các
+        chiều giữ nguyên tên, nên điều kiện lọc, ``HAVING`` và ``ORDER BY``
+        của truy vấn gốc dùng lại được trên bảng rollup.
+        """
+        expressions = expressions or {}
+        measures = [(func.lower(), col) for func, col in aggregates]
+        if not measures or any(func not in ROLLUP_FUNCTIONS for func, _ in measures):
+            return None
+        for rollup in self.rollups.values():
+            if not rollup.ready or rollup.table != table:
+                continue
+            if not set(measures) <= set(rollup.measures):
+                continue
+            dims = rollup.dimensions
+            if any(dims.get(col) != expressions.get(col, col) for col in group_cols):
+                continue
+            # Điều kiện lọc viết trên cột gốc nên chỉ áp được cho chiều là cột gốc
+            if any(dims.get(col) != col for col in filter_cols):
+                continue
+            rollup.routed += 1
+            logger.debug("Dùng rollup {} cho {} trên {}", rollup.name, measures, table)
+            return rollup.name, [
+                f"{func}Merge({rollup.state_column(func, col)}) AS {func}_{col}"
+                for func, col in measures
+            ]
+        return None
+
+    async def stats(self) -> List[Dict[str, Any]]:
+        """Số dòng bảng nguồn và bảng rollup (số dòng phải quét trước/sau) của mỗi rollup."""
+        if not self.rollups:
+            return []
+        names = sorted({r.table for r in self.rollups.values()} | set(self.rollups))
+        result = await self._ch.aquery(
+            "SELECT name, total_rows FROM system.tables "
+            "WHERE database = currentDatabase() AND name IN {names:Array(String)}",
+            parameters={"names": names},
+        )
+        rows = {name: total or 0 for name, total in result.result_rows}
+        stats = []
+        for rollup in self.rollups.values():
+            source_rows = rows.get(rollup.table, 0)
+            rollup_rows = rows.get(rollup.name, 0)
+            stats.append(
+                {
+                    "name": rollup.name,
+                    "table": rollup.table,
+                    "dimensions": list(rollup.dimensions),
+                    "measures": [f"{func}:{col}" for func, col in rollup.measures],
+                    "append_only": rollup.append_only,
+                    "ready": rollup.ready,
+                    "source_rows": source_rows,
+                    "rollup_rows": rollup_rows,
+                    "reduction": round(source_rows / rollup_rows, 1) if rollup_rows else None,
+                    "routed_queries": rollup.routed,
+                }
+            )
+        return stats
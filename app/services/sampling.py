@@ -0,0 +1,97 @@
+"""Tổng hợp xấp xỉ (``approx=true``) cho ``GET /crud/{table}``.
+
+Phép tổng hợp chính xác được thay bằng hàm xấp xỉ rẻ hơn (``uniqExact`` ->
+``uniq``, phân vị -> ``quantileTDigest``). Với bảng có ``SAMPLE BY``, truy vấn
+chỉ đọc một phần dữ liệu (``SAMPLE <tỷ lệ>``); ``sum``/``count`` được nhân với
+``_sample_factor`` để ước lượng cho toàn bảng, ``uniq`` chỉ được nhân khi cột
+đếm chính là cột của khóa lấy mẫu (mỗi giá trị rơi trọn vào mẫu hoặc không).
+
+Sai số trả về là sai số tương đối của ước lượng số dòng với độ tin cậy 95%,
+tính từ số dòng thực sự đọc được trong mỗi nhóm: ``1.96 * sqrt((1 - k) / n)``.
+"""
+
+import math
+import re
+from typing import Optional
+
+from app.services.query_dsl import AGGREGATE_FUNCTIONS, Aggregate, QueryDSLError
+
+# Hàm xấp xỉ thay cho hàm chính xác tương ứng
+APPROX_FUNCTIONS = {
+    "uniqexact": "uniq",
+    "median": "quantileTDigest(0.5)",
+    "p50": "quantileTDigest(0.5)",
+    "p90": "quantileTDigest(0.9)",
+    "p95": "quantileTDigest(0.95)",
+    "p99": "quantileTDigest(0.99)",
+}
+# Phép tổng hợp cộng dồn theo dòng, cần nhân hệ số mẫu
+_ADDITIVE = {"sum", "count"}
+_DISTINCT = {"uniq", "uniqexact"}
+SAMPLE_FACTOR_COLUMN = "_sample_factor"
+# Cột ẩn đếm số dòng đã đọc của mỗi nhóm, dùng để ước lượng sai số
+SAMPLED_ROWS_ALIAS = "__sampled_rows"
+CONFIDENCE = 0.95
+_Z = 1.96
+MIN_SAMPLE_RATIO = 0.000001
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def sample_key(column: str) -> str:
+    """Biểu thức ``SAMPLE BY`` cho khóa số nguyên ``column``.
+
+    Băm để mẫu trải đều trên toàn bộ miền giá trị thay vì chỉ lấy các khóa nhỏ.
+    """
+    return f"intHash64({column})"
+
+
+def sampled_order_by(column: str, bucket: int) -> str:
+    """Sorting key của bảng lấy mẫu theo khóa số nguyên ``column``.
+
+    ``SAMPLE`` chỉ bỏ qua được granule khi khóa lấy mẫu đứng gần đầu sorting
+    key. Dòng được chia thành các khoảng ``bucket`` khóa liên tiếp và sắp theo
+    hash trong mỗi khoảng, nên đọc mẫu chỉ đọc phần đầu của mỗi khoảng, còn
+    truy vấn theo khóa vẫn lọc được theo khoảng (``intDiv`` đơn điệu).
+    """
+    return f"(intDiv({column}, {bucket}), {sample_key(column)}, {column})"
+
+
+def parse_ratio(raw: Optional[str], default: float) -> float:
+    """Tỷ lệ mẫu từ tham số ``sample`` (``0 < k <= 1``)."""
+    try:
+        ratio = float(raw) if raw is not None else default
+    except ValueError:
+        raise QueryDSLError("Invalid sample ratio")
+    if not MIN_SAMPLE_RATIO <= ratio <= 1:
+        raise QueryDSLError(f"sample must be between {MIN_SAMPLE_RATIO:f} and 1")
+    return ratio
+
+
+def sample_clause(ratio: float) -> str:
+    """Mệnh đề ``SAMPLE`` dạng số thập phân (ClickHouse không nhận dạng ``1e-05``)."""
+    return f"SAMPLE {f'{ratio:.6f}'.rstrip('0').rstrip('.')}"
+
+
+def _references(expr: str, column: str) -> bool:
+    return column in _IDENTIFIER_RE.findall(expr)
+
+
+def approx_expr(aggregate: Aggregate, sampling_key: Optional[str] = None) -> str:
+    """Biểu thức xấp xỉ của ``aggregate``; ``sampling_key`` khác rỗng khi đọc ``SAMPLE``."""
+    func = APPROX_FUNCTIONS.get(aggregate.func, AGGREGATE_FUNCTIONS[aggregate.func])
+    expr = f"{func}({aggregate.column})"
+    if sampling_key and (
+        aggregate.func in _ADDITIVE
+        or (aggregate.func in _DISTINCT and _references(sampling_key, aggregate.column))
+    ):
+        expr += f" * any({SAMPLE_FACTOR_COLUMN})"
+    return expr
+
+
+def relative_error(sampled_rows: int, ratio: float) -> Optional[float]:
+    """Sai số tương đối (độ tin cậy 95%) của ước lượng từ ``sampled_rows`` dòng mẫu."""
+    if ratio >= 1:
+        return 0.0
+    if not sampled_rows:
+        return None
+    return round(_Z * math.sqrt((1 - ratio) / sampled_rows), 6)
@@ -0,0 +1,95 @@
+"""Bộ nhớ đệm metadata bảng (schema, sorting key) dùng chung trong tiến trình."""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+_DDL_RE = re.compile(r"^\s*(ALTER|CREATE|DROP|RENAME|TRUNCATE)\b", re.IGNORECASE)
+_DDL_TABLE_RE = re.compile(
+    r"^\s*(?:ALTER|CREATE|DROP|TRUNCATE)\s+(?:OR\s+REPLACE\s+)?(?:TEMPORARY\s+)?TABLE\s+"
+    r"(?:IF\s+(?:NOT\s+)?EXISTS\s+)?([`\"\w.]+)",
+    re.IGNORECASE,
+)
+
+
+def is_ddl(sql: str) -> bool:
+    """Kiểm tra câu lệnh có phải DDL làm thay đổi schema hay không."""
+    return bool(_DDL_RE.match(sql))
+
+
+def ddl_table(sql: str) -> Optional[str]:
+    """Lấy tên bảng bị tác động bởi câu lệnh DDL, ``None`` nếu không xác định được."""
+    match = _DDL_TABLE_RE.match(sql)
+    if not match:
+        return None
+    name = match.group(1).replace("`", "").replace('"', "")
+    return name.split(".")[-1]
+
+
+class SchemaCache:
+    """Cache metadata của bảng (schema, sorting key...) với TTL và loại bỏ LRU."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, table: str) -> Optional[Any]:
+        """Trả về giá trị còn hạn của bảng hoặc ``None`` nếu chưa có/đã hết hạn."""
+        with self._lock:
+            entry = self._entries.get(table)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[table]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(table)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, table: str, value: Any) -> None:
+        """Lưu giá trị của bảng, loại bỏ bảng ít dùng nhất khi vượt giới hạn."""
+        with self._lock:
+            self._entries[table] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(table)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, table: Optional[str] = None) -> None:
+        """Xóa cache của một bảng, hoặc toàn bộ cache nếu không truyền ``table``."""
+        with self._lock:
+            if table is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(table, None)
+        logger.debug("Làm mới cache metadata cho {}", table or "tất cả bảng")
+
+    def invalidate_for_sql(self, sql: str) -> bool:
+        """Làm mới cache nếu ``sql`` là câu lệnh DDL. Trả về ``True`` nếu đã làm mới."""
+        if not is_ddl(sql):
+            return False
+        self.invalidate(ddl_table(sql))
+        return True
+
+    def stats(self) -> Dict[str, float]:
+        """Thống kê hit/miss của cache."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
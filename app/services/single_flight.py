@@ -0,0 +1,76 @@
+"""Gộp các lời gọi giống nhau đang chạy đồng thời thành một (single-flight)."""
+
+import asyncio
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Flight:
+    """Một lời gọi đang chạy cùng số request đang chờ kết quả của nó."""
+
+    def __init__(self, task: "asyncio.Future[Any]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Chia sẻ một lần thực thi cho mọi lời gọi cùng khóa đang chờ.
+
+    Lời gọi đầu tiên của một khóa chạy ``func`` trong task riêng, các lời gọi
+    tới sau khi task chưa xong chỉ chờ kết quả của task đó. Lỗi được ném lại
+    cho tất cả người chờ và không được giữ lại: lời gọi kế tiếp sẽ chạy lại.
+    Một người chờ bị hủy không ảnh hưởng tới những người còn lại; khi người
+    chờ cuối cùng bỏ đi, task bị hủy để ``func`` tự dọn dẹp (ví dụ
+    ``KILL QUERY``).
+
+    Lớp này chỉ dùng trong một event loop nên không cần khóa.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._metrics: Dict[str, int] = {
+            "leaders": 0,
+            "collapsed": 0,
+            "errors": 0,
+            "abandoned": 0,
+        }
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Chạy ``func`` hoặc chờ lần chạy đang diễn ra cùng ``key``."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(partial(self._done, key, flight))
+            self._metrics["leaders"] += 1
+        else:
+            self._metrics["collapsed"] += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self._abandon(key, flight)
+
+    def _abandon(self, key: Hashable, flight: _Flight) -> None:
+        """Không còn ai chờ: hủy task và giải phóng khóa."""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        flight.task.cancel()
+        self._metrics["abandoned"] += 1
+
+    def _done(self, key: Hashable, flight: _Flight, task: "asyncio.Future[Any]") -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not task.cancelled() and task.exception() is not None:
+            self._metrics["errors"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Số lời gọi thực chạy, số lời gọi được gộp và số lời gọi đang chạy."""
+        calls = self._metrics["leaders"] + self._metrics["collapsed"]
+        return {
+            **self._metrics,
+            "in_flight": len(self._flights),
+            "collapse_rate": self._metrics["collapsed"] / calls if calls else 0.0,
+        }
@@ -0,0 +1,143 @@
+"""Tiện ích trả dữ liệu ClickHouse dạng stream (NDJSON, mảng JSON, Arrow...)."""
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from time import perf_counter
+from typing import Any, AsyncIterator, List, Optional, Sequence, Tuple
+
+from fastapi.responses import StreamingResponse
+
+from app.services.metrics import SERIALIZATION
+from app.services.tracing import add_phase
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Media type được hỗ trợ -> định dạng output của ClickHouse
+COLUMNAR_FORMATS = {
+    "application/vnd.apache.arrow.stream": "ArrowStream",
+    "application/x-parquet": "Parquet",
+    "application/vnd.apache.parquet": "Parquet",
+    "text/csv": "CSVWithNames",
+}
+
+# Setting để ClickHouse trả String dạng utf8 thay vì binary trong Arrow/Parquet
+COLUMNAR_SETTINGS = {
+    "output_format_arrow_string_as_string": 1,
+    "output_format_parquet_string_as_string": 1,
+}
+
+
+def json_default(value: Any) -> Any:
+    """Chuyển các kiểu dữ liệu ClickHouse không chuẩn JSON sang dạng tương thích."""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode(errors="replace")
+    return str(value)
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, default=json_default, ensure_ascii=False)
+
+
+def _encode_rows(
+    block: Sequence[Sequence[Any]], columns: Optional[List[str]], fmt: str = "json"
+) -> List[str]:
+    started = perf_counter()
+    if columns:
+        encoded = [_dumps(dict(zip(columns, row))) for row in block]
+    else:
+        encoded = [_dumps(list(row)) for row in block]
+    elapsed = perf_counter() - started
+    SERIALIZATION.observe(elapsed, fmt)
+    add_phase("encode", elapsed)
+    return encoded
+
+
+async def start_stream(blocks: AsyncIterator) -> AsyncIterator:
+    """Đọc trước block đầu tiên để lỗi truy vấn được ném ra trước khi gửi header.
+
+    Trả về async iterator phát lại block đầu tiên rồi tới các block còn lại.
+    """
+    try:
+        first = await blocks.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def replay():
+        if first is not None:
+            yield first
+            async for block in blocks:
+                yield block
+
+    return replay()
+
+
+async def ndjson_stream(
+    blocks: AsyncIterator, columns: Optional[List[str]] = None
+) -> AsyncIterator[bytes]:
+    """Mỗi dòng kết quả thành một dòng JSON, gửi theo từng block."""
+    async for block in blocks:
+        if block:
+            yield ("\n".join(_encode_rows(block, columns, "ndjson")) + "\n").encode()
+
+
+async def json_array_stream(
+    blocks: AsyncIterator,
+    columns: Optional[List[str]] = None,
+    prefix: bytes = b"[",
+    suffix: bytes = b"]",
+) -> AsyncIterator[bytes]:
+    """Ghi kết quả thành một mảng JSON, gửi dần theo từng block."""
+    yield prefix
+    first = True
+    async for block in blocks:
+        if not block:
+            continue
+        chunk = ",".join(_encode_rows(block, columns))
+        yield (chunk if first else "," + chunk).encode()
+        first = False
+    yield suffix
+
+
+def wants_ndjson(accept: Optional[str]) -> bool:
+    """Kiểm tra header ``Accept`` có yêu cầu NDJSON hay không."""
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
+
+
+def negotiate_format(accept: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Chọn định dạng cột theo header ``Accept``.
+
+    Trả về ``(media_type, định dạng ClickHouse)`` hoặc ``None`` nếu client
+    không yêu cầu Arrow/Parquet/CSV.
+    """
+    if not accept:
+        return None
+    for part in accept.split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in COLUMNAR_FORMATS:
+            return media_type, COLUMNAR_FORMATS[media_type]
+    return None
+
+
+def stream_format_response(chunks: AsyncIterator[bytes], media_type: str) -> StreamingResponse:
+    """Tạo ``StreamingResponse`` chuyển thẳng byte định dạng cột từ ClickHouse."""
+    return StreamingResponse(chunks, media_type=media_type)
+
+
+def stream_rows_response(
+    blocks: AsyncIterator,
+    columns: Optional[List[str]],
+    ndjson: bool,
+    prefix: bytes = b"[",
+    suffix: bytes = b"]",
+) -> StreamingResponse:
+    """Tạo ``StreamingResponse`` từ các block dòng của ClickHouse."""
+    if ndjson:
+        return StreamingResponse(ndjson_stream(blocks, columns), media_type=NDJSON_MEDIA_TYPE)
+    return StreamingResponse(
+        json_array_stream(blocks, columns, prefix, suffix), media_type="application/json"
+    )
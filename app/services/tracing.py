@@ -0,0 +1,196 @@
+"""Theo dõi thời gian từng giai đoạn của request và log request chậm.
+
+``TracingMiddleware`` gán cho mỗi request một ID (header ``X-Request-ID`` của
+client nếu hợp lệ, ngược lại sinh mới) và lưu ``Trace`` vào ``ContextVar``.
+Mọi truy vấn ClickHouse chạy trong request nhận ``query_id`` dạng
+``<request_id>-<uuid8>-<n>`` (phần ``uuid8`` do server sinh cho mỗi request
+để hai request trùng ``X-Request-ID`` không giành cùng ``query_id``) và được ghi lại thời gian theo giai đoạn
+(``clickhouse.describe``, ``clickhouse.select``...); các bước dựng kết quả
+(``build``) và mã hóa JSON (``encode``) cũng được ghi. Request vượt
+``SLOW_REQUEST_THRESHOLD`` giây được log kèm bảng phân rã giai đoạn và số
+liệu của từng truy vấn đọc từ ``system.query_log``.
+"""
+
+import asyncio
+import itertools
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+
+REQUEST_ID_HEADER = "x-request-id"
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+QUERY_LOG_SQL = (
+    "SELECT query_id, query_duration_ms, read_rows, read_bytes, result_rows, memory_usage "
+    "FROM system.query_log "
+    "WHERE event_date >= yesterday() AND type != 'QueryStart' "
+    "AND query_id IN {query_ids:Array(String)}"
+)
+
+
+class Trace:
+    """Thời gian các giai đoạn và danh sách truy vấn ClickHouse của một request.
+
+    Các thread của pool ClickHouse ghi vào cùng đối tượng (qua bản sao
+    context); ``list.append`` và ``next`` trên ``itertools.count`` đủ an toàn
+    dưới GIL nên không cần khóa.
+    """
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        # Header của client có thể trùng giữa các request nên query_id luôn
+        # mang thêm phần ngẫu nhiên riêng của request này
+        self.query_prefix = f"{request_id}-{uuid.uuid4().hex[:8]}"
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.queries: List[Tuple[str, str, float]] = []
+        self._seq = itertools.count(1)
+
+    def new_query_id(self) -> str:
+        return f"{self.query_prefix}-{next(self._seq)}"
+
+    def breakdown(self, total: float) -> Dict[str, float]:
+        """Tổng thời gian (ms) theo giai đoạn, phần còn lại tính vào ``other``."""
+        result: Dict[str, float] = {}
+        for name, elapsed in self.phases:
+            result[name] = result.get(name, 0.0) + elapsed
+        result["other"] = max(0.0, total - sum(result.values()))
+        return {name: round(elapsed * 1000, 3) for name, elapsed in result.items()}
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+# Giữ tham chiếu tới các task log request chậm đang chờ query_log
+_pending: Set["asyncio.Task[None]"] = set()
+
+
+def request_id_from(header: Optional[str]) -> str:
+    """ID request từ header của client (nếu hợp lệ) hoặc ID mới."""
+    if header and _REQUEST_ID_RE.match(header):
+        return header
+    return uuid.uuid4().hex
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def start_trace(request_id: str):
+    """Bắt đầu trace cho request hiện tại, trả về token để ``end_trace``."""
+    return _current.set(Trace(request_id))
+
+
+def end_trace(token) -> None:
+    _current.reset(token)
+
+
+def new_query_id() -> str:
+    """``query_id`` cho truy vấn mới: gắn với request hiện tại nếu có."""
+    trace = _current.get()
+    if trace is None:
+        return str(uuid.uuid4())
+    return trace.new_query_id()
+
+
+def traced_query_id(query_id: Optional[str]) -> Optional[str]:
+    """Giữ ``query_id`` có sẵn; trong request thì sinh ID gắn với request."""
+    if query_id is not None or _current.get() is None:
+        return query_id
+    return new_query_id()
+
+
+def add_phase(name: str, elapsed: float) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.phases.append((name, elapsed))
+
+
+def record_query(query_id: Optional[str], sql: str, elapsed: float) -> None:
+    """Ghi thời gian một truy vấn ClickHouse vào giai đoạn ``clickhouse.<lệnh>``."""
+    trace = _current.get()
+    if trace is None:
+        return
+    phase = f"clickhouse.{statement_kind(sql)}"
+    trace.phases.append((phase, elapsed))
+    if query_id is not None:
+        trace.queries.append((query_id, phase, elapsed))
+
+
+def statement_kind(sql: str) -> str:
+    words = sql.split(None, 1)
+    if not words:
+        return "unknown"
+    kind = words[0].lower()
+    return "select" if kind in ("with", "(") else kind
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Đo thời gian khối lệnh như một giai đoạn của request hiện tại."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - started)
+
+
+async def fetch_query_log(ch, query_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Số liệu ``system.query_log`` (read_rows, memory_usage...) theo ``query_id``."""
+    result = await ch.aquery(QUERY_LOG_SQL, parameters={"query_ids": query_ids})
+    stats: Dict[str, Dict[str, Any]] = {}
+    for query_id, duration, read_rows, read_bytes, result_rows, memory in result.result_rows:
+        stats[query_id] = {
+            "duration_ms": duration,
+            "read_rows": read_rows,
+            "read_bytes": read_bytes,
+            "result_rows": result_rows,
+            "memory_usage": memory,
+        }
+    return stats
+
+
+async def log_slow_request(ch, trace: Trace, method: str, path: str, status: int, total: float):
+    """Log request chậm kèm phân rã giai đoạn và số liệu ``system.query_log``.
+
+    ClickHouse ghi ``query_log`` theo lô (mặc định mỗi 7.5 giây) nên việc đọc
+    được hoãn ``SLOW_REQUEST_QUERY_LOG_DELAY`` giây.
+    """
+    queries = [
+        {"query_id": query_id, "phase": phase, "elapsed_ms": round(elapsed * 1000, 3)}
+        for query_id, phase, elapsed in trace.queries
+    ]
+    if queries and ch is not None:
+        await asyncio.sleep(settings.SLOW_REQUEST_QUERY_LOG_DELAY)
+        try:
+            stats = await fetch_query_log(ch, [query["query_id"] for query in queries])
+            for query in queries:
+                query.update(stats.get(query["query_id"], {}))
+        except Exception as exc:
+            logger.warning("Không đọc được system.query_log cho {}: {}", trace.request_id, exc)
+    logger.warning(
+        "Request chậm {} {} {} ({:.1f} ms), request_id={}, giai đoạn={}, truy vấn={}",
+        method,
+        path,
+        status,
+        total * 1000,
+        trace.request_id,
+        trace.breakdown(total),
+        queries,
+    )
+
+
+def schedule_slow_log(ch, trace: Trace, method: str, path: str, status: int, total: float):
+    """Chạy ``log_slow_request`` ở nền, ngoài context của request."""
+    token = _current.set(None)
+    try:
+        task = asyncio.ensure_future(log_slow_request(ch, trace, method, path, status, total))
+    finally:
+        _current.reset(token)
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
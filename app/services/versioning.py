@@ -0,0 +1,78 @@
+"""Ghi dữ liệu dạng phiên bản cho các bảng ``ReplacingMergeTree``.
+
+Mỗi lần tạo, cập nhật hay xóa đều chèn một dòng mới với ``_version`` lớn hơn;
+ClickHouse tự giữ lại phiên bản mới nhất của mỗi khóa khi merge, còn truy vấn
+đọc dùng ``FINAL`` và lọc ``_deleted = 0`` để luôn thấy trạng thái mới nhất.
+"""
+
+import threading
+import time
+from typing import Dict, List
+
+VERSION_COLUMN = "_version"
+DELETED_COLUMN = "_deleted"
+
+# Cột hệ thống thêm vào bảng phiên bản; giá trị mặc định dùng cùng đơn vị với
+# ``next_version`` để dòng chèn từ nơi khác vẫn mới hơn các phiên bản cũ
+VERSION_COLUMNS_DDL = (
+    f"{VERSION_COLUMN} UInt64 DEFAULT toUnixTimestamp64Nano(now64(9)),\n"
+    f"{DELETED_COLUMN} UInt8 DEFAULT 0"
+)
+VERSIONED_ENGINE = f"ReplacingMergeTree({VERSION_COLUMN})"
+
+_lock = threading.Lock()
+_last_version = 0
+
+
+def next_version() -> int:
+    """Sinh số phiên bản (nano giây) tăng nghiêm ngặt trong tiến trình."""
+    global _last_version
+    with _lock:
+        _last_version = max(_last_version + 1, time.time_ns())
+        return _last_version
+
+
+def is_versioned(schema: Dict[str, str]) -> bool:
+    """Bảng có cột phiên bản và cột đánh dấu xóa hay không."""
+    return VERSION_COLUMN in schema and DELETED_COLUMN in schema
+
+
+def _insert_select(
+    table: str,
+    key: str,
+    key_type: str,
+    columns: List[str],
+    values: Dict[str, str],
+    deleted: int,
+) -> str:
+    select = [values.get(col, col) for col in columns]
+    target = ", ".join(columns + [VERSION_COLUMN, DELETED_COLUMN])
+    return (
+        f"INSERT INTO {table} ({target}) "
+        f"SELECT {', '.join(select)}, {{__version:UInt64}}, {deleted} "
+        f"FROM {table} FINAL "
+        f"WHERE {key} = {{__key:{key_type}}} AND {DELETED_COLUMN} = 0"
+    )
+
+
+def update_sql(
+    table: str, key: str, key_type: str, columns: List[str], updates: Dict[str, str]
+) -> str:
+    """Câu lệnh chèn phiên bản mới của một dòng đang tồn tại.
+
+    ``updates`` ánh xạ cột cần đổi sang kiểu ClickHouse; giá trị truyền qua
+    tham số cùng tên, các cột còn lại giữ nguyên giá trị cũ. Nếu dòng không
+    tồn tại thì không có dòng nào được ghi (``written_rows == 0``).
+    """
+    values = {col: f"{{{col}:{ch_type}}}" for col, ch_type in updates.items()}
+    return _insert_select(table, key, key_type, columns, values, 0)
+
+
+def delete_sql(table: str, key: str, key_type: str, columns: List[str]) -> str:
+    """Câu lệnh chèn bản ghi đánh dấu xóa (tombstone) cho một dòng đang tồn tại."""
+    return _insert_select(table, key, key_type, columns, {}, 1)
+
+
+def written_rows(summary) -> int:
+    """Số dòng đã ghi từ ``QuerySummary`` trả về bởi ``command``."""
+    return int(getattr(summary, "written_rows", 0) or 0)
@@ -0,0 +1,144 @@
+"""Benchmark throughput of ClickHouseClient against a local stub server.
+
+The stub speaks just enough of the ClickHouse HTTP protocol for
+``clickhouse_connect`` to connect and run ``SELECT`` queries, and sleeps a
+fixed latency per query to emulate a slow server. The benchmark compares the
+old behaviour (blocking ``query`` called directly from coroutines) with the
+pooled ``aquery`` interface.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clickhouse_connect import get_client  # noqa: E402
+from clickhouse_connect.driver.httputil import get_pool_manager  # noqa: E402
+
+from app.services.clickhouse_client import ClickHouseClient  # noqa: E402
+
+
+def _native_string(value: str) -> bytes:
+    data = value.encode()
+    return bytes([len(data)]) + data
+
+
+def _native_uint8_block(name: str, value: int) -> bytes:
+    """Encode a one column, one row ``UInt8`` block in Native format."""
+    return b"\x01\x01" + _native_string(name) + _native_string("UInt8") + bytes([value])
+
+
+class StubClickHouseHandler(BaseHTTPRequestHandler):
+    """Minimal ClickHouse HTTP endpoint answering every query after a delay."""
+
+    latency = 0.05
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def _reply(self, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode(errors="ignore") if length else ""
+        query = parse_qs(urlparse(self.path).query).get("query", [body])[0] or body
+        if "version()" in query:
+            self._reply(b"22.1.1.1\tUTC\n")
+        elif "system.settings" in query:
+            self._reply(b"")
+        else:
+            time.sleep(self.latency)
+            self._reply(_native_uint8_block("result", 1))
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def start_stub(latency: float) -> ThreadingHTTPServer:
+    StubClickHouseHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubClickHouseHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_factory(port: int):
+    def factory():
+        return get_client(
+            host="127.0.0.1",
+            port=port,
+            username="default",
+            password="",
+            pool_mgr=get_pool_manager(maxsize=1),
+        )
+
+    return factory
+
+
+async def run_blocking(ch: ClickHouseClient, requests: int, concurrency: int) -> float:
+    """Old behaviour: the blocking call runs directly on the event loop."""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            ch.query("SELECT 1")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return time.perf_counter() - start
+
+
+async def run_async(ch: ClickHouseClient, requests: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            await ch.aquery("SELECT 1")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ClickHouse connection pool")
+    parser.add_argument("--requests", type=int, default=400, help="Total queries to run")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent coroutines")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub latency per query (s)")
+    parser.add_argument("--pool-size", type=int, default=16, help="Pooled HTTP sessions")
+    parser.add_argument("--max-inflight", type=int, default=64, help="Max in-flight queries")
+    args = parser.parse_args()
+
+    server = start_stub(args.latency)
+    port = server.server_address[1]
+    ch = ClickHouseClient(
+        pool_size=args.pool_size,
+        max_inflight=args.max_inflight,
+        acquire_timeout=60,
+        client_factory=stub_factory(port),
+    )
+    try:
+        for name, runner in (("blocking", run_blocking), ("async pool", run_async)):
+            elapsed = asyncio.run(runner(ch, args.requests, args.concurrency))
+            print(
+                f"{name:<11} {args.requests} queries in {elapsed:.2f}s "
+                f"-> {args.requests / elapsed:.1f} q/s"
+            )
+    finally:
+        ch.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
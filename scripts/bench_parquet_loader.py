@@ -0,0 +1,259 @@
+"""Benchmark the pipelined Parquet loader against the old download-then-insert path.
+
+A local S3 stand-in serves the Parquet file over HTTP (``HEAD`` and ranged
+``GET``, which is all the MinIO client needs for ``stat_object`` and
+``get_object``), so the benchmark runs without a MinIO server. Inserts go to
+a sink that sleeps ``--insert-latency`` seconds per million rows to emulate
+ClickHouse, or to a real server with ``--ch-host``.
+
+Each mode runs in a fresh process so that peak memory is measured per mode:
+
+    python scripts/bench_parquet_loader.py --rows 5000000 --row-group-size 250000
+"""
+
+import argparse
+import email.utils
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from generate_parquet import generate_table  # noqa: E402
+from parquet_loader import load_parquet, open_local_file, open_minio_object  # noqa: E402
+
+from app.services.bulk_insert import insert_arrow_batches  # noqa: E402
+
+BUCKET = "bench"
+
+
+class StubS3Handler(BaseHTTPRequestHandler):
+    """Serves files of ``root`` as objects of every bucket (no auth).
+
+    Supports ``HEAD``, ranged ``GET`` and a non paginated ``ListObjectsV2``.
+    """
+
+    root = "."
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def _path(self) -> str:
+        _, _, key = self.path.split("?")[0].lstrip("/").partition("/")
+        return os.path.join(self.root, unquote(key))
+
+    def _headers(self, status: int, length: int, size: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("ETag", f'"{size:x}"')
+        self.send_header("Last-Modified", email.utils.formatdate(usegmt=True))
+        self.send_header("Accept-Ranges", "bytes")
+
+    def do_HEAD(self) -> None:
+        path = self._path()
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        self._headers(200, size, size)
+        self.end_headers()
+
+    def _list(self) -> None:
+        query = parse_qs(urlparse(self.path).query)
+        prefix = query.get("prefix", [""])[0]
+        entries = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in sorted(files):
+                full = os.path.join(dirpath, name)
+                key = os.path.relpath(full, self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    size = os.path.getsize(full)
+                    entries.append(
+                        f"<Contents><Key>{escape(key)}</Key>"
+                        f"<LastModified>2024-01-01T00:00:00.000Z</LastModified>"
+                        f'<ETag>"{size:x}"</ETag><Size>{size}</Size>'
+                        f"<StorageClass>STANDARD</StorageClass></Contents>"
+                    )
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{BUCKET}</Name><Prefix>{escape(prefix)}</Prefix>"
+            f"<KeyCount>{len(entries)}</KeyCount><IsTruncated>false</IsTruncated>"
+            + "".join(entries)
+            + "</ListBucketResult>"
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Type", "application/xml")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if "list-type=2" in self.path:
+            self._list()
+            return
+        path = self._path()
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        start, end = 0, size - 1
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        self._headers(206 if match else 200, end - start + 1, size)
+        if match:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                chunk = f.read(min(remaining, 1 << 20))
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+
+def start_s3_stub(root: str) -> ThreadingHTTPServer:
+    StubS3Handler.root = root
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubS3Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SleepSink:
+    """Stand-in ClickHouse client: ``insert_arrow`` sleeps in proportion to rows."""
+
+    def __init__(self, seconds_per_million: float):
+        self.seconds_per_million = seconds_per_million
+
+    def insert_arrow(self, table: str, arrow_table: pa.Table, settings=None) -> None:
+        time.sleep(arrow_table.num_rows / 1e6 * self.seconds_per_million)
+
+
+def _client_factory(args):
+    if not args.ch_host:
+        return lambda: SleepSink(args.insert_latency)
+    from clickhouse_connect import get_client
+
+    return lambda: get_client(
+        host=args.ch_host, port=args.ch_port, username=args.ch_user, password=args.ch_password
+    )
+
+
+def _minio(port: int):
+    from minio import Minio
+
+    return Minio(
+        f"127.0.0.1:{port}",
+        access_key="bench",
+        secret_key="bench",
+        secure=False,
+        region="us-east-1",
+    )
+
+
+def run_mode(mode: str, args, port: int, path: str, results) -> None:
+    factory = _client_factory(args)
+    start = time.perf_counter()
+    if mode == "download":
+        # Previous behaviour: whole object in memory, one insert stream
+        import io
+
+        response = _minio(port).get_object(BUCKET, os.path.basename(path))
+        buffer = io.BytesIO(response.read())
+        response.close()
+        rows = insert_arrow_batches(
+            factory(),
+            args.table,
+            pq.ParquetFile(buffer).iter_batches(batch_size=args.batch_size),
+            args.batch_size,
+        )
+    else:
+        if mode == "pipelined-minio":
+            open_file = open_minio_object(_minio(port), BUCKET, os.path.basename(path))
+        else:
+            open_file = open_local_file(path)
+        rows = load_parquet(
+            open_file,
+            factory,
+            args.table,
+            batch_size=args.batch_size,
+            decode_workers=args.decode_workers,
+            insert_workers=args.insert_workers,
+            queue_size=args.queue_size,
+        )["rows"]
+    elapsed = time.perf_counter() - start
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put((mode, rows, elapsed, pa.default_memory_pool().max_memory() / 1e6, max_rss))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipelined Parquet loader")
+    parser.add_argument("--input", help="Parquet file to load (default: generate one)")
+    parser.add_argument("--rows", type=int, default=5_000_000, help="Rows to generate")
+    parser.add_argument("--cols", type=int, default=10, help="Columns to generate")
+    parser.add_argument("--row-group-size", type=int, default=250_000, help="Rows per row group")
+    parser.add_argument("--batch-size", type=int, default=100_000, help="Rows per insert")
+    parser.add_argument("--decode-workers", type=int, default=4)
+    parser.add_argument("--insert-workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument(
+        "--insert-latency",
+        type=float,
+        default=1.0,
+        help="Sink seconds per million inserted rows (ignored with --ch-host)",
+    )
+    parser.add_argument("--modes", default="download,pipelined-minio,pipelined-file")
+    parser.add_argument("--table", default="bench_parquet_loader")
+    parser.add_argument("--ch-host", help="Insert into a real ClickHouse instead of the sink")
+    parser.add_argument("--ch-port", type=int, default=8123)
+    parser.add_argument("--ch-user", default="default")
+    parser.add_argument("--ch-password", default="")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        path = args.input
+        if path is None:
+            path = os.path.join(root, "bench.parquet")
+            pq.write_table(
+                generate_table(args.rows, args.cols), path, row_group_size=args.row_group_size
+            )
+        server = start_s3_stub(os.path.dirname(os.path.abspath(path)))
+        port = server.server_address[1]
+        print(f"File: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        try:
+            for mode in args.modes.split(","):
+                proc = ctx.Process(target=run_mode, args=(mode, args, port, path, results))
+                proc.start()
+                mode, rows, elapsed, arrow_peak, max_rss = results.get()
+                proc.join()
+                print(
+                    f"{mode:<16} {rows} rows in {elapsed:6.2f}s "
+                    f"{rows / elapsed / 1e6:6.2f} Mrows/s "
+                    f"arrow peak {arrow_peak:8.1f} MB  max RSS {max_rss:8.1f} MB"
+                )
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
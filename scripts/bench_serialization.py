@@ -0,0 +1,96 @@
+"""Compare JSON vs columnar (Arrow / Parquet / CSV) serialization cost.
+
+The JSON path reproduces what ``query_rows`` does for a normal request: the
+result is materialized as Python row tuples, turned into one dict per row and
+JSON encoded. The columnar paths encode the same data straight from Arrow
+buffers, which is what the API returns when a client negotiates
+``application/vnd.apache.arrow.stream``, ``application/x-parquet`` or
+``text/csv``.
+
+Use a file produced by ``generate_parquet.py`` or let the script generate one:
+
+    python scripts/generate_parquet.py --rows 10000000 --cols 10 --output data10m.parquet
+    python scripts/bench_serialization.py --input data10m.parquet
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from generate_parquet import generate_table  # noqa: E402
+
+
+def measure(name: str, func, rows: int) -> None:
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    size = func()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    print(
+        f"{name:<10} {wall:8.2f}s wall {cpu:8.2f}s cpu "
+        f"{rows / wall / 1e6:8.2f} Mrows/s {size / 1e6:10.1f} MB"
+    )
+
+
+def encode_json(table: pa.Table) -> int:
+    names = table.column_names
+    # Same shape as clickhouse_connect result_rows: a list of Python tuples
+    rows = list(zip(*(column.to_pylist() for column in table.columns)))
+    body = json.dumps([{names[idx]: row[idx] for idx in range(len(names))} for row in rows])
+    return len(body)
+
+
+def encode_arrow(table: pa.Table) -> int:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().size
+
+
+def encode_parquet(table: pa.Table) -> int:
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    return buffer.tell()
+
+
+def encode_csv(table: pa.Table) -> int:
+    buffer = io.BytesIO()
+    pacsv.write_csv(table, buffer)
+    return buffer.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON vs Arrow serialization")
+    parser.add_argument("--input", help="Parquet file to load (default: generate in memory)")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Rows to generate")
+    parser.add_argument("--cols", type=int, default=10, help="Columns to generate")
+    parser.add_argument(
+        "--formats",
+        default="arrow,parquet,csv,json",
+        help="Comma separated formats to measure",
+    )
+    args = parser.parse_args()
+
+    table = pq.read_table(args.input) if args.input else generate_table(args.rows, args.cols)
+    print(f"Dataset: {table.num_rows} rows x {table.num_columns} columns")
+    encoders = {
+        "arrow": encode_arrow,
+        "parquet": encode_parquet,
+        "csv": encode_csv,
+        "json": encode_json,
+    }
+    for name in args.formats.split(","):
+        measure(name, lambda: encoders[name](table), table.num_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""Infer compact ClickHouse DDL for a Parquet file.
+
+Column types come from the Arrow schema narrowed with Parquet column
+statistics (min/max/null count over every row group) and a sample of rows
+(sortedness, key suggestions). Choices that lose data or only pay off when
+they hold for every row (whole-day timestamps, string cardinality) are
+confirmed by a scan of those columns over the whole file:
+
+- integers become the smallest ``UInt*``/``Int*`` covering min..max;
+- strings with few distinct values become ``LowCardinality(String)``;
+- ``Nullable`` is used only for columns that actually contain nulls;
+- timestamps become ``Date`` when every value is midnight, otherwise
+  ``DateTime`` or ``DateTime64(precision)``; decimals keep ``Decimal(P, S)``.
+
+It also suggests ``ORDER BY``/``PARTITION BY`` keys and per-column codecs,
+and can add a ``SAMPLE BY`` key so the table supports ``SAMPLE`` queries.
+Profiles of several files loaded into one table are combined with
+:func:`merge_profiles` so the plan covers every file.
+"""
+
+import datetime
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+_UNSIGNED = [("UInt8", 2**8), ("UInt16", 2**16), ("UInt32", 2**32), ("UInt64", 2**64)]
+_SIGNED = [("Int8", 2**7), ("Int16", 2**15), ("Int32", 2**31), ("Int64", 2**63)]
+_TIME_PRECISION = {"s": 0, "ms": 3, "us": 6, "ns": 9}
+
+
+@dataclass
+class ColumnProfile:
+    """What is known about one column after reading statistics and a sample."""
+
+    name: str
+    arrow_type: pa.DataType
+    min: Any = None
+    max: Any = None
+    null_count: int = 0
+    has_stats: bool = True
+    sample_rows: int = 0
+    distinct: int = 0
+    sorted: bool = False
+    midnight_only: bool = False
+    compressed_bytes: int = 0
+    ch_type: str = ""
+    codec: Optional[str] = None
+
+
+@dataclass
+class TablePlan:
+    """Inferred columns plus suggested table keys."""
+
+    columns: List[ColumnProfile]
+    order_by: str = "tuple()"
+    partition_by: Optional[str] = None
+    sample_by: Optional[str] = None
+    notes: List[str] = field(default_factory=list)
+
+    def column_ddl(self, codecs: bool = False) -> str:
+        parts = []
+        for col in self.columns:
+            ddl = f"{col.name} {col.ch_type}"
+            if codecs and col.codec:
+                ddl += f" CODEC({col.codec})"
+            parts.append(ddl)
+        return ", ".join(parts)
+
+    def expected_bytes(self) -> Dict[str, int]:
+        """Compressed size of every column in the source Parquet file."""
+        return {col.name: col.compressed_bytes for col in self.columns}
+
+
+def _integer_type(lo: int, hi: int, min_bits: int = 8) -> str:
+    if lo >= 0:
+        candidates = [(n, limit) for n, limit in _UNSIGNED if limit >= 2**min_bits]
+        return next(name for name, limit in candidates if hi < limit)
+    candidates = [(n, limit) for n, limit in _SIGNED if limit >= 2 ** (min_bits - 1)]
+    return next(name for name, limit in candidates if -limit <= lo and hi < limit)
+
+
+def _base_type(
+    col: ColumnProfile, low_cardinality_ratio: float, max_low_cardinality: int, min_integer_bits: int
+) -> str:
+    t = col.arrow_type
+    if pa.types.is_boolean(t):
+        return "Bool"
+    if pa.types.is_integer(t):
+        if col.has_stats and col.min is not None:
+            return _integer_type(int(col.min), int(col.max), min_integer_bits)
+        return f"{'U' if pa.types.is_unsigned_integer(t) else ''}Int{t.bit_width}"
+    if pa.types.is_floating(t):
+        return "Float32" if t.bit_width <= 32 else "Float64"
+    if pa.types.is_decimal(t):
+        return f"Decimal({t.precision}, {t.scale})"
+    if pa.types.is_date(t):
+        # Date covers 1970..2149, older or later values need Date32
+        if col.min is not None and not (
+            datetime.date(1970, 1, 1) <= col.min and col.max <= datetime.date(2149, 6, 6)
+        ):
+            return "Date32"
+        return "Date"
+    if pa.types.is_timestamp(t):
+        if col.midnight_only:
+            return "Date"
+        precision = _TIME_PRECISION[t.unit]
+        tz = f", '{t.tz}'" if t.tz else ""
+        if precision == 0:
+            return f"DateTime({t.tz!r})" if t.tz else "DateTime"
+        return f"DateTime64({precision}{tz})"
+    if pa.types.is_string(t) or pa.types.is_large_string(t) or pa.types.is_dictionary(t):
+        if (
+            col.sample_rows
+            and col.distinct <= max_low_cardinality
+            and col.distinct <= col.sample_rows * low_cardinality_ratio
+        ):
+            return "LowCardinality(String)"
+        return "String"
+    return "String"
+
+
+def _codec(col: ColumnProfile) -> Optional[str]:
+    base = col.ch_type.replace("Nullable(", "").replace("LowCardinality(", "")
+    if base.startswith(("DateTime", "Date")):
+        return "DoubleDelta, ZSTD(1)" if col.sorted else "Delta, ZSTD(1)"
+    if base.startswith(("UInt", "Int")):
+        return "Delta, ZSTD(1)" if col.sorted else "T64, ZSTD(1)"
+    if base.startswith("Float"):
+        return "Gorilla, ZSTD(1)" if col.sorted else None
+    if base.startswith("String") and not col.ch_type.startswith("LowCardinality"):
+        return "ZSTD(3)"
+    return None
+
+
+def _is_string(arrow_type: pa.DataType) -> bool:
+    return (
+        pa.types.is_string(arrow_type)
+        or pa.types.is_large_string(arrow_type)
+        or pa.types.is_dictionary(arrow_type)
+    )
+
+
+def _all_midnight(values: pa.Array) -> bool:
+    values = pc.drop_null(values)
+    if not len(values):
+        return True
+    return bool(pc.all(pc.equal(values, pc.floor_temporal(values, unit="day"))).as_py())
+
+
+def profile_parquet(
+    pq_file: pq.ParquetFile, sample_rows: int = 100000, max_distinct: int = 10000
+) -> List[ColumnProfile]:
+    """Collect statistics of every column and sample the first ``sample_rows`` rows.
+
+    When the file is larger than the sample, timestamp columns that look like
+    whole days and string columns with at most ``max_distinct`` values in the
+    sample are re-checked over every row. Distinct counts stop at the first
+    value past ``max_distinct``.
+    """
+    schema = pq_file.schema_arrow
+    metadata = pq_file.metadata
+    profiles = {f.name: ColumnProfile(f.name, f.type) for f in schema}
+    for g in range(metadata.num_row_groups):
+        row_group = metadata.row_group(g)
+        for i in range(row_group.num_columns):
+            chunk = row_group.column(i)
+            col = profiles.get(chunk.path_in_schema)
+            if col is None:
+                continue
+            col.compressed_bytes += chunk.total_compressed_size
+            stats = chunk.statistics
+            if stats is None:
+                # Without statistics nulls cannot be ruled out
+                col.has_stats = False
+                continue
+            col.null_count += stats.null_count
+            if not stats.has_min_max:
+                continue
+            col.min = stats.min if col.min is None else min(col.min, stats.min)
+            col.max = stats.max if col.max is None else max(col.max, stats.max)
+
+    sample = None
+    for batch in pq_file.iter_batches(batch_size=sample_rows):
+        sample = pa.Table.from_batches([batch])
+        break
+    if sample is not None:
+        for name, col in profiles.items():
+            values = sample.column(name)
+            col.sample_rows = len(values)
+            if pa.types.is_dictionary(col.arrow_type):
+                values = values.cast(col.arrow_type.value_type)
+            col.distinct = pc.count_distinct(values).as_py()
+            non_null = pc.drop_null(values)
+            if len(non_null) > 1 and not pa.types.is_boolean(col.arrow_type):
+                try:
+                    col.sorted = bool(
+                        pc.all(pc.greater_equal(non_null[1:], non_null[:-1])).as_py()
+                    )
+                except pa.ArrowNotImplementedError:
+                    col.sorted = False
+            if pa.types.is_timestamp(col.arrow_type) and len(non_null):
+                col.midnight_only = _all_midnight(non_null)
+        if sample.num_rows < metadata.num_rows:
+            _scan_whole_file(pq_file, profiles, sample_rows, max_distinct)
+    return list(profiles.values())
+
+
+def _scan_whole_file(
+    pq_file: pq.ParquetFile,
+    profiles: Dict[str, ColumnProfile],
+    batch_size: int,
+    max_distinct: int,
+) -> None:
+    """Confirm ``midnight_only`` and string distinct counts over every row."""
+    timestamps = [c for c in profiles.values() if c.midnight_only]
+    strings = [
+        c for c in profiles.values() if _is_string(c.arrow_type) and c.distinct <= max_distinct
+    ]
+    if not timestamps and not strings:
+        return
+    seen: Dict[str, set] = {c.name: set() for c in strings}
+    rows = 0
+    columns = [c.name for c in timestamps + strings]
+    for batch in pq_file.iter_batches(batch_size=batch_size, columns=columns):
+        rows += batch.num_rows
+        for col in list(timestamps):
+            if not _all_midnight(batch.column(col.name)):
+                col.midnight_only = False
+                timestamps.remove(col)
+        for col in list(strings):
+            values = batch.column(col.name)
+            if pa.types.is_dictionary(values.type):
+                values = values.dictionary_decode()
+            seen[col.name].update(pc.unique(values).to_pylist())
+            if len(seen[col.name]) > max_distinct:
+                col.distinct = len(seen[col.name])
+                strings.remove(col)
+        if not timestamps and not strings:
+            return
+    for col in strings:
+        col.distinct = len(seen[col.name])
+        col.sample_rows = rows
+
+
+def _merge_type(name: str, a: pa.DataType, b: pa.DataType) -> pa.DataType:
+    if a == b:
+        return a
+    if pa.types.is_integer(a) and pa.types.is_integer(b):
+        # Width and sign come from the merged min/max; this only matters without stats
+        return pa.int64()
+    if pa.types.is_floating(a) and pa.types.is_floating(b):
+        return pa.float64()
+    if pa.types.is_timestamp(a) and pa.types.is_timestamp(b) and a.tz == b.tz:
+        return a if _TIME_PRECISION[a.unit] >= _TIME_PRECISION[b.unit] else b
+    if _is_string(a) and _is_string(b):
+        return pa.string()
+    raise ValueError(f"Column {name} has incompatible types across files: {a} and {b}")
+
+
+def merge_profiles(profiles: List[List[ColumnProfile]]) -> List[ColumnProfile]:
+    """Combine the profiles of several files into one profile per column.
+
+    Min/max, null counts and sizes cover every file; a choice that must hold
+    for every row (sorted, whole-day timestamps) holds only if it held in each
+    file. Distinct counts are added up, an upper bound of the real count. A
+    column missing from some files is treated as containing nulls.
+    """
+    merged: Dict[str, ColumnProfile] = {}
+    for index, file_profiles in enumerate(profiles):
+        names = {col.name for col in file_profiles}
+        for acc in merged.values():
+            if acc.name not in names:
+                acc.null_count += 1
+        for col in file_profiles:
+            acc = merged.get(col.name)
+            if acc is None:
+                merged[col.name] = acc = replace(col)
+                # Missing from the files profiled before this one
+                acc.null_count += int(index > 0)
+                continue
+            acc.arrow_type = _merge_type(col.name, acc.arrow_type, col.arrow_type)
+            if col.min is not None:
+                acc.min = col.min if acc.min is None else min(acc.min, col.min)
+                acc.max = col.max if acc.max is None else max(acc.max, col.max)
+            acc.null_count += col.null_count
+            acc.has_stats = acc.has_stats and col.has_stats
+            acc.sample_rows += col.sample_rows
+            acc.distinct += col.distinct
+            acc.sorted = acc.sorted and col.sorted
+            acc.midnight_only = acc.midnight_only and col.midnight_only
+            acc.compressed_bytes += col.compressed_bytes
+    return list(merged.values())
+
+
+def plan_table(
+    profiles: List[ColumnProfile],
+    order_by: Optional[str] = None,
+    partition_by: Optional[str] = None,
+    low_cardinality_ratio: float = 0.05,
+    max_low_cardinality: int = 10000,
+    min_integer_bits: int = 8,
+    sample_by: Optional[str] = None,
+) -> TablePlan:
+    """Choose types and codecs; suggest keys unless ``order_by``/``partition_by`` are given.
+
+    Pass ``"tuple()"`` / ``""`` to disable a suggested key explicitly.
+    ``min_integer_bits`` keeps integer columns at least that wide, for tables
+    that will also receive files other than the profiled one. ``sample_by``
+    names a column whose hash becomes the sampling key, appended to the end
+    of ``ORDER BY`` as ClickHouse requires.
+    """
+    for col in profiles:
+        ch_type = _base_type(col, low_cardinality_ratio, max_low_cardinality, min_integer_bits)
+        if col.null_count or not col.has_stats:
+            if ch_type.startswith("LowCardinality("):
+                ch_type = f"LowCardinality(Nullable({ch_type[len('LowCardinality('):-1]}))"
+            else:
+                ch_type = f"Nullable({ch_type})"
+        col.ch_type = ch_type
+        col.codec = None if ch_type.startswith("LowCardinality") else _codec(col)
+
+    plan = TablePlan(profiles)
+    plan.order_by, order_note = (order_by, None) if order_by else _suggest_order_by(profiles)
+    if partition_by is None:
+        plan.partition_by, partition_note = _suggest_partition_by(profiles)
+    else:
+        plan.partition_by, partition_note = partition_by or None, None
+    plan.notes = [n for n in (order_note, partition_note) if n]
+    if sample_by:
+        plan.sample_by, plan.order_by = _sample_key(profiles, sample_by, plan.order_by)
+    return plan
+
+
+def _sample_key(profiles: List[ColumnProfile], column: str, order_by: str):
+    """Sampling expression for ``column`` and the ``ORDER BY`` that contains it."""
+    col = next((c for c in profiles if c.name == column), None)
+    if col is None:
+        raise ValueError(f"Unknown sample_by column: {column}")
+    if col.ch_type.startswith(("Nullable", "LowCardinality(Nullable")):
+        raise ValueError(f"sample_by column {column} is nullable")
+    expr = f"cityHash64({column})"
+    if order_by == "tuple()":
+        return expr, expr
+    keys = order_by[1:-1] if order_by.startswith("(") and order_by.endswith(")") else order_by
+    return expr, f"({keys}, {expr})"
+
+
+def _suggest_order_by(profiles: List[ColumnProfile]):
+    # Low cardinality columns first (cheap to skip by), then the time column
+    keyable = [c for c in profiles if not c.ch_type.startswith("Nullable")]
+    low = sorted(
+        (c for c in keyable if c.ch_type.startswith("LowCardinality") or c.ch_type == "Bool"),
+        key=lambda c: c.distinct,
+    )[:2]
+    times = [c for c in keyable if c.ch_type.startswith(("Date", "DateTime"))]
+    keys = [c.name for c in low] + [c.name for c in times[:1]]
+    if not keys:
+        sorted_cols = [c for c in keyable if c.sorted and c.ch_type.startswith(("UInt", "Int"))]
+        keys = [c.name for c in sorted_cols[:1]]
+    if not keys:
+        return "tuple()", None
+    expr = f"({', '.join(keys)})" if len(keys) > 1 else keys[0]
+    return expr, f"Suggested ORDER BY {expr}"
+
+
+def _suggest_partition_by(profiles: List[ColumnProfile]):
+    for col in profiles:
+        if col.ch_type.startswith("Nullable") or col.min is None:
+            continue
+        if not col.ch_type.startswith(("Date", "DateTime")):
+            continue
+        months = (col.max.year - col.min.year) * 12 + col.max.month - col.min.month + 1
+        # Monthly partitions only pay off for a moderate number of months
+        if 2 <= months <= 120:
+            expr = f"toYYYYMM({col.name})"
+            return expr, f"Suggested PARTITION BY {expr} ({months} months)"
+    return None, None
+
+
+def create_table_sql(dest_table: str, plan: TablePlan, codecs: bool = False, settings: str = "") -> str:
+    sql = f"CREATE TABLE IF NOT EXISTS {dest_table} ({plan.column_ddl(codecs)}) ENGINE = MergeTree()"
+    if plan.partition_by:
+        sql += f" PARTITION BY {plan.partition_by}"
+    sql += f" ORDER BY {plan.order_by}"
+    if plan.sample_by:
+        sql += f" SAMPLE BY {plan.sample_by}"
+    if settings:
+        sql += f" SETTINGS {settings}"
+    return sql
+
+
+def compression_report(ch_client, dest_table: str, expected: Dict[str, int]) -> List[Dict[str, Any]]:
+    """Compare Parquet (expected) and ClickHouse (actual) compressed bytes per column."""
+    result = ch_client.query(
+        "SELECT name, data_compressed_bytes, data_uncompressed_bytes FROM system.columns "
+        "WHERE database = currentDatabase() AND table = {table:String}",
+        parameters={"table": dest_table},
+    )
+    report = []
+    for name, compressed, uncompressed in result.result_rows:
+        report.append(
+            {
+                "column": name,
+                "expected_bytes": expected.get(name, 0),
+                "actual_bytes": compressed,
+                "uncompressed_bytes": uncompressed,
+            }
+        )
+    return report
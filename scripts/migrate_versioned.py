@@ -0,0 +1,38 @@
+"""Convert legacy ``MergeTree`` entity tables to versioned ``ReplacingMergeTree``.
+
+``init_db`` runs in every worker and only reports tables that still use the
+old engine. Run this once per deployment (with writes to the entity tables
+paused) to copy each legacy table into a versioned one and swap them; the
+old table is kept as ``<table>__legacy_<timestamp>``.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.clickhouse_client import ENTITY_TABLES, ClickHouseClient  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate entity tables to ReplacingMergeTree")
+    parser.add_argument(
+        "--table",
+        action="append",
+        choices=sorted(ENTITY_TABLES),
+        help="Table to migrate (repeatable, default: all entity tables)",
+    )
+    args = parser.parse_args()
+
+    ch = ClickHouseClient()
+    try:
+        for table in args.table or ENTITY_TABLES:
+            migrated = ch.migrate_to_versioned(table)
+            print(f"{table}: {'migrated' if migrated else 'skipped'}")
+    finally:
+        ch.close()
+
+
+if __name__ == "__main__":
+    main()
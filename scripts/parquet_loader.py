@@ -0,0 +1,336 @@
+"""Pipelined Parquet loader: ranged reads -> parallel decode -> parallel insert.
+
+The loader never holds the whole file in memory. Parquet is read through a
+seekable file object (a local file or :class:`MinioRangeFile`, which turns
+``seek``/``read`` into ranged GETs), row groups are decoded by a thread pool
+and handed to ``insert_workers`` threads through a bounded queue. At most
+``decode_workers + queue_size + insert_workers`` batches of ``batch_size`` rows
+are alive at any time, whatever the size of the file.
+"""
+
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+
+_STOP = object()
+
+
+class MinioRangeFile(io.RawIOBase):
+    """Read-only seekable view of a MinIO/S3 object backed by ranged GETs.
+
+    Reads are served from a single ``block_size`` read-ahead block so that
+    pyarrow's many small reads (footer, page headers) do not turn into one
+    request each.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        obj: str,
+        size: Optional[int] = None,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ):
+        self._client = client
+        self.bucket = bucket
+        self.obj = obj
+        self.size = size if size is not None else client.stat_object(bucket, obj).size
+        self.block_size = block_size
+        self._pos = 0
+        self._block_start = 0
+        self._block = b""
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._pos
+
+    def _fetch(self, start: int, length: int) -> bytes:
+        response = self._client.get_object(self.bucket, self.obj, offset=start, length=length)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+            response.release_conn()
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        return data
+
+    def readinto(self, b) -> int:
+        wanted = min(len(b), self.size - self._pos)
+        if wanted <= 0:
+            return 0
+        block_end = self._block_start + len(self._block)
+        if self._block_start <= self._pos and self._pos + wanted <= block_end:
+            offset = self._pos - self._block_start
+            data = self._block[offset:offset + wanted]
+        elif wanted >= self.block_size:
+            # Large reads (whole column chunks) bypass the read-ahead block
+            data = self._fetch(self._pos, wanted)
+        else:
+            length = min(self.block_size, self.size - self._pos)
+            self._block_start, self._block = self._pos, self._fetch(self._pos, length)
+            data = self._block[:wanted]
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class Checkpoint:
+    """Local JSON manifest of loaded files and row groups, used to resume a run.
+
+    Each file entry is keyed by object name and remembers the object ETag
+    (a changed object is loaded again from scratch), the batch size (so that
+    retried inserts reuse the same deduplication tokens), completed row
+    groups and whether the whole file is done. The manifest is rewritten
+    atomically after every update.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f).get("files", {})
+
+    def entry(self, obj: str, etag: str, batch_size: int) -> Dict[str, Any]:
+        """Entry of ``obj``; reset if the object changed since the last run."""
+        entry = self.files.get(obj)
+        if entry is None or entry.get("etag") != etag:
+            entry = self.files[obj] = {
+                "etag": etag,
+                "batch_size": batch_size,
+                "row_groups": [],
+                "rows": 0,
+                "done": False,
+            }
+        return entry
+
+    def is_done(self, obj: str, etag: str) -> bool:
+        entry = self.files.get(obj)
+        return bool(entry and entry.get("etag") == etag and entry.get("done"))
+
+    def row_group_done(self, obj: str, group: int, rows: int) -> None:
+        entry = self.files[obj]
+        if group not in entry["row_groups"]:
+            entry["row_groups"].append(group)
+            entry["rows"] += rows
+        self.save()
+
+    def file_done(self, obj: str) -> None:
+        self.files[obj]["done"] = True
+        self.save()
+
+    def save(self) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"files": self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def dedup_token(obj: str, etag: str, group: int, batch: int) -> str:
+    """Insert deduplication token for one batch of one row group of an object."""
+    return f"{obj}:{etag}:{group}:{batch}"
+
+
+def open_minio_object(client, bucket: str, obj: str, block_size: int = DEFAULT_BLOCK_SIZE):
+    """Return a factory opening independent range readers over one object.
+
+    Every decode thread needs its own file position, so the loader asks for a
+    new reader per thread; the object size is looked up only once.
+    """
+    size = client.stat_object(bucket, obj).size
+
+    def opener():
+        return pq.ParquetFile(MinioRangeFile(client, bucket, obj, size, block_size))
+
+    return opener
+
+
+def open_local_file(path: str):
+    """Factory counterpart of :func:`open_minio_object` for a plain file.
+
+    The path is handed to pyarrow, which owns the file handle and releases it
+    when the ``ParquetFile`` is closed.
+    """
+
+    def opener():
+        return pq.ParquetFile(path)
+
+    return opener
+
+
+def load_parquet(
+    open_file: Callable[[], pq.ParquetFile],
+    client_factory: Callable[[], Any],
+    dest_table: str,
+    batch_size: int = 100000,
+    decode_workers: int = 4,
+    insert_workers: int = 4,
+    queue_size: int = 8,
+    row_groups: Optional[Iterable[int]] = None,
+    on_row_group: Optional[Callable[[int, int], None]] = None,
+    insert_settings: Optional[Callable[[int, int], Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """Load ``row_groups`` (default: all) of a Parquet file into ``dest_table``.
+
+    ``open_file`` returns a new ``ParquetFile`` per decode thread and
+    ``client_factory`` a new ClickHouse client per insert thread, because
+    neither a file position nor a ClickHouse HTTP session can be shared
+    between threads. ``on_row_group(index, rows)`` is called once every batch
+    of a row group has been inserted. ``insert_settings(index, batch)`` may
+    return settings for the ``batch``-th insert of a row group, e.g. an
+    ``insert_deduplication_token`` that makes a retried insert a no-op.
+    Every file opened here is closed before returning.
+    """
+    first = open_file()
+    opened = [first]
+    metadata = first.metadata
+    groups = list(range(metadata.num_row_groups) if row_groups is None else row_groups)
+    work: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    local = threading.local()
+    lock = threading.Lock()
+    # Per row group: [batches decoded, batches inserted, decoding finished]
+    remaining: Dict[int, List[int]] = {g: [0, 0, 0] for g in groups}
+    stats = {"rows": 0, "batches": 0, "insert_seconds": 0.0, "decode_seconds": 0.0}
+
+    def put(item) -> None:
+        while not stop.is_set():
+            try:
+                work.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def fail(exc: BaseException) -> None:
+        with lock:
+            errors.append(exc)
+        stop.set()
+
+    def row_group_done(group: int, rows: int) -> None:
+        if on_row_group is not None:
+            on_row_group(group, rows)
+
+    def decode(group: int) -> None:
+        if stop.is_set():
+            return
+        try:
+            if not hasattr(local, "file"):
+                local.file = open_file()
+                with lock:
+                    opened.append(local.file)
+            start = time.perf_counter()
+            batches = local.file.iter_batches(batch_size=batch_size, row_groups=[group])
+            for index, batch in enumerate(batches):
+                with lock:
+                    stats["decode_seconds"] += time.perf_counter() - start
+                    remaining[group][0] += 1
+                put((group, index, pa.Table.from_batches([batch])))
+                start = time.perf_counter()
+            with lock:
+                state = remaining[group]
+                state[2] = 1
+                finished = state[0] == state[1]
+            if finished:
+                row_group_done(group, metadata.row_group(group).num_rows)
+        except BaseException as exc:  # noqa: BLE001 - reported to the caller
+            fail(exc)
+
+    def insert_loop() -> None:
+        try:
+            client = client_factory()
+            while not stop.is_set():
+                try:
+                    item = work.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _STOP:
+                    return
+                group, index, table = item
+                settings = insert_settings(group, index) if insert_settings else None
+                start = time.perf_counter()
+                if settings:
+                    client.insert_arrow(dest_table, table, settings=settings)
+                else:
+                    client.insert_arrow(dest_table, table)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    stats["rows"] += table.num_rows
+                    stats["batches"] += 1
+                    stats["insert_seconds"] += elapsed
+                    state = remaining[group]
+                    state[1] += 1
+                    finished = state[2] and state[0] == state[1]
+                if finished:
+                    row_group_done(group, metadata.row_group(group).num_rows)
+        except BaseException as exc:  # noqa: BLE001 - reported to the caller
+            fail(exc)
+
+    start = time.perf_counter()
+    inserters = [
+        threading.Thread(target=insert_loop, name=f"insert-{i}", daemon=True)
+        for i in range(insert_workers)
+    ]
+    for thread in inserters:
+        thread.start()
+    try:
+        with ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="decode") as pool:
+            list(pool.map(decode, groups))
+    finally:
+        for pq_file in opened:
+            pq_file.close()
+    for _ in inserters:
+        put(_STOP)
+    for thread in inserters:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - start
+    logging.info(
+        "Loaded %d rows from %d row groups into %s in %.2f seconds",
+        stats["rows"], len(groups), dest_table, elapsed,
+    )
+    return {
+        **stats,
+        "row_groups": len(groups),
+        "seconds": elapsed,
+        "rows_per_second": stats["rows"] / elapsed if elapsed else 0.0,
+        "compressed_bytes": sum(compressed_size(metadata, g) for g in groups),
+    }
+
+
+def compressed_size(metadata: pq.FileMetaData, group: int) -> int:
+    """On-disk (compressed) size of one row group."""
+    row_group = metadata.row_group(group)
+    return sum(row_group.column(i).total_compressed_size for i in range(row_group.num_columns))
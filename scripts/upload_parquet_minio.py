@@ -1,15 +1,51 @@
 import argparse
+import functools
+import multiprocessing
 import os
+import queue
 import sys
 import time
-import io
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
 
 from minio import Minio
 import pyarrow as pa
-import pyarrow.parquet as pq
 from clickhouse_connect import get_client
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.bulk_insert import insert_arrow_batches  # noqa: E402
+from ddl_inference import (  # noqa: E402
+    ColumnProfile,
+    TablePlan,
+    compression_report,
+    create_table_sql,
+    merge_profiles,
+    plan_table,
+    profile_parquet,
+)
+from parquet_loader import (  # noqa: E402
+    DEFAULT_BLOCK_SIZE,
+    Checkpoint,
+    compressed_size,
+    dedup_token,
+    load_parquet,
+    open_minio_object,
+)
+
+
+DEFAULT_DDL_OPTIONS: Dict[str, Any] = {
+    "infer": True,
+    "order_by": None,
+    "partition_by": None,
+    "sample_by": None,
+    "codecs": False,
+    "sample_rows": 100000,
+    "min_integer_bits": 8,
+}
+
 
 def arrow_to_clickhouse(pa_type: pa.DataType) -> str:
     mapping = {
@@ -24,6 +60,91 @@ def arrow_to_clickhouse(pa_type: pa.DataType) -> str:
     return "String"
 
 
+def create_table(
+    ch_client,
+    dest_table: str,
+    pq_file,
+    drop_table: bool = False,
+    dedup_window: int = 0,
+    ddl_options: Optional[Dict[str, Any]] = None,
+    profiles: Optional[List[ColumnProfile]] = None,
+) -> Optional[TablePlan]:
+    """Create ``dest_table`` for the columns of ``pq_file``.
+
+    With ``ddl_options["infer"]`` (the default) column types, codecs and keys
+    come from :mod:`ddl_inference`; otherwise every column uses the broad
+    ``arrow_to_clickhouse`` mapping and ``ORDER BY tuple()``. With
+    ``ddl_options["sample_by"]`` the table gets a ``SAMPLE BY`` key on the hash
+    of that column, so ``approx=true`` queries can read a sample. ``dedup_window``
+    enables ``insert_deduplication_token`` on a non replicated MergeTree by
+    keeping the hashes of the last ``dedup_window`` inserted blocks. With
+    inference, ``profiles`` (e.g. merged over several files) replace the
+    profile of ``pq_file``. Returns the plan used, or ``None`` without
+    inference.
+    """
+    options = {**DEFAULT_DDL_OPTIONS, **(ddl_options or {})}
+    settings = f"non_replicated_deduplication_window = {dedup_window}" if dedup_window else ""
+    plan = None
+    if options["infer"]:
+        if profiles is None:
+            profiles = profile_parquet(pq_file, options["sample_rows"])
+        plan = plan_table(
+            profiles,
+            order_by=options["order_by"],
+            partition_by=options["partition_by"],
+            min_integer_bits=options["min_integer_bits"],
+            sample_by=options["sample_by"],
+        )
+        for note in plan.notes:
+            logging.info(note)
+        create_sql = create_table_sql(dest_table, plan, options["codecs"], settings)
+    else:
+        schema = ", ".join(
+            f"{field.name} {arrow_to_clickhouse(field.type)}" for field in pq_file.schema_arrow
+        )
+        create_sql = f"CREATE TABLE IF NOT EXISTS {dest_table} ({schema}) ENGINE = MergeTree()"
+        if options["sample_by"]:
+            sample_key = f"cityHash64({options['sample_by']})"
+            create_sql += f" ORDER BY {sample_key} SAMPLE BY {sample_key}"
+        else:
+            create_sql += " ORDER BY tuple()"
+        if settings:
+            create_sql += f" SETTINGS {settings}"
+    logging.info("Destination DDL: %s", create_sql)
+    try:
+        if drop_table:
+            ch_client.command(f"DROP TABLE IF EXISTS {dest_table}")
+        ch_client.command(create_sql)
+    except Exception as exc:
+        logging.error("Failed to prepare ClickHouse table %s: %s", dest_table, exc)
+        raise
+    return plan
+
+
+def log_compression_report(ch_client, dest_table: str, plan: Optional[TablePlan]) -> None:
+    """Log Parquet (expected) vs ClickHouse (actual) compressed size per column."""
+    if plan is None:
+        return
+    try:
+        report = compression_report(ch_client, dest_table, plan.expected_bytes())
+    except Exception as exc:
+        logging.warning("Could not read compressed sizes of %s: %s", dest_table, exc)
+        return
+    for row in report:
+        logging.info(
+            "%-24s expected %10.1f MB  actual %10.1f MB  (uncompressed %10.1f MB)",
+            row["column"],
+            row["expected_bytes"] / 1e6,
+            row["actual_bytes"] / 1e6,
+            row["uncompressed_bytes"] / 1e6,
+        )
+    expected = sum(row["expected_bytes"] for row in report)
+    actual = sum(row["actual_bytes"] for row in report)
+    logging.info(
+        "Compressed size of %s: expected %.1f MB, actual %.1f MB", dest_table, expected / 1e6, actual / 1e6
+    )
+
+
 def upload_parquet_from_minio(
     endpoint: str,
     access_key: str,
@@ -34,56 +155,252 @@ def upload_parquet_from_minio(
     dest_table: str,
     batch_size: int = 100000,
     drop_table: bool = False,
+    client_factory=None,
+    decode_workers: int = 4,
+    insert_workers: int = 4,
+    queue_size: int = 8,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    ddl_options: Optional[Dict[str, Any]] = None,
 ) -> int:
+    """Stream ``obj`` from MinIO into ``dest_table`` without downloading it first.
+
+    Row groups are fetched with ranged GETs, decoded by ``decode_workers``
+    threads and inserted by ``insert_workers`` threads, each using its own
+    client from ``client_factory`` (``ch_client`` is used for DDL and, when no
+    factory is given, for a single insert worker). ``ddl_options`` control
+    how the destination table is created, see :func:`create_table`.
+    """
     try:
         client = Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=False)
-        response = client.get_object(bucket, obj)
-        buffer = io.BytesIO()
-        for chunk in response.stream(32 * 1024):
-            buffer.write(chunk)
-        buffer.seek(0)
+        open_file = open_minio_object(client, bucket, obj, block_size)
+        pq_file = open_file()
     except Exception as exc:
-        logging.error("Failed to download %s from bucket %s: %s", obj, bucket, exc)
+        logging.error("Failed to open %s from bucket %s: %s", obj, bucket, exc)
         raise
 
-    pq_file = pq.ParquetFile(buffer)
-    columns = pq_file.schema_arrow.names
-    schema = ", ".join(
-        f"{name} {arrow_to_clickhouse(pq_file.schema_arrow.field(name).type)}" for name in columns
-    )
+    plan = create_table(ch_client, dest_table, pq_file, drop_table, ddl_options=ddl_options)
+
+    def log_row_group(index: int, rows: int) -> None:
+        logging.info("Inserted row group %d with %d rows", index, rows)
 
+    if client_factory is None:
+        client_factory, insert_workers = (lambda: ch_client), 1
     try:
-        if drop_table:
-            ch_client.command(f"DROP TABLE IF EXISTS {dest_table}")
-        create_sql = f"CREATE TABLE IF NOT EXISTS {dest_table} ({schema}) ENGINE = MergeTree() ORDER BY tuple()"
-        ch_client.command(create_sql)
+        stats = load_parquet(
+            open_file,
+            client_factory,
+            dest_table,
+            batch_size=batch_size,
+            decode_workers=decode_workers,
+            insert_workers=insert_workers,
+            queue_size=queue_size,
+            on_row_group=log_row_group,
+        )
     except Exception as exc:
-        logging.error("Failed to prepare ClickHouse table %s: %s", dest_table, exc)
+        logging.error("Failed to insert into %s: %s", dest_table, exc)
         raise
 
-    total_rows = 0
-    batch_count = 0
-    for batch in pq_file.iter_batches(batch_size=batch_size):
-        batch_count += 1
-        start_batch = time.time()
-        table = pa.Table.from_batches([batch])
+    logging.info(
+        "Completed upload with %d total rows (%.0f rows/s)",
+        stats["rows"],
+        stats["rows_per_second"],
+    )
+    log_compression_report(ch_client, dest_table, plan)
+
+    return stats["rows"]
+
+
+def _load_object(
+    minio_config: Dict[str, Any],
+    ch_config: Dict[str, Any],
+    bucket: str,
+    obj: str,
+    etag: str,
+    dest_table: str,
+    batch_size: int,
+    skip_row_groups,
+    loader_options: Dict[str, Any],
+    events,
+) -> Dict[str, Any]:
+    """Load one object in a worker process, reporting finished row groups to ``events``."""
+    open_file = open_minio_object(
+        Minio(**minio_config), bucket, obj, loader_options.pop("block_size", DEFAULT_BLOCK_SIZE)
+    )
+    # Only the footer is needed here; load_parquet opens its own readers
+    pq_file = open_file()
+    try:
+        metadata = pq_file.metadata
+    finally:
+        pq_file.close()
+    skip = set(skip_row_groups)
+    groups = [g for g in range(metadata.num_row_groups) if g not in skip]
+
+    def on_row_group(group: int, rows: int) -> None:
+        events.put((obj, group, rows, compressed_size(metadata, group)))
+
+    return load_parquet(
+        open_file,
+        functools.partial(get_client, **ch_config),
+        dest_table,
+        batch_size=batch_size,
+        row_groups=groups,
+        on_row_group=on_row_group,
+        insert_settings=lambda group, batch: {
+            "insert_deduplication_token": dedup_token(obj, etag, group, batch)
+        },
+        **loader_options,
+    )
+
+
+def profile_objects(client, bucket: str, names: List[str], sample_rows: int) -> List[ColumnProfile]:
+    """Profile every object in ``names`` and merge the results into one table profile."""
+    profiles = []
+    for name in names:
+        pq_file = open_minio_object(client, bucket, name)()
         try:
-            ch_client.insert_arrow(dest_table, table)
-        except Exception as exc:
-            logging.error("Failed to insert batch %d: %s", batch_count, exc)
-            raise
-        elapsed_batch = time.time() - start_batch
-        total_rows += table.num_rows
+            profiles.append(profile_parquet(pq_file, sample_rows))
+        finally:
+            pq_file.close()
+    return merge_profiles(profiles)
+
+
+def upload_prefix_from_minio(
+    minio_config: Dict[str, Any],
+    ch_config: Dict[str, Any],
+    bucket: str,
+    prefix: str,
+    dest_table: str,
+    checkpoint_path: str,
+    processes: Optional[int] = None,
+    batch_size: int = 100000,
+    drop_table: bool = False,
+    suffix: str = ".parquet",
+    dedup_window: int = 10000,
+    ddl_options: Optional[Dict[str, Any]] = None,
+    **loader_options,
+) -> Dict[str, Any]:
+    """Load every ``suffix`` object under ``prefix`` with a pool of processes.
+
+    Finished row groups and files are recorded in the checkpoint at
+    ``checkpoint_path`` so an interrupted run resumes where it stopped. Each
+    insert carries a deduplication token derived from object, ETag, row group
+    and batch, so a row group that was partly inserted before the
+    interruption is not duplicated when it is loaded again.
+
+    The table is planned from the merged profiles of every listed object
+    (see :func:`profile_objects`). Inferred integer columns are still kept at
+    least 32 bits wide, since files added under the prefix later are loaded
+    into the existing table.
+    """
+    client = Minio(**minio_config)
+    objects = [
+        o
+        for o in client.list_objects(bucket, prefix=prefix, recursive=True)
+        if o.object_name.endswith(suffix)
+    ]
+    if not objects:
+        logging.warning("No %s objects under %s/%s", suffix, bucket, prefix)
+        return {"files": 0, "rows": 0, "failed": 0}
+    checkpoint = Checkpoint(checkpoint_path)
+    if drop_table:
+        # The manifest describes rows of the table that is about to be dropped
+        checkpoint.files = {}
+    pending = [o for o in objects if not checkpoint.is_done(o.object_name, o.etag)]
+    logging.info(
+        "%d objects under %s/%s, %d already loaded", len(objects), bucket, prefix, len(objects) - len(pending)
+    )
+    options = {**DEFAULT_DDL_OPTIONS, "min_integer_bits": 32, **(ddl_options or {})}
+    profiles = None
+    if options["infer"]:
+        logging.info("Profiling %d objects to plan %s", len(objects), dest_table)
+        profiles = profile_objects(
+            client, bucket, [o.object_name for o in objects], options["sample_rows"]
+        )
+    first = open_minio_object(client, bucket, objects[0].object_name)()
+    ch_client = get_client(**ch_config)
+    try:
+        plan = create_table(
+            ch_client, dest_table, first, drop_table, dedup_window, options, profiles
+        )
+    finally:
+        first.close()
+
+    total_bytes = sum(o.size for o in pending)
+    done_bytes = 0
+    rows = failed = 0
+    start = time.time()
+    file_start: Dict[str, float] = {}
+
+    def handle(event) -> None:
+        nonlocal done_bytes
+        obj, group, group_rows, group_bytes = event
+        checkpoint.row_group_done(obj, group, group_rows)
+        done_bytes += group_bytes
+        elapsed = time.time() - start
+        rate = done_bytes / elapsed if elapsed else 0.0
+        eta = (total_bytes - done_bytes) / rate if rate else float("inf")
         logging.info(
-            "Inserted batch %d with %d rows in %.2f seconds",
-            batch_count,
-            table.num_rows,
-            elapsed_batch,
+            "%s row group %d done (%d rows); overall %.1f%% at %.1f MB/s, ETA %.0fs",
+            obj, group, group_rows, 100 * done_bytes / total_bytes, rate / 1e6, eta,
         )
 
-    logging.info("Completed %d batches with %d total rows", batch_count, total_rows)
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(processes) as pool:
+        events = manager.Queue()
+        futures = {}
+        for o in pending:
+            entry = checkpoint.entry(o.object_name, o.etag, batch_size)
+            future = pool.submit(
+                _load_object,
+                minio_config,
+                ch_config,
+                bucket,
+                o.object_name,
+                o.etag,
+                dest_table,
+                entry["batch_size"],
+                list(entry["row_groups"]),
+                dict(loader_options),
+                events,
+            )
+            futures[future] = o.object_name
+            file_start[o.object_name] = time.time()
+        checkpoint.save()
+        remaining = set(futures)
+        while remaining:
+            try:
+                handle(events.get(timeout=0.5))
+                continue
+            except queue.Empty:
+                pass
+            for future in [f for f in remaining if f.done()]:
+                remaining.discard(future)
+                obj = futures[future]
+                try:
+                    stats = future.result()
+                except Exception as exc:
+                    failed += 1
+                    logging.error("Failed to load %s: %s", obj, exc)
+                    continue
+                checkpoint.file_done(obj)
+                rows += stats["rows"]
+                elapsed = time.time() - file_start[obj]
+                logging.info(
+                    "Loaded %s: %d rows in %.1fs (%.0f rows/s, %.1f MB/s)",
+                    obj, stats["rows"], elapsed, stats["rows"] / elapsed,
+                    stats["compressed_bytes"] / elapsed / 1e6,
+                )
+        while True:
+            try:
+                handle(events.get_nowait())
+            except queue.Empty:
+                break
 
-    return total_rows
+    elapsed = time.time() - start
+    logging.info(
+        "Loaded %d files (%d failed), %d rows in %.1fs", len(pending) - failed, failed, rows, elapsed
+    )
+    log_compression_report(ch_client, dest_table, plan)
+    return {"files": len(pending) - failed, "rows": rows, "failed": failed, "seconds": elapsed}
 
 
 def upload_table_to_clickhouse(
@@ -102,8 +419,7 @@ def upload_table_to_clickhouse(
 
     create_sql = f"CREATE TABLE IF NOT EXISTS {dest_table} ({schema}) ENGINE = MergeTree() ORDER BY tuple()"
     ch_client.command(create_sql)
-    for batch in table.to_batches(batch_size):
-        ch_client.insert_arrow(dest_table, pa.Table.from_batches([batch]))
+    insert_arrow_batches(ch_client, dest_table, table.to_batches(batch_size), batch_size)
 
 
 def main():
@@ -113,7 +429,9 @@ def main():
 
     parser = argparse.ArgumentParser(description="Upload parquet file from MinIO to ClickHouse")
     parser.add_argument("--bucket", required=True, help="MinIO bucket name")
-    parser.add_argument("--object", required=True, help="Parquet object name")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--object", help="Parquet object name")
+    source.add_argument("--prefix", help="Load every Parquet object under this prefix")
     parser.add_argument("--table", required=True, help="Destination ClickHouse table")
     parser.add_argument(
         "--minio-endpoint",
@@ -133,19 +451,103 @@ def main():
     parser.add_argument("--ch-db", default=os.environ.get("CLICKHOUSE_DATABASE", "default"))
     parser.add_argument("--batch-size", type=int, default=100000, help="Rows per insert batch")
     parser.add_argument("--drop-table", action="store_true", help="Drop destination table before loading")
-
+    parser.add_argument("--decode-workers", type=int, default=4, help="Threads decoding row groups")
+    parser.add_argument("--insert-workers", type=int, default=4, help="Concurrent insert connections")
+    parser.add_argument(
+        "--queue-size", type=int, default=8, help="Decoded batches buffered between decode and insert"
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=DEFAULT_BLOCK_SIZE,
+        help="Read-ahead size of each ranged GET in bytes",
+    )
+    parser.add_argument(
+        "--processes", type=int, default=os.cpu_count(), help="Files loaded in parallel (--prefix)"
+    )
+    parser.add_argument("--suffix", default=".parquet", help="Object name suffix to load (--prefix)")
+    parser.add_argument(
+        "--checkpoint",
+        help="Manifest of loaded files/row groups (--prefix, default .upload_<table>.json)",
+    )
+    parser.add_argument(
+        "--simple-types",
+        action="store_true",
+        help="Map every integer to Int64 and string to String instead of inferring narrow types",
+    )
+    parser.add_argument("--order-by", help="ORDER BY expression (default: suggested, 'tuple()' for none)")
+    parser.add_argument("--partition-by", help="PARTITION BY expression (default: suggested, '' for none)")
+    parser.add_argument(
+        "--sample-by", help="Column whose hash becomes the SAMPLE BY key (default: not sampleable)"
+    )
+    parser.add_argument("--codecs", action="store_true", help="Apply suggested per-column codecs")
+    parser.add_argument(
+        "--sample-rows", type=int, default=100000, help="Rows sampled to estimate cardinality"
+    )
+    parser.add_argument(
+        "--dedup-window",
+        type=int,
+        default=10000,
+        help="non_replicated_deduplication_window of tables created with --prefix",
+    )
 
     args = parser.parse_args()
 
+    ch_config = {
+        "host": args.ch_host,
+        "port": args.ch_port,
+        "username": args.ch_user,
+        "password": args.ch_password,
+        "database": args.ch_db,
+    }
+    client_factory = functools.partial(get_client, **ch_config)
+    ddl_options = {
+        "infer": not args.simple_types,
+        "order_by": args.order_by,
+        "partition_by": args.partition_by,
+        "sample_by": args.sample_by,
+        "codecs": args.codecs,
+        "sample_rows": args.sample_rows,
+    }
+
     start = time.time()
-    try:
-        ch_client = get_client(
-            host=args.ch_host,
-            port=args.ch_port,
-            username=args.ch_user,
-            password=args.ch_password,
-            database=args.ch_db,
+    if args.prefix is not None:
+        minio_config = {
+            "endpoint": args.minio_endpoint,
+            "access_key": args.minio_access,
+            "secret_key": args.minio_secret,
+            "secure": False,
+        }
+        try:
+            result = upload_prefix_from_minio(
+                minio_config,
+                ch_config,
+                args.bucket,
+                args.prefix,
+                args.table,
+                args.checkpoint or f".upload_{args.table}.json",
+                processes=args.processes,
+                batch_size=args.batch_size,
+                drop_table=args.drop_table,
+                suffix=args.suffix,
+                dedup_window=args.dedup_window,
+                ddl_options=ddl_options,
+                decode_workers=args.decode_workers,
+                insert_workers=args.insert_workers,
+                queue_size=args.queue_size,
+                block_size=args.block_size,
+            )
+        except Exception as exc:
+            logging.error("Upload failed: %s", exc)
+            sys.exit(1)
+        print(
+            f"Uploaded {result['rows']} rows from {result['files']} files "
+            f"in {time.time() - start:.2f} seconds"
         )
+        sys.exit(1 if result["failed"] else 0)
+
+    try:
+        ch_client = client_factory()
     except Exception as exc:
         logging.error("Failed to connect to ClickHouse: %s", exc)
         sys.exit(1)
@@ -161,6 +563,12 @@ def main():
             dest_table=args.table,
             batch_size=args.batch_size,
             drop_table=args.drop_table,
+            client_factory=client_factory,
+            decode_workers=args.decode_workers,
+            insert_workers=args.insert_workers,
+            queue_size=args.queue_size,
+            block_size=args.block_size,
+            ddl_options=ddl_options,
         )
     except Exception as exc:
         logging.error("Upload failed: %s", exc)
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import sys
+from datetime import timedelta
+from pathlib import Path
+from urllib.parse import urlencode
+
+import pytest
+from jose import JWTError
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.core import security
+from app.core.security import TokenCache, create_access_token, decode_token
+from app.main import app
+from app.services.credentials import (
+    ClickHouseCredentialStore,
+    CredentialStore,
+    MemoryCredentialStore,
+    RegistrationConflictError,
+    hash_password,
+    verify_password,
+)
+
+
+async def post(path, body, content_type):
+    messages = []
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return messages[0]["status"], json.loads(messages[1]["body"])
+
+
+def test_password_hash_is_salted_and_verifies():
+    first = hash_password("secret", iterations=1000)
+    second = hash_password("secret", iterations=1000)
+    assert first != second
+    assert verify_password("secret", first) and verify_password("secret", second)
+    assert not verify_password("wrong", first)
+    assert not verify_password("secret", "plain-text")
+
+
+def test_register_and_login_use_credential_store(monkeypatch):
+    monkeypatch.setattr(security.settings, "PASSWORD_HASH_ITERATIONS", 1000)
+    app.state.credentials = store = MemoryCredentialStore()
+    register = json.dumps({"username": "bob", "password": "pw"}).encode()
+    status, body = asyncio.run(post("/auth/register", register, "application/json"))
+    assert status == 200 and body["token_type"] == "bearer"
+    assert store._users["bob"].startswith("pbkdf2_sha256$1000$")
+    status, _ = asyncio.run(post("/auth/register", register, "application/json"))
+    assert status == 400
+
+    form = "application/x-www-form-urlencoded"
+    login = urlencode({"username": "bob", "password": "pw"}).encode()
+    status, body = asyncio.run(post("/auth/login", login, form))
+    assert status == 200 and decode_token(body["access_token"])["sub"] == "bob"
+    wrong = urlencode({"username": "bob", "password": "nope"}).encode()
+    assert asyncio.run(post("/auth/login", wrong, form))[0] == 401
+    missing = urlencode({"username": "nobody", "password": "pw"}).encode()
+    assert asyncio.run(post("/auth/login", missing, form))[0] == 401
+
+
+def test_verified_tokens_are_cached_until_expiry(monkeypatch):
+    monkeypatch.setattr(security, "token_cache", TokenCache(max_size=2))
+    calls = []
+    real_decode = security.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return real_decode(*args, **kwargs)
+
+    monkeypatch.setattr(security.jwt, "decode", counting_decode)
+    token = create_access_token({"sub": "alice"})
+    for _ in range(3):
+        assert decode_token(token)["sub"] == "alice"
+    assert len(calls) == 1
+
+    expired = create_access_token({"sub": "alice"}, expires_delta=timedelta(seconds=-1))
+    with pytest.raises(JWTError):
+        decode_token(expired)
+    with pytest.raises(JWTError):
+        decode_token(token + "x")
+    assert security.token_cache.stats()["entries"] == 1
+
+
+class RacingClickHouse:
+    """Bảng ``auth_users`` giả: ``get`` của cả hai lần đăng ký chạy trước khi có dòng nào."""
+
+    def __init__(self):
+        self.rows = []
+        self.commands = []
+
+    async def acommand(self, sql, parameters=None):
+        self.commands.append(sql)
+
+    async def ainsert(self, table, data, column_names=None):
+        self.rows.extend(data)
+
+    async def aquery(self, sql, parameters=None):
+        rows = [r for r in self.rows if r[0] == parameters["username"]]
+        await asyncio.sleep(0)
+
+        class Result:
+            result_rows = [(max(rows, key=lambda r: (r[2], r[1]))[1],)] if rows else []
+
+        return Result()
+
+
+def test_concurrent_registration_keeps_first_account(monkeypatch):
+    ch = RacingClickHouse()
+    store = ClickHouseCredentialStore(ch)
+    ranks = iter([200, 100])
+    monkeypatch.setattr("app.services.credentials.registration_rank", lambda: next(ranks))
+
+    async def main():
+        return await asyncio.gather(
+            store.create("bob", "owner-hash"), store.create("bob", "attacker-hash"),
+            return_exceptions=True,
+        )
+
+    first, second = asyncio.run(main())
+    assert first is None and isinstance(second, RegistrationConflictError)
+    assert asyncio.run(store.get("bob")) == "owner-hash"
+
+    with pytest.raises(TypeError):
+        CredentialStore()
+
+    # Không có AUTH_ADMIN_PASSWORD thì không tạo tài khoản quản trị
+    monkeypatch.setattr(security.settings, "AUTH_ADMIN_PASSWORD", "")
+    asyncio.run(store.init())
+    assert len(ch.commands) == 1 and [r[0] for r in ch.rows] == ["bob", "bob"]
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.main import app
+from app.routers.crud import read_row, read_rows_batch
+from app.services.batch_loader import BatchLoader, Lookup, TooManyKeysError, parse_ids
+from app.services.clickhouse_client import ClickHouseClient
+
+LOOKUP = Lookup("dim_users", "id", "UInt64", ("id", "name"), versioned=True)
+
+
+class FakeClickHouse:
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    async def aquery(self, sql, parameters=None):
+        self.calls.append((sql, parameters))
+        await asyncio.sleep(0)
+        if self.error:
+            raise self.error
+
+        class Result:
+            result_rows = [(k, f"User {k}") for k in parameters["__keys"] if k % 2]
+
+        return Result()
+
+
+class UsersClient:
+    """Client giả lập trả về người dùng có ID lẻ trong danh sách khóa."""
+
+    queries = []
+
+    def query(self, sql, parameters=None, settings=None):
+        UsersClient.queries.append(sql)
+
+        class Result:
+            result_rows = [
+                (k, f"User {k}", f"u{k}@example.com") for k in parameters["__keys"] if k % 2
+            ]
+
+        return Result()
+
+    def close(self):
+        pass
+
+
+async def get(path, query_string=b""):
+    messages = []
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string,
+        "root_path": "",
+        "headers": [],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return messages[0]["status"], json.loads(messages[1]["body"])
+
+
+def test_concurrent_loads_share_one_in_query():
+    ch = FakeClickHouse()
+    loader = BatchLoader(ch, delay=0, max_keys=10)
+
+    async def main():
+        return await asyncio.gather(*(loader.load(LOOKUP, k) for k in [1, 2, 3, 1]))
+
+    results = asyncio.run(main())
+    assert [r.result_rows for r in results] == [
+        [(1, "User 1")], [], [(3, "User 3")], [(1, "User 1")]
+    ]
+    assert ch.calls == [
+        (
+            "SELECT id, name FROM dim_users FINAL WHERE id IN {__keys:Array(UInt64)} AND _deleted = 0",
+            {"__keys": [1, 2, 3]},
+        )
+    ]
+    assert loader.stats()["loads"] == 4 and loader.stats()["queries"] == 1
+
+
+def test_large_batches_are_split_and_errors_reach_every_caller():
+    ch = FakeClickHouse()
+    loader = BatchLoader(ch, delay=0, max_keys=2)
+    rows = asyncio.run(loader.load_many(LOOKUP, [1, 2, 3, 5, 7]))
+    assert sorted(rows) == [1, 3, 5, 7]
+    assert [p["__keys"] for _, p in ch.calls] == [[1, 2], [3, 5], [7]]
+
+    failing = BatchLoader(FakeClickHouse(error=RuntimeError("boom")), delay=0)
+
+    async def main():
+        return await asyncio.gather(
+            failing.load(LOOKUP, 1), failing.load(LOOKUP, 2), return_exceptions=True
+        )
+
+    assert [str(r) for r in asyncio.run(main())] == ["boom", "boom"]
+
+    assert parse_ids("3, 1,,3", int) == [3, 1]
+    with pytest.raises(TooManyKeysError):
+        parse_ids("1,2,3", int, max_ids=2)
+    with pytest.raises(ValueError):
+        parse_ids("1,x", int)
+
+
+def test_multi_get_endpoint_keeps_request_order():
+    UsersClient.queries = []
+    app.state.clickhouse = ch = ClickHouseClient(client_factory=UsersClient)
+    try:
+        status, body = asyncio.run(get("/users", b"ids=5,2,1,5"))
+        assert status == 200
+        assert [u["id"] for u in body] == [5, 1]
+        assert len(UsersClient.queries) == 1
+        assert asyncio.run(get("/users", b"ids=1,abc"))[0] == 400
+    finally:
+        ch.close()
+
+
+class CrudClickHouse:
+    def __init__(self):
+        self.loader = BatchLoader(FakeClickHouse(), delay=0)
+
+    async def aget_table_schema(self, table):
+        return [("id", "UInt64"), ("name", "String")]
+
+
+def test_invalid_id_is_rejected_before_joining_a_batch():
+    ch = CrudClickHouse()
+
+    async def main():
+        return await asyncio.gather(
+            read_row("dim_users", "1", ch=ch),
+            read_row("dim_users", "abc", ch=ch),
+            read_row("dim_users", "3", ch=ch),
+            return_exceptions=True,
+        )
+
+    first, bad, third = asyncio.run(main())
+    assert (first, third) == ({"id": 1, "name": "User 1"}, {"id": 3, "name": "User 3"})
+    assert isinstance(bad, HTTPException) and bad.status_code == 400
+    assert [p["__keys"] for _, p in ch.loader._ch.calls] == [[1, 3]]
+
+    for ids in ("1,abc", "1,-2"):
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(read_rows_batch("dim_users", ids=ids, ch=ch))
+        assert exc.value.status_code == 400
+    assert len(ch.loader._ch.calls) == 1
+
+
+def test_entity_ids_outside_uint64_never_reach_a_batch():
+    assert parse_ids("0,18446744073709551615") == [0, 2**64 - 1]
+    for raw in ("1,-2", "18446744073709551616", "1.5"):
+        with pytest.raises(ValueError):
+            parse_ids(raw)
+
+    UsersClient.queries = []
+    app.state.clickhouse = ch = ClickHouseClient(client_factory=UsersClient)
+    try:
+        assert asyncio.run(get("/users", b"ids=1,-2"))[0] == 400
+        assert asyncio.run(get("/products", b"ids=18446744073709551616"))[0] == 400
+        assert asyncio.run(get("/orders", b"ids=-1"))[0] == 400
+        for path in ("/users/-1", "/products/18446744073709551616", "/orders/-5/enriched"):
+            assert asyncio.run(get(path))[0] == 422
+        assert UsersClient.queries == []
+    finally:
+        ch.close()
@@ -0,0 +1,98 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pyarrow as pa
+import pytest
+
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services.bulk_insert import BulkFormatError, ingest_body, rebatch
+
+
+SCHEMA = {"id": "UInt64", "name": "String"}
+
+
+class FakeBulkClient:
+    def __init__(self):
+        self.inserts = []
+
+    def insert(self, table, data, column_names=None, column_oriented=False):
+        self.inserts.append((table, data, column_names))
+
+    def insert_arrow(self, table, arrow_table):
+        self.inserts.append((table, arrow_table.to_pydict(), arrow_table.column_names))
+
+
+async def chunks(data: bytes, size: int = 7):
+    for idx in range(0, len(data), size):
+        yield data[idx:idx + size]
+
+
+def test_ingest_ndjson_in_batches():
+    ch = FakeBulkClient()
+    body = b'{"id": 1, "name": "a"}\n{"id": "2", "name": 3}\n\n{"id": 3, "name": "c"}\n'
+    stats = asyncio.run(ingest_body(ch, "t", "application/x-ndjson", chunks(body), SCHEMA, 2))
+    assert stats["rows"] == 3
+    assert stats["bytes"] == len(body)
+    assert ch.inserts == [
+        ("t", [[1, 2], ["a", "3"]], ["id", "name"]),
+        ("t", [[3], ["c"]], ["id", "name"]),
+    ]
+
+
+def test_ingest_csv_and_arrow():
+    ch = FakeBulkClient()
+    csv_body = b"id,name\n1,10\n2,b\n"
+    asyncio.run(ingest_body(ch, "t", "text/csv", chunks(csv_body), SCHEMA, 100))
+    assert ch.inserts[0][1] == {"id": [1, 2], "name": ["10", "b"]}
+
+    table = pa.table({"id": [1, 2, 3], "name": ["a", "b", "c"]})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    body = sink.getvalue().to_pybytes()
+    stats = asyncio.run(
+        ingest_body(ch, "t", "application/vnd.apache.arrow.stream", chunks(body, 64), SCHEMA, 2)
+    )
+    assert stats["rows"] == 3
+    assert [len(i[1]["id"]) for i in ch.inserts[1:]] == [2, 1]
+
+
+def test_ingest_rejects_unknown_columns():
+    ch = FakeBulkClient()
+    with pytest.raises(BulkFormatError):
+        asyncio.run(
+            ingest_body(ch, "t", "application/x-ndjson", chunks(b'{"bad": 1}\n'), SCHEMA, 10)
+        )
+    assert ch.inserts == []
+
+
+def test_rebatch_splits_and_merges():
+    batches = pa.table({"x": list(range(5))}).to_batches(max_chunksize=2)
+    assert [t.num_rows for t in rebatch(batches, 3)] == [3, 2]
+
+
+def test_bad_chunk_is_rejected_before_insert_with_committed_count():
+    ch = FakeBulkClient()
+    # Dòng 3 thiếu cột id không Nullable: lô thứ hai bị từ chối trước khi chèn
+    body = b'{"id": 1, "name": "a"}\n{"id": 2, "name": "b"}\n{"name": "c"}\n'
+    with pytest.raises(BulkFormatError) as exc:
+        asyncio.run(ingest_body(ch, "t", "application/x-ndjson", chunks(body), SCHEMA, 2))
+    assert "line 3" in str(exc.value) and exc.value.rows_committed == 2
+    assert len(ch.inserts) == 1
+
+    ch = FakeBulkClient()
+    csv_body = b"id,name\n1,a\n2,b\nx,c\n"
+    with pytest.raises(BulkFormatError) as exc:
+        asyncio.run(ingest_body(ch, "t", "text/csv", chunks(csv_body), SCHEMA, 100))
+    assert exc.value.rows_committed == 0 and ch.inserts == []
+
+    # Cột Nullable được phép thiếu
+    ch = FakeBulkClient()
+    body = b'{"id": 1, "note": "a"}\n{"id": 2}\n'
+    schema = {"id": "UInt64", "note": "Nullable(String)"}
+    asyncio.run(ingest_body(ch, "t", "application/x-ndjson", chunks(body), schema, 10))
+    assert ch.inserts == [("t", [[1, 2], ["a", None]], ["id", "note"])]
@@ -0,0 +1,284 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services.clickhouse_client import ClickHouseClient, PoolTimeoutError
+
+
+class SlowClient:
+    """Client giả lập: mỗi truy vấn ngủ một khoảng và ghi nhận độ song song."""
+
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def query(self, sql, parameters=None, settings=None):
+        with SlowClient.lock:
+            SlowClient.active += 1
+            SlowClient.peak = max(SlowClient.peak, SlowClient.active)
+        time.sleep(0.05)
+        with SlowClient.lock:
+            SlowClient.active -= 1
+        return sql
+
+    def close(self):
+        pass
+
+
+def test_aquery_runs_concurrently_up_to_pool_size():
+    SlowClient.peak = 0
+    ch = ClickHouseClient(pool_size=4, max_inflight=16, client_factory=SlowClient)
+
+    async def main():
+        return await asyncio.gather(*(ch.aquery(f"SELECT {i}") for i in range(8)))
+
+    try:
+        results = asyncio.run(main())
+    finally:
+        ch.close()
+    assert results == [f"SELECT {i}" for i in range(8)]
+    assert SlowClient.peak == 4
+    assert ch.pool_stats()["created"] == 4
+
+
+def test_acquire_timeout_when_pool_exhausted():
+    ch = ClickHouseClient(pool_size=1, acquire_timeout=0.01, client_factory=SlowClient)
+    try:
+        with ch.session():
+            with pytest.raises(PoolTimeoutError):
+                ch.query("SELECT 1")
+    finally:
+        ch.close()
+
+
+class YieldingLock:
+    """Khóa nhường CPU sau mỗi lần nhả, làm lộ kiểm tra rồi tăng không nguyên tử."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+
+    def __exit__(self, *args):
+        self._lock.release()
+        time.sleep(0.005)
+
+
+def test_concurrent_acquire_never_exceeds_pool_size():
+    created = []
+    lock = threading.Lock()
+
+    def slow_factory():
+        # Tạo kết nối chậm để các thread cùng thấy pool chưa đầy
+        with lock:
+            created.append(1)
+            attempt = len(created)
+        time.sleep(0.02)
+        if attempt == 3:
+            raise ConnectionError("boom")
+        return SlowClient()
+
+    ch = ClickHouseClient(pool_size=3, acquire_timeout=2, client_factory=slow_factory)
+    ch._lock = YieldingLock()
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def borrow():
+        barrier.wait()
+        try:
+            with ch.session():
+                time.sleep(0.02)
+        except ConnectionError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=borrow) for _ in range(8)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Lần tạo lỗi trả lại chỗ, pool tạo lại được tới đúng pool_size
+        assert len(errors) == 1
+        assert ch.pool_stats()["created"] <= 3
+        assert len(created) - len(errors) == ch.pool_stats()["created"]
+    finally:
+        ch.close()
+
+
+class StreamClient:
+    """Client giả lập hỗ trợ ``query_row_block_stream`` và ``KILL QUERY``."""
+
+    killed = []
+
+    class Stream:
+        def __init__(self, blocks):
+            self.blocks = iter(blocks)
+            self.closed = False
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.closed = True
+
+        def __next__(self):
+            return next(self.blocks)
+
+    def query_row_block_stream(self, sql, parameters=None, settings=None):
+        return StreamClient.Stream([[(1,), (2,)], [(3,)]])
+
+    def command(self, sql, parameters=None):
+        StreamClient.killed.append(parameters["query_id"])
+
+    def close(self):
+        pass
+
+
+def test_stream_row_blocks_yields_blocks_and_releases_client():
+    ch = ClickHouseClient(pool_size=1, client_factory=StreamClient)
+
+    async def main():
+        return [block async for block in ch.stream_row_blocks("SELECT 1")]
+
+    try:
+        assert asyncio.run(main()) == [[(1,), (2,)], [(3,)]]
+        assert ch.pool_stats()["in_use"] == 0
+    finally:
+        ch.close()
+
+
+def test_stream_row_blocks_kills_query_when_consumer_stops():
+    StreamClient.killed = []
+    ch = ClickHouseClient(pool_size=2, client_factory=StreamClient)
+
+    async def main():
+        blocks = ch.stream_row_blocks("SELECT 1")
+        first = await blocks.__anext__()
+        await blocks.aclose()
+        return first
+
+    try:
+        assert asyncio.run(main()) == [(1,), (2,)]
+        for _ in range(100):
+            if StreamClient.killed:
+                break
+            time.sleep(0.01)
+        assert len(StreamClient.killed) == 1
+    finally:
+        ch.close()
+
+
+class CountingClient:
+    """Client giả lập đếm số truy vấn thực sự gửi tới ClickHouse."""
+
+    calls = 0
+    killed = []
+    fail = False
+
+    def query(self, sql, parameters=None, settings=None):
+        CountingClient.calls += 1
+        time.sleep(0.05)
+        if CountingClient.fail:
+            raise RuntimeError("boom")
+        return [sql, parameters]
+
+    def command(self, sql, parameters=None):
+        CountingClient.killed.append(parameters["query_id"])
+
+    def close(self):
+        pass
+
+
+def test_identical_concurrent_queries_are_collapsed():
+    CountingClient.calls, CountingClient.fail = 0, False
+    ch = ClickHouseClient(pool_size=4, client_factory=CountingClient)
+
+    async def main():
+        same = [ch.aquery("SELECT  *\nFROM t", {"a": 1}) for _ in range(10)]
+        other = ch.aquery("SELECT * FROM t", {"a": 2})
+        return await asyncio.gather(*same, other)
+
+    try:
+        results = asyncio.run(main())
+    finally:
+        ch.close()
+    assert CountingClient.calls == 2
+    assert all(r is results[0] for r in results[:10])
+    stats = ch.flights.stats()
+    assert stats["leaders"] == 2 and stats["collapsed"] == 9 and stats["in_flight"] == 0
+
+
+def test_collapsed_queries_share_errors_and_retry_afterwards():
+    CountingClient.calls, CountingClient.fail = 0, True
+    ch = ClickHouseClient(pool_size=2, client_factory=CountingClient)
+
+    async def main():
+        return await asyncio.gather(
+            *(ch.aquery("SELECT 1") for _ in range(3)), return_exceptions=True
+        )
+
+    try:
+        results = asyncio.run(main())
+        assert all(isinstance(r, RuntimeError) for r in results)
+        CountingClient.fail = False
+        assert asyncio.run(ch.aquery("SELECT 1")) == ["SELECT 1", {}]
+    finally:
+        ch.close()
+    assert CountingClient.calls == 2
+    assert ch.flights.stats()["errors"] == 1
+
+
+def test_cancelling_one_waiter_keeps_others_and_last_kills_query():
+    CountingClient.calls, CountingClient.fail, CountingClient.killed = 0, False, []
+    ch = ClickHouseClient(pool_size=2, client_factory=CountingClient)
+
+    async def main():
+        first = asyncio.ensure_future(ch.aquery("SELECT 1"))
+        second = asyncio.ensure_future(ch.aquery("SELECT 1"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        result = await second
+        third = asyncio.ensure_future(ch.aquery("SELECT 2"))
+        await asyncio.sleep(0.01)
+        third.cancel()
+        await asyncio.gather(third, return_exceptions=True)
+        return first.cancelled(), result
+
+    try:
+        cancelled, result = asyncio.run(main())
+        for _ in range(100):
+            if CountingClient.killed:
+                break
+            time.sleep(0.01)
+    finally:
+        ch.close()
+    assert cancelled and result == ["SELECT 1", {}]
+    assert len(CountingClient.killed) == 1
+    assert ch.flights.stats()["abandoned"] == 1
+
+
+def test_write_starts_a_new_flight():
+    CountingClient.calls, CountingClient.fail = 0, False
+    ch = ClickHouseClient(pool_size=2, client_factory=CountingClient)
+
+    async def main():
+        before = asyncio.ensure_future(ch.aquery("SELECT * FROM t"))
+        await asyncio.sleep(0.01)
+        ch.result_cache.invalidate_table("t")
+        after = asyncio.ensure_future(ch.aquery("SELECT * FROM t"))
+        return await asyncio.gather(before, after)
+
+    try:
+        asyncio.run(main())
+    finally:
+        ch.close()
+    assert CountingClient.calls == 2
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 from pathlib import Path
 
@@ -10,17 +11,20 @@ from starlette.datastructures import QueryParams
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from app.routers.crud import _schema_dict, query_rows
+from app.services.pagination import decode_cursor
+from app.services.result_cache import ResultCache
+from app.services.rollups import RollupManager
 
 
 class FakeClient:
-    def get_table_schema(self, table: str):
+    async def aget_table_schema(self, table: str):
         raise Exception("Code: 60, DB::Exception: Table default.users doesn't exist")
 
 
 def test_schema_dict_table_not_found():
     client = FakeClient()
     with pytest.raises(HTTPException) as exc:
-        _schema_dict(client, "users")
+        asyncio.run(_schema_dict(client, "users"))
     assert exc.value.status_code == 404
 
 
@@ -28,15 +32,17 @@ class FakeQueryClient:
     def __init__(self):
         self.sql = None
         self.parameters = None
+        self.result_cache = ResultCache(endpoints="")
+        self.rollups = RollupManager(self, rollups={})
 
-    def get_table_schema(self, table: str):
+    async def aget_table_schema(self, table: str):
         return [
             ("order_id", "UInt64"),
             ("user_id", "UInt64"),
             ("status", "String"),
         ]
 
-    def query(self, sql: str, parameters=None):
+    async def aquery(self, sql: str, parameters=None):
         self.sql = sql
         self.parameters = parameters
 
@@ -47,21 +53,128 @@ class FakeQueryClient:
 
 
 class SimpleRequest:
-    def __init__(self, qp: QueryParams):
+    def __init__(self, qp: QueryParams, headers=None):
         self.query_params = qp
+        self.headers = headers or {}
 
 
 def test_query_rows_with_aggregate():
     client = FakeQueryClient()
     qp = QueryParams("aggregate=count:order_id&status=active&group_by=status")
     req = SimpleRequest(qp)
-    import asyncio
 
-    res = asyncio.get_event_loop().run_until_complete(
-        query_rows("fact_orders", req, ch=client)
-    )
+    res = asyncio.run(query_rows("fact_orders", req, ch=client))
     assert (
         client.sql
         == "SELECT COUNT(order_id) AS count_order_id, status FROM fact_orders WHERE status={status:String} GROUP BY status"
     )
     assert res == [{"count_order_id": 2, "status": "active"}]
+
+
+class FakePageClient(FakeQueryClient):
+    async def aget_sorting_key(self, table: str):
+        return "order_id, user_id"
+
+    async def aquery(self, sql: str, parameters=None):
+        self.sql = sql
+        self.parameters = parameters
+
+        class Result:
+            result_rows = [(1, 10, "active"), (2, 20, "active"), (3, 30, "active")]
+
+        return Result()
+
+
+def test_query_rows_keyset_pagination():
+    client = FakePageClient()
+    req = SimpleRequest(QueryParams("limit=2"))
+    res = asyncio.run(query_rows("fact_orders", req, ch=client))
+    assert client.sql == "SELECT * FROM fact_orders ORDER BY order_id, user_id LIMIT 3"
+    assert [r["order_id"] for r in res["rows"]] == [1, 2]
+    assert decode_cursor(res["next"], 2) == [2, 20]
+
+    req = SimpleRequest(QueryParams({"limit": "2", "after": res["next"]}))
+    asyncio.run(query_rows("fact_orders", req, ch=client))
+    assert client.sql == (
+        "SELECT * FROM fact_orders WHERE order_id >= {__after_0:UInt64} AND "
+        "((order_id > {__after_0:UInt64}) OR "
+        "(order_id = {__after_0:UInt64} AND user_id > {__after_1:UInt64})) "
+        "ORDER BY order_id, user_id LIMIT 3"
+    )
+    assert client.parameters == {"__after_0": 2, "__after_1": 20}
+
+
+def test_query_rows_invalid_cursor():
+    client = FakePageClient()
+    req = SimpleRequest(QueryParams("after=not-a-cursor"))
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(query_rows("fact_orders", req, ch=client))
+    assert exc.value.status_code == 400
+
+
+class FakeRowsClient(FakePageClient):
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+
+    async def aquery(self, sql: str, parameters=None):
+        self.sql = sql
+        self.parameters = parameters
+        rows = self.rows
+
+        class Result:
+            result_rows = rows
+
+        return Result()
+
+
+def test_query_rows_fields_and_range_filters():
+    # status được chọn, order_id/user_id đọc thêm để tạo cursor
+    client = FakeRowsClient([("active", 2, 10), ("active", 3, 20), ("active", 4, 30)])
+    qp = QueryParams("fields=status&order_id__gte=2&user_id__in=10,20,30&limit=2")
+    res = asyncio.run(query_rows("fact_orders", SimpleRequest(qp), ch=client))
+    assert client.sql == (
+        "SELECT status, order_id, user_id FROM fact_orders "
+        "WHERE order_id >= {order_id__gte:UInt64} AND user_id IN {user_id__in:Array(UInt64)} "
+        "ORDER BY order_id, user_id LIMIT 3"
+    )
+    assert client.parameters == {"order_id__gte": 2, "user_id__in": [10, 20, 30]}
+    assert res["rows"] == [{"status": "active"}, {"status": "active"}]
+    assert decode_cursor(res["next"], 2) == [3, 20]
+
+
+def test_query_rows_multiple_aggregates_with_having_and_order():
+    client = FakeRowsClient([(9, 3, "active")])
+    qp = QueryParams(
+        "aggregate=sum:order_id&aggregate=count:order_id&group_by=status"
+        "&having=count_order_id__gte:2&order_by=-sum_order_id&limit=5"
+    )
+    res = asyncio.run(query_rows("fact_orders", SimpleRequest(qp), ch=client))
+    assert client.sql == (
+        "SELECT SUM(order_id) AS sum_order_id, COUNT(order_id) AS count_order_id, status "
+        "FROM fact_orders GROUP BY status HAVING count_order_id >= {__having_0:UInt64} "
+        "ORDER BY sum_order_id DESC LIMIT 5"
+    )
+    assert client.parameters == {"__having_0": 2}
+    assert res == [{"sum_order_id": 9, "count_order_id": 3, "status": "active"}]
+
+
+@pytest.mark.parametrize(
+    "qp",
+    [
+        "order_id__like=1",
+        "user_id__in=",
+        "fields=missing",
+        "order_by=missing",
+        "aggregate=foo:order_id",
+        "aggregate=count:order_id&fields=status",
+        "aggregate=count:order_id&having=sum_order_id__gt:1",
+        "having=count_order_id__gte:1",
+        "aggregate=count:order_id&after=abc",
+    ],
+)
+def test_query_rows_rejects_invalid_dsl(qp):
+    client = FakeRowsClient([])
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(query_rows("fact_orders", SimpleRequest(QueryParams(qp)), ch=client))
+    assert exc.value.status_code == 400
@@ -0,0 +1,153 @@
+import datetime
+import decimal
+import io
+import sys
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Đảm bảo thư mục scripts có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1] / "scripts"))
+
+from ddl_inference import create_table_sql, merge_profiles, plan_table, profile_parquet
+
+
+def profile(table: pa.Table):
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, row_group_size=500)
+    buffer.seek(0)
+    return profile_parquet(pq.ParquetFile(buffer))
+
+
+def plan_for(table: pa.Table, **kwargs):
+    return plan_table(profile(table), **kwargs)
+
+
+def types(plan):
+    return {col.name: col.ch_type for col in plan.columns}
+
+
+def sample_table(rows=2000):
+    start = datetime.datetime(2024, 1, 1)
+    return pa.table(
+        {
+            "id": list(range(rows)),
+            "delta": [i % 7 - 3 for i in range(rows)],
+            "big": [i * 10**6 for i in range(rows)],
+            "country": [["VN", "US", "FR"][i % 3] for i in range(rows)],
+            "email": [f"user{i}@example.com" for i in range(rows)],
+            "maybe": [None if i % 5 == 0 else i for i in range(rows)],
+            "created": pa.array(
+                [start + datetime.timedelta(hours=i) for i in range(rows)], pa.timestamp("ms")
+            ),
+            "day": pa.array(
+                [start + datetime.timedelta(days=i % 30) for i in range(rows)], pa.timestamp("us")
+            ),
+            "price": pa.array([decimal.Decimal("9.99")] * rows, pa.decimal128(12, 2)),
+        }
+    )
+
+
+def test_narrow_types_from_statistics_and_sample():
+    inferred = types(plan_for(sample_table()))
+    assert inferred["id"] == "UInt16"
+    assert inferred["delta"] == "Int8"
+    assert inferred["big"] == "UInt32"
+    assert inferred["country"] == "LowCardinality(String)"
+    assert inferred["email"] == "String"
+    assert inferred["maybe"] == "Nullable(UInt16)"
+    assert inferred["created"] == "DateTime64(3)"
+    assert inferred["day"] == "Date"
+    assert inferred["price"] == "Decimal(12, 2)"
+
+
+def test_min_integer_bits_widens_integers():
+    inferred = types(plan_for(sample_table(), min_integer_bits=32))
+    assert inferred["id"] == "UInt32"
+    assert inferred["delta"] == "Int32"
+
+
+def test_suggested_and_explicit_keys():
+    plan = plan_for(sample_table())
+    assert plan.order_by == "(country, created)"
+    assert plan.partition_by == "toYYYYMM(created)"
+
+    plan = plan_for(sample_table(), order_by="id", partition_by="")
+    sql = create_table_sql("events", plan, codecs=True)
+    assert "PARTITION BY" not in sql
+    assert sql.endswith("ORDER BY id")
+    assert "id UInt16 CODEC(Delta, ZSTD(1))" in sql
+    assert "email String CODEC(ZSTD(3))" in sql
+
+
+def test_sample_by_appends_hash_to_order_by():
+    plan = plan_for(sample_table(), order_by="(country, created)", sample_by="id")
+    sql = create_table_sql("events", plan)
+    assert sql.endswith(
+        "ORDER BY (country, created, cityHash64(id)) SAMPLE BY cityHash64(id)"
+    )
+    plan = plan_for(sample_table(), order_by="tuple()", sample_by="email")
+    assert create_table_sql("events", plan).endswith(
+        "ORDER BY cityHash64(email) SAMPLE BY cityHash64(email)"
+    )
+
+
+def test_whole_file_decides_date_and_low_cardinality():
+    rows = 2000
+    start = datetime.datetime(2024, 1, 1)
+    table = pa.table(
+        {
+            # Chỉ các dòng cuối có giờ khác 0, mẫu đầu file toàn nửa đêm
+            "day": pa.array(
+                [start + datetime.timedelta(days=i % 30, hours=int(i >= 1900)) for i in range(rows)],
+                pa.timestamp("us"),
+            ),
+            "plain_day": pa.array(
+                [start + datetime.timedelta(days=i % 30) for i in range(rows)], pa.timestamp("us")
+            ),
+            # Mẫu đầu file chỉ có vài giá trị, phần sau toàn giá trị khác nhau
+            "code": [f"c{i % 3}" if i < 500 else f"u{i}" for i in range(rows)],
+            "country": [["VN", "US", "FR"][i % 3] for i in range(rows)],
+        }
+    )
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, row_group_size=500)
+    buffer.seek(0)
+    profiles = profile_parquet(pq.ParquetFile(buffer), sample_rows=500)
+    inferred = types(plan_table(profiles))
+    assert inferred["day"] == "DateTime64(6)"
+    assert inferred["plain_day"] == "Date"
+    assert inferred["code"] == "String"
+    assert inferred["country"] == "LowCardinality(String)"
+
+
+def test_merged_profiles_cover_every_file():
+    start = datetime.datetime(2024, 1, 1)
+    first = pa.table(
+        {
+            "id": list(range(100)),
+            "day": pa.array([start] * 100, pa.timestamp("us")),
+            "note": [f"n{i % 2}" for i in range(100)],
+        }
+    )
+    # File sau có id lớn hơn, giờ khác 0, giá trị null và thêm một cột
+    second = pa.table(
+        {
+            "id": list(range(100000, 100100)),
+            "day": pa.array([start + datetime.timedelta(hours=1)] * 100, pa.timestamp("us")),
+            "note": pa.array([None] * 100, pa.string()),
+            "extra": list(range(100)),
+        }
+    )
+    assert types(plan_table(profile(first))) == {
+        "id": "UInt8",
+        "day": "Date",
+        "note": "LowCardinality(String)",
+    }
+    merged = merge_profiles([profile(first), profile(second)])
+    inferred = types(plan_table(merged))
+    assert inferred["id"] == "UInt32"
+    assert inferred["day"] == "DateTime64(6)"
+    assert inferred["note"] == "LowCardinality(Nullable(String))"
+    assert inferred["extra"] == "Nullable(UInt8)"
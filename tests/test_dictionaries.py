@@ -0,0 +1,132 @@
+import asyncio
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import QueryParams
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.core.config import settings
+from app.routers.orders import read_enriched_order, read_enriched_orders, summarize_orders
+from app.services.clickhouse_client import ENTITY_TABLES
+from app.services.dictionaries import DictionaryManager
+from app.services.result_cache import ResultCache
+
+ORDER = (7, 1, 3, 2, 19.5, datetime(2024, 1, 1), "User 1", "user1@example.com", "Pen")
+
+
+class FakeClickHouse:
+    def __init__(self, rows=(ORDER,), tables="dim_users,dim_products"):
+        self.rows = list(rows)
+        self.commands = []
+        self.queries = []
+        self.result_cache = ResultCache(endpoints="")
+        self.dictionaries = DictionaryManager(
+            self, ENTITY_TABLES, tables=tables, lifetime_min=30, lifetime_max=90
+        )
+
+    def command(self, sql, parameters=None):
+        self.commands.append(sql)
+
+    async def aquery(self, sql, parameters=None):
+        self.queries.append((sql, parameters))
+        rows = self.rows
+
+        class Result:
+            result_rows = rows
+
+        return Result()
+
+
+class SimpleRequest:
+    def __init__(self):
+        self.query_params = QueryParams("")
+        self.headers = {}
+
+
+def test_create_all_defines_versioned_dictionaries():
+    ch = FakeClickHouse()
+    ch.dictionaries.create_all()
+    users, products = ch.commands
+    assert users.startswith(
+        "CREATE OR REPLACE DICTIONARY dim_users_dict (\nid UInt64,\nname String,\nemail String\n)"
+    )
+    assert "QUERY 'SELECT id, name, email FROM dim_users FINAL WHERE _deleted = 0'" in users
+    assert "INVALIDATE_QUERY 'SELECT max(_version) FROM dim_users'" in users
+    assert users.endswith("LAYOUT(HASHED())\nLIFETIME(MIN 30 MAX 90)")
+    assert products.startswith(
+        "CREATE OR REPLACE DICTIONARY dim_products_dict (\nid UInt64,\nname String\n)"
+    )
+
+    with pytest.raises(ValueError):
+        DictionaryManager(ch, ENTITY_TABLES, tables="fact_missing")
+
+
+def test_enriched_order_resolves_names_in_one_query():
+    ch = FakeClickHouse()
+    order = asyncio.run(read_enriched_order(7, SimpleRequest(), ch=ch))
+    assert (order.user_name, order.product_name) == ("User 1", "Pen")
+    (sql, params), = ch.queries
+    assert "dictGetOrNull('dim_users_dict', 'name', user_id) AS user_name" in sql
+    assert "dictGetOrNull('dim_products_dict', 'name', product_id) AS product_name" in sql
+    assert sql.endswith(
+        "FROM fact_orders FINAL WHERE order_id = {order_id:UInt64} AND _deleted = 0"
+    )
+    assert params == {"order_id": 7}
+
+    orders = asyncio.run(
+        read_enriched_orders(SimpleRequest(), user_id=1, product_id=None, after=5, limit=10, ch=ch)
+    )
+    assert [o.order_id for o in orders] == [7]
+    sql, params = ch.queries[-1]
+    assert "WHERE 1 AND user_id = {user_id:UInt64} AND order_id > {after:UInt64}" in sql
+    assert sql.endswith("ORDER BY order_id LIMIT {limit:UInt32}")
+    assert params == {"limit": 10, "user_id": 1, "after": 5}
+
+    empty = FakeClickHouse(rows=[])
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(read_enriched_order(8, SimpleRequest(), ch=empty))
+    assert exc.value.status_code == 404
+
+
+def test_summary_groups_by_key_before_lookup():
+    ch = FakeClickHouse(rows=[(3, "Pen", 4, 9, 120.0)])
+    summary = asyncio.run(summarize_orders(SimpleRequest(), by="product", limit=5, ch=ch))
+    assert summary[0].model_dump() == {
+        "id": 3, "name": "Pen", "orders": 4, "quantity": 9, "total": 120.0
+    }
+    sql, _ = ch.queries[0]
+    assert sql.startswith(
+        "SELECT product_id, dictGetOrNull('dim_products_dict', 'name', product_id) AS name"
+    )
+    assert "GROUP BY product_id ORDER BY total DESC" in sql
+
+    disabled = FakeClickHouse(tables="dim_products")
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(summarize_orders(SimpleRequest(), by="user", limit=5, ch=disabled))
+    assert exc.value.status_code == 503
+
+
+def test_enriched_cache_is_invalidated_by_dimension_writes(monkeypatch):
+    monkeypatch.setattr(settings, "RESULT_CACHE_TTL", 300.0)
+    ch = FakeClickHouse()
+    ch.result_cache = ResultCache(endpoints="orders.read_enriched_order,orders.summarize_orders")
+    for _ in range(2):
+        asyncio.run(read_enriched_order(7, SimpleRequest(), ch=ch))
+    assert len(ch.queries) == 1
+    # Đổi tên người dùng: kết quả có tên lấy qua dictionary phải được đọc lại
+    ch.result_cache.invalidate_table("dim_users")
+    asyncio.run(read_enriched_order(7, SimpleRequest(), ch=ch))
+    assert len(ch.queries) == 2
+
+    ch.rows = [(3, "Pen", 4, 9, 120.0)]
+    for table in ("dim_users", "dim_products"):
+        asyncio.run(summarize_orders(SimpleRequest(), by="product", limit=5, ch=ch))
+        ch.result_cache.invalidate_table(table)
+    asyncio.run(summarize_orders(SimpleRequest(), by="product", limit=5, ch=ch))
+    # Ghi vào dim_users không ảnh hưởng tổng hợp theo sản phẩm, dim_products thì có
+    assert len(ch.queries) == 4
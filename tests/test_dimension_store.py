@@ -0,0 +1,107 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.routers.users import read_user, read_users
+from app.services import metrics
+from app.services.dimension_store import DimensionStore
+
+ENTITIES = {"dim_users": {"order_by": "id", "columns": ["id", "name", "email"]}}
+SCHEMA = [
+    ("id", "UInt64"),
+    ("name", "String"),
+    ("email", "String"),
+    ("_version", "UInt64"),
+    ("_deleted", "UInt8"),
+]
+
+
+class FakeClickHouse:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+        self.dimensions = DimensionStore(self, ENTITIES, tables="dim_users", lookback=1e-9)
+
+    async def aget_table_schema(self, table):
+        return SCHEMA
+
+    async def aquery(self, sql, parameters=None):
+        self.queries.append((sql, parameters))
+        since = (parameters or {}).get("since", -1)
+
+        class Result:
+            result_rows = [row for row in self.rows if row[3] > since]
+
+        return Result()
+
+
+def test_reload_then_incremental_refresh_by_version():
+    ch = FakeClickHouse([(1, "A", "a@x", 10, 0), (2, "B", "b@x", 20, 0)])
+    store = ch.dimensions
+    asyncio.run(store.reload("dim_users"))
+    users = store.table("dim_users")
+    assert ch.queries[0][0] == (
+        "SELECT id, name, email, _version, _deleted FROM dim_users FINAL"
+    )
+    assert users.get(1) == (1, "A", "a@x") and users.watermark == 20
+
+    # Dòng mới hơn watermark được áp; dòng có phiên bản cũ hơn bị bỏ qua
+    ch.rows = [(1, "A2", "a@x", 30, 0), (2, "B", "b@x", 25, 1), (1, "old", "o@x", 5, 0)]
+    assert asyncio.run(store.refresh("dim_users")) == 2
+    sql, params = ch.queries[-1]
+    assert sql.endswith("FROM dim_users WHERE _version > {since:UInt64} ORDER BY _version")
+    assert params == {"since": 19}
+    assert users.get(1) == (1, "A2", "a@x")
+    assert users.get(2) is None
+    assert users.get_many([2, 1, 9]) == {1: [(1, "A2", "a@x")]}
+    assert users.watermark == 30
+    stats = users.stats()
+    assert stats["rows"] == 1 and stats["deleted"] == 1 and stats["memory_bytes"] > 0
+
+
+def test_local_writes_apply_immediately():
+    ch = FakeClickHouse([(1, "A", "a@x", 10, 0)])
+    store = ch.dimensions
+    asyncio.run(store.reload("dim_users"))
+    users = store.table("dim_users")
+
+    store.apply_insert(
+        "dim_users", [[2, 3], ["B", "C"], ["b@x", "c@x"], [40, 41]],
+        ["id", "name", "email", "_version"], column_oriented=True,
+    )
+    assert users.get(3) == (3, "C", "c@x")
+    store.apply_update("dim_users", "id", 2, {"name": "B2"}, 50)
+    assert users.get(2) == (2, "B2", "b@x")
+    # Bản cập nhật cũ hơn phiên bản đang có không ghi đè
+    store.apply_update("dim_users", "id", 2, {"name": "stale"}, 45)
+    assert users.get(2)[1] == "B2"
+    store.apply_update("dim_users", "id", 1, {}, 60, deleted=True)
+    assert users.get(1) is None
+
+    # Giá trị sai kiểu không làm lệch các cột
+    store.apply_insert("dim_users", [("x", "X", "x@x", 70)], ["id", "name", "email", "_version"])
+    assert users.stats()["rows"] == 2 and users.get(3) == (3, "C", "c@x")
+
+    metrics.track_dimensions(store)
+    text = metrics.render()
+    assert 'dimension_store_rows{table="dim_users"} 2' in text
+    assert 'dimension_store_refresh_lag_seconds{table="dim_users"}' in text
+
+
+def test_user_endpoints_read_from_store_without_querying():
+    ch = FakeClickHouse([(1, "A", "a@x", 10, 0), (2, "B", "b@x", 20, 0)])
+    asyncio.run(ch.dimensions.reload("dim_users"))
+    queries = len(ch.queries)
+    user = asyncio.run(read_user(2, request=None, ch=ch))
+    assert (user.id, user.name, user.email) == (2, "B", "b@x")
+    assert [u.id for u in asyncio.run(read_users(ids="2,7,1", ch=ch))] == [2, 1]
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(read_user(7, request=None, ch=ch))
+    assert exc.value.status_code == 404
+    assert len(ch.queries) == queries
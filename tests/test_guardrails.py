@@ -0,0 +1,149 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.core.config import settings
+from app.core.security import create_access_token
+from app.main import app
+from app.services.clickhouse_client import ClickHouseClient
+from app.services.guardrails import limit_error, resolve_profile
+
+PROFILES = {
+    "default": {"max_execution_time": 300},
+    "adhoc": {"max_execution_time": 60, "max_result_rows": 1000},
+    "readonly": {"readonly": 2},
+}
+
+
+class RecordingClient:
+    """Client giả lập ghi lại setting của mỗi truy vấn."""
+
+    calls = []
+    killed = []
+    error = None
+    delay = 0.0
+    lock = threading.Lock()
+
+    def query(self, sql, parameters=None, settings=None):
+        with RecordingClient.lock:
+            RecordingClient.calls.append(settings or {})
+        time.sleep(RecordingClient.delay)
+        if RecordingClient.error:
+            raise Exception(RecordingClient.error)
+
+        class Result:
+            result_rows = [(1, "A", "a@example.com")]
+
+        return Result()
+
+    def command(self, sql, parameters=None, settings=None):
+        RecordingClient.killed.append(parameters["query_id"])
+
+    def close(self):
+        pass
+
+
+def reset(error=None, delay=0.0):
+    RecordingClient.calls, RecordingClient.killed = [], []
+    RecordingClient.error, RecordingClient.delay = error, delay
+
+
+async def call(path, headers=(), disconnect_after=None):
+    """Gọi ứng dụng ASGI trực tiếp, có thể giả lập client ngắt kết nối."""
+    messages = []
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.encode(), v.encode()) for k, v in headers],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return messages
+
+
+def run_app(ch, *args, **kwargs):
+    app.state.clickhouse = ch
+    try:
+        return asyncio.run(call(*args, **kwargs))
+    finally:
+        ch.close()
+
+
+def test_resolve_profile_merges_default_endpoint_and_user():
+    profile = resolve_profile(
+        "sql.execute_sql", "alice", PROFILES, "sql.execute_sql:adhoc", "alice:readonly"
+    )
+    assert profile.name == "default+adhoc+readonly"
+    assert profile.settings == {"max_execution_time": 60, "max_result_rows": 1000, "readonly": 2}
+    assert resolve_profile("users.read_user", None, PROFILES, "", "").settings == {
+        "max_execution_time": 300
+    }
+
+
+def test_limit_error_maps_clickhouse_codes():
+    error = limit_error(Exception("Code: 396. DB::Exception: Limit for result exceeded"))
+    assert error.status_code == 413 and error.code == 396
+    assert limit_error(Exception("Code: 159. DB::Exception: Timeout exceeded")).status_code == 408
+    assert limit_error(Exception("Code: 60. DB::Exception: Table doesn't exist")) is None
+
+
+def test_profile_settings_reach_clickhouse_per_user(monkeypatch):
+    monkeypatch.setattr(settings, "QUERY_PROFILES", PROFILES)
+    monkeypatch.setattr(settings, "QUERY_PROFILE_USERS", "alice:readonly")
+    reset()
+    token = create_access_token({"sub": "alice"})
+    ch = ClickHouseClient(client_factory=RecordingClient)
+    messages = run_app(ch, "/users/1", headers=[("authorization", f"Bearer {token}")])
+    assert messages[0]["status"] == 200
+    (sent,) = RecordingClient.calls
+    assert sent.pop("query_id")
+    assert sent == {"max_execution_time": 300, "readonly": 2}
+
+
+def test_exceeded_limit_returns_4xx(monkeypatch):
+    monkeypatch.setattr(settings, "QUERY_PROFILES", PROFILES)
+    reset(error="Code: 241. DB::Exception: Memory limit (for query) exceeded")
+    ch = ClickHouseClient(client_factory=RecordingClient)
+    messages = run_app(ch, "/users/1")
+    assert messages[0]["status"] == 413
+    assert b"max_memory_usage" in messages[1]["body"]
+
+
+def test_client_disconnect_kills_running_query():
+    reset(delay=0.3)
+    ch = ClickHouseClient(pool_size=2, client_factory=RecordingClient)
+    messages = run_app(ch, "/users/1", disconnect_after=0.05)
+    assert messages == []
+    for _ in range(100):
+        if RecordingClient.killed:
+            break
+        time.sleep(0.01)
+    assert RecordingClient.killed == [RecordingClient.calls[0]["query_id"]]
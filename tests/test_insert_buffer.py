@@ -0,0 +1,110 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services.insert_buffer import BufferFullError, InsertBuffer, InvalidRowError
+
+SCHEMA = [("id", "UInt64"), ("name", "String"), ("note", "Nullable(String)")]
+
+
+class FakeInsertClient:
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+
+    async def aget_table_schema(self, table):
+        return SCHEMA
+
+    async def ainsert(self, table, data, column_names=None, column_oriented=False):
+        if self.fail:
+            raise Exception("Code: 252. DB::Exception: Too many parts")
+        self.calls.append((table, data, column_names, column_oriented))
+
+
+def test_buffer_batches_rows_into_one_columnar_insert():
+    ch = FakeInsertClient()
+
+    async def main():
+        buffer = InsertBuffer(ch, max_rows=100, max_delay=0.01)
+        await asyncio.gather(
+            *(buffer.insert("dim_users", {"id": i, "name": f"U{i}"}) for i in range(3))
+        )
+        return buffer.stats()
+
+    stats = asyncio.run(main())
+    assert ch.calls == [("dim_users", [[0, 1, 2], ["U0", "U1", "U2"]], ["id", "name"], True)]
+    assert stats["flushes"] == 1
+    assert stats["rows_flushed"] == 3
+    assert stats["reasons"]["delay"] == 1
+
+
+def test_buffer_flushes_on_row_count_and_propagates_errors():
+    ch = FakeInsertClient(fail=True)
+
+    async def main():
+        buffer = InsertBuffer(ch, max_rows=2, max_delay=10)
+        return await asyncio.gather(
+            buffer.insert("t", {"id": 1}),
+            buffer.insert("t", {"id": 2}),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(main())
+    assert all("Too many parts" in str(r) for r in results)
+
+
+def test_async_ack_applies_backpressure_when_queue_full():
+    ch = FakeInsertClient()
+
+    async def main():
+        buffer = InsertBuffer(ch, max_delay=10, max_pending=1, enqueue_timeout=0.01)
+        await buffer.insert("t", {"id": 1}, ack="async")
+        with pytest.raises(BufferFullError):
+            await buffer.insert("t", {"id": 2}, ack="async")
+        await buffer.flush_all()
+        return buffer.stats()
+
+    stats = asyncio.run(main())
+    assert stats["pending_rows"] == 0
+    assert stats["reasons"]["shutdown"] == 1
+
+
+def test_rows_share_a_buffer_regardless_of_key_order_and_empty_buffers_are_pruned():
+    ch = FakeInsertClient()
+
+    async def main():
+        buffer = InsertBuffer(ch, max_rows=100, max_delay=0.01)
+        await asyncio.gather(
+            buffer.insert("dim_users", {"id": "1", "name": "A"}),
+            buffer.insert("dim_users", {"name": "B", "id": 2}),
+        )
+        return buffer.stats()
+
+    stats = asyncio.run(main())
+    assert ch.calls == [("dim_users", [[1, 2], ["A", "B"]], ["id", "name"], True)]
+    assert stats["buffers"] == 0
+
+
+def test_invalid_row_is_rejected_without_failing_the_batch():
+    ch = FakeInsertClient()
+
+    async def main():
+        buffer = InsertBuffer(ch, max_rows=100, max_delay=0.01)
+        return await asyncio.gather(
+            buffer.insert("t", {"id": 1, "note": None}),
+            buffer.insert("t", {"id": "abc"}),
+            buffer.insert("t", {"id": 3, "name": None}),
+            buffer.insert("t", {"id": 4, "extra": 1}),
+            buffer.insert("t", {"id": 5}),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(main())
+    assert [isinstance(r, InvalidRowError) for r in results] == [False, True, True, True, False]
+    assert [call[1] for call in ch.calls] == [[[1], [None]], [[5]]]
@@ -0,0 +1,121 @@
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.main import app
+from app.services import metrics
+from app.services.clickhouse_client import ClickHouseClient
+from app.services.metrics import Counter, Histogram, query_shape
+
+
+class SummaryClient:
+    """Client giả lập trả về kết quả kèm ``X-ClickHouse-Summary``."""
+
+    def query(self, sql, parameters=None, settings=None):
+        class Result:
+            result_rows = [(7, "User 7", "user7@example.com")]
+            summary = {"read_rows": "120", "read_bytes": "4096", "result_rows": "1"}
+
+        return Result()
+
+    def command(self, sql, parameters=None, settings=None):
+        raise RuntimeError("Code: 62. DB::Exception: Syntax error")
+
+    def close(self):
+        pass
+
+
+async def get(path):
+    messages = []
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return messages
+
+
+def test_query_shape_strips_literals():
+    assert query_shape("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'a''b';") == (
+        "SELECT * FROM t WHERE id IN (?) AND name = ?"
+    )
+    assert query_shape("SELECT  x1 FROM t2 WHERE id = {id:UInt64} LIMIT 10") == (
+        "SELECT x1 FROM t2 WHERE id = {id:UInt64} LIMIT ?"
+    )
+
+
+def test_histogram_counts_from_many_threads():
+    histogram = Histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1.0))
+
+    def work():
+        for _ in range(10000):
+            histogram.observe(0.5, "/a")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    text = "\n".join(histogram.collect())
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 0' in text
+    assert 'test_seconds_bucket{route="/a",le="1"} 40000' in text
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 40000' in text
+    assert 'test_seconds_sum{route="/a"} 20000' in text
+
+
+def test_series_over_limit_share_overflow_label():
+    counter = Counter("test_total", "Test.", ("shape",), max_series=2)
+    for shape in ("a", "b", "c", "d"):
+        counter.inc(shape)
+    text = "\n".join(counter.collect())
+    assert 'test_total{shape="__other__"} 2' in text
+
+
+def test_metrics_endpoint_reports_requests_and_queries():
+    app.state.clickhouse = ch = ClickHouseClient(client_factory=SummaryClient)
+    try:
+        asyncio.run(get("/users/7"))
+        try:
+            ch.command("DROP TABLE x")
+        except RuntimeError:
+            pass
+        messages = asyncio.run(get("/metrics"))
+    finally:
+        ch.close()
+    assert messages[0]["status"] == 200
+    text = messages[1]["body"].decode()
+    assert 'http_responses_total{method="GET",route="/users/{user_id}",status="200"}' in text
+    assert 'http_request_duration_seconds_count{method="GET",route="/users/{user_id}"}' in text
+    shape = metrics.query_shape(
+        "SELECT id, name, email FROM dim_users FINAL "
+        "WHERE id IN {__keys:Array(UInt64)} AND _deleted = 0"
+    )
+    assert f'clickhouse_read_rows_total{{kind="query",shape="{shape}"}}' in text
+    assert 'errors_total{source="clickhouse",type="RuntimeError"}' in text
+    assert 'clickhouse_pool_connections{state="size"}' in text
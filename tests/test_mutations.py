@@ -0,0 +1,177 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services.dimension_store import DimensionStore, DimensionTable
+from app.services.guardrails import profile_settings
+from app.services.mutations import MutationManager, choose_strategy, parse_strategies
+
+SCHEMA = [("id", "UInt64"), ("name", "String"), ("score", "Float64")]
+
+
+class Summary:
+    written_rows = 1
+
+
+class FakeClient:
+    def __init__(self, engine="MergeTree"):
+        self.engine = engine
+        self.commands = []
+        self.settings = []
+        self.dimensions = DimensionStore(self, {}, tables="")
+
+    async def aget_table_schema(self, table):
+        return SCHEMA
+
+    async def aget_table_engine(self, table):
+        return self.engine
+
+    async def acommand(self, sql, parameters=None):
+        self.commands.append((sql, parameters))
+        self.settings.append(profile_settings())
+        return Summary()
+
+    async def aquery(self, sql, parameters=None):
+        # Mọi khóa đều tồn tại trừ các khóa âm
+        rows = [(1,)] if parameters["__key"] >= 0 else []
+
+        class Result:
+            result_rows = rows
+
+        return Result()
+
+
+def test_choose_strategy():
+    versioned = {"id": "UInt64", "_version": "UInt64", "_deleted": "UInt8"}
+    assert choose_strategy("ReplacingMergeTree", versioned) == "versioned"
+    assert choose_strategy("ReplacingMergeTree", {"id": "UInt64"}) == "lightweight"
+    assert choose_strategy("MergeTree", {"id": "UInt64"}) == "lightweight"
+    assert choose_strategy("Memory", {"id": "UInt64"}) == "mutation"
+
+
+def test_parse_strategies():
+    assert parse_strategies("a:versioned, b:mutation") == {"a": "versioned", "b": "mutation"}
+    assert parse_strategies("") == {}
+    with pytest.raises(ValueError):
+        parse_strategies("a:fast")
+
+
+def test_concurrent_deletes_grouped_into_one_lightweight_delete():
+    client = FakeClient()
+    manager = MutationManager(client, overrides={}, max_delay=0.01)
+
+    async def run():
+        await asyncio.gather(*(manager.delete("events", "id", i) for i in range(5)))
+
+    asyncio.run(run())
+    assert len(client.commands) == 1
+    sql, params = client.commands[0]
+    assert sql == "DELETE FROM events WHERE id IN {__keys:Array(UInt64)}"
+    assert params["__keys"] == [0, 1, 2, 3, 4]
+    assert manager.stats()["grouped"] == 5
+
+
+def test_concurrent_updates_grouped_with_multiif():
+    client = FakeClient()
+    manager = MutationManager(client, overrides={"events": "mutation"}, max_delay=0.01)
+
+    async def run():
+        await asyncio.gather(
+            manager.update("events", "id", 1, {"name": "a"}),
+            manager.update("events", "id", 2, {"name": "b"}),
+            manager.update("events", "id", 1, {"name": "c"}),
+        )
+
+    asyncio.run(run())
+    assert len(client.commands) == 1
+    sql, params = client.commands[0]
+    assert sql.startswith("ALTER TABLE events UPDATE name = multiIf(")
+    assert params["__keys"] == [1, 2]
+    # Lần cập nhật sau cùng của cùng một khóa được giữ lại
+    assert params["name__0"] == "c" and params["name__1"] == "b"
+
+
+def test_max_keys_flushes_early():
+    client = FakeClient(engine="Log")
+    manager = MutationManager(client, overrides={}, max_delay=60, max_keys=2)
+
+    async def run():
+        await asyncio.gather(manager.delete("logs", "id", 1), manager.delete("logs", "id", 2))
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert client.commands[0][0].startswith("ALTER TABLE logs DELETE WHERE")
+
+
+def test_flush_error_propagates_to_callers():
+    class FailingClient(FakeClient):
+        async def acommand(self, sql, parameters=None):
+            raise RuntimeError("boom")
+
+    manager = MutationManager(FailingClient(), overrides={}, max_delay=0.01)
+    with pytest.raises(RuntimeError):
+        asyncio.run(manager.delete("events", "id", 1))
+    assert manager.stats()["errors"] == 1
+
+
+def test_update_and_delete_of_a_table_are_sent_in_arrival_order():
+    client = FakeClient()
+    manager = MutationManager(client, overrides={}, max_delay=60, max_keys=2)
+
+    async def run():
+        update = asyncio.ensure_future(manager.update("events", "id", 1, {"name": "a"}))
+        await asyncio.sleep(0)
+        # Nhóm xóa đủ khóa nên được gửi ngay, nhưng phải sau nhóm cập nhật tới trước
+        await asyncio.gather(
+            update, manager.delete("events", "id", 1), manager.delete("events", "id", 2)
+        )
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    kinds = [sql.split()[0] for sql, _ in client.commands]
+    assert kinds == ["ALTER", "DELETE"]
+    assert client.settings == [{"mutations_sync": 1}] * 2
+    assert manager.stats()["pending"] == 0
+
+
+def test_dimension_store_only_changes_after_mutation_succeeds():
+    class FailingClient(FakeClient):
+        fail = True
+
+        async def acommand(self, sql, parameters=None):
+            if self.fail:
+                raise RuntimeError("boom")
+            return await super().acommand(sql, parameters)
+
+    client = FailingClient()
+    table = DimensionTable("dim_users", "id", ["id", "name"], dict(SCHEMA))
+    table.replace([(1, "old", 1, 0)])
+    client.dimensions._tables["dim_users"] = table
+    manager = MutationManager(client, overrides={"dim_users": "mutation"}, max_delay=0.01)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(manager.update("dim_users", "id", 1, {"name": "new"}))
+    assert table.get(1) == (1, "old")
+
+    client.fail = False
+    asyncio.run(manager.update("dim_users", "id", 1, {"name": "new"}))
+    assert table.get(1) == (1, "new")
+
+
+def test_missing_key_is_reported_without_mutation():
+    client = FakeClient()
+    manager = MutationManager(client, overrides={}, max_delay=0.01)
+
+    async def run():
+        return await asyncio.gather(
+            manager.update("events", "id", -1, {"name": "a"}),
+            manager.delete("events", "id", -1),
+            manager.delete("events", "id", 3),
+        )
+
+    assert asyncio.run(run()) == [0, 0, 1]
+    sql, params = client.commands[0]
+    assert len(client.commands) == 1 and params["__keys"] == [3]
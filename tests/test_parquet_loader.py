@@ -0,0 +1,194 @@
+import io
+import os
+import queue
+import sys
+import threading
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+# Đảm bảo thư mục scripts có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1] / "scripts"))
+
+from parquet_loader import Checkpoint, MinioRangeFile, dedup_token, load_parquet, open_local_file
+
+
+def write_parquet(path, rows=1000, row_group_size=100):
+    table = pa.table({"id": list(range(rows)), "name": [f"n{i}" for i in range(rows)]})
+    pq.write_table(table, path, row_group_size=row_group_size)
+    return table
+
+
+class FakeResponse(io.BytesIO):
+    def release_conn(self):
+        pass
+
+
+class FakeMinio:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.ranges = []
+
+    def stat_object(self, bucket, obj):
+        return type("Stat", (), {"size": len(self.data)})()
+
+    def get_object(self, bucket, obj, offset=0, length=0):
+        self.ranges.append((offset, length))
+        return FakeResponse(self.data[offset:offset + length])
+
+
+class RecordingClient:
+    lock = threading.Lock()
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def insert_arrow(self, table, arrow_table, settings=None):
+        with self.lock:
+            self.sink.append(arrow_table)
+
+
+def test_range_file_reads_parquet_with_ranged_gets(tmp_path):
+    path = tmp_path / "data.parquet"
+    expected = write_parquet(path)
+    minio = FakeMinio(path.read_bytes())
+    source = MinioRangeFile(minio, "bucket", "data.parquet", block_size=4096)
+    assert pq.read_table(source).equals(expected)
+    assert minio.ranges and all(length <= len(minio.data) for _, length in minio.ranges)
+
+
+def test_load_parquet_inserts_every_row_group_once(tmp_path):
+    path = tmp_path / "data.parquet"
+    expected = write_parquet(path)
+    inserted = []
+    done = []
+    stats = load_parquet(
+        open_local_file(str(path)),
+        lambda: RecordingClient(inserted),
+        "dest",
+        batch_size=30,
+        decode_workers=3,
+        insert_workers=2,
+        queue_size=2,
+        on_row_group=lambda group, rows: done.append((group, rows)),
+    )
+    assert stats["rows"] == 1000
+    assert sorted(done) == [(g, 100) for g in range(10)]
+    ids = sorted(i for t in inserted for i in t.column("id").to_pylist())
+    assert ids == expected.column("id").to_pylist()
+
+
+def test_load_parquet_propagates_insert_errors(tmp_path):
+    path = tmp_path / "data.parquet"
+    write_parquet(path)
+
+    class Failing:
+        def insert_arrow(self, table, arrow_table, settings=None):
+            raise RuntimeError("insert failed")
+
+    with pytest.raises(RuntimeError):
+        load_parquet(open_local_file(str(path)), Failing, "dest", queue_size=1)
+
+
+def test_checkpoint_resume_and_etag_change(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    checkpoint = Checkpoint(path)
+    checkpoint.entry("a.parquet", "etag1", 100)
+    checkpoint.row_group_done("a.parquet", 0, 10)
+    checkpoint.row_group_done("a.parquet", 0, 10)
+
+    resumed = Checkpoint(path)
+    entry = resumed.entry("a.parquet", "etag1", 500)
+    assert entry["row_groups"] == [0] and entry["rows"] == 10
+    # Batch size from the first run is kept so dedup tokens stay identical
+    assert entry["batch_size"] == 100
+    assert not resumed.is_done("a.parquet", "etag1")
+    resumed.file_done("a.parquet")
+    assert Checkpoint(path).is_done("a.parquet", "etag1")
+    assert resumed.entry("a.parquet", "etag2", 500)["row_groups"] == []
+
+
+def test_load_parquet_skips_row_groups_and_passes_dedup_tokens(tmp_path):
+    path = tmp_path / "data.parquet"
+    write_parquet(path)
+    tokens = []
+
+    class TokenClient:
+        def insert_arrow(self, table, arrow_table, settings=None):
+            with RecordingClient.lock:
+                tokens.append(settings["insert_deduplication_token"])
+
+    stats = load_parquet(
+        open_local_file(str(path)),
+        TokenClient,
+        "dest",
+        batch_size=60,
+        row_groups=[1, 2],
+        insert_settings=lambda group, batch: {
+            "insert_deduplication_token": dedup_token("data.parquet", "e", group, batch)
+        },
+    )
+    assert stats["rows"] == 200
+    assert sorted(tokens) == [
+        "data.parquet:e:1:0",
+        "data.parquet:e:1:1",
+        "data.parquet:e:2:0",
+        "data.parquet:e:2:1",
+    ]
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def open_handles(path):
+    handles = 0
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            handles += os.readlink(f"/proc/self/fd/{fd}") == str(path)
+        except OSError:
+            pass
+    return handles
+
+
+def test_load_parquet_closes_local_files(tmp_path):
+    path = tmp_path / "data.parquet"
+    write_parquet(path)
+
+    opener = open_local_file(str(path))
+    # Giữ tham chiếu tới mọi file đã mở: handle phải được đóng tường minh
+    files = []
+
+    def open_file():
+        files.append(opener())
+        return files[-1]
+
+    load_parquet(open_file, lambda: RecordingClient([]), "dest", decode_workers=3)
+    assert len(files) > 1 and open_handles(path) == 0
+
+
+def test_prefix_worker_closes_the_metadata_file(tmp_path, monkeypatch):
+    import upload_parquet_minio
+
+    path = tmp_path / "data.parquet"
+    write_parquet(path)
+    opener = open_local_file(str(path))
+    files = []
+
+    def open_object(client, bucket, obj, block_size):
+        def open_file():
+            files.append(opener())
+            return files[-1]
+
+        return open_file
+
+    sink = []
+    monkeypatch.setattr(upload_parquet_minio, "Minio", lambda **config: None)
+    monkeypatch.setattr(upload_parquet_minio, "open_minio_object", open_object)
+    monkeypatch.setattr(upload_parquet_minio, "get_client", lambda **config: RecordingClient(sink))
+    events = queue.Queue()
+    stats = upload_parquet_minio._load_object(
+        {}, {}, "bucket", "data.parquet", "etag", "dest", 100, [0], {"decode_workers": 2}, events
+    )
+    assert stats["rows"] == 900 and events.qsize() == 9
+    # Cả file chỉ dùng để đọc metadata cũng phải được đóng
+    assert all(f.closed for f in files) and open_handles(path) == 0
@@ -0,0 +1,141 @@
+import asyncio
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+import pytest
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services.query_jobs import InvalidJobQueryError, JobNotReadyError, JobScheduler
+
+
+def arrow_bytes(rows: int) -> bytes:
+    sink = io.BytesIO()
+    table = pa.table({"id": list(range(rows)), "name": [f"n{i}" for i in range(rows)]})
+    with ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=10)
+    return sink.getvalue()
+
+
+class FakeClickHouse:
+    def __init__(self, rows=25):
+        self.data = arrow_bytes(rows)
+        self.order = []
+        self.block = asyncio.Event()
+
+    async def stream_raw(
+        self, sql, parameters=None, fmt="ArrowStream", settings=None, query_id=None
+    ):
+        self.order.append(sql)
+        if sql == "SELECT slow":
+            await self.block.wait()
+        if sql == "SELECT broken":
+            raise RuntimeError("Code: 62. DB::Exception: Syntax error")
+        for i in range(0, len(self.data), 100):
+            yield self.data[i:i + 100]
+
+    async def aquery(self, sql, parameters=None):
+        class Result:
+            result_rows = [(50, 4000, 200, 1.5)]
+
+        return Result()
+
+
+async def wait_finished(jobs, job_id):
+    for _ in range(200):
+        if jobs.get(job_id).status in ("done", "failed", "cancelled"):
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_jobs_run_by_priority_and_results_are_paged(tmp_path):
+    async def main():
+        ch = FakeClickHouse()
+        jobs = JobScheduler(ch, max_concurrency=1, spill_dir=str(tmp_path), result_ttl=60)
+        slow = await jobs.submit("SELECT slow")
+        await asyncio.sleep(0.01)
+        low = await jobs.submit("SELECT low", priority="low")
+        high = await jobs.submit("SELECT high", priority="high")
+        status = await jobs.status(low.id)
+        assert status["queue_position"] == 1
+        running = await jobs.status(slow.id)
+        assert running["progress"]["percent"] == 25.0
+        with pytest.raises(JobNotReadyError):
+            jobs.page(low.id, 0, 10)
+        ch.block.set()
+        await wait_finished(jobs, low.id)
+        await jobs.shutdown()
+        return ch, jobs, high
+
+    ch, jobs, high = asyncio.run(main())
+    assert ch.order == ["SELECT slow", "SELECT high", "SELECT low"]
+    page = jobs.page(high.id, 20, 10)
+    assert page["total_rows"] == 25 and page["next_offset"] is None
+    assert page["rows"][0] == {"id": 20, "name": "n20"}
+    assert jobs.page(high.id, 0, 10)["next_offset"] == 10
+    parquet = jobs.result_path(high.id, "parquet")
+    assert pq.read_table(parquet).num_rows == 25
+
+
+def test_cancel_and_failure_remove_spill_files(tmp_path):
+    async def main():
+        ch = FakeClickHouse()
+        jobs = JobScheduler(ch, max_concurrency=2, spill_dir=str(tmp_path), result_ttl=60)
+        slow = await jobs.submit("SELECT slow")
+        broken = await jobs.submit("SELECT broken")
+        await asyncio.sleep(0.02)
+        jobs.cancel(slow.id)
+        await wait_finished(jobs, slow.id)
+        await wait_finished(jobs, broken.id)
+        await jobs.shutdown()
+        return jobs, slow, broken
+
+    jobs, slow, broken = asyncio.run(main())
+    assert slow.status == "cancelled"
+    assert broken.status == "failed" and "Syntax error" in broken.error
+    assert os.listdir(tmp_path) == []
+    assert jobs.stats()["cancelled"] == 1 and jobs.stats()["failed"] == 1
+
+
+def test_finished_jobs_expire(tmp_path):
+    async def main():
+        jobs = JobScheduler(FakeClickHouse(), spill_dir=str(tmp_path), result_ttl=0.05)
+        job = await jobs.submit("SELECT 1")
+        await wait_finished(jobs, job.id)
+        await jobs.shutdown()
+        return jobs, job
+
+    jobs, job = asyncio.run(main())
+    assert job.status == "done" and os.listdir(tmp_path)
+    time.sleep(0.1)
+    assert jobs.summaries() == []
+    assert os.listdir(tmp_path) == []
+
+
+def test_only_select_queries_become_jobs(tmp_path):
+    async def main():
+        ch = FakeClickHouse()
+        jobs = JobScheduler(ch, spill_dir=str(tmp_path))
+        for sql in ("DROP TABLE fact_orders", "INSERT INTO t SELECT 1", "ALTER TABLE t DELETE WHERE 1"):
+            with pytest.raises(InvalidJobQueryError):
+                await jobs.submit(sql)
+        # SELECT, WITH và truy vấn trong ngoặc vẫn được nhận
+        submitted = [
+            await jobs.submit(sql)
+            for sql in ("select 1", "WITH 1 AS x SELECT x", "(SELECT 1) UNION ALL (SELECT 2)")
+        ]
+        for job in submitted:
+            await wait_finished(jobs, job.id)
+        await jobs.shutdown()
+        return ch, jobs
+
+    ch, jobs = asyncio.run(main())
+    assert len(ch.order) == 3
+    assert jobs.stats()["submitted"] == 3
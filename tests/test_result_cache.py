@@ -0,0 +1,158 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services import result_cache
+from app.services.guardrails import fixed_settings
+from app.services.result_cache import (
+    ResultCache,
+    cache_key,
+    cached_query,
+    read_tables,
+    written_tables,
+)
+
+
+class SimpleRequest:
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+
+class FakeClient:
+    def __init__(self, cache: ResultCache):
+        self.result_cache = cache
+        self.queries = 0
+        self.rows = [(1, "a")]
+
+    async def aquery(self, sql, parameters=None):
+        self.queries += 1
+
+        class Result:
+            result_rows = list(self.rows)
+
+        return Result()
+
+
+def run(ch, headers=None, sql="SELECT * FROM dim_users FINAL WHERE id = {id:UInt64}"):
+    return asyncio.run(
+        cached_query(
+            ch,
+            SimpleRequest(headers),
+            "users.read_user",
+            sql,
+            {"id": 1},
+            lambda result: {"rows": result.result_rows},
+        )
+    )
+
+
+def test_sql_normalization_and_table_detection():
+    assert cache_key("SELECT 1\n  FROM t;", {"a": 1}) == cache_key("SELECT 1 FROM t", {"a": 1})
+    assert cache_key("SELECT 1 FROM t", {"a": 1}) != cache_key("SELECT 1 FROM t", {"a": 2})
+    assert read_tables("SELECT * FROM db.a FINAL JOIN `b` ON 1") == {"a", "b"}
+    assert written_tables("INSERT INTO dim_users SELECT * FROM x") == {"dim_users"}
+    assert written_tables("ALTER TABLE fact_orders DELETE WHERE 1") == {"fact_orders"}
+    assert written_tables("EXCHANGE TABLES a AND b") == {"a", "b"}
+    assert written_tables("SELECT 1") == set()
+    assert written_tables("SYSTEM DROP MARK CACHE") is None
+
+
+def test_disabled_endpoint_returns_plain_result():
+    ch = FakeClient(ResultCache(endpoints=""))
+    assert run(ch) == {"rows": [(1, "a")]}
+    assert run(ch) == {"rows": [(1, "a")]}
+    assert ch.queries == 2
+
+
+def test_hit_etag_and_invalidation_on_write():
+    cache = ResultCache(endpoints="users.read_user", ttl=60)
+    ch = FakeClient(cache)
+    first = run(ch)
+    assert first.headers["X-Cache"] == "MISS" and first.body == b'{"rows": [[1, "a"]]}'
+    second = run(ch)
+    assert second.headers["X-Cache"] == "HIT" and ch.queries == 1
+    assert second.headers["Cache-Control"].startswith("private, max-age=")
+    assert run(ch, {"if-none-match": first.headers["ETag"]}).status_code == 304
+
+    cache.invalidate_for_sql("INSERT INTO other_table VALUES")
+    assert run(ch).headers["X-Cache"] == "HIT"
+    cache.invalidate_for_sql("INSERT INTO dim_users VALUES")
+    assert run(ch).headers["X-Cache"] == "MISS" and ch.queries == 2
+    assert run(ch, {"cache-control": "no-cache"}).headers["X-Cache"] == "MISS"
+    stats = cache.stats()
+    assert stats["stale"] == 1 and stats["hits"] == 3 and stats["not_modified"] == 1
+
+
+def test_entries_are_not_shared_across_query_profiles():
+    cache = ResultCache(endpoints="*", ttl=60)
+    ch = FakeClient(cache)
+    assert run(ch).headers["X-Cache"] == "MISS"
+    # Hồ sơ cắt kết quả: không được trả lại kết quả đầy đủ đã cache và ngược lại
+    with fixed_settings("export", {"max_result_rows": 1, "result_overflow_mode": "break"}):
+        assert run(ch).headers["X-Cache"] == "MISS"
+        assert run(ch).headers["X-Cache"] == "HIT"
+    assert run(ch).headers["X-Cache"] == "HIT"
+    assert ch.queries == 2
+    assert cache_key("SELECT 1", {}, "export") != cache_key("SELECT 1", {})
+
+
+def test_ttl_expiry():
+    cache = ResultCache(endpoints="*", ttl=0.01)
+    ch = FakeClient(cache)
+    run(ch)
+    time.sleep(0.02)
+    assert run(ch).headers["X-Cache"] == "MISS"
+    assert cache.stats()["expired"] == 1
+
+
+def test_memory_budget_demotes_to_disk(tmp_path):
+    cache = ResultCache(
+        endpoints="*", ttl=60, max_bytes=30, disk_dir=str(tmp_path / "cache"), disk_max_bytes=10**6
+    )
+    ch = FakeClient(cache)
+    run(ch, sql="SELECT * FROM a")
+    run(ch, sql="SELECT * FROM b")
+    assert cache.stats()["entries"] == 1 and cache.stats()["disk_entries"] == 1
+    assert run(ch, sql="SELECT * FROM a").headers["X-Cache"] == "HIT"
+    assert cache.stats()["disk_hits"] == 1 and ch.queries == 2
+
+
+def test_disk_tier_stores_raw_bytes_off_the_event_loop(tmp_path, monkeypatch):
+    disk_dir = tmp_path / "cache"
+    cache = ResultCache(
+        endpoints="*", ttl=60, max_bytes=30, disk_dir=str(disk_dir), disk_max_bytes=10**6
+    )
+    ch = FakeClient(cache)
+    threads = []
+    read_file = result_cache._read_file
+    write_file = result_cache._write_file
+
+    def recording_read(path):
+        threads.append(threading.get_ident())
+        return read_file(path)
+
+    def recording_write(path, body):
+        threads.append(threading.get_ident())
+        write_file(path, body)
+
+    monkeypatch.setattr(result_cache, "_read_file", recording_read)
+    monkeypatch.setattr(result_cache, "_write_file", recording_write)
+    run(ch, sql="SELECT * FROM a")
+    run(ch, sql="SELECT * FROM b")
+    # Mục bị đẩy xuống đĩa là thân JSON nguyên bản, ghi qua file tạm
+    (path,) = os.listdir(disk_dir)
+    assert not path.endswith(".tmp")
+    assert (disk_dir / path).read_bytes() == b'{"rows": [[1, "a"]]}'
+    assert run(ch, sql="SELECT * FROM a").headers["X-Cache"] == "HIT"
+    assert ch.queries == 2 and len(threads) >= 2
+    # Đọc/ghi file không chạy trên thread của event loop
+    assert threading.get_ident() not in threads
+
+    asyncio.run(cache.clear())
+    assert os.listdir(disk_dir) == []
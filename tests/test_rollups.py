@@ -0,0 +1,224 @@
+import asyncio
+import json
+import re
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import QueryParams
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.core.config import settings
+from app.routers.crud import query_rows
+from app.services.result_cache import ResultCache
+from app.services.rollups import RollupManager
+
+ROLLUPS = {
+    "orders_by_user_day": {
+        "table": "fact_orders",
+        "dimensions": ["user_id", "product_id", "day=toDate(order_date)"],
+        "measures": ["sum:total", "count:order_id"],
+        "append_only": True,
+    }
+}
+
+SCHEMA = [
+    ("order_id", "UInt64"),
+    ("user_id", "UInt64"),
+    ("product_id", "UInt64"),
+    ("total", "Float64"),
+    ("order_date", "DateTime"),
+    ("_version", "UInt64"),
+    ("_deleted", "UInt8"),
+]
+
+
+class FakeClickHouse:
+    def __init__(self, rollups=ROLLUPS, exists="0"):
+        self.commands = []
+        self.sql = None
+        self.exists = exists
+        self.rows = [(125.5, 7)]
+        self.result_cache = ResultCache(endpoints="")
+        self.rollups = RollupManager(self, rollups=rollups, watermark_delay=0)
+
+    def get_table_schema(self, table):
+        return SCHEMA
+
+    async def aget_table_schema(self, table):
+        return SCHEMA
+
+    def command(self, sql, parameters=None):
+        self.commands.append(sql)
+        return self.exists if sql.startswith("EXISTS") else None
+
+    async def aquery(self, sql, parameters=None):
+        self.sql = sql
+        rows = self.rows
+
+        class Result:
+            result_rows = rows
+
+        return Result()
+
+
+def _watermark(sql, op):
+    return int(re.search(rf"_version {op} (\d+)", sql).group(1))
+
+
+def _sum_total(response):
+    return json.loads(response.body)[0]["sum_total"]
+
+
+class SimpleRequest:
+    def __init__(self, qp):
+        self.query_params = QueryParams(qp)
+        self.headers = {}
+
+
+def test_create_all_builds_view_and_backfills_new_rollup():
+    ch = FakeClickHouse()
+    ch.rollups.create_all()
+    _, create, view, backfill = ch.commands
+    assert create.startswith(
+        "CREATE TABLE IF NOT EXISTS orders_by_user_day ENGINE = AggregatingMergeTree "
+        "ORDER BY (user_id, product_id, day) AS SELECT user_id AS user_id"
+    )
+    assert "toDate(order_date) AS day" in create and create.endswith("LIMIT 0")
+    assert view.startswith(
+        "CREATE MATERIALIZED VIEW IF NOT EXISTS orders_by_user_day_mv TO orders_by_user_day"
+    )
+    assert "sumState(total) AS sum_total_state" in view
+    assert "WHERE _deleted = 0 AND _version > " in view and "FINAL" not in view
+    assert backfill.startswith("INSERT INTO orders_by_user_day SELECT")
+    assert "FROM fact_orders FINAL WHERE _deleted = 0 AND _version <= " in backfill
+    # View và phần nạp dữ liệu cũ chia dòng theo cùng một mốc _version
+    assert _watermark(view, ">") == _watermark(backfill, "<=")
+
+    existing = FakeClickHouse(exists="1")
+    existing.rollups.create_all()
+    assert len(existing.commands) == 3
+
+
+def test_versioned_table_without_append_only_is_not_rolled_up():
+    spec = {"orders": {**ROLLUPS["orders_by_user_day"], "append_only": False}}
+    ch = FakeClickHouse(rollups=spec)
+    ch.rollups.create_all()
+    assert ch.commands == []
+    assert ch.rollups.route("fact_orders", [("sum", "total")], [], []) is None
+
+
+def test_matching_aggregate_is_routed_to_rollup():
+    ch = FakeClickHouse()
+    ch.rollups.create_all()
+    qp = "aggregate=sum:total&group_by=user_id&product_id=3"
+    res = asyncio.run(query_rows("fact_orders", SimpleRequest(qp), ch=ch))
+    assert ch.sql == (
+        "SELECT sumMerge(sum_total_state) AS sum_total, user_id FROM orders_by_user_day "
+        "WHERE product_id={product_id:UInt64} GROUP BY user_id"
+    )
+    assert res == [{"sum_total": 125.5, "user_id": 7}]
+    assert ch.rollups.get("orders_by_user_day").routed == 1
+
+    # Phép tổng hợp không có trong rollup vẫn đọc bảng gốc
+    asyncio.run(query_rows("fact_orders", SimpleRequest("aggregate=max:total"), ch=ch))
+    assert ch.sql.startswith("SELECT MAX(total) AS max_total FROM fact_orders FINAL")
+
+    # Nhiều phép tổng hợp, HAVING và ORDER BY dùng chung bí danh trên rollup
+    ch.rows = [(125.5, 2, 7)]
+    qp = (
+        "aggregate=sum:total,count:order_id&group_by=user_id"
+        "&having=sum_total__gt:100&order_by=-sum_total"
+    )
+    res = asyncio.run(query_rows("fact_orders", SimpleRequest(qp), ch=ch))
+    assert ch.sql == (
+        "SELECT sumMerge(sum_total_state) AS sum_total, countMerge(count_order_id_state) "
+        "AS count_order_id, user_id FROM orders_by_user_day GROUP BY user_id "
+        "HAVING sum_total > {__having_0:Float64} ORDER BY sum_total DESC"
+    )
+    assert res == [{"sum_total": 125.5, "count_order_id": 2, "user_id": 7}]
+
+
+def test_group_by_expression_dimension_alias():
+    ch = FakeClickHouse()
+    ch.rollups.create_all()
+    ch.rows = [(125.5, "2024-01-02")]
+    qp = "aggregate=sum:total&group_by=day&order_by=day"
+    res = asyncio.run(query_rows("fact_orders", SimpleRequest(qp), ch=ch))
+    assert ch.sql == (
+        "SELECT sumMerge(sum_total_state) AS sum_total, day FROM orders_by_user_day "
+        "GROUP BY day ORDER BY day"
+    )
+    assert res == [{"sum_total": 125.5, "day": "2024-01-02"}]
+
+    # Phép tổng hợp không có trong rollup: bí danh được tính lại trên bảng gốc
+    asyncio.run(query_rows("fact_orders", SimpleRequest("aggregate=max:total&group_by=day"), ch=ch))
+    assert ch.sql.startswith(
+        "SELECT MAX(total) AS max_total, toDate(order_date) AS day FROM fact_orders FINAL"
+    )
+    assert ch.sql.endswith("GROUP BY day")
+
+    # Bí danh không thuộc rollup nào vẫn bị từ chối
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(query_rows("fact_orders", SimpleRequest("aggregate=sum:total&group_by=week"), ch=ch))
+    assert exc.value.status_code == 400
+
+
+def test_rebuild_recreates_view_with_new_watermark():
+    ch = FakeClickHouse()
+    ch.rollups.create_all()
+    first_view = ch.commands[2]
+    ch.commands.clear()
+    ch.rollups.rebuild("orders_by_user_day")
+    drop, truncate, view, backfill = ch.commands
+    assert drop == "DROP VIEW IF EXISTS orders_by_user_day_mv"
+    assert truncate == "TRUNCATE TABLE orders_by_user_day"
+    watermark = _watermark(view, ">")
+    assert watermark > _watermark(first_view, ">")
+    assert _watermark(backfill, "<=") == watermark
+
+
+def test_rollup_is_not_routed_while_rebuilding():
+    ch = FakeClickHouse()
+    ch.rollups.create_all()
+    routed = []
+    command = ch.command
+
+    def recording_command(sql, parameters=None):
+        # Ghi lại rollup có được dùng không ở từng bước của rebuild
+        routed.append(ch.rollups.route("fact_orders", [("sum", "total")], [], []))
+        return command(sql, parameters)
+
+    ch.command = recording_command
+    ch.rollups.rebuild("orders_by_user_day")
+    assert routed == [None] * 4
+    assert ch.rollups.route("fact_orders", [("sum", "total")], [], []) is not None
+
+    # Nạp lỗi: rollup chỉ có một phần dữ liệu, tiếp tục đọc bảng gốc
+    def failing_command(sql, parameters=None):
+        if sql.startswith("INSERT"):
+            raise RuntimeError("boom")
+        return command(sql, parameters)
+
+    ch.command = failing_command
+    with pytest.raises(RuntimeError):
+        ch.rollups.rebuild("orders_by_user_day")
+    assert ch.rollups.route("fact_orders", [("sum", "total")], [], []) is None
+
+
+def test_routed_query_cache_is_invalidated_by_source_writes(monkeypatch):
+    monkeypatch.setattr(settings, "RESULT_CACHE_TTL", 300.0)
+    ch = FakeClickHouse()
+    ch.result_cache = ResultCache(endpoints="crud.query_rows")
+    ch.rollups.create_all()
+    request = SimpleRequest("aggregate=sum:total&group_by=user_id")
+    assert _sum_total(asyncio.run(query_rows("fact_orders", request, ch=ch))) == 125.5
+    ch.rows = [(200.0, 7)]
+    # Chưa ghi gì: vẫn đọc từ cache
+    assert _sum_total(asyncio.run(query_rows("fact_orders", request, ch=ch))) == 125.5
+    # Ghi vào bảng nguồn làm rollup đổi theo, kết quả cache phải bị bỏ
+    ch.result_cache.invalidate_table("fact_orders")
+    assert _sum_total(asyncio.run(query_rows("fact_orders", request, ch=ch))) == 200.0
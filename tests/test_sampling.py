@@ -0,0 +1,126 @@
+import asyncio
+import math
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import QueryParams
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.core.config import settings
+from app.routers.crud import query_rows
+from app.services.clickhouse_client import _entity_ddl
+from app.services.pagination import parse_sorting_key
+from app.services.result_cache import ResultCache
+from app.services.rollups import RollupManager
+
+SCHEMA = [
+    ("order_id", "UInt64"),
+    ("user_id", "UInt64"),
+    ("total", "Float64"),
+    ("status", "String"),
+    ("_version", "UInt64"),
+    ("_deleted", "UInt8"),
+]
+
+
+class FakeClickHouse:
+    def __init__(self, rows, sampling_key="intHash64(order_id)"):
+        self.rows = rows
+        self.sampling_key = sampling_key
+        self.sql = None
+        self.result_cache = ResultCache(endpoints="")
+        self.rollups = RollupManager(self, rollups={})
+
+    async def aget_table_schema(self, table):
+        return SCHEMA
+
+    async def aget_sampling_key(self, table):
+        return self.sampling_key
+
+    async def aquery(self, sql, parameters=None):
+        self.sql = sql
+        rows = self.rows
+
+        class Result:
+            result_rows = rows
+
+        return Result()
+
+
+class SimpleRequest:
+    def __init__(self, qp):
+        self.query_params = QueryParams(qp)
+        self.headers = {}
+
+
+def test_entity_ddl_adds_sample_key(monkeypatch):
+    monkeypatch.setattr(settings, "SAMPLED_TABLES", "fact_orders")
+    ddl = _entity_ddl("fact_orders", "fact_orders")
+    assert ddl.endswith(
+        "ORDER BY (intDiv(order_id, 1048576), intHash64(order_id), order_id)"
+        "\nSAMPLE BY intHash64(order_id)"
+    )
+    assert _entity_ddl("dim_users", "dim_users").endswith("ORDER BY id")
+    # Khóa lấy mẫu suy ra từ khóa không cản trở phân trang theo cursor
+    schema = dict(SCHEMA)
+    assert parse_sorting_key("order_id, intHash64(order_id)", schema) == ["order_id"]
+    key = "intDiv(order_id, 1048576), intHash64(order_id), order_id"
+    assert parse_sorting_key(key, schema) == ["order_id"]
+    assert parse_sorting_key("order_id, cityHash64(user_id)", schema) is None
+
+
+def test_approx_rewrites_aggregates_and_samples():
+    ch = FakeClickHouse([(400.0, 3, 12.5, "paid", 100)])
+    qp = (
+        "aggregate=sum:total,uniqexact:user_id,p90:total&group_by=status"
+        "&approx=true&sample=0.25"
+    )
+    res = asyncio.run(query_rows("fact_orders", SimpleRequest(qp), ch=ch))
+    assert ch.sql == (
+        "SELECT SUM(total) * any(_sample_factor) AS sum_total, "
+        "uniq(user_id) AS uniqexact_user_id, quantileTDigest(0.9)(total) AS p90_total, status, count() AS __sampled_rows "
+        "FROM fact_orders FINAL SAMPLE 0.25 WHERE _deleted = 0 GROUP BY status"
+    )
+    assert (res["sample"], res["sample_factor"], res["confidence"]) == (0.25, 4.0, 0.95)
+    row, = res["rows"]
+    assert row["sum_total"] == 400.0 and "__sampled_rows" not in row
+    assert row["relative_error"] == pytest.approx(1.96 * math.sqrt(0.75 / 100), abs=1e-6)
+
+    # uniq trên cột của khóa lấy mẫu được nhân hệ số mẫu
+    ch.rows = [(30, 100)]
+    asyncio.run(
+        query_rows("fact_orders", SimpleRequest("aggregate=uniq:order_id&approx=true"), ch=ch)
+    )
+    assert ch.sql.startswith(
+        "SELECT uniq(order_id) * any(_sample_factor) AS uniq_order_id, count() AS __sampled_rows "
+        "FROM fact_orders FINAL SAMPLE 0.1 "
+    )
+
+
+def test_approx_without_sample_key_reads_whole_table():
+    ch = FakeClickHouse([(2.5,)], sampling_key="")
+    qp = "aggregate=median:total&approx=true"
+    res = asyncio.run(query_rows("fact_orders", SimpleRequest(qp), ch=ch))
+    assert ch.sql == (
+        "SELECT quantileTDigest(0.5)(total) AS median_total FROM fact_orders FINAL "
+        "WHERE _deleted = 0"
+    )
+    assert res == {
+        "rows": [{"median_total": 2.5, "relative_error": None}],
+        "sample": 1.0,
+        "sample_factor": 1.0,
+        "confidence": 0.95,
+    }
+
+    for qp in (
+        "approx=true",
+        "aggregate=sum:total&sample=0.5",
+        "aggregate=sum:total&approx=1&sample=2",
+    ):
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(query_rows("fact_orders", SimpleRequest(qp), ch=ch))
+        assert exc.value.status_code == 400
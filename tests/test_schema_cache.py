@@ -0,0 +1,53 @@
+import sys
+import time
+from pathlib import Path
+
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.services.schema_cache import SchemaCache, ddl_table, is_ddl
+
+
+COLUMNS = [("id", "UInt64"), ("name", "String")]
+
+
+def test_schema_cache_hit_miss_and_lru_eviction():
+    cache = SchemaCache(ttl=60, max_size=2)
+    assert cache.get("a") is None
+    cache.set("a", COLUMNS)
+    cache.set("b", COLUMNS)
+    assert cache.get("a") == COLUMNS
+    cache.set("c", COLUMNS)
+    # "b" ít được dùng nhất nên bị loại bỏ
+    assert cache.get("b") is None
+    assert cache.get("a") == COLUMNS
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["evictions"] == 1
+
+
+def test_schema_cache_ttl_expiry():
+    cache = SchemaCache(ttl=0.01, max_size=10)
+    cache.set("a", COLUMNS)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_schema_cache_invalidated_by_ddl():
+    cache = SchemaCache(ttl=60, max_size=10)
+    cache.set("dim_users", COLUMNS)
+    cache.set("dim_products", COLUMNS)
+    assert not cache.invalidate_for_sql("INSERT INTO dim_users VALUES (1, 'a')")
+    assert cache.invalidate_for_sql("ALTER TABLE default.dim_users ADD COLUMN age UInt8")
+    assert cache.get("dim_users") is None
+    assert cache.get("dim_products") == COLUMNS
+    assert cache.invalidate_for_sql("RENAME TABLE a TO b")
+    assert cache.get("dim_products") is None
+
+
+def test_ddl_detection():
+    assert is_ddl("  create table x (id UInt8) ENGINE = Memory")
+    assert not is_ddl("SELECT 1")
+    assert ddl_table("DROP TABLE IF EXISTS `fact_orders`") == "fact_orders"
@@ -0,0 +1,138 @@
+import asyncio
+import re
+import sys
+import threading
+from pathlib import Path
+
+from loguru import logger
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.core.config import settings
+from app.main import app
+from app.services import tracing
+from app.services.clickhouse_client import ClickHouseClient
+from app.services.profiler import folded, sample
+
+
+class LoggedClient:
+    """Client giả lập ghi lại query_id và trả số liệu query_log."""
+
+    calls = []
+
+    def query(self, sql, parameters=None, settings=None):
+        LoggedClient.calls.append((sql, (settings or {}).get("query_id")))
+
+        class Result:
+            result_rows = [(1, "A", "a@example.com")]
+
+        if "system.query_log" in sql:
+            Result.result_rows = [
+                (query_id, 12, 100, 800, 1, 4096) for query_id in parameters["query_ids"]
+            ]
+        return Result()
+
+    def close(self):
+        pass
+
+
+async def get(path, headers=()):
+    messages = []
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.encode(), v.encode()) for k, v in headers],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return messages
+
+
+def test_query_id_derives_from_request_id(monkeypatch):
+    monkeypatch.setattr(settings, "SLOW_REQUEST_THRESHOLD", 0)
+    LoggedClient.calls = []
+    app.state.clickhouse = ch = ClickHouseClient(client_factory=LoggedClient)
+    try:
+        messages = asyncio.run(get("/users/1", headers=[("x-request-id", "req-42")]))
+    finally:
+        ch.close()
+    assert (b"x-request-id", b"req-42") in messages[0]["headers"]
+    ((_, query_id),) = LoggedClient.calls
+    assert re.fullmatch(r"req-42-[0-9a-f]{8}-1", query_id)
+    assert tracing.request_id_from("bad id;") != "bad id;"
+
+
+def test_slow_request_is_logged_with_phases_and_query_log(monkeypatch):
+    monkeypatch.setattr(settings, "SLOW_REQUEST_THRESHOLD", 0.000001)
+    monkeypatch.setattr(settings, "SLOW_REQUEST_QUERY_LOG_DELAY", 0)
+    LoggedClient.calls = []
+    records = []
+    sink = logger.add(lambda message: records.append(message.record["message"]), level="WARNING")
+    app.state.clickhouse = ch = ClickHouseClient(client_factory=LoggedClient)
+
+    async def main():
+        await get("/users/1", headers=[("x-request-id", "slow-1")])
+        await asyncio.gather(*tracing._pending)
+
+    try:
+        asyncio.run(main())
+    finally:
+        logger.remove(sink)
+        ch.close()
+    (line,) = [r for r in records if "Request chậm" in r]
+    assert "request_id=slow-1" in line
+    assert "clickhouse.select" in line and "build" in line
+    query_id = LoggedClient.calls[0][1]
+    assert "'memory_usage': 4096" in line and f"'query_id': '{query_id}'" in line
+    # Truy vấn query_log không mang query_id của request
+    assert not (LoggedClient.calls[-1][1] or "").startswith("slow-1-")
+
+
+def test_duplicate_request_ids_get_distinct_query_ids():
+    # Hai request dùng chung X-Request-ID vẫn có query_id khác nhau
+    first, second = tracing.Trace("dup"), tracing.Trace("dup")
+    query_ids = [first.new_query_id(), second.new_query_id(), first.new_query_id()]
+    assert len(set(query_ids)) == 3
+    assert all(query_id.startswith("dup-") for query_id in query_ids)
+    assert first.request_id == second.request_id == "dup"
+
+
+def test_profiler_samples_busy_thread():
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_loop, name="busy")
+    worker.start()
+    try:
+        stacks = sample(0.2, 0.005)
+    finally:
+        stop.set()
+        worker.join()
+    text = folded(stacks)
+    line = next(line for line in text.splitlines() if "busy_loop" in line)
+    assert line.startswith("busy;")
+    assert int(line.rsplit(" ", 1)[1]) > 0
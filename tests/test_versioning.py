@@ -0,0 +1,176 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+# Đảm bảo thư mục gốc của dự án có trong sys.path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.models.warehouse import User
+from app.routers.users import create_user, delete_user, update_user
+from app.services.clickhouse_client import ClickHouseClient
+from app.services.dimension_store import DimensionStore
+from app.services.mutations import MutationManager
+from app.services.versioning import delete_sql, is_versioned, next_version, update_sql
+
+
+def test_next_version_strictly_increasing():
+    versions = [next_version() for _ in range(1000)]
+    assert versions == sorted(set(versions))
+
+
+def test_update_sql_keeps_untouched_columns():
+    sql = update_sql("dim_users", "id", "UInt64", ["id", "name", "email"], {"name": "String"})
+    assert sql.startswith("INSERT INTO dim_users (id, name, email, _version, _deleted)")
+    assert "SELECT id, {name:String}, email, {__version:UInt64}, 0" in sql
+    assert "FROM dim_users FINAL WHERE id = {__key:UInt64} AND _deleted = 0" in sql
+
+
+def test_delete_sql_writes_tombstone():
+    sql = delete_sql("dim_products", "id", "UInt64", ["id", "name"])
+    assert "SELECT id, name, {__version:UInt64}, 1 FROM dim_products FINAL" in sql
+
+
+def test_is_versioned():
+    assert is_versioned({"id": "UInt64", "_version": "UInt64", "_deleted": "UInt8"})
+    assert not is_versioned({"id": "UInt64"})
+
+
+class Summary:
+    def __init__(self, written_rows):
+        self.written_rows = written_rows
+
+
+class FakeBuffer:
+    def __init__(self):
+        self.rows = []
+
+    async def insert(self, table, row, ack="flush"):
+        self.rows.append((table, row))
+
+
+class FakeClient:
+    def __init__(self, written_rows=1):
+        self.written_rows = written_rows
+        self.commands = []
+        self.queries = 0
+        self.insert_buffer = FakeBuffer()
+        self.mutations = MutationManager(self, overrides={})
+        self.dimensions = DimensionStore(self, {}, tables="")
+
+    async def aget_table_schema(self, table):
+        return [
+            ("id", "UInt64"),
+            ("name", "String"),
+            ("email", "String"),
+            ("_version", "UInt64"),
+            ("_deleted", "UInt8"),
+        ]
+
+    async def aget_table_engine(self, table):
+        return "ReplacingMergeTree"
+
+    async def aquery(self, sql, parameters=None):
+        self.queries += 1
+        raise AssertionError("writes must not read before writing")
+
+    async def acommand(self, sql, parameters=None):
+        self.commands.append((sql, parameters))
+        return Summary(self.written_rows)
+
+
+def test_create_user_is_single_versioned_insert():
+    client = FakeClient()
+    user = User(id=1, name="A", email="a@example.com")
+    assert asyncio.run(create_user(user, "flush", client)) == {"status": "ok"}
+    table, row = client.insert_buffer.rows[0]
+    assert table == "dim_users"
+    assert row["_version"] > 0
+    assert client.queries == 0
+
+
+def test_update_user_single_round_trip():
+    client = FakeClient()
+    user = User(id=1, name="B", email="b@example.com")
+    asyncio.run(update_user(1, user, client))
+    assert len(client.commands) == 1
+    sql, params = client.commands[0]
+    assert sql.startswith("INSERT INTO dim_users")
+    assert params["__key"] == 1 and params["name"] == "B"
+
+
+def test_update_missing_user_returns_404():
+    client = FakeClient(written_rows=0)
+    user = User(id=9, name="B", email="b@example.com")
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(update_user(9, user, client))
+    assert exc.value.status_code == 404
+
+
+def test_delete_missing_user_returns_404():
+    client = FakeClient(written_rows=0)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(delete_user(9, client))
+    assert exc.value.status_code == 404
+    assert client.queries == 0
+
+
+class MigrationClient:
+    """Bảng ``dim_users`` cũ dùng ``MergeTree``; ``existing`` là các bảng đã có."""
+
+    def __init__(self, existing=()):
+        self.engine = "MergeTree"
+        self.existing = set(existing)
+        self.commands = []
+
+    def get_table_engine(self, table):
+        return self.engine
+
+    def invalidate_metadata(self, table=None):
+        pass
+
+    def command(self, sql, parameters=None):
+        self.commands.append(sql)
+        name = sql.split()[2]
+        if sql.startswith("EXISTS"):
+            return "1" if name in self.existing else "0"
+        if sql.startswith("CREATE TABLE") and name in self.existing:
+            raise RuntimeError("Code: 57. Table already exists")
+        if sql.startswith("EXCHANGE"):
+            self.engine = "ReplacingMergeTree"
+        return None
+
+
+def test_migrate_to_versioned_keeps_legacy_under_unique_name():
+    ch = MigrationClient()
+    assert ClickHouseClient.migrate_to_versioned(ch, "dim_users") is True
+    assert ch.commands[0].startswith("CREATE TABLE dim_users__migration_lock ")
+    exchange = next(c for c in ch.commands if c.startswith("EXCHANGE"))
+    staging = exchange.split()[-1]
+    assert staging.startswith("dim_users__versioned_")
+    rename = next(c for c in ch.commands if c.startswith("RENAME"))
+    assert rename == f"RENAME TABLE {staging} TO dim_users__legacy_{staging.rsplit('_', 1)[1]}"
+    assert not any(c.startswith("DROP TABLE IF EXISTS dim_users__versioned") for c in ch.commands)
+    assert ch.commands[-1] == "DROP TABLE IF EXISTS dim_users__migration_lock"
+    # Bảng đã chuyển thì lần chạy sau không làm gì
+    ch.commands.clear()
+    assert ClickHouseClient.migrate_to_versioned(ch, "dim_users") is False
+    assert ch.commands == []
+
+
+def test_migrate_to_versioned_skips_when_another_migration_holds_the_lock():
+    ch = MigrationClient(existing={"dim_users__migration_lock"})
+    assert ClickHouseClient.migrate_to_versioned(ch, "dim_users") is False
+    assert not any(c.startswith(("EXCHANGE", "DROP")) for c in ch.commands)
+
+
+def test_migrate_to_versioned_refuses_to_overwrite_legacy_table(monkeypatch):
+    monkeypatch.setattr(time, "strftime", lambda fmt: "20240101000000")
+    ch = MigrationClient(existing={"dim_users__legacy_20240101000000"})
+    with pytest.raises(RuntimeError):
+        ClickHouseClient.migrate_to_versioned(ch, "dim_users")
+    assert not any(c.startswith("EXCHANGE") for c in ch.commands)
+    assert ch.commands[-1] == "DROP TABLE IF EXISTS dim_users__migration_lock"